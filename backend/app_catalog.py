@@ -0,0 +1,288 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""ufw application profiles and /etc/services names.
+
+- Application profiles are the INI files in `UFW_APPLICATIONS_DIR`
+  (/etc/ufw/applications.d): one section per application with `title`,
+  `description` and `ports` ("80,443/tcp", "53|53/tcp", "60000:61000/udp";
+  an entry without a protocol means tcp and udp).
+- Service names come from `SERVICES_FILE` (/etc/services).
+
+Both are loaded into one immutable `AppCatalog`, with the port map built up
+front: (port, protocol) -> names, profile port ranges expanded, so naming a
+port is one dict lookup. `get_catalog()` reuses the catalog until the stat signature of one
+of the files changes, checking at most every `CATALOG_CHECK_INTERVAL`
+seconds, so a listing never parses a file.
+
+Reverse lookups (`AppCatalog.services_for`) take a listing's "to" column and
+are memoized per catalog; `annotated_listing` keeps the annotated copy of the
+current snapshot. Service names are not part of the snapshot ETag, so a
+client may keep stale names until the rules change.
+"""
+import asyncio
+import configparser
+import os
+import re
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+UFW_CONF_DIR = os.getenv("UFW_CONF_DIR", "/etc/ufw")
+UFW_APPLICATIONS_DIR = os.getenv("UFW_APPLICATIONS_DIR", os.path.join(UFW_CONF_DIR, "applications.d"))
+SERVICES_FILE = os.getenv("WEBFIRE_SERVICES_FILE", "/etc/services")
+CATALOG_CHECK_INTERVAL = 2.0
+
+# Ranges wider than this are not expanded into service names.
+MAX_LOOKUP_RANGE = 64
+
+_PORT_ENTRY = re.compile(r"^(\d{1,5}(?::\d{1,5})?(?:,\d{1,5}(?::\d{1,5})?)*)(?:/(tcp|udp))?$")
+_LISTED_PORTS = re.compile(r"^(\d+(?::\d+)?(?:,\d+(?::\d+)?)*)(?:/(\w+))?$")
+
+
+class PortEntry(NamedTuple):
+    """One `ports` entry of a profile, as ufw stores it in a rule tuple."""
+    ports: str  # "80,443", "60000:61000"
+    protocol: str  # "tcp", "udp" or "any"
+
+
+class AppProfile(NamedTuple):
+    name: str
+    title: str
+    description: str
+    ports: Tuple[PortEntry, ...]
+
+    def ports_text(self) -> List[str]:
+        return [entry.ports + ("" if entry.protocol == "any" else "/" + entry.protocol) for entry in self.ports]
+
+
+def _port_spans(ports: str) -> Iterable[Tuple[int, int]]:
+    for part in ports.split(","):
+        low, _, high = part.partition(":")
+        yield int(low), int(high or low)
+
+
+def _protocols(protocol: str) -> Tuple[str, ...]:
+    return ("tcp", "udp") if protocol in ("any", "") else (protocol,)
+
+
+def parse_profile_ports(value: str) -> Optional[Tuple[PortEntry, ...]]:
+    """
+    Parses the `ports` value of a profile.
+
+    Returns:
+        tuple | None: The entries, or None if any entry is invalid (ufw skips such profiles).
+    """
+    entries = []
+    for item in value.split("|"):
+        match = _PORT_ENTRY.match(item.strip())
+        if not match:
+            return None
+        ports, protocol = match.group(1), match.group(2) or "any"
+        spans = list(_port_spans(ports))
+        if any(not 1 <= low <= high <= 65535 for low, high in spans):
+            return None
+        if protocol == "any" and (len(spans) > 1 or spans[0][0] != spans[0][1]):
+            return None  # ufw requires a protocol for lists and ranges
+        entries.append(PortEntry(ports, protocol))
+    return tuple(entries) if entries else None
+
+
+def parse_profiles(text: str) -> List[AppProfile]:
+    """Parses one application profile file; invalid sections are skipped."""
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    try:
+        parser.read_string(text)
+    except configparser.Error:
+        return []
+    profiles = []
+    for name in parser.sections():
+        section = parser[name]
+        ports = parse_profile_ports(section.get("ports", ""))
+        if ports is None or "/" in name or name.lower() == "all":
+            continue
+        profiles.append(AppProfile(name, section.get("title", ""), section.get("description", ""), ports))
+    return profiles
+
+
+def parse_services(text: str) -> Dict[Tuple[int, str], List[str]]:
+    """Parses /etc/services into (port, protocol) -> service names."""
+    services: Dict[Tuple[int, str], List[str]] = defaultdict(list)
+    for line in text.splitlines():
+        fields = line.split("#", 1)[0].split()
+        if len(fields) < 2:
+            continue
+        port, _, protocol = fields[1].partition("/")
+        if not port.isdigit() or protocol not in ("tcp", "udp"):
+            continue
+        names = services[(int(port), protocol)]
+        if fields[0] not in names:
+            names.append(fields[0])
+    return services
+
+
+class AppCatalog:
+    """Application profiles and service names with precomputed port maps."""
+
+    def __init__(self, profiles: Iterable[AppProfile], services: Dict[Tuple[int, str], List[str]]):
+        self.profiles: Dict[str, AppProfile] = {}
+        self._by_lower: Dict[str, str] = {}
+        for profile in profiles:
+            self.profiles.setdefault(profile.name, profile)
+            self._by_lower.setdefault(profile.name.lower(), profile.name)
+        self.services = {key: tuple(names) for key, names in services.items()}
+        self.service_names = frozenset(name for names in services.values() for name in names)
+        # (port, "tcp" | "udp" | "any") -> application names, then service names.
+        named: Dict[Tuple[int, str], List[str]] = defaultdict(list)
+        for profile in sorted(self.profiles.values()):
+            for entry in profile.ports:
+                for protocol in _protocols(entry.protocol):
+                    for low, high in _port_spans(entry.ports):
+                        for port in range(low, high + 1):
+                            _append(named[(port, protocol)], [profile.name])
+        for (port, protocol), names in sorted(services.items()):
+            _append(named[(port, protocol)], names)
+        for port, protocol in list(named):
+            _append(named[(port, "any")], named.get((port, "tcp"), ()))
+            _append(named[(port, "any")], named.get((port, "udp"), ()))
+        self.port_names: Dict[Tuple[int, str], Tuple[str, ...]] = {key: tuple(names) for key, names in named.items()}
+        self._memo: Dict[str, Tuple[str, ...]] = {}
+
+    def find(self, name: str) -> Optional[AppProfile]:
+        """Looks up a profile by name; like ufw, falls back to a case-insensitive match."""
+        profile = self.profiles.get(name)
+        if profile is None:
+            canonical = self._by_lower.get(name.lower())
+            profile = self.profiles.get(canonical) if canonical else None
+        return profile
+
+    def names_for_port(self, port: int, protocol: str = "any") -> Tuple[str, ...]:
+        """Application profiles first, then /etc/services names, for one port."""
+        return self.port_names.get((port, protocol), ())
+
+    def services_for(self, to: str) -> Tuple[str, ...]:
+        """
+        Names for the destination of a listed rule (its "to" column).
+
+        Port rules get the profiles and services on their ports (ranges up
+        to `MAX_LOOKUP_RANGE` ports); application rules get the application.
+        """
+        names = self._memo.get(to)
+        if names is None:
+            if to.endswith(" (v6)"):
+                names = self.services_for(to[:-len(" (v6)")])
+            else:
+                names = self._lookup(to)
+            self._memo[to] = names
+        return names
+
+    def _lookup(self, to: str) -> Tuple[str, ...]:
+        location = to.split(" on ", 1)[0].strip()
+        if not location or location.startswith("Anywhere"):
+            return ()
+        words = location.split(" ", 1)
+        last = words[-1]
+        if len(words) == 2 and not ("/" in words[0] or ":" in words[0] or words[0][0].isdigit()):
+            last = location  # an application name with spaces
+        match = _LISTED_PORTS.match(last)
+        if not match:
+            profile = self.find(last)
+            return (profile.name,) if profile else ()
+        protocol = match.group(2) or "any"
+        ports = match.group(1)
+        if ports.isdigit():
+            return self.port_names.get((int(ports), protocol), ())
+        names: List[str] = []
+        for low, high in _port_spans(ports):
+            if high - low < MAX_LOOKUP_RANGE:
+                for port in range(low, high + 1):
+                    _append(names, self.port_names.get((port, protocol), ()))
+        return tuple(names)
+
+
+def _append(names: List[str], more: Iterable[str]):
+    for name in more:
+        if name not in names:
+            names.append(name)
+
+
+def _read(path: str) -> str:
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def _profile_paths() -> List[str]:
+    try:
+        names = sorted(os.listdir(UFW_APPLICATIONS_DIR))
+    except OSError:
+        return []
+    return [os.path.join(UFW_APPLICATIONS_DIR, name) for name in names if not name.startswith(".")]
+
+
+def _stamp(paths: List[str]) -> tuple:
+    stamp = []
+    for path in [UFW_APPLICATIONS_DIR, SERVICES_FILE] + paths:
+        try:
+            st = os.stat(path)
+            stamp.append((path, st.st_ino, st.st_size, st.st_mtime_ns))
+        except OSError:
+            stamp.append((path, None))
+    return tuple(stamp)
+
+
+def load_catalog() -> AppCatalog:
+    """Reads the profile directory and the services file."""
+    profiles: List[AppProfile] = []
+    for path in _profile_paths():
+        profiles.extend(parse_profiles(_read(path)))
+    return AppCatalog(profiles, parse_services(_read(SERVICES_FILE)))
+
+
+_catalog: Optional[AppCatalog] = None
+_catalog_stamp: Optional[tuple] = None
+_checked_at = 0.0
+
+
+def get_catalog() -> AppCatalog:
+    """The current catalog, reloaded when one of its files changed."""
+    global _catalog, _catalog_stamp, _checked_at
+    now = time.monotonic()
+    if _catalog is not None and now - _checked_at < CATALOG_CHECK_INTERVAL:
+        return _catalog
+    _checked_at = now
+    stamp = _stamp(_profile_paths())
+    if _catalog is None or stamp != _catalog_stamp:
+        _catalog = load_catalog()
+        _catalog_stamp = stamp
+    return _catalog
+
+
+def annotate_rules(rules: List[dict], catalog: Optional[AppCatalog] = None) -> List[dict]:
+    """Copies of listed rules with a "services" list each."""
+    catalog = catalog or get_catalog()
+    return [dict(rule, services=list(catalog.services_for(rule["to"]))) for rule in rules]
+
+
+# Annotated listing of the last snapshot: (ETag, catalog, data).
+_last_listing: Tuple[Optional[str], Optional[AppCatalog], Optional[dict]] = (None, None, None)
+
+
+async def annotated_listing(snapshot) -> dict:
+    """
+    The snapshot's listing with service names on every rule.
+
+    Built in a worker thread once per snapshot and catalog.
+    """
+    global _last_listing
+    if snapshot.data["status"] == "error":
+        return snapshot.data
+    catalog = get_catalog()
+    etag, last_catalog, data = _last_listing
+    if etag is not None and etag == snapshot.etag and last_catalog is catalog:
+        return data
+    rules = await asyncio.to_thread(annotate_rules, snapshot.data.get("rules", []), catalog)
+    data = dict(snapshot.data, rules=rules)
+    if snapshot.etag:
+        _last_listing = (snapshot.etag, catalog, data)
+    return data
@@ -0,0 +1,403 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Audit trail of firewall mutations.
+
+Every mutation made through the API is recorded as one event: time, user
+(the token's `sub`), action, request, the resulting rule diff, duration and
+outcome. Recording only appends the event to an in-memory buffer; a
+background task writes the buffer out every `AUDIT_FLUSH_INTERVAL`, as one
+write and one fsync however many events it holds (group commit), so the
+request never waits for the disk.
+
+Storage, under `AUDIT_DIR`, is append-only:
+
+- NNNNNN.log: segments of one JSON event per line. A new segment is started
+  once the current one reaches `AUDIT_SEGMENT_BYTES`.
+- NNNNNN.idx: one line per block of up to `AUDIT_BLOCK_EVENTS` events of the
+  segment: offset, length, count, earliest and latest time, and users.
+
+Worker processes append under a file lock and read each other's blocks from
+the tail of the index files. Events written but not yet indexed (a crash
+between the two writes) are indexed by the next writer.
+
+Queries use the block index only: blocks are kept ordered by their earliest
+event together with the running maximum of their latest, so the blocks that
+can hold events of a time range are found by two binary searches, and each
+user has such a list of the blocks with events of theirs. Only those blocks
+are read, and only until the requested number of events is found. Events are
+returned in time order, ties broken by their position in the log.
+"""
+import asyncio
+import fcntl
+import heapq
+import json
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from typing import Awaitable, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from metrics import Gauge
+
+STATE_DIR = os.getenv("WEBFIRE_STATE_DIR", "/var/lib/webfire")
+AUDIT_DIR = os.getenv("WEBFIRE_AUDIT_DIR", os.path.join(STATE_DIR, "audit"))
+AUDIT_SEGMENT_BYTES = int(os.getenv("WEBFIRE_AUDIT_SEGMENT_MB", "64")) * 1024 * 1024
+# Seconds events are buffered before they are written together.
+AUDIT_FLUSH_INTERVAL = float(os.getenv("WEBFIRE_AUDIT_FLUSH_MS", "50")) / 1000
+# Events per index block: larger blocks mean a smaller index but more reading per query.
+AUDIT_BLOCK_EVENTS = 256
+# Delay before writing again after a failed write; the events stay buffered.
+AUDIT_RETRY_DELAY = 5.0
+
+_INFINITY = float("inf")
+
+
+class _Block(NamedTuple):
+    first: float  # earliest event time
+    last: float   # latest event time
+    segment: int
+    offset: int
+    length: int
+    count: int
+
+
+class _Blocks:
+    """Blocks ordered by earliest event, with the running maximum of their latest events."""
+
+    def __init__(self):
+        self.keys: List[Tuple[float, int, int]] = []
+        self.blocks: List[_Block] = []
+        self.reach: List[float] = []  # max(block.last for block in blocks[:i + 1])
+
+    def add(self, block: _Block):
+        key = (block.first, block.segment, block.offset)
+        # Blocks arrive nearly in order (workers' clocks and flushes interleave),
+        # so this inserts at or close to the end.
+        i = bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.blocks.insert(i, block)
+        self.reach.insert(i, block.last)
+        for j in range(i, len(self.blocks)):
+            self.reach[j] = max(self.reach[j - 1], self.blocks[j].last) if j else self.blocks[j].last
+
+    def between(self, since: float, until: float) -> List[_Block]:
+        """The blocks that may hold events from `since` to `until`."""
+        start = bisect_left(self.reach, since)
+        end = bisect_right(self.keys, (until, _INFINITY, _INFINITY))
+        return self.blocks[start:end]
+
+
+def _event_time(line: bytes) -> float:
+    # Written with "time" first; read it without parsing the whole event.
+    if line.startswith(b'{"time":'):
+        return float(line[8:line.index(b",", 8)])
+    return json.loads(line)["time"]
+
+
+def _cursor(key: Tuple[float, int, int]) -> str:
+    return "%r:%d:%d" % key
+
+
+def _parse_cursor(cursor: str) -> Tuple[float, int, int]:
+    """
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    when, segment, offset = cursor.split(":")
+    return float(when), int(segment), int(offset)
+
+
+class AuditLog:
+    """Buffered, group-committed, segmented append-only event log with a time and user index."""
+
+    def __init__(self, directory: str, segment_bytes: int = AUDIT_SEGMENT_BYTES,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL, block_events: int = AUDIT_BLOCK_EVENTS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.block_events = block_events
+        self._buffer: List[dict] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        # Index, shared by the writer thread and queries.
+        self._lock = threading.Lock()
+        self._segments: List[int] = []
+        self._indexed: Dict[int, int] = {}  # segment -> bytes of .idx read
+        self._ends: Dict[int, int] = {}  # segment -> end of the last indexed block in .log
+        self._all = _Blocks()
+        self._by_user: Dict[str, _Blocks] = {}
+        self.events = 0
+
+    def _path(self, segment: int, suffix: str) -> str:
+        return os.path.join(self.directory, "%06d%s" % (segment, suffix))
+
+    # --- Recording ---
+    def record(self, event: dict):
+        """Buffers an event; it is written by `run` (or `flush`)."""
+        self._buffer.append(event)
+        if self._wake is not None:
+            self._wake.set()
+
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    async def flush(self):
+        """Writes the buffered events now."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            events, self._buffer = self._buffer, []
+            if not events:
+                return
+            try:
+                await asyncio.to_thread(self.commit, events)
+            except BaseException:
+                self._buffer[:0] = events
+                raise
+
+    async def run(self):
+        """Background task: writes the buffer every `flush_interval` while there are events."""
+        self._wake = asyncio.Event()
+        try:
+            while True:
+                if not self._buffer:
+                    self._wake.clear()
+                    await self._wake.wait()
+                await asyncio.sleep(self.flush_interval)
+                try:
+                    await self.flush()
+                except OSError:
+                    await asyncio.sleep(AUDIT_RETRY_DELAY)
+        finally:
+            self._wake = None
+
+    # --- Storage ---
+    def commit(self, events: List[dict]):
+        """Appends events to the current segment, with fsync, and indexes them."""
+        lines = [json.dumps({"time": event["time"], **event}, separators=(",", ":"), default=str).encode() + b"\n"
+                 for event in events]
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(os.path.join(self.directory, "lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self.refresh()
+            segment = self._segments[-1] if self._segments else 1
+            end = self._recover(segment) if self._segments else 0
+            if end >= self.segment_bytes:
+                segment, end = segment + 1, 0
+            entries = []
+            for start in range(0, len(lines), self.block_events):
+                block = lines[start:start + self.block_events]
+                length = sum(map(len, block))
+                entries.append(self._entry(events[start:start + self.block_events], end, length))
+                end += length
+            with open(self._path(segment, ".log"), "ab") as f:
+                f.write(b"".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            self._append_index(segment, entries)
+            self.refresh()
+        finally:
+            os.close(fd)  # releases the lock
+
+    @staticmethod
+    def _entry(events: List[dict], offset: int, length: int) -> bytes:
+        times = [event["time"] for event in events]
+        users = sorted({event.get("user") or "" for event in events})
+        return json.dumps({"o": offset, "n": length, "c": len(events), "t0": min(times), "t1": max(times),
+                           "u": users}, separators=(",", ":")).encode() + b"\n"
+
+    def _recover(self, segment: int) -> int:
+        """Indexes complete events past the last indexed block and drops a torn last line; returns the end."""
+        path = self._path(segment, ".log")
+        end = self._ends.get(segment, 0)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+        if size == end:
+            return end
+        with open(path, "rb") as f:
+            f.seek(end)
+            data = f.read(size - end)
+        events, lengths = [], []
+        for line in data.split(b"\n")[:-1]:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break
+            lengths.append(len(line) + 1)
+        entries = []
+        for start in range(0, len(events), self.block_events):
+            length = sum(lengths[start:start + self.block_events])
+            entries.append(self._entry(events[start:start + self.block_events], end, length))
+            end += length
+        if end < size:
+            os.truncate(path, end)
+        if entries:
+            self._append_index(segment, entries)
+            self.refresh()
+        return end
+
+    def _append_index(self, segment: int, entries: List[bytes]):
+        with open(self._path(segment, ".idx"), "ab") as f:
+            if f.tell() > self._indexed.get(segment, 0):
+                f.truncate(self._indexed.get(segment, 0))  # drop a torn line
+            f.write(b"".join(entries))
+
+    def refresh(self):
+        """Reads index blocks appended since the last call, by any process."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        segments = sorted(int(name[:-4]) for name in names if name.endswith(".log") and name[:-4].isdigit())
+        with self._lock:
+            # Only the newest known segment and new ones can grow.
+            for segment in segments:
+                if segment in self._indexed and segment != self._segments[-1]:
+                    continue
+                path = self._path(segment, ".idx")
+                try:
+                    with open(path, "rb") as f:
+                        f.seek(self._indexed.get(segment, 0))
+                        data = f.read()
+                except FileNotFoundError:
+                    data = b""
+                read = data.rfind(b"\n") + 1
+                for line in data[:read].splitlines():
+                    self._add(segment, json.loads(line))
+                self._indexed[segment] = self._indexed.get(segment, 0) + read
+                self._ends.setdefault(segment, 0)
+            self._segments = segments
+
+    def _add(self, segment: int, entry: dict):
+        block = _Block(entry["t0"], entry["t1"], segment, entry["o"], entry["n"], entry["c"])
+        self._all.add(block)
+        for user in entry["u"]:
+            self._by_user.setdefault(user, _Blocks()).add(block)
+        self._ends[segment] = max(self._ends.get(segment, 0), entry["o"] + entry["n"])
+        self.events += entry["c"]
+
+    # --- Queries ---
+    def _read(self, block: _Block, needle: Optional[bytes] = None) -> Iterator[Tuple[Tuple[float, int, int], bytes]]:
+        """The block's events as (key, line); with `needle`, only those whose line contains it."""
+        with open(self._path(block.segment, ".log"), "rb") as f:
+            f.seek(block.offset)
+            data = f.read(block.length)
+        if needle is None:
+            offset = block.offset
+            for line in data.split(b"\n")[:-1]:
+                yield (_event_time(line), block.segment, offset), line
+                offset += len(line) + 1
+            return
+        at = data.find(needle)
+        while at != -1:
+            start = data.rfind(b"\n", 0, at) + 1
+            end = data.find(b"\n", at)
+            line = data[start:end]
+            yield (_event_time(line), block.segment, block.offset + start), line
+            at = data.find(needle, end)
+
+    def _matching(self, since: Optional[float], until: Optional[float], user: Optional[str],
+                  action: Optional[str], after: Optional[Tuple[float, int, int]]) -> Iterator[tuple]:
+        """Matching events as (key, line), in key order."""
+        self.refresh()
+        since = -_INFINITY if since is None else since
+        until = _INFINITY if until is None else until
+        if after is not None:
+            since = max(since, after[0])
+        with self._lock:
+            blocks = (self._by_user.get(user, _Blocks()) if user is not None else self._all).between(since, until)
+        # Lines that can match contain the field as written; only those are parsed.
+        needles = [(field, value, b'"%s":%s' % (field.encode(), json.dumps(value).encode()))
+                   for field, value in (("user", user), ("action", action)) if value is not None]
+        heap = []
+        for block in blocks:
+            # Events of this and later blocks sort after the block's first event.
+            while heap and heap[0][0] < (block.first, block.segment, block.offset):
+                yield heapq.heappop(heap)
+            for key, line in self._read(block, needles[0][2] if needles else None):
+                if not since <= key[0] <= until or (after is not None and key <= after):
+                    continue
+                if needles and not all(needle in line and json.loads(line).get(field) == value
+                                       for field, value, needle in needles):
+                    continue
+                heapq.heappush(heap, (key, line))
+        while heap:
+            yield heapq.heappop(heap)
+
+    def query(self, since: Optional[float] = None, until: Optional[float] = None, user: Optional[str] = None,
+              action: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None) -> dict:
+        """
+        Events in time order.
+
+        Args:
+            since (float, optional): Earliest event time (Unix time).
+            until (float, optional): Latest event time.
+            user (str, optional): Only this user's events.
+            action (str, optional): Only events of this action.
+            limit (int): Events per page.
+            cursor (str, optional): `next_cursor` of the previous page.
+
+        Returns:
+            dict: {"events": [...], "next_cursor": str | None}; each event has an "id".
+
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+        after = _parse_cursor(cursor) if cursor else None
+        events, last, more = [], None, False
+        for key, line in self._matching(since, until, user, action, after):
+            if len(events) == limit:
+                more = True
+                break
+            events.append(dict(json.loads(line), id="%d:%d" % key[1:]))
+            last = key
+        return {"events": events, "next_cursor": _cursor(last) if more else None}
+
+    def export(self, since: Optional[float] = None, until: Optional[float] = None, user: Optional[str] = None,
+               action: Optional[str] = None) -> Iterator[bytes]:
+        """Matching events as stored, one JSON line each, in time order."""
+        for _, line in self._matching(since, until, user, action, None):
+            yield line + b"\n"
+
+
+async def audited(log: AuditLog, user: str, action: str, request: dict, operation: Awaitable[dict],
+                  diff: Optional[Callable[[dict], Optional[dict]]] = None,
+                  changed: Optional[Callable[[dict], bool]] = None) -> dict:
+    """
+    Runs a mutation and records it.
+
+    Args:
+        log (AuditLog): Where to record.
+        user (str): Who made the request.
+        action (str): What kind of mutation, e.g. "add".
+        request (dict): What was asked for (method, path, body).
+        operation (awaitable): The mutation; resolves to a {"status", "message"} result.
+        diff (callable, optional): Maps a successful result to {"added": [...], "removed": [...]}.
+        changed (callable, optional): Successful results it returns False for
+            changed nothing and are not recorded.
+
+    Returns:
+        dict: The mutation's result.
+    """
+    at = time.time()
+    started = time.perf_counter()
+    event = {"time": at, "user": user, "action": action, "request": request}
+    try:
+        result = await operation
+    except Exception as e:
+        log.record(dict(event, duration_ms=round((time.perf_counter() - started) * 1000, 3), outcome="error",
+                        message=str(e), diff=None))
+        raise
+    outcome = result.get("status", "success")
+    if changed is not None and outcome == "success" and not changed(result):
+        return result
+    log.record(dict(event, duration_ms=round((time.perf_counter() - started) * 1000, 3), outcome=outcome,
+                    message=result.get("message"),
+                    diff=diff(result) if diff is not None and outcome == "success" else None))
+    return result
+
+
+audit_log = AuditLog(AUDIT_DIR)
+Gauge("webfire_audit_buffered_events", "Audit events waiting to be written.", audit_log.buffered)
@@ -1,4 +1,23 @@
 # (C) 2025 by OPNLAB Development. All rights reserved.
+"""Passwords and tokens.
+
+- Password hashes are computed and checked in a small thread pool
+  (`AUTH_HASH_WORKERS`), never on the event loop: PBKDF2 is meant to be slow,
+  and hashlib releases the GIL while it runs. At most `AUTH_MAX_PENDING`
+  checks wait for the pool; beyond that logins fail fast with `LoginBusy`.
+- Access tokens are short-lived JWTs. Verified claims are cached by token
+  hash until the token expires, so a request carrying a known token costs a
+  dict lookup instead of an HMAC check and JSON decode.
+- Refresh tokens are longer-lived JWTs of type "refresh". They are only
+  accepted by the refresh endpoint, which answers with a new pair.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -6,27 +25,47 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
 
+from metrics import Gauge, add_timing, cache_lookups
+
 # to get a string like this run:
 # openssl rand -hex 32
 import os
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-super-secret-key") # TODO: Change this in production!
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+AUTH_HASH_WORKERS = int(os.getenv("WEBFIRE_AUTH_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+AUTH_MAX_PENDING = int(os.getenv("WEBFIRE_AUTH_MAX_PENDING", "64"))
+TOKEN_CACHE_SIZE = int(os.getenv("WEBFIRE_TOKEN_CACHE_SIZE", "10000"))
 
 # Use PBKDF2-SHA256 for wide compatibility (avoids bcrypt backend issues in containers)
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
+# Checked against when the user does not exist, so unknown and known users
+# take the same time to reject (hash of a random, discarded password).
+DUMMY_HASH = "$pbkdf2-sha256$29000$n5NSqlXK2Tvn3PvfO0fI.Q$tHiAQZzNPUXAZvJ3E1XhBOUPSk3T9SEgIotp0OoHsjM"
+
 
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
 
 
 class TokenData(BaseModel):
     username: Optional[str] = None
 
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
+class LoginBusy(Exception):
+    """Too many password checks are already waiting."""
+
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -35,6 +74,46 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+_hash_pool = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="webfire-hash")
+_pending = 0
+Gauge("webfire_hash_pool_pending", "Password hash operations running or waiting (saturated above the worker count).",
+      lambda: _pending)
+Gauge("webfire_hash_pool_workers", "Threads computing password hashes.", lambda: AUTH_HASH_WORKERS)
+
+
+async def _in_hash_pool(function, *args):
+    global _pending
+    if _pending >= AUTH_MAX_PENDING:
+        raise LoginBusy()
+    _pending += 1
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_pool, function, *args)
+    finally:
+        _pending -= 1
+        add_timing("password-hash", time.perf_counter() - started)
+
+
+async def verify_password_async(plain_password: str, hashed_password: Optional[str]) -> bool:
+    """
+    Checks a password in the hashing pool.
+
+    Args:
+        plain_password (str): The password given.
+        hashed_password (str, optional): The stored hash; None for an unknown
+            user, which is checked against `DUMMY_HASH` and always fails.
+
+    Raises:
+        LoginBusy: If `AUTH_MAX_PENDING` checks are already waiting.
+    """
+    valid = await _in_hash_pool(verify_password, plain_password, hashed_password or DUMMY_HASH)
+    return valid and hashed_password is not None
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _in_hash_pool(get_password_hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -44,3 +123,85 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+
+def create_refresh_token(username: str) -> str:
+    return create_access_token(
+        {"sub": username, "type": "refresh", "jti": uuid.uuid4().hex},
+        expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    )
+
+
+def issue_tokens(username: str) -> dict:
+    """Returns a new access/refresh token pair as the token endpoints answer it."""
+    return {
+        "access_token": create_access_token(
+            {"sub": username}, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)),
+        "token_type": "bearer",
+        "refresh_token": create_refresh_token(username),
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+
+class TokenCache:
+    """
+    Claims of verified tokens by SHA-256 of the token, dropped at expiry.
+
+    Used from the threadpool that runs sync dependencies, hence the lock.
+    """
+
+    def __init__(self, size: int = TOKEN_CACHE_SIZE):
+        self.size = size
+        self._claims: "OrderedDict[bytes, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[dict]:
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            claims = self._claims.get(key)
+            if claims is None:
+                return None
+            if claims["exp"] <= time.time():
+                self._claims.pop(key, None)
+                return None
+            return claims
+
+    def put(self, token: str, claims: dict):
+        if self.size <= 0:
+            return
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            self._claims[key] = claims
+            while len(self._claims) > self.size:
+                self._claims.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._claims.clear()
+
+
+token_cache = TokenCache()
+
+
+def decode_token(token: str, token_type: str = "access") -> dict:
+    """
+    Verifies a token and returns its claims.
+
+    Args:
+        token (str): The JWT.
+        token_type (str): "access" or "refresh"; a token of the other type is rejected.
+
+    Raises:
+        JWTError: If the token is invalid, expired or of the wrong type.
+    """
+    if token_type == "access":
+        claims = token_cache.get(token)
+        cache_lookups.inc("token", "miss" if claims is None else "hit")
+        if claims is not None:
+            return claims
+    claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if claims.get("type", "access") != token_type or not isinstance(claims.get("exp"), (int, float)):
+        raise JWTError("Wrong token type")
+    if token_type == "access":
+        token_cache.put(token, claims)
+    return claims
@@ -0,0 +1,73 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""JSON baselines of benchmark results, and regression checks against them.
+
+A result file is {"suite", "created", "host", "config", "results"}, where
+`results` maps a case name to its metrics. Metric names say which way is
+better: `*_ms` and `*_us` are latencies (lower is better), `*_per_s` are
+throughputs (higher is better); other metrics are informational.
+"""
+import json
+import platform
+import time
+from typing import Dict, List, Optional, Sequence
+
+
+def save(path: str, suite: str, config: dict, results: Dict[str, dict]):
+    document = {
+        "suite": suite,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "host": {"python": platform.python_version(), "machine": platform.machine(), "node": platform.node()},
+        "config": config,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(path: str, suite: str, config: dict, results: Dict[str, dict], tolerance: float,
+            checked: Optional[Sequence[str]] = None) -> List[str]:
+    """
+    Compares results with a saved baseline.
+
+    Args:
+        tolerance (float): Allowed relative change in the bad direction, e.g. 0.25.
+        checked (Sequence[str], optional): Metrics to check; all by default.
+
+    Returns:
+        list: One message per regression; also warnings when the baseline
+        was recorded with another suite or configuration.
+    """
+    with open(path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    messages = []
+    if baseline.get("suite") != suite:
+        return [f"baseline is for suite {baseline.get('suite')!r}, not {suite!r}"]
+    if baseline.get("config") != config:
+        messages.append(f"warning: baseline config {baseline.get('config')} differs from {config}")
+    for case, metrics in results.items():
+        old = baseline["results"].get(case)
+        if old is None:
+            continue
+        for name, value in metrics.items():
+            before = old.get(name)
+            if checked is not None and name not in checked:
+                continue
+            if not isinstance(before, (int, float)) or not before:
+                continue
+            if name.endswith(("_ms", "_us")) and value > before * (1 + tolerance):
+                messages.append(f"{case}: {name} {before:g} -> {value:g} (+{(value / before - 1) * 100:.0f}%)")
+            elif name.endswith("_per_s") and value < before / (1 + tolerance):
+                messages.append(f"{case}: {name} {before:g} -> {value:g} ({(value / before - 1) * 100:.0f}%)")
+    return messages
+
+
+def report(path: str, suite: str, config: dict, results: Dict[str, dict], tolerance: float,
+           checked: Optional[Sequence[str]] = None) -> int:
+    """Prints the comparison with a baseline; returns the exit status (1 on regressions)."""
+    messages = compare(path, suite, config, results, tolerance, checked)
+    regressions = [m for m in messages if not m.startswith("warning:")]
+    for message in messages:
+        print(message)
+    print("%d regression(s) against %s (tolerance %.0f%%)" % (len(regressions), path, tolerance * 100))
+    return 1 if regressions else 0
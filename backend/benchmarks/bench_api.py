@@ -0,0 +1,174 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""HTTP load test of the API against a fake ufw.
+
+Starts the backend under uvicorn with `fake_ufw` standing in for sudo and
+ufw (a generated configuration of `--rules` rules), then for `--seconds`
+drives, concurrently over real HTTP:
+
+- `--readers` clients polling `GET /api/rules`,
+- `--pollers` clients polling `GET /api/status`,
+- `--writers` clients each adding a rule (`POST /api/rules`), finding it
+  (`GET /api/rules?port=`) and deleting it (`DELETE /api/rules/{id}`).
+
+Every mutation invalidates the rule cache, so reads that follow one pay for
+a ufw call (or, with `--backend file`, for reading the rule files).
+Reports throughput and p50/p99 latency per operation, optionally saved as a
+JSON baseline (`--output`) or checked against one (`--compare`, exit 1 on a
+regression beyond `--tolerance`).
+
+Usage:
+    python benchmarks/bench_api.py [--rules 1000] [--seconds 10] [--backend status|file]
+        [--workers 1] [--output FILE] [--compare FILE]
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx  # noqa: E402
+
+import baseline  # noqa: E402
+import fake_ufw  # noqa: E402
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(tmp: str, args) -> tuple:
+    env = dict(os.environ, WEBFIRE_STATE_DIR=os.path.join(tmp, "state"),
+               WEBFIRE_MUTATION_LOCK=os.path.join(tmp, "mutations.lock"),
+               UFW_RULES_BACKEND=args.backend, UFW_LOG_FILE=os.path.join(tmp, "ufw.log"))
+    env.update(fake_ufw.setup(os.path.join(tmp, "ufw"), os.path.join(tmp, "bin"), args.rules))
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=BACKEND, env=env)
+    base = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            if httpx.get(base + "/").status_code == 200:
+                return server, base
+        except httpx.TransportError:
+            pass
+        if time.monotonic() > deadline or server.poll() is not None:
+            server.kill()
+            raise RuntimeError("The backend did not start")
+        time.sleep(0.2)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    async def request(self, client: httpx.AsyncClient, name: str, method: str, path: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+            ok = response.is_success
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        return response
+
+    def summary(self, seconds: float) -> dict:
+        results = {}
+        for name, samples in sorted(self.latencies.items()):
+            samples.sort()
+            results[name] = {
+                "requests": len(samples),
+                "errors": self.errors.get(name, 0),
+                "throughput_per_s": round(len(samples) / seconds, 2),
+                "p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+                "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2),
+            }
+        return results
+
+
+async def load(base: str, args) -> dict:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.readers + args.pollers + args.writers)
+    async with httpx.AsyncClient(base_url=base, timeout=120, limits=limits) as client:
+        token = (await client.post("/api/token", data={"username": "admin", "password": "secret"})).json()
+        client.headers["Authorization"] = f"Bearer {token['access_token']}"
+        await client.get("/api/rules")  # warm the cache
+        deadline = time.perf_counter() + args.seconds
+        ports = iter(random.Random(1).sample(range(20000, 60000), 40000))
+
+        async def reader():
+            while time.perf_counter() < deadline:
+                await recorder.request(client, "GET /api/rules", "GET", "/api/rules")
+
+        async def poller():
+            while time.perf_counter() < deadline:
+                await recorder.request(client, "GET /api/status", "GET", "/api/status")
+
+        async def writer():
+            while time.perf_counter() < deadline:
+                port = str(next(ports))
+                await recorder.request(client, "POST /api/rules", "POST", "/api/rules",
+                                       json={"action": "allow", "port": port, "protocol": "tcp"})
+                listing = await client.get("/api/rules", params={"port": port})
+                rules = listing.json().get("rules", []) if listing.is_success else []
+                if rules:
+                    await recorder.request(client, "DELETE /api/rules/{id}", "DELETE", f"/api/rules/{rules[0]['id']}",
+                                           headers={"If-Match": listing.headers.get("etag", "")})
+
+        started = time.perf_counter()
+        await asyncio.gather(*(reader() for _ in range(args.readers)), *(poller() for _ in range(args.pollers)),
+                             *(writer() for _ in range(args.writers)))
+        return recorder.summary(time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--pollers", type=int, default=4)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--backend", choices=["status", "file"], default="status")
+    parser.add_argument("--output", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", help="Baseline to check for regressions; exits 1 on any")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    config = {key: getattr(args, key) for key in ("rules", "seconds", "readers", "pollers", "writers",
+                                                   "workers", "backend")}
+    with tempfile.TemporaryDirectory() as tmp:
+        server, base = start_server(tmp, args)
+        try:
+            results = asyncio.run(load(base, args))
+        finally:
+            server.terminate()
+            server.wait(10)
+
+    print("%-24s %8s %7s %8s %10s %10s" % ("operation", "requests", "errors", "req/s", "p50 ms", "p99 ms"))
+    for name, result in results.items():
+        print("%-24s %8d %7d %8.1f %10.2f %10.2f" % (name, result["requests"], result["errors"],
+                                                     result["throughput_per_s"], result["p50_ms"], result["p99_ms"]))
+    if args.output:
+        baseline.save(args.output, "api", config, results)
+    if args.compare:
+        sys.exit(baseline.report(args.compare, "api", config, results, args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
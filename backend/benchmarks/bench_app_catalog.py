@@ -0,0 +1,56 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Service names on rule listings: catalog load and annotation cost.
+
+Times loading the catalog (the host's /etc/services and application
+profiles, or `WEBFIRE_SERVICES_FILE` / `UFW_APPLICATIONS_DIR`), then
+annotating a generated listing with a fresh catalog (every "to" value looked
+up once) and again with the memo warm, against parsing /etc/services for
+every request as a naive implementation would.
+
+Usage:
+    python benchmarks/bench_app_catalog.py [--rules 10000 50000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app_catalog  # noqa: E402
+from app_catalog import annotate_rules, load_catalog, parse_services  # noqa: E402
+from bench_rule_analysis import generate  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, nargs="+", default=[10000, 50000])
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    catalog = load_catalog()
+    print("catalog: %d profiles, %d service ports, loaded in %.2f ms" % (
+        len(catalog.profiles), len(catalog.services), (time.perf_counter() - start) * 1000))
+
+    for count in args.rules:
+        rules = generate(count)
+        catalog = load_catalog()
+        start = time.perf_counter()
+        annotated = annotate_rules(rules, catalog)
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        annotate_rules(rules, catalog)
+        warm = time.perf_counter() - start
+        named = sum(1 for rule in annotated if rule["services"])
+        print("%6d rules (%d distinct destinations, %d with names)" % (count, len(catalog._memo), named))
+        print("  %-34s %8.2f ms" % ("annotate, fresh catalog", cold * 1000))
+        print("  %-34s %8.2f ms" % ("annotate, memo warm", warm * 1000))
+
+        start = time.perf_counter()
+        with open(app_catalog.SERVICES_FILE, encoding="utf-8", errors="replace") as f:
+            parse_services(f.read())
+        print("  %-34s %8.2f ms" % ("parse /etc/services (per request)", (time.perf_counter() - start) * 1000))
+
+
+if __name__ == "__main__":
+    main()
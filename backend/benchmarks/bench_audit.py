@@ -0,0 +1,206 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Audit log: group-committed writes and indexed queries over a large log.
+
+Writes `--events` generated mutation events (a few dozen users, several
+actions, times spread over a year) through `AuditLog.commit` in groups of
+`--group`, as the background flush does, then opens the log with a fresh
+`AuditLog` and times queries against it. Times:
+
+- record:   `audited` calls on the event loop while the flush task commits,
+            `--record` events; reports events/s end to end (until on disk)
+            and the 99th percentile of the time a request spends in it
+- load:     building the index of the whole log from its .idx files
+- recent:   the first page (100 events) of the last hour
+- range:    the first page of a one-day range in the middle of the log
+- user:     the first page of one user's events over the whole log
+- paging:   the next 10 pages after `range`, by cursor
+- scan:     the same one-day range read without the index (every line parsed)
+- export:   streaming all events of one day
+
+Usage:
+    python benchmarks/bench_audit.py [--events 1000000] [--output FILE] [--compare FILE]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import baseline  # noqa: E402
+from audit import AuditLog, audited  # noqa: E402
+
+START = 1700000000.0
+YEAR = 365 * 86400
+ACTIONS = ("add", "add", "add", "delete", "delete", "batch", "ruleset", "enable", "disable")
+
+
+def generate_events(count, users, seed=1):
+    """Events in time order, as they are recorded."""
+    rng = random.Random(seed)
+    names = ["user%02d" % i for i in range(users)]
+    step = YEAR / count
+    for i in range(count):
+        port = rng.randrange(1, 65536)
+        action = rng.choice(ACTIONS)
+        yield {
+            "time": START + i * step + rng.random() * step,
+            "user": names[int(rng.paretovariate(1.2)) % users],
+            "action": action,
+            "request": {"method": "POST", "path": "/api/rules", "body": {"action": "allow", "port": str(port)}},
+            "duration_ms": round(rng.uniform(5, 80), 3),
+            "outcome": "success" if rng.random() < 0.95 else "error",
+            "message": "Rule added",
+            "diff": {"added": [{"to": "%d/tcp" % port, "action": "ALLOW", "direction": "IN", "from": "Anywhere"}],
+                     "removed": []},
+        }
+
+
+def write_log(log, count, users, group):
+    batch = []
+    for event in generate_events(count, users):
+        batch.append(event)
+        if len(batch) == group:
+            log.commit(batch)
+            batch = []
+    if batch:
+        log.commit(batch)
+
+
+async def record_burst(log, count, concurrency):
+    """Mutations recorded through `audited` by concurrent requests while `run` flushes."""
+    writer = asyncio.create_task(log.run())
+
+    async def operation():
+        return {"status": "success", "message": "Rule added"}
+
+    durations = []
+
+    async def request(worker):
+        for i in range(worker, count, concurrency):
+            started = time.perf_counter()
+            await audited(log, "user%02d" % (i % 20), "add", {"method": "POST", "path": "/api/rules"}, operation(),
+                          lambda _: {"added": [{"to": "%d/tcp" % (i % 65536)}], "removed": []})
+            durations.append(time.perf_counter() - started)
+            if i % 64 == 0:
+                await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request(worker) for worker in range(concurrency)))
+    await log.flush()
+    elapsed = time.perf_counter() - start
+    writer.cancel()
+    try:
+        await writer
+    except asyncio.CancelledError:
+        pass
+    durations.sort()
+    return elapsed, durations[int(len(durations) * 0.99)]
+
+
+def timed(function, repeat=5):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def scan_unindexed(directory, since, until):
+    """Every line of every segment parsed and filtered."""
+    events = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".log"):
+            with open(os.path.join(directory, name), "rb") as f:
+                for line in f:
+                    event = json.loads(line)
+                    if since <= event["time"] <= until:
+                        events.append(event)
+    events.sort(key=lambda event: event["time"])
+    return events[:100]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--group", type=int, default=500, help="Events per commit")
+    parser.add_argument("--record", type=int, default=50000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--output", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", help="Baseline to check for regressions; exits 1 on any")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        record_s, p99 = asyncio.run(record_burst(AuditLog(os.path.join(directory, "burst")), args.record,
+                                                 args.concurrency))
+        assert AuditLog(os.path.join(directory, "burst")).query(limit=1)["events"], "nothing recorded"
+
+        path = os.path.join(directory, "log")
+        start = time.perf_counter()
+        write_log(AuditLog(path), args.events, args.users, args.group)
+        write_s = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+        log = AuditLog(path)
+        start = time.perf_counter()
+        log.refresh()
+        load_ms = (time.perf_counter() - start) * 1000
+        assert log.events == args.events, "events lost"
+
+        end = START + YEAR
+        middle = START + YEAR / 2
+        recent_ms, _ = timed(lambda: log.query(since=end - 3600))
+        range_ms, page = timed(lambda: log.query(since=middle, until=middle + 86400))
+        user_ms, _ = timed(lambda: log.query(user="user07"))
+
+        def paging():
+            cursor = page["next_cursor"]
+            for _ in range(10):
+                cursor = log.query(since=middle, until=middle + 86400, cursor=cursor)["next_cursor"]
+
+        paging_ms, _ = timed(paging)
+        scan_ms, scanned = timed(lambda: scan_unindexed(path, middle, middle + 86400), repeat=1)
+        assert [event["time"] for event in scanned] == [event["time"] for event in page["events"]], \
+            "indexed and unindexed queries disagree"
+        export_ms, lines = timed(lambda: sum(1 for _ in log.export(since=middle, until=middle + 86400)))
+
+    print("%d events (%.0f MiB), %d users" % (args.events, size / 2 ** 20, args.users))
+    print("  record    %9.0f events/s  (%d concurrent requests, p99 %.3f ms in `audited`)"
+          % (args.record / record_s, args.concurrency, p99 * 1000))
+    print("  write     %9.0f events/s  (commits of %d)" % (args.events / write_s, args.group))
+    print("  load      %9.2f ms" % load_ms)
+    print("  recent    %9.2f ms" % recent_ms)
+    print("  range     %9.2f ms" % range_ms)
+    print("  user      %9.2f ms" % user_ms)
+    print("  paging    %9.2f ms  (10 pages)" % paging_ms)
+    print("  scan      %9.2f ms  (unindexed)" % scan_ms)
+    print("  export    %9.2f ms  (%d events)" % (export_ms, lines))
+
+    results = {
+        "record_events_per_s": round(args.record / record_s),
+        "record_p99_ms": round(p99 * 1000, 4),
+        "write_events_per_s": round(args.events / write_s),
+        "load_ms": round(load_ms, 2),
+        "recent_ms": round(recent_ms, 3),
+        "range_ms": round(range_ms, 3),
+        "user_ms": round(user_ms, 3),
+        "paging_ms": round(paging_ms, 3),
+        "export_ms": round(export_ms, 2),
+    }
+    config = {"events": args.events, "users": args.users, "group": args.group, "record": args.record}
+    if args.output:
+        baseline.save(args.output, "audit", config, results)
+    if args.compare:
+        sys.exit(baseline.report(args.compare, "audit", config, results, args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Protected-endpoint latency while logins are in progress.
+
+Drives the app in-process (httpx ASGI transport, one event loop, as one
+uvicorn worker would) with `--readers` clients polling `GET /api/mutations`
+with a valid token while `--logins` clients log in over and over. Reports
+read latency percentiles and login throughput for:
+
+- inline: PBKDF2 on the event loop and every token re-verified (before),
+- pool: PBKDF2 in the hashing thread pool, tokens re-verified,
+- pool+cache: hashing pool and verified-claims cache (current).
+
+Usage:
+    python benchmarks/bench_auth.py [--seconds 3] [--readers 20] [--logins 8]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from contextlib import nullcontext
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx  # noqa: E402
+
+import auth  # noqa: E402
+from main import app  # noqa: E402
+
+CREDENTIALS = {"username": "admin", "password": "secret"}
+
+
+async def _inline(function, *args):
+    return function(*args)
+
+
+async def measure(args) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        token = (await client.post("/api/token", data=CREDENTIALS)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        latencies, logins = [], 0
+        deadline = time.perf_counter() + args.seconds
+
+        async def reader():
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await client.get("/api/mutations", headers=headers)
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.text
+
+        async def login():
+            nonlocal logins
+            while time.perf_counter() < deadline:
+                response = await client.post("/api/token", data=CREDENTIALS)
+                if response.status_code == 200:
+                    logins += 1
+
+        await asyncio.gather(*(reader() for _ in range(args.readers)), *(login() for _ in range(args.logins)))
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {"reads": len(latencies), "p50": percentile(0.5), "p99": percentile(0.99),
+            "max": latencies[-1] * 1000, "logins": logins / args.seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--readers", type=int, default=20)
+    parser.add_argument("--logins", type=int, default=8)
+    args = parser.parse_args()
+
+    print("%d readers, %d login loops, %.0f s each, %d hashing workers"
+          % (args.readers, args.logins, args.seconds, auth.AUTH_HASH_WORKERS))
+    print("  %-12s %8s %9s %9s %9s %10s" % ("mode", "reads", "p50 ms", "p99 ms", "max ms", "logins/s"))
+    # A cache of size 0 stores nothing, so every request verifies its token.
+    modes = [("inline", True, 0), ("pool", False, 0), ("pool+cache", False, auth.TOKEN_CACHE_SIZE)]
+    for name, inline, cache_size in modes:
+        auth.token_cache.clear()
+        auth.token_cache.size = cache_size
+        with patch("auth._in_hash_pool", _inline) if inline else nullcontext():
+            result = asyncio.run(measure(args))
+        print("  %-12s %8d %9.2f %9.2f %9.2f %10.1f"
+              % (name, result["reads"], result["p50"], result["p99"], result["max"], result["logins"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Blocklist import: parsing, aggregation, ipset scripts and update diffs.
+
+Times every step of `PUT /api/blocklists/{name}` that runs in the API
+process for a synthetic feed (random /16../32 networks with overlaps), and
+compares the aggregation with `ipaddress.collapse_addresses`. The ipset
+restore itself runs in the kernel and is not measured.
+
+Usage:
+    python benchmarks/bench_blocklist.py [--entries 100000] [--churn 0.01]
+"""
+import argparse
+import ipaddress
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from blocklist import aggregate, diff_networks, incremental_script, save_script, swap_script  # noqa: E402
+
+
+def generate(count: int, seed: int = 1) -> str:
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(count):
+        length = rng.choice((16, 20, 24, 24, 28, 32, 32, 32, 32, 32))
+        address = ipaddress.IPv4Address(rng.getrandbits(32))
+        lines.append(f"{address}/{length}" if length < 32 else str(address))
+    return "\n".join(lines) + "\n"
+
+
+def timed(label, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    print("  %-34s %8.1f ms" % (label, (time.perf_counter() - start) * 1000))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--churn", type=float, default=0.01, help="Share of entries replaced in the update")
+    args = parser.parse_args()
+
+    text = generate(args.entries)
+    print("%d entries (%.1f MB)" % (args.entries, len(text) / 1e6))
+    result = timed("parse + aggregate", aggregate, text)
+    networks = result["v4"]
+    print("  -> %d networks in the ipset" % len(networks))
+    timed("ipaddress.collapse_addresses", lambda: list(ipaddress.collapse_addresses(
+        ipaddress.ip_network(line, strict=False) for line in text.split())))
+    timed("swap script", swap_script, "bench", "v4", networks)
+    timed("boot restore file", save_script, "bench", "v4", networks)
+
+    lines = text.split("\n")
+    changed = int(args.entries * args.churn)
+    replacement = generate(changed, seed=2).split("\n")
+    updated_text = "\n".join(replacement[:changed] + lines[changed:])
+    updated = timed("parse + aggregate (update)", aggregate, updated_text)
+    diff = timed("diff against installed set", diff_networks, networks, updated["v4"])
+    timed("incremental script", incremental_script, "bench", "v4", diff)
+    print("  -> +%d / -%d networks" % (len(diff["added"]), len(diff["removed"])))
+
+
+if __name__ == "__main__":
+    main()
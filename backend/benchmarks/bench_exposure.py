@@ -0,0 +1,175 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Socket inventory: chunked regex scan of synthetic /proc/net files vs. splitting every line.
+
+Writes /proc/net/tcp, tcp6, udp and udp6 files for a host with `--sockets`
+sockets, of which `--listeners` are listening and the rest established
+connections, and a listing of `--rules` incoming rules. Times:
+
+- cold:   first `SocketScanner.scan`, every listener decoded
+- warm:   a rescan after `--churn` connections changed; decoded listeners reused
+- naive:  reading each file's lines, splitting and converting every field,
+          keeping the listening ones (what a straightforward parser does)
+- join:   classifying the listeners against the rules (`exposure.classify`)
+
+Usage:
+    python benchmarks/bench_exposure.py [--sockets 200000] [--listeners 500] [--output FILE] [--compare FILE]
+"""
+import argparse
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import baseline  # noqa: E402
+from exposure import SocketScanner, classify  # noqa: E402
+
+HEADER = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+
+
+def _encode(address, port):
+    raw = socket.inet_pton(socket.AF_INET6 if ":" in address else socket.AF_INET, address)
+    return "%s:%04X" % (b"".join(raw[i:i + 4][::-1] for i in range(0, len(raw), 4)).hex().upper(), port)
+
+
+def _line(number, local, remote, state, uid, inode):
+    return "%4d: %s %s %s 00000000:00000000 00:00000000 00000000 %5d        0 %d 1 0000000000000000 100 0 0 10 0\n" % (
+        number, _encode(*local), _encode(*remote), state, uid, inode)
+
+
+def generate_sockets(total, listeners, seed=1):
+    """Socket entries per file: (local, remote, state, uid, inode)."""
+    rng = random.Random(seed)
+    files = {"tcp": [], "tcp6": [], "udp": [], "udp6": []}
+    ports = rng.sample(range(1, 20000), listeners)
+    for i, port in enumerate(ports):
+        name = rng.choice(("tcp", "tcp", "tcp6", "udp", "udp6"))
+        any_address = "::" if name.endswith("6") else "0.0.0.0"
+        local = rng.choice((any_address, any_address, "::1" if name.endswith("6") else "127.0.0.1"))
+        files[name].append(((local, port), (any_address, 0), "0A" if name.startswith("tcp") else "07",
+                            rng.randrange(1000), 100000 + i))
+    for i in range(total - listeners):
+        v6 = rng.random() < 0.3
+        name = "tcp6" if v6 else "tcp"
+        if v6:
+            local, remote = "2001:db8::10", "2001:db8:%x::%x" % (rng.randrange(65536), rng.randrange(1, 65536))
+        else:
+            local, remote = "192.0.2.10", "10.%d.%d.%d" % (rng.randrange(256), rng.randrange(256), rng.randrange(1, 255))
+        files[name].append(((local, rng.choice(ports)), (remote, rng.randrange(32768, 61000)),
+                            rng.choice(("01", "01", "01", "06", "08")), 33, 500000 + i))
+    for entries in files.values():
+        rng.shuffle(entries)
+    return files
+
+
+def write_proc(directory, files):
+    os.makedirs(os.path.join(directory, "net"), exist_ok=True)
+    size = 0
+    for name, entries in files.items():
+        text = HEADER + "".join(_line(i, *entry) for i, entry in enumerate(entries))
+        with open(os.path.join(directory, "net", name), "w") as f:
+            f.write(text)
+        size += len(text)
+    return size
+
+
+def scan_naive(directory):
+    """Every line split and every field converted."""
+    listeners = []
+    for name in ("tcp", "tcp6", "udp", "udp6"):
+        with open(os.path.join(directory, "net", name)) as f:
+            next(f)
+            for line in f:
+                fields = line.split()
+                local, remote, state = fields[1], fields[2], int(fields[3], 16)
+                address, port = local.split(":")
+                remote_address, remote_port = remote.split(":")
+                raw = bytes.fromhex(address)
+                raw = b"".join(raw[i:i + 4][::-1] for i in range(0, len(raw), 4))
+                entry = (name[:3], len(raw) == 16, socket.inet_ntop(socket.AF_INET6 if len(raw) == 16
+                                                                    else socket.AF_INET, raw),
+                         int(port, 16), int(fields[7]), int(fields[9]))
+                if state == 0x0A or (name.startswith("udp") and state == 7 and int(remote_address, 16) == 0):
+                    listeners.append(entry)
+    return listeners
+
+
+def generate_rules(count, seed=2):
+    rng = random.Random(seed)
+    rules = []
+    for i in range(count):
+        port = rng.randrange(1, 20000)
+        source = "Anywhere" if rng.random() < 0.7 else "10.%d.0.0/16" % rng.randrange(256)
+        rules.append({"id": i + 1, "to": "%d/tcp" % port, "action": rng.choice(("ALLOW", "ALLOW", "DENY")),
+                      "direction": "IN", "from": source})
+    return rules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, default=200000)
+    parser.add_argument("--listeners", type=int, default=500)
+    parser.add_argument("--churn", type=int, default=5000)
+    parser.add_argument("--rules", type=int, default=1000)
+    parser.add_argument("--output", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", help="Baseline to check for regressions; exits 1 on any")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    files = generate_sockets(args.sockets, args.listeners)
+    rules = generate_rules(args.rules)
+    with tempfile.TemporaryDirectory() as directory:
+        size = write_proc(directory, files)
+        scanner = SocketScanner(directory)
+
+        start = time.perf_counter()
+        listeners = scanner.scan()
+        cold_ms = (time.perf_counter() - start) * 1000
+
+        rng = random.Random(3)
+        for entries in files.values():
+            for i in rng.sample(range(len(entries)), min(len(entries), args.churn * len(entries) // args.sockets)):
+                local, remote, state, uid, inode = entries[i]
+                if state not in ("0A", "07"):
+                    entries[i] = (local, (remote[0], rng.randrange(32768, 61000)), state, uid, inode + args.sockets)
+        write_proc(directory, files)
+        start = time.perf_counter()
+        warm = scanner.scan()
+        warm_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        naive = scan_naive(directory)
+        naive_ms = (time.perf_counter() - start) * 1000
+
+    assert sorted(listeners) == sorted(warm) == sorted(naive), "scans disagree"
+    assert len(listeners) == args.listeners, "listeners lost"
+
+    start = time.perf_counter()
+    result = classify(listeners, rules)
+    join_ms = (time.perf_counter() - start) * 1000
+
+    print("%d sockets (%.1f MiB), %d listening, %d rules" % (args.sockets, size / 2 ** 20, len(listeners), args.rules))
+    print("  cold      %9.2f ms  (%.0f sockets/s)" % (cold_ms, args.sockets / cold_ms * 1000))
+    print("  warm      %9.2f ms" % warm_ms)
+    print("  naive     %9.2f ms  (%.1fx)" % (naive_ms, naive_ms / cold_ms))
+    print("  join      %9.2f ms  %s, %d unused rules" % (join_ms, result["counts"], len(result["unused_rules"])))
+
+    results = {
+        "cold_ms": round(cold_ms, 2),
+        "warm_ms": round(warm_ms, 2),
+        "join_ms": round(join_ms, 2),
+        "scan_sockets_per_s": round(args.sockets / cold_ms * 1000),
+        "naive_sockets_per_s": round(args.sockets / naive_ms * 1000),
+    }
+    config = {"sockets": args.sockets, "listeners": args.listeners, "churn": args.churn, "rules": args.rules}
+    if args.output:
+        baseline.save(args.output, "exposure", config, results)
+    if args.compare:
+        sys.exit(baseline.report(args.compare, "exposure", config, results, args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
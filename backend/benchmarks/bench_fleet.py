@@ -0,0 +1,123 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Fleet fan-out latency against simulated agents.
+
+Starts `--hosts` stand-in agents, each a minimal HTTP/1.1 keep-alive server
+on its own localhost port that answers after `--latency` ms (standing in
+for the agent running ufw). Then times:
+
+- one status read per host, one host after another (today's workflow),
+- the same read through `FleetClient.fan_out`, cold (login + connect) and
+  warm (pooled connections, cached tokens),
+- a staged rollout of one rule add (canary 5, then the rest).
+
+Usage:
+    python benchmarks/bench_fleet.py [--hosts 500] [--latency 20] [--concurrency 100]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fleet import Agent, AgentRegistry, FleetClient  # noqa: E402
+
+BODIES = {
+    "/api/token": json.dumps({"access_token": "t", "token_type": "bearer"}).encode(),
+    "/api/status": json.dumps({"status": "active"}).encode(),
+    "/api/rules": json.dumps({"status": "success", "message": "Rule added"}).encode(),
+}
+
+
+class StandInAgent:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode().split("\r\n")
+                path = lines[0].split(" ")[1].split("?")[0]
+                length = 0
+                for line in lines[1:]:
+                    if line.lower().startswith("content-length:"):
+                        length = int(line.split(":")[1])
+                if length:
+                    await reader.readexactly(length)
+                await asyncio.sleep(self.latency)
+                body = BODIES.get(path, b"{}")
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def timed(label, coroutine):
+    start = time.perf_counter()
+    result = await coroutine
+    print("  %-34s %8.0f ms" % (label, (time.perf_counter() - start) * 1000))
+    return result
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+async def run(args):
+    agent = StandInAgent(args.latency / 1000)
+    servers = [await asyncio.start_server(agent.handle, "127.0.0.1", 0, backlog=1024) for _ in range(args.hosts)]
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = AgentRegistry(os.path.join(tmp, "fleet.json"))
+        for n, server in enumerate(servers):
+            port = server.sockets[0].getsockname()[1]
+            registry.agents[f"host{n:04d}"] = Agent(url=f"http://127.0.0.1:{port}", username="admin", password="x")
+        names = registry.select()
+        print("%d hosts, %d ms agent latency, concurrency %d" % (args.hosts, args.latency, args.concurrency))
+
+        sequential = FleetClient(registry, concurrency=1)
+        await timed("sequential reads", _sequential(sequential, names))
+        await sequential.close()
+
+        client = FleetClient(registry, concurrency=args.concurrency)
+        before = agent.connections
+        results = await timed("fan-out reads (cold)", collect(client.fan_out(names, "GET", "/api/status")))
+        cold_connections = agent.connections - before
+        results += await timed("fan-out reads (warm)", collect(client.fan_out(names, "GET", "/api/status")))
+        print("  -> %d/%d ok, %d connections opened, %d more when warm" % (
+            sum(r["ok"] for r in results), len(results), cold_connections,
+            agent.connections - before - cold_connections))
+        latencies = sorted(r["elapsed_ms"] for r in results[len(names):])
+        print("  -> warm per-host p50 %.1f ms, p95 %.1f ms" % (
+            latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]))
+        events = await timed("rollout, canary 5 then rest", collect(client.rollout(
+            names, "POST", "/api/rules", {"action": "allow", "port": "8443"}, canary=5)))
+        print("  -> %s" % json.dumps(events[-1]))
+        await client.close()
+    for server in servers:
+        server.close()
+
+
+async def _sequential(client, names):
+    for name in names:
+        await client.call(name, "GET", "/api/status")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hosts", type=int, default=500)
+    parser.add_argument("--latency", type=int, default=20, help="Simulated agent response time in ms")
+    parser.add_argument("--concurrency", type=int, default=100)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
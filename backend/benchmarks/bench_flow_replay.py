@@ -0,0 +1,150 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Flow replay: recorded flows against a rule set, indexed and memoized vs. a per-rule loop.
+
+Generates `--rules` rules (port rules, port ranges, rules for source
+networks, deny rules for single hosts, some IPv6) and `--flows` CSV flow
+records as a busy host sees them: clients from a pool of `--hosts`
+addresses, destination ports skewed towards a few services, random source
+ports. Times:
+
+- compile:  listing -> indexed rule engine
+- replay:   reading and deciding all records (`flow_replay.replay`)
+- naive:    parsing each record and trying the same rules in order until
+            one matches, over `--naive-flows` records generated alike (the
+            first records of the replay set); a full run on that many
+
+Both report the measured flows per second of their own run.
+
+Usage:
+    python benchmarks/bench_flow_replay.py [--rules 1000] [--flows 1000000] [--naive-flows 20000]
+                                           [--output FILE] [--compare FILE]
+"""
+import argparse
+import csv
+import io
+import ipaddress
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import baseline  # noqa: E402
+from flow_replay import RuleEngine, compile_rules, replay  # noqa: E402
+
+
+def generate_rules(count, seed=1):
+    """A listing of `count` rules."""
+    rng = random.Random(seed)
+    rules = []
+    for i in range(count):
+        kind = rng.random()
+        port = rng.randrange(1, 20000)
+        if kind < 0.4:
+            rule = {"to": "%d/tcp" % port, "action": "ALLOW", "from": "Anywhere"}
+        elif kind < 0.55:
+            rule = {"to": "%d:%d/udp" % (port, port + rng.randrange(1, 500)), "action": "ALLOW", "from": "Anywhere"}
+        elif kind < 0.75:
+            rule = {"to": "%d/tcp" % port, "action": "ALLOW",
+                    "from": "10.%d.%d.0/24" % (rng.randrange(256), rng.randrange(256))}
+        elif kind < 0.9:
+            rule = {"to": "Anywhere", "action": "DENY", "from": "198.51.%d.%d" % (rng.randrange(256), rng.randrange(256))}
+        else:
+            rule = {"to": "%d/tcp (v6)" % port, "action": "ALLOW", "from": "Anywhere (v6)"}
+        rule.update(id=i + 1, direction="IN")
+        rules.append(rule)
+    return rules
+
+
+def generate_flows(count, hosts, seed=2):
+    """CSV flow records."""
+    rng = random.Random(seed)
+    clients = ["10.%d.%d.%d" % (rng.randrange(256), rng.randrange(256), rng.randrange(1, 255)) for _ in range(hosts // 2)]
+    clients += ["198.51.%d.%d" % (rng.randrange(256), rng.randrange(256)) for _ in range(hosts - len(clients))]
+    services = [22, 25, 53, 80, 443, 3306, 5432, 8080] + [rng.randrange(1, 20000) for _ in range(200)]
+    lines = ["src,dst,proto,sport,dport"]
+    for _ in range(count):
+        port = rng.choice(services[:8]) if rng.random() < 0.8 else rng.choice(services)
+        lines.append("%s,192.0.2.10,%s,%d,%d" % (rng.choice(clients), "udp" if port == 53 else "tcp",
+                                                  rng.randrange(32768, 61000), port))
+    return "\n".join(lines) + "\n"
+
+
+def replay_naive(text, matches):
+    """Per record: parse, then try every rule in order."""
+    verdicts = []
+    reader = csv.reader(io.StringIO(text))
+    next(reader)
+    for src, dst, proto, _, dport in reader:
+        src, dst, dport = ipaddress.ip_address(src), ipaddress.ip_address(dst), int(dport)
+        v6 = src.version == 6
+        src, dst = int(src), int(dst)
+        verdict = "deny"
+        for rule in matches:
+            if rule.v6 != v6 or rule.direction != "in" or rule.protocol not in ("any", proto):
+                continue
+            if not (rule.src[0] <= src <= rule.src[1] and rule.dst[0] <= dst <= rule.dst[1]):
+                continue
+            if rule.dports is not None and not any(low <= dport <= high for low, high in rule.dports):
+                continue
+            verdict = rule.action.lower()
+            break
+        verdicts.append(verdict)
+    return verdicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=1000)
+    parser.add_argument("--flows", type=int, default=1000000)
+    parser.add_argument("--hosts", type=int, default=20000)
+    parser.add_argument("--naive-flows", type=int, default=20000)
+    parser.add_argument("--output", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", help="Baseline to check for regressions; exits 1 on any")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    rules = generate_rules(args.rules)
+    text = generate_flows(args.flows, args.hosts)
+
+    start = time.perf_counter()
+    matches, _ = compile_rules(rules)
+    engine = RuleEngine(matches)
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    result = replay(text, [engine])
+    replay_s = time.perf_counter() - start
+
+    # The same generator and seed: these are the first records of `text`.
+    sample = min(args.naive_flows, args.flows)
+    naive_text = generate_flows(sample, args.hosts)
+    start = time.perf_counter()
+    naive = replay_naive(naive_text, matches)
+    naive_s = time.perf_counter() - start
+
+    indexed = [result.decisions[i][0][0] for i in result.flows[:sample]]
+    assert indexed == naive, "indexed and naive replay disagree"
+
+    print("%d rules, %d flows (%.1f MiB), %d distinct" % (args.rules, args.flows, len(text) / 2 ** 20,
+                                                         len(result.distinct)))
+    print("  compile   %9.2f ms" % compile_ms)
+    print("  replay    %9.2f s  for %d flows (%.0f flows/s)" % (replay_s, args.flows, args.flows / replay_s))
+    print("  naive     %9.2f s  for %d flows (%.0f flows/s)" % (naive_s, sample, sample / naive_s))
+
+    results = {
+        "compile_ms": round(compile_ms, 2),
+        "replay_ms": round(replay_s * 1000, 2),
+        "replay_flows_per_s": round(args.flows / replay_s),
+        "naive_flows_per_s": round(sample / naive_s),
+    }
+    config = {"rules": args.rules, "flows": args.flows, "naive_flows": sample, "hosts": args.hosts}
+    if args.output:
+        baseline.save(args.output, "flow_replay", config, results)
+    if args.compare:
+        sys.exit(baseline.report(args.compare, "flow_replay", config, results, args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
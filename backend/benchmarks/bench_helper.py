@@ -0,0 +1,131 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Per-operation latency of ufw calls: sudo per call vs. the privileged helper.
+
+Generates a configuration of `--rules` rules for `fake_ufw` and times the
+ufw_service calls behind the API, `--iterations` times each:
+
+- list:   fetching the rule listing (`ufw status numbered` and parsing it,
+          or the helper's `list`)
+- add:    `add_ufw_rule`
+- delete: `delete_ufw_rule`
+- reload: `reload_ufw`
+
+"sudo" starts the sudo stand-in and the fake ufw for every call, as the API
+does without the helper. "helper" sends the same calls to `ufw_helper`
+running in its own process with the fake's command code loaded in-process,
+as the helper loads ufw's frontend. Both pay the fake's simulated kernel
+apply time (`FAKE_UFW_APPLY_MS`), so the difference is what the helper
+saves: process start, imports, and reading and parsing the rule files.
+
+Usage:
+    python benchmarks/bench_helper.py [--rules 1000] [--iterations 20] [--output FILE] [--compare FILE]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(BENCHMARKS, "..")
+sys.path.insert(0, BACKEND)
+
+import baseline  # noqa: E402
+import fake_ufw  # noqa: E402
+import ufw_service  # noqa: E402
+from ufw_service import Rule, add_ufw_rule, delete_ufw_rule, reload_ufw  # noqa: E402
+
+HELPER = f"""
+import sys
+sys.path[:0] = [{BACKEND!r}, {BENCHMARKS!r}]
+import fake_ufw, ufw_helper
+from ufw_service import CommandResult
+ufw_helper.main(lambda argv, input=None: CommandResult(*fake_ufw.run(argv)))
+"""
+
+
+def start_helper(socket_path: str) -> subprocess.Popen:
+    helper = subprocess.Popen([sys.executable, "-c", HELPER, "--socket", socket_path])
+    deadline = time.monotonic() + 30
+    while not os.path.exists(socket_path):
+        if time.monotonic() > deadline or helper.poll() is not None:
+            helper.kill()
+            raise RuntimeError("The helper did not start")
+        time.sleep(0.05)
+    return helper
+
+
+async def run_operations(iterations: int) -> dict:
+    async def listing():
+        data = await ufw_service._fetch_ufw_rules()
+        assert data["status"] == "active", data
+
+    async def add():
+        result = await add_ufw_rule(Rule(action="allow", port=str(next(ports)), protocol="tcp",
+                                         from_ip="10.0.0.0/8"))
+        assert result["status"] == "success", result
+
+    async def delete():
+        # Removes the oldest rule, so adds and deletes keep the count steady.
+        result = await delete_ufw_rule(1)
+        assert result["status"] == "success", result
+
+    ports = iter(range(20000, 60000))
+    results = {}
+    for name, operation in (("list", listing), ("add", add), ("delete", delete), ("reload", reload_ufw)):
+        await operation()  # warm up
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            await operation()
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+        results[name] = {"p50_ms": round(samples[len(samples) // 2] * 1000, 2),
+                         "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 2)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--output", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", help="Baseline to check for regressions; exits 1 on any")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(fake_ufw.setup(os.path.join(tmp, "ufw"), os.path.join(tmp, "bin"), args.rules))
+        for name, result in asyncio.run(run_operations(args.iterations)).items():
+            results[f"sudo/{name}"] = result
+
+        socket_path = os.path.join(tmp, "helper.sock")
+        helper = start_helper(socket_path)
+        ufw_service.HELPER_SOCKET = socket_path
+        try:
+            for name, result in asyncio.run(run_operations(args.iterations)).items():
+                results[f"helper/{name}"] = result
+        finally:
+            ufw_service.HELPER_SOCKET = None
+            helper.terminate()
+            helper.wait(10)
+
+    print("%-10s %12s %12s %12s %12s %9s" % ("operation", "sudo p50 ms", "sudo p99 ms",
+                                              "helper p50", "helper p99", "speedup"))
+    for name in ("list", "add", "delete", "reload"):
+        before, after = results[f"sudo/{name}"], results[f"helper/{name}"]
+        print("%-10s %12.2f %12.2f %12.2f %12.2f %8.1fx" % (
+            name, before["p50_ms"], before["p99_ms"], after["p50_ms"], after["p99_ms"],
+            before["p50_ms"] / max(after["p50_ms"], 0.001)))
+    config = {"rules": args.rules, "iterations": args.iterations}
+    if args.output:
+        baseline.save(args.output, "helper", config, results)
+    if args.compare:
+        sys.exit(baseline.report(args.compare, "helper", config, results, args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Rule history storage: size and latency over many versions.
+
+Generates a ufw configuration with N rules (see bench_rule_readers) and
+records `--versions` successive versions, each adding, deleting or changing
+one rule block (with the occasional revert to an earlier state, which
+deduplicates). Reports the time per recorded version, the size of the pack
+and version log, and the time to rebuild and diff random versions.
+
+Usage:
+    python benchmarks/bench_history.py [--rules 1000] [--versions 10000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_rule_readers import generate_config  # noqa: E402
+from history import RuleHistory, join_files  # noqa: E402
+
+
+def split_blocks(text):
+    head, _, rest = text.partition("### RULES ###\n")
+    body, _, tail = rest.partition("### END RULES ###")
+    return head + "### RULES ###\n", [b for b in body.split("\n\n") if b.strip()], "### END RULES ###" + tail
+
+
+def render(parts):
+    head, blocks, tail = parts
+    return head + "".join("\n" + block.strip("\n") + "\n" for block in blocks) + "\n" + tail
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.95) - 1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=1000)
+    parser.add_argument("--versions", type=int, default=10000)
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+    rng = random.Random(5)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        generate_config(tmp, args.rules)
+        files = []
+        for name in ("user.rules", "user6.rules"):
+            with open(os.path.join(tmp, name)) as f:
+                files.append(split_blocks(f.read()))
+        raw = len(join_files([render(parts) for parts in files]))
+        history = RuleHistory(os.path.join(tmp, "history"))
+
+        recorded = []
+        saved = []
+        start = time.perf_counter()
+        for n in range(args.versions):
+            head, blocks, tail = files[rng.random() < 0.3]
+            roll = rng.random()
+            if roll < 0.05 and saved:
+                files = rng.choice(saved)  # revert to an earlier state
+                files = [(h, list(b), t) for h, b, t in files]
+            elif roll < 0.5 or len(blocks) < 10:
+                port = 20000 + n
+                blocks.insert(rng.randrange(len(blocks) + 1),
+                              "### tuple ### allow tcp %d 0.0.0.0/0 any 0.0.0.0/0 in\n"
+                              "-A ufw-user-input -p tcp --dport %d -j ACCEPT" % (port, port))
+            else:
+                del blocks[rng.randrange(len(blocks))]
+            if n % 500 == 0:
+                saved.append([(h, list(b), t) for h, b, t in files])
+            version = history.append(join_files([render(parts) for parts in files]), "bench")
+            if version:
+                recorded.append(version["id"])
+        elapsed = time.perf_counter() - start
+
+        pack = os.path.getsize(history.store.path)
+        log = os.path.getsize(history.log_path)
+        print("%d rules (%.0f KB per version uncompressed), %d versions" % (args.rules, raw / 1024, len(recorded)))
+        print("  record                 %8.2f ms per version" % (elapsed / args.versions * 1000))
+        print("  objects.pack           %8.2f MB  (%d distinct contents)" % (pack / 1e6, len(history.store._index)))
+        print("  versions.jsonl         %8.2f MB" % (log / 1e6))
+        print("  uncompressed total     %8.2f MB" % (raw * len(recorded) / 1e6))
+
+        reopened = RuleHistory(os.path.join(tmp, "history"))
+        start = time.perf_counter()
+        reopened.versions
+        reopened.store._refresh()
+        print("  open (index scan)      %8.2f ms" % ((time.perf_counter() - start) * 1000))
+        rebuild, diff = [], []
+        for _ in range(args.samples):
+            version_id = rng.choice(recorded)
+            reopened.store._cache.clear()
+            start = time.perf_counter()
+            reopened.store.get(reopened.get(version_id)["hash"])
+            rebuild.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            reopened.diff(version_id)
+            diff.append(time.perf_counter() - start)
+        print("  rebuild random version p50 %6.2f ms  p95 %6.2f ms" % percentiles(rebuild))
+        print("  diff random version    p50 %6.2f ms  p95 %6.2f ms" % percentiles(diff))
+
+
+if __name__ == "__main__":
+    main()
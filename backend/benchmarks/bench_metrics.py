@@ -0,0 +1,141 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Request overhead of the metrics middleware and instrumentation.
+
+Calls the ASGI app directly (no sockets, no HTTP client), so the per-request
+cost of the application itself is what is measured. Each mode runs in its
+own process, because `WEBFIRE_METRICS` is read at import:
+
+- off: `WEBFIRE_METRICS=0` (no middleware, recording is a no-op),
+- on: the default,
+- on+profile: with the `X-Webfire-Profile` header on every request.
+
+Endpoints: `GET /` (nothing but the framework) and an authenticated
+`GET /api/rules` of `--rules` rules served from the snapshot cache. The
+framework's own variance is larger than the overhead, so the middleware is
+also timed alone, around an app that does nothing.
+
+Usage:
+    python benchmarks/bench_metrics.py [--requests 5000] [--rules 100]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+async def drive(app, path: str, headers: list, requests: int) -> list:
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+             "root_path": "", "headers": headers, "client": ("127.0.0.1", 1), "server": ("bench", 80)}
+    request = {"type": "http.request", "body": b"", "more_body": False}
+
+    async def receive():
+        return request
+
+    async def send(message):
+        pass
+
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        await app(dict(scope), receive, send)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def worker(args):
+    """Runs in a child process: times both endpoints with the current environment."""
+    from unittest.mock import patch
+
+    from fastapi.testclient import TestClient
+
+    from main import app
+
+    data = {"status": "active", "rules": [
+        {"id": n + 1, "to": f"{1000 + n}/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"}
+        for n in range(args.rules)]}
+    token = TestClient(app).post("/api/token", data={"username": "admin", "password": "secret"}).json()
+    headers = [(b"authorization", f"Bearer {token['access_token']}".encode())]
+    if args.profile:
+        headers.append((b"x-webfire-profile", b"1"))
+    results = {}
+    with patch("ufw_service._fetch_ufw_rules", return_value=data):
+        for path in ("/", "/api/rules"):
+            asyncio.run(drive(app, path, headers, args.requests // 10))  # warm up
+            timings = sorted(asyncio.run(drive(app, path, headers, args.requests)))
+            results[path] = {"mean": sum(timings) / len(timings) * 1e6,
+                             "p99": timings[int(len(timings) * 0.99)] * 1e6}
+    print(json.dumps(results))
+
+
+async def _empty_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def middleware_alone(requests: int) -> dict:
+    from metrics import MetricsMiddleware
+
+    class Route:
+        path = "/bench"
+
+    results = {}
+    for name, app in (("bare", _empty_app), ("middleware", MetricsMiddleware(_empty_app))):
+        async def run(app=app):
+            scope = {"type": "http", "method": "GET", "headers": [(b"accept", b"*/*")], "route": Route()}
+            started = time.perf_counter()
+            for _ in range(requests):
+                await app(dict(scope), None, _discard)
+            return (time.perf_counter() - started) / requests * 1e6
+
+        results[name] = asyncio.run(run())
+    return results
+
+
+async def _discard(message):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rules", type=int, default=100)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--profile", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args)
+        return
+
+    modes = [("off", {"WEBFIRE_METRICS": "0"}, []), ("on", {"WEBFIRE_METRICS": "1"}, []),
+             ("on+profile", {"WEBFIRE_METRICS": "1"}, ["--profile"])]
+    results = {}
+    with tempfile.TemporaryDirectory() as state_dir:
+        for name, env, extra in modes:
+            output = subprocess.run(
+                [sys.executable, __file__, "--worker", "--requests", str(args.requests), "--rules", str(args.rules)]
+                + extra, env=dict(os.environ, WEBFIRE_STATE_DIR=state_dir, **env),
+                check=True, capture_output=True, text=True).stdout
+            results[name] = json.loads(output.strip().splitlines()[-1])
+
+    alone = middleware_alone(args.requests * 20)
+    print("middleware alone: %.2f us/request (empty app %.2f us)"
+          % (alone["middleware"] - alone["bare"], alone["bare"]))
+    print("%d requests per endpoint, times in microseconds" % args.requests)
+    print("  %-12s %-11s %9s %9s %10s" % ("mode", "endpoint", "mean", "p99", "overhead"))
+    for path in ("/", "/api/rules"):
+        base = results["off"][path]["mean"]
+        for name, _, _ in modes:
+            result = results[name][path]
+            print("  %-12s %-11s %9.1f %9.1f %+9.1f%%"
+                  % (name, path, result["mean"], result["p99"], (result["mean"] / base - 1) * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Rule analysis time over synthetic rule sets.
+
+Generates listings with a realistic mix: per-port allows, per-source allows,
+"deny from" blocks, port ranges and IPv6 twins; then times `analyze_rules`.
+With --check the findings are compared against a naive pairwise scan.
+
+Usage:
+    python benchmarks/bench_rule_analysis.py [--rules 1000 10000] [--check]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import rule_analysis  # noqa: E402
+from rule_analysis import analyze_rules, parse_listing_rule  # noqa: E402
+
+
+def generate(count, seed=1):
+    rng = random.Random(seed)
+    v4, v6 = [], []
+
+    def source():
+        if rng.random() < 0.5:
+            return "10.%d.%d.0/24" % (rng.randrange(256), rng.randrange(256))
+        return "%d.%d.%d.%d" % (rng.choice((45, 89, 185, 203)), rng.randrange(256), rng.randrange(256),
+                                rng.randrange(1, 255))
+
+    while len(v4) + len(v6) < count:
+        kind = rng.random()
+        proto = rng.choice(("/tcp", "/tcp", "/udp", ""))
+        port = str(rng.randrange(1, 65536))
+        if kind < 0.45:
+            rule = (port + proto, rng.choice(("ALLOW", "ALLOW", "DENY", "LIMIT")), "IN", "Anywhere")
+        elif kind < 0.7:
+            rule = (port + proto, "ALLOW", "IN", source())
+        elif kind < 0.85:
+            rule = ("Anywhere", rng.choice(("DENY", "REJECT")), "IN", source())
+        elif kind < 0.92:
+            low = rng.randrange(1024, 60000)
+            rule = ("%d:%d/tcp" % (low, low + rng.randrange(1, 2000)), "ALLOW", "IN", "Anywhere")
+        else:
+            rule = (port + proto, rng.choice(("ALLOW", "DENY")), "OUT", "Anywhere")
+        v4.append(rule)
+        if rule[3] == "Anywhere" and rng.random() < 0.5:
+            v6.append((rule[0] + " (v6)", rule[1], rule[2], "Anywhere (v6)"))
+    rules = v4 + v6
+    return [{"id": i + 1, "to": to, "action": action, "direction": direction, "from": src}
+            for i, (to, action, direction, src) in enumerate(rules[:count])]
+
+
+def naive(rules):
+    matches = [m for m in map(parse_listing_rule, rules) if m]
+    kinds = {}
+    for i, match in enumerate(matches):
+        accept = match.action in ("ALLOW", "LIMIT")
+        conflict = False
+        for earlier in matches[:i]:
+            if (earlier.v6, earlier.direction) != (match.v6, match.direction):
+                continue
+            if rule_analysis.covers(earlier, match):
+                kinds[match.id] = "redundant" if earlier.action == match.action else "shadowed"
+                break
+            if ((earlier.action in ("ALLOW", "LIMIT")) != accept and earlier.src[0] <= match.src[0] and match.src[1] <= earlier.src[1]
+                    and rule_analysis.overlaps(earlier, match)):
+                conflict = True
+        else:
+            if conflict:
+                kinds[match.id] = "conflict"
+    return kinds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--check", action="store_true", help="compare with a naive O(n^2) scan")
+    args = parser.parse_args()
+
+    for count in args.rules:
+        rules = generate(count)
+        start = time.perf_counter()
+        result = analyze_rules(rules)
+        elapsed = time.perf_counter() - start
+        print("%6d rules: %7.1f ms  %s" % (count, elapsed * 1000, result["counts"]))
+        if args.check:
+            start = time.perf_counter()
+            expected = naive(rules)
+            naive_time = time.perf_counter() - start
+            got = {f["id"]: f["kind"] for f in result["findings"]}
+            print("              naive %7.1f ms, %s" % (naive_time * 1000, "match" if got == expected else "MISMATCH"))
+
+
+if __name__ == "__main__":
+    main()
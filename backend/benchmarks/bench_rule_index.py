@@ -0,0 +1,57 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Filtered rule listing: index build time and per-query latency.
+
+Compares `RuleIndex.query` with the scan the rules table used to run in the
+browser (every field of every rule checked per keystroke).
+
+Usage:
+    python benchmarks/bench_rule_index.py [--rules 10000 50000] [--repeat 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_rule_analysis import generate  # noqa: E402
+from rule_index import RuleIndex, RuleQuery  # noqa: E402
+
+QUERIES = [
+    ("q=22", RuleQuery(q="22")),
+    ("q=203.0", RuleQuery(q="203.0")),
+    ("action=DENY&port=443", RuleQuery(action="DENY", port=443)),
+    ("cidr_contains=10.1.2.3", RuleQuery(cidr_contains="10.1.2.3")),
+    ("direction=OUT&q=tcp", RuleQuery(direction="OUT", q="tcp")),
+]
+
+
+def scan(rules, q):
+    q = q.lower()
+    return [r for r in rules if any(q in str(value).lower() for value in r.values())]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    for count in args.rules:
+        rules = generate(count)
+        start = time.perf_counter()
+        index = RuleIndex(rules)
+        print("%6d rules: index built in %.0f ms" % (count, (time.perf_counter() - start) * 1000))
+        for label, query in QUERIES:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                result = index.query(query, limit=100)
+            elapsed = (time.perf_counter() - start) / args.repeat
+            print("  %-26s %8.3f ms  (%d matches)" % (label, elapsed * 1000, result["total"]))
+        start = time.perf_counter()
+        scan(rules, "22")
+        print("  %-26s %8.3f ms" % ("field scan, q=22", (time.perf_counter() - start) * 1000))
+
+
+if __name__ == "__main__":
+    main()
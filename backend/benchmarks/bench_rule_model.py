@@ -0,0 +1,141 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Parsing a dual-stack rule listing: dicts vs. the typed rule model.
+
+Generates `ufw status numbered` output for `--rules` rules of a dual-stack
+host: rules without addresses are listed twice (IPv4 and "(v6)"), rules with
+an IPv4 or IPv6 source once. Measures, per parser, the time to parse the
+output and the memory the parsed rules keep (tracemalloc), including what
+they add to the `parse_location` and network caches:
+
+- dicts:        `parse_ufw_status_numbered`, the JSON listing (strings only)
+- dicts+parse:  the listing plus an ipaddress network per address column,
+                parsed per rule, as a naive typed model would
+- dicts+model:  the listing plus `parse_listing` over it; what the server
+                keeps once `get_listed_rules` has parsed a snapshot. Timed
+                with warm caches (a new snapshot of a known rule set) and
+                with empty ones (cold); both keep the same memory, as the
+                warm run reuses what the cold one cached
+
+and the time to group IPv4/IPv6 twins.
+
+Usage:
+    python benchmarks/bench_rule_model.py [--rules 20000] [--repeat 5] [--output FILE] [--compare FILE]
+"""
+import argparse
+import gc
+import ipaddress
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import baseline  # noqa: E402
+import rule_model  # noqa: E402
+from rule_model import group_twins, parse_listing  # noqa: E402
+from ufw_service import parse_ufw_status_numbered  # noqa: E402
+
+
+def generate(count, seed=1):
+    """`ufw status numbered` output for `count` rules, IPv4 lines first."""
+    rng = random.Random(seed)
+    v4, v6 = [], []
+    for _ in range(count):
+        proto = rng.choice(("/tcp", "/tcp", "/udp", ""))
+        port = str(rng.randrange(1, 65536)) if rng.random() < 0.9 else "%d:%d/tcp" % (1000, rng.randrange(1001, 5000))
+        to = port + (proto if ":" not in port else "")
+        action = rng.choice(("ALLOW IN", "ALLOW IN", "DENY IN", "LIMIT IN", "ALLOW OUT"))
+        kind = rng.random()
+        if kind < 0.6:
+            v4.append((to, action, "Anywhere"))
+            v6.append((to + " (v6)", action, "Anywhere (v6)"))
+        elif kind < 0.8:
+            v4.append((to, action, "10.%d.%d.0/24" % (rng.randrange(256), rng.randrange(256))))
+        else:
+            v6.append((to + " (v6)", action, "2001:db8:%x::/48" % rng.randrange(65536)))
+    lines = ["Status: active", "", "     To                         Action      From",
+             "     --                         ------      ----"]
+    for i, (to, action, src) in enumerate(v4 + v6):
+        lines.append("[%2d] %-26s %-11s %s" % (i + 1, to, action, src))
+    return "\n".join(lines) + "\n"
+
+
+def parse_dicts_typed(output):
+    rules = parse_ufw_status_numbered(output)["rules"]
+    for rule in rules:
+        for key in ("to", "from"):
+            head = rule[key].split(" ", 1)[0]
+            if not head.startswith("Anywhere") and head[0].isdigit() and ("." in head or ":" in head):
+                try:
+                    rule[key + "_net"] = ipaddress.ip_network(head, strict=False)
+                except ValueError:
+                    pass
+    return rules
+
+
+def parse_dicts_model(output):
+    data = parse_ufw_status_numbered(output)
+    return data, parse_listing(data["rules"])
+
+
+def clear_caches():
+    rule_model.parse_location.cache_clear()
+    rule_model._network.cache_clear()
+
+
+def measure(parse, output, repeat, before=None):
+    timings = []
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        parse(output)
+        timings.append(time.perf_counter() - start)
+    # Cache entries are part of what a parse keeps.
+    clear_caches()
+    gc.collect()
+    tracemalloc.start()
+    kept = parse(output)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return {"parse_ms": round(min(timings) * 1000, 2), "kept_kib": round(size / 1024)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", help="Baseline to check for regressions; exits 1 on any")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    output = generate(args.rules)
+    lines = output.count("\n[")
+    results = {
+        "dicts": measure(parse_ufw_status_numbered, output, args.repeat),
+        "dicts+parse": measure(parse_dicts_typed, output, args.repeat),
+        "dicts+model": measure(parse_dicts_model, output, args.repeat),
+        "dicts+model/cold": measure(parse_dicts_model, output, args.repeat, clear_caches),
+    }
+    _, rules = parse_dicts_model(output)
+    start = time.perf_counter()
+    grouped = group_twins(rules)
+    results["group_twins"] = {"parse_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+    print("%d rules, %d listed lines, %d after grouping twins" % (args.rules, lines, len(grouped)))
+    for name, result in results.items():
+        print("  %-17s %9.2f ms %s" % (name, result["parse_ms"],
+                                        "%9d KiB kept" % result["kept_kib"] if "kept_kib" in result else ""))
+    config = {"rules": args.rules, "repeat": args.repeat}
+    if args.output:
+        baseline.save(args.output, "rule_model", config, results)
+    if args.compare:
+        sys.exit(baseline.report(args.compare, "rule_model", config, results, args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
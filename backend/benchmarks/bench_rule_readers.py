@@ -0,0 +1,134 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Per-call latency of the two rule listing backends.
+
+Generates a ufw configuration directory with N rules (IPv4 + IPv6 twins) and
+the matching `ufw status numbered` output, then times:
+
+* status-parse: parsing the captured status output (parse cost only)
+* status-fork:  spawning a process that prints the status output and parsing
+                it. Without --live the process is a bare Python interpreter,
+                a lower bound for the ufw frontend, which is itself a Python
+                program importing much more.
+* native:       reading user.rules/user6.rules/ufw.conf and parsing tuples
+
+Usage:
+    python benchmarks/bench_rule_readers.py [--rules 10 100 1000] [--repeat 50] [--live]
+
+--live times `sudo ufw status numbered` against the host firewall instead of
+the simulated fork, and reads the real /etc/ufw files.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import ufw_service  # noqa: E402
+from ufw_service import (  # noqa: E402
+    number_rule_tuples,
+    parse_ufw_status_numbered,
+    parse_user_rules,
+    read_ufw_rules_native as read_native_async,
+)
+
+
+def generate_config(directory, count):
+    v4 = ["*filter", ":ufw-user-input - [0:0]", "### RULES ###", ""]
+    v6 = ["*filter", ":ufw6-user-input - [0:0]", "### RULES ###", ""]
+    for i in range(count):
+        port = 1000 + i
+        source = "0.0.0.0/0" if i % 3 else "10.%d.%d.0/24" % (i // 256 % 256, i % 256)
+        v4 += ["### tuple ### allow tcp %d 0.0.0.0/0 any %s in" % (port, source),
+               "-A ufw-user-input -p tcp --dport %d -j ACCEPT" % port, ""]
+        if i % 3:
+            v6 += ["### tuple ### allow tcp %d ::/0 any ::/0 in" % port,
+                   "-A ufw6-user-input -p tcp --dport %d -j ACCEPT" % port, ""]
+    for lines in (v4, v6):
+        lines += ["### END RULES ###", "COMMIT", ""]
+    with open(os.path.join(directory, "user.rules"), "w") as f:
+        f.write("\n".join(v4))
+    with open(os.path.join(directory, "user6.rules"), "w") as f:
+        f.write("\n".join(v6))
+    with open(os.path.join(directory, "ufw.conf"), "w") as f:
+        f.write("ENABLED=yes\nLOGLEVEL=low\n")
+
+    rules = parse_user_rules("\n".join(v4)) + parse_user_rules("\n".join(v6), v6=True)
+    status = ["Status: active", "", "     To                         Action      From",
+              "     --                         ------      ----"]
+    for rule in number_rule_tuples(rules):
+        action = ("%s %s" % (rule["action"], rule["direction"])).strip()
+        status.append(("[%2d] %-26s %-12s%s" % (rule["id"], rule["to"], action, rule["from"])).rstrip())
+    path = os.path.join(directory, "status_numbered.txt")
+    with open(path, "w") as f:
+        f.write("\n".join(status) + "\n")
+    return path
+
+
+_loop = asyncio.new_event_loop()
+
+
+def read_ufw_rules_native():
+    return _loop.run_until_complete(read_native_async())
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.95) - 1] * 1000
+
+
+def point_at(directory):
+    ufw_service.UFW_CONF_FILE = os.path.join(directory, "ufw.conf")
+    ufw_service.USER_RULES_FILE = os.path.join(directory, "user.rules")
+    ufw_service.USER6_RULES_FILE = os.path.join(directory, "user6.rules")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--live", action="store_true")
+    args = parser.parse_args()
+
+    print("%-8s %-14s %10s %10s" % ("rules", "path", "p50 ms", "p95 ms"))
+    if args.live:
+        fork = ["sudo", "/usr/sbin/ufw", "status", "numbered"]
+        results = {
+            "status-fork": timed(lambda: parse_ufw_status_numbered(
+                subprocess.run(fork, capture_output=True, text=True, check=True).stdout), args.repeat),
+            "native": timed(read_ufw_rules_native, args.repeat),
+        }
+        for name, (p50, p95) in results.items():
+            print("%-8s %-14s %10.3f %10.3f" % ("live", name, p50, p95))
+        return
+
+    for count in args.rules:
+        with tempfile.TemporaryDirectory() as tmp:
+            status_path = generate_config(tmp, count)
+            with open(status_path) as f:
+                status_text = f.read()
+            point_at(tmp)
+            assert read_ufw_rules_native() == parse_ufw_status_numbered(status_text)
+
+            fork = [sys.executable, "-S", "-c",
+                    "import sys; sys.stdout.write(open(sys.argv[1]).read())", status_path]
+            results = {
+                "status-parse": timed(lambda: parse_ufw_status_numbered(status_text), args.repeat),
+                "status-fork": timed(lambda: parse_ufw_status_numbered(
+                    subprocess.run(fork, capture_output=True, text=True, check=True).stdout), args.repeat),
+                "native": timed(read_ufw_rules_native, args.repeat),
+            }
+            for name, (p50, p95) in results.items():
+                print("%-8d %-14s %10.3f %10.3f" % (count, name, p50, p95))
+
+
+if __name__ == "__main__":
+    main()
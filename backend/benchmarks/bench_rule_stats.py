@@ -0,0 +1,137 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Per-rule counters: mapping and parsing cost on large `iptables-save -c` dumps.
+
+Generates user.rules/user6.rules for `--rules` rules (a mix of port,
+source, any-protocol and limit rules; rules without a source on both
+families) and the dumps `iptables-save -c -t filter` would print once ufw
+loaded them, with ufw's other chains around the user chains. Times:
+
+- layout:   mapping the rule files' verdict lines to rule IDs (once per
+            rule file change)
+- count:    adding up the counters of one dump pair (every sample)
+- naive:    splitting every dump line in Python and converting every
+            counter, as a line-by-line parser would
+- response: building the per-rule entries with rates
+
+Usage:
+    python benchmarks/bench_rule_stats.py [--rules 10000 50000] [--repeat 5] [--output FILE] [--compare FILE]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import baseline  # noqa: E402
+from rule_stats import CounterSample, build_layout, count_rules, rule_counters  # noqa: E402
+from ufw_service import Rule, render_rule_block, rule_to_tuples  # noqa: E402
+
+_HEAD = "*filter\n:ufw-user-input - [0:0]\n:ufw-user-output - [0:0]\n:ufw-user-forward - [0:0]\n### RULES ###\n"
+_TAIL = "\n### END RULES ###\n\n### LOGGING ###\n-A ufw-user-logging-input -j RETURN\n### END LOGGING ###\nCOMMIT\n"
+
+
+def generate(count, seed=1):
+    """Rule file texts (IPv4, IPv6) for `count` rules."""
+    rng = random.Random(seed)
+    blocks = [[], []]
+    for i in range(count):
+        kind = rng.random()
+        port = str(1000 + i % 60000)
+        if kind < 0.5:
+            rule = Rule(action=rng.choice(("allow", "deny")), port=port, protocol="tcp")
+        elif kind < 0.7:
+            rule = Rule(action="allow", port=port, protocol="tcp",
+                        from_ip="10.%d.%d.0/24" % (i // 256 % 256, i % 256))
+        elif kind < 0.8:
+            rule = Rule(action="allow", port=port, protocol="tcp", from_ip="2001:db8:%x::/48" % (i % 65536))
+        elif kind < 0.9:
+            rule = Rule(action="allow", port=port)  # tcp and udp lines
+        else:
+            rule = Rule(action="limit", port=port, protocol="tcp")  # three lines
+        for rule_tuple in rule_to_tuples(rule):
+            blocks[rule_tuple.v6].append("\n".join(render_rule_block(rule_tuple)))
+    texts = []
+    for v6, family in enumerate(blocks):
+        text = _HEAD + "".join("\n" + block + "\n" for block in family) + _TAIL
+        texts.append(text.replace("ufw-", "ufw6-") if v6 else text)
+    return texts
+
+
+def kernel_dump(text, seed=2):
+    """What `iptables-save -c -t filter` prints for the loaded file, with ufw's own chains around it."""
+    rng = random.Random(seed)
+    prefix = "ufw6-" if "ufw6-" in text else "ufw-"
+    lines = ["# Generated by iptables-save", "*filter", ":INPUT DROP [0:0]"]
+    lines += ["[%d:%d] -A %sbefore-input -p udp -m udp --sport 67 --dport 68 -j ACCEPT" % (n, n * 80, prefix)
+              for n in range(200)]
+    for line in text.splitlines():
+        if line.startswith("-A "):
+            packets = rng.randrange(100000)
+            line = line.replace(" -p tcp", " -p tcp -m tcp").replace(" -p udp", " -p udp -m udp")
+            lines.append("[%d:%d] %s" % (packets, packets * rng.randrange(60, 1500), line))
+    lines += ["[0:0] -A %sreject-input -j REJECT" % prefix, "COMMIT", ""]
+    return "\n".join(lines)
+
+
+def count_naive(dumps):
+    counters = {}
+    for dump in dumps:
+        for line in dump.splitlines():
+            if not line.startswith("["):
+                continue
+            head, _, rest = line.partition("] ")
+            packets, _, nbytes = head[1:].partition(":")
+            fields = rest.split()
+            counters.setdefault(fields[1], []).append((int(packets), int(nbytes)))
+    return counters
+
+
+def best(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return result, round(min(timings) * 1000, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", help="Baseline to check for regressions; exits 1 on any")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = {}
+    for count in args.rules:
+        texts = generate(count)
+        dumps = [kernel_dump(text) for text in texts]
+        layout, layout_ms = best(lambda: build_layout(texts), args.repeat)
+        (packets, nbytes, out_of_sync), count_ms = best(lambda: count_rules(layout, dumps), args.repeat)
+        assert not out_of_sync, out_of_sync
+        _, naive_ms = best(lambda: count_naive(dumps), args.repeat)
+        before = CounterSample(0.0, 0.0, layout, packets, nbytes, ())
+        after = CounterSample(1.0, 1.0, layout, packets, nbytes, ())
+        entries, response_ms = best(lambda: rule_counters(after, before), args.repeat)
+        lines = sum(dump.count("\n[") for dump in dumps)
+        print("%6d rules, %d listed, %d dump lines (%.1f MiB)" % (
+            count, len(entries), lines, sum(map(len, dumps)) / 2 ** 20))
+        for name, value in (("layout", layout_ms), ("count", count_ms), ("naive", naive_ms),
+                            ("response", response_ms)):
+            print("  %-10s %9.2f ms" % (name, value))
+        results[f"{count}"] = {"layout_ms": layout_ms, "count_ms": count_ms, "naive_ms": naive_ms,
+                               "response_ms": response_ms}
+
+    config = {"rules": args.rules, "repeat": args.repeat}
+    if args.output:
+        baseline.save(args.output, "rule_stats", config, results)
+    if args.compare:
+        sys.exit(baseline.report(args.compare, "rule_stats", config, results, args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Desired-state sync (`PUT /api/ruleset`) against a large rule set.
+
+Generates a ufw configuration with N rules (see bench_rule_readers) and
+times `sync_ruleset` for the identical set (the common "nothing changed"
+case of a git-driven deploy), for a set with a few edits as a dry run, and
+the body validation of the request. For comparison it prints the cost of
+one ufw call per rule, estimated with a bare Python interpreter start (a
+lower bound for the ufw frontend).
+
+Usage:
+    python benchmarks/bench_ruleset.py [--rules 2000] [--repeat 20]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_rule_readers import generate_config, point_at  # noqa: E402
+from ufw_service import RuleSet, sync_ruleset  # noqa: E402
+
+
+def desired_rules(count):
+    # The same rules generate_config writes.
+    return [{"action": "allow", "port": str(1000 + i), "protocol": "tcp",
+             "from_ip": "any" if i % 3 else "10.%d.%d.0/24" % (i // 256 % 256, i % 256)}
+            for i in range(count)]
+
+
+def timed(label, fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    print("  %-38s p50 %8.2f ms  p95 %8.2f ms" % (
+        label, samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.95) - 1] * 1000))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    with tempfile.TemporaryDirectory() as tmp:
+        generate_config(tmp, args.rules)
+        point_at(tmp)
+        body = {"rules": desired_rules(args.rules)}
+        print("%d rules" % args.rules)
+        ruleset = timed("validate request body", lambda: RuleSet.model_validate(body), args.repeat)
+        result = timed("sync, unchanged set", lambda: loop.run_until_complete(sync_ruleset(ruleset)), args.repeat)
+        assert not result["add"] and not result["delete"], result["message"]
+        print("  -> %s" % result["message"])
+
+        edited = dict(body, rules=body["rules"][5:] + [{"action": "deny", "port": str(20000 + i), "protocol": "udp"}
+                                                       for i in range(5)])
+        edited = RuleSet.model_validate(edited)
+        result = timed("dry run, 5 removed + 5 added", lambda: loop.run_until_complete(
+            sync_ruleset(edited, dry_run=True)), args.repeat)
+        print("  -> %s" % result["message"])
+
+    start = time.perf_counter()
+    for _ in range(5):
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+    spawn = (time.perf_counter() - start) / 5
+    print("  %-38s >= %7.0f ms  (%d x %.1f ms interpreter start)" % (
+        "one ufw call per rule", spawn * args.rules * 1000, args.rules, spawn * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Ingestion throughput of the UFW log tailer.
+
+Generates a log file with realistic `[UFW BLOCK]`/`[UFW ALLOW]` lines (plus
+some unrelated kernel lines) and times:
+
+- poll:     back-to-back `LogTailer.poll` calls from offset 0 (parsing only)
+- backlog:  the same file read by `run_traffic_ingestion`, the task the
+            server runs, with its poll interval and sleeps
+- live:     `--rate` lines/s appended in 100 ms bursts for `--seconds` while
+            `run_traffic_ingestion` tails the file; reports how far behind
+            it is when the writer stops
+- query:    a top-N query over the ingested records
+
+Exits 1 if the backlog or live rate is below `--min-rate` lines/s.
+
+Usage:
+    python benchmarks/bench_traffic_log.py [--lines 1000000] [--sources 50000] [--min-rate 50000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from traffic_log import TRAFFIC_POLL_INTERVAL, LogTailer, TrafficIndex, run_traffic_ingestion  # noqa: E402
+
+TEMPLATE = (
+    "Oct 18 13:{m:02d}:{s:02d} host kernel: [{up}.{us:06d}] [UFW {action}] IN={iface_in} OUT={iface_out} "
+    "MAC=52:54:00:12:34:56:52:54:00:65:43:21:08:00 SRC={src} DST=10.0.0.2 LEN=60 TOS=0x00 PREC=0x00 "
+    "TTL=50 ID={ident} DF PROTO={proto} SPT={sport} DPT={dport} WINDOW=64240 RES=0x00 SYN URGP=0\n"
+)
+
+
+def generate(lines, sources, seed=42):
+    """Log lines; `lines` UFW lines with an unrelated kernel line every 50."""
+    rng = random.Random(seed)
+    ports = [22, 23, 80, 443, 445, 1433, 3306, 3389, 5900, 8080] + list(range(10000, 10100))
+    for i in range(lines):
+        if i % 50 == 0:
+            yield "Oct 18 13:00:00 host kernel: [%d.000000] eth0: renamed from veth12ab\n" % i
+        outgoing = rng.random() < 0.1
+        yield TEMPLATE.format(
+            m=i // 60000 % 60, s=i // 1000 % 60, up=5000 + i // 1000, us=i % 1000000,
+            action="ALLOW" if outgoing else "BLOCK",
+            iface_in="" if outgoing else "eth0", iface_out="eth0" if outgoing else "",
+            src="%d.%d.%d.%d" % (rng.choice((45, 89, 185, 193)), *divmod(rng.randrange(sources), 256), 7),
+            ident=i % 65536, proto="UDP" if rng.random() < 0.2 else "TCP",
+            sport=rng.randrange(1024, 65535), dport=rng.choice(ports),
+        )
+
+
+async def ingest_backlog(tailer, records, interval):
+    """Seconds until `run_traffic_ingestion` has ingested `records` records."""
+    task = asyncio.create_task(run_traffic_ingestion(tailer, interval))
+    start = time.perf_counter()
+    while tailer.index.total < records:
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    task.cancel()
+    return elapsed
+
+
+async def ingest_live(tailer, path, lines, rate, interval):
+    """
+    Appends `lines` at `rate` lines/s while `run_traffic_ingestion` tails the
+    file. Returns the records ingested and the seconds from the first write
+    until all of them were ingested.
+    """
+    bursts = [lines[i:i + rate // 10] for i in range(0, len(lines), rate // 10)]
+    task = asyncio.create_task(run_traffic_ingestion(tailer, interval))
+    start = time.perf_counter()
+    total = tailer.index.total
+    with open(path, "a") as f:
+        for n, burst in enumerate(bursts):
+            f.write("".join(burst))
+            f.flush()
+            await asyncio.sleep(max(0.0, start + (n + 1) / 10 - time.perf_counter()))
+    while tailer.index.total - total < len(lines):
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    task.cancel()
+    return tailer.index.total - total, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=1000000)
+    parser.add_argument("--sources", type=int, default=50000)
+    parser.add_argument("--interval", type=float, default=TRAFFIC_POLL_INTERVAL, help="Seconds between polls")
+    parser.add_argument("--rate", type=int, default=60000, help="Lines/s appended in the live case")
+    parser.add_argument("--seconds", type=int, default=5, help="Duration of the live case")
+    parser.add_argument("--min-rate", type=float, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log = os.path.join(tmp, "ufw.log")
+        with open(log, "w") as f:
+            f.writelines(generate(args.lines, args.sources))
+        size = os.path.getsize(log)
+        tailer = LogTailer(log, os.path.join(tmp, "traffic.offset"), TrafficIndex(capacity=args.lines))
+
+        start = time.perf_counter()
+        records = 0
+        while True:
+            added = tailer.poll()
+            if not added:
+                break
+            records += added
+        poll_s = time.perf_counter() - start
+
+        query_start = time.perf_counter()
+        top = tailer.index.top(window=3600, limit=10)
+        query = time.perf_counter() - query_start
+
+        tailer = LogTailer(log, None, TrafficIndex(capacity=args.lines))
+        backlog_s = asyncio.run(ingest_backlog(tailer, records, args.interval))
+
+        live_log = os.path.join(tmp, "live.log")
+        open(live_log, "w").close()
+        tailer = LogTailer(live_log, None, TrafficIndex(capacity=args.lines))
+        live_lines = [line for line in generate(args.rate * args.seconds, args.sources, seed=7)
+                      if "[UFW " in line]
+        live, live_s = asyncio.run(ingest_live(tailer, live_log, live_lines, args.rate, args.interval))
+
+    backlog_rate = records / backlog_s
+    live_rate = live / live_s
+    print("file:       %.1f MB, %d UFW lines" % (size / 1e6, args.lines))
+    print("poll:       %.0f lines/s, %.1f MB/s (back to back)" % (records / poll_s, size / poll_s / 1e6))
+    print("backlog:    %.0f lines/s in %.2f s (run_traffic_ingestion, %.1f s interval)"
+          % (backlog_rate, backlog_s, args.interval))
+    print("live:       %d lines/s for %d s, caught up %.2f s after the last write (%.0f lines/s)"
+          % (args.rate, args.seconds, live_s - args.seconds, live_rate))
+    print("top query:  %.1f ms over %d records" % (query * 1000, top["records"]))
+    # The live case keeps up if it caught up within a poll or two of the last write.
+    slow = backlog_rate < args.min_rate or (args.rate >= args.min_rate and live_s > args.seconds + 2 * args.interval)
+    if slow:
+        print("below %.0f lines/s" % args.min_rate)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
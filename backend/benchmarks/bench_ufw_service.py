@@ -0,0 +1,113 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Microbenchmarks of ufw_service parsing and command building.
+
+For each rule count, generates a configuration (as `bench_rule_readers`
+does) and times, per call:
+
+- parse-status: `parse_ufw_status_numbered` on the `ufw status numbered` text
+- parse-files:  `parse_user_rules` on user.rules + user6.rules and numbering
+- etag:         the content hash served as the listing's ETag
+- rule-command: `rule_command`, the ufw command line of one add (per rule)
+- rule-block:   `rule_to_tuples` + `render_rule_block`, the rule file lines
+                of one add as written by batches (per rule)
+- render-files: re-rendering both rule files after a batch edit
+
+Usage:
+    python benchmarks/bench_ufw_service.py [--rules 10 1000 50000] [--output FILE] [--compare FILE]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import baseline  # noqa: E402
+from bench_rule_readers import generate_config  # noqa: E402
+from ufw_service import (  # noqa: E402
+    Rule,
+    _compute_etag,
+    _RulesFile,
+    number_rule_tuples,
+    parse_ufw_status_numbered,
+    parse_user_rules,
+    render_rule_block,
+    rule_command,
+    rule_to_tuples,
+)
+
+SAMPLE_RULES = [
+    Rule(action="allow", port="22", protocol="tcp"),
+    Rule(action="deny", port="3306", protocol="tcp", from_ip="203.0.113.0/24"),
+    Rule(action="limit", port="2222", protocol="tcp"),
+    Rule(action="reject", port="8000:8100", protocol="udp", direction="out", from_ip="2001:db8::/32"),
+]
+
+
+def measure(function, budget: float) -> dict:
+    """Calls `function` repeatedly for about `budget` seconds; per-call p50/p99 in microseconds."""
+    samples = []
+    deadline = time.perf_counter() + budget
+    while len(samples) < 5 or (time.perf_counter() < deadline and len(samples) < 100000):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {"p50_us": round(samples[len(samples) // 2] * 1e6, 2),
+            "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 2),
+            "calls": len(samples)}
+
+
+def run(counts, budget: float) -> dict:
+    results = {}
+    for count in counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(generate_config(tmp, count)) as f:
+                status_text = f.read()
+            with open(os.path.join(tmp, "user.rules")) as f:
+                v4 = f.read()
+            with open(os.path.join(tmp, "user6.rules")) as f:
+                v6 = f.read()
+        data = parse_ufw_status_numbered(status_text)
+        files = [_RulesFile(v4, v6=False), _RulesFile(v6, v6=True)]
+        cases = {
+            "parse-status": lambda: parse_ufw_status_numbered(status_text),
+            "parse-files": lambda: number_rule_tuples(parse_user_rules(v4) + parse_user_rules(v6, v6=True)),
+            "etag": lambda: _compute_etag(data),
+            "render-files": lambda: [f.render() for f in files],
+        }
+        for name, function in cases.items():
+            results[f"{name}/{count}"] = measure(function, budget)
+    results["rule-command"] = measure(lambda: [rule_command(rule) for rule in SAMPLE_RULES], budget)
+    results["rule-block"] = measure(
+        lambda: [render_rule_block(t) for rule in SAMPLE_RULES for t in rule_to_tuples(rule)], budget)
+    for name in ("rule-command", "rule-block"):
+        for key in ("p50_us", "p99_us"):
+            results[name][key] = round(results[name][key] / len(SAMPLE_RULES), 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, nargs="+", default=[10, 1000, 50000])
+    parser.add_argument("--budget", type=float, default=1.0, help="Seconds per case")
+    parser.add_argument("--output", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", help="Baseline to check for regressions; exits 1 on any")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    config = {"rules": args.rules}
+    results = run(args.rules, args.budget)
+    print("%-22s %12s %12s %8s" % ("case", "p50 us", "p99 us", "calls"))
+    for name, result in results.items():
+        print("%-22s %12.2f %12.2f %8d" % (name, result["p50_us"], result["p99_us"], result["calls"]))
+    if args.output:
+        baseline.save(args.output, "ufw_service", config, results)
+    if args.compare:
+        # Tails of sub-millisecond calls are scheduler noise; only medians are checked.
+        sys.exit(baseline.report(args.compare, "ufw_service", config, results, args.tolerance, ["p50_us"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Stand-in for the ufw executable, for benchmarks and load tests.
+
+Keeps its state in real user.rules/user6.rules/ufw.conf files under
+`UFW_CONF_DIR` (the directory the backend reads with `UFW_RULES_BACKEND=file`
+and edits for batches), and understands the commands the backend runs:
+`status [numbered]`, `allow|deny|reject|limit ...`, `delete N`, `enable`,
+`disable` and `reload`.
+
+Latency: the fake is itself a Python program that imports the backend's rule
+code, so each call pays an interpreter start and imports (a few hundred ms),
+much like ufw. On top of that:
+
+- `FAKE_UFW_DELAY_MS` is added to every call (default 0),
+- commands that apply rules to the kernel (add, delete, enable, reload) sleep
+  `FAKE_UFW_APPLY_MS` (default 30) plus `FAKE_UFW_RULE_US` per rule for a full
+  reload (default 20), standing in for iptables-restore.
+
+`setup()` generates a configuration of any size and a `sudo` stand-in that
+runs this file for /usr/sbin/ufw and any other command as the current user;
+put its directory first on PATH.
+"""
+import fcntl
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ufw_service import (  # noqa: E402
+    Rule,
+    _RulesFile,
+    number_rule_tuples,
+    parse_user_rules,
+    render_rule_block,
+    rule_to_tuples,
+)
+
+CONF_DIR = os.getenv("UFW_CONF_DIR", "/etc/ufw")
+DELAY = float(os.getenv("FAKE_UFW_DELAY_MS", "0")) / 1000
+APPLY = float(os.getenv("FAKE_UFW_APPLY_MS", "30")) / 1000
+PER_RULE = float(os.getenv("FAKE_UFW_RULE_US", "20")) / 1e6
+
+SUDO = """#!/bin/sh
+# sudo stand-in: runs the command as the current user, with ufw replaced by the fake.
+while [ "${1#-}" != "$1" ]; do shift; done
+if [ "$1" = /usr/sbin/ufw ]; then shift; exec "%s" "%s" "$@"; fi
+exec "$@"
+"""
+
+
+def setup(conf_dir: str, bin_dir: str, rules: int) -> dict:
+    """
+    Creates a ufw configuration with `rules` rules and the `sudo` stand-in.
+
+    Returns:
+        dict: Environment variables to run the backend against the fake.
+    """
+    from bench_rule_readers import generate_config
+
+    os.makedirs(conf_dir, exist_ok=True)
+    os.makedirs(bin_dir, exist_ok=True)
+    generate_config(conf_dir, rules)
+    path = os.path.join(bin_dir, "sudo")
+    with open(path, "w") as f:
+        f.write(SUDO % (sys.executable, os.path.abspath(__file__)))
+    os.chmod(path, 0o755)
+    return {"UFW_CONF_DIR": conf_dir, "PATH": bin_dir + os.pathsep + os.environ.get("PATH", "")}
+
+
+def _path(name: str) -> str:
+    return os.path.join(CONF_DIR, name)
+
+
+def _read(name: str) -> str:
+    with open(_path(name), encoding="utf-8") as f:
+        return f.read()
+
+
+def _write(name: str, text: str):
+    tmp = _path("." + name + ".fake")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, _path(name))
+
+
+def _enabled() -> bool:
+    return "ENABLED=yes" in _read("ufw.conf")
+
+
+def _files():
+    return [_RulesFile(_read("user.rules"), v6=False), _RulesFile(_read("user6.rules"), v6=True)]
+
+
+def _apply(full: bool):
+    rules = sum(len(f.blocks) for f in _files()) if full else 0
+    time.sleep(APPLY + rules * PER_RULE)
+
+
+def render_status_numbered(listing: list) -> str:
+    lines = ["Status: active", "", "     To                         Action      From",
+             "     --                         ------      ----"]
+    for rule in listing:
+        action = ("%s %s" % (rule["action"], rule["direction"])).strip()
+        lines.append(("[%2d] %-26s %-12s%s" % (rule["id"], rule["to"], action, rule["from"])).rstrip())
+    return "\n".join(lines) + "\n\n"
+
+
+def status(numbered: bool) -> str:
+    if not _enabled():
+        return "Status: inactive\n"
+    if not numbered:
+        return "Status: active\n"
+    rules = parse_user_rules(_read("user.rules")) + parse_user_rules(_read("user6.rules"), v6=True)
+    return render_status_numbered(number_rule_tuples(rules))
+
+
+def add(action: str, words: list) -> str:
+    rule = Rule(action=action, port="", protocol=None, direction="in", from_ip="any")
+    while words:
+        word = words.pop(0)
+        if word in ("in", "out"):
+            rule.direction = word
+        elif word == "from":
+            rule.from_ip = words.pop(0)
+        elif word == "port":
+            rule.port = words.pop(0)
+        elif word == "proto":
+            rule.protocol = words.pop(0)
+        elif word == "to":
+            words.pop(0)  # only "any"
+        elif word == "app":
+            rule.app = words.pop(0)
+    files = _files()
+    messages = []
+    for rule_tuple in rule_to_tuples(rule):
+        rules_file = files[rule_tuple.v6]
+        suffix = " (v6)" if rule_tuple.v6 else ""
+        if any(existing == rule_tuple for existing, _ in rules_file.blocks):
+            messages.append("Skipping adding existing rule" + suffix)
+            continue
+        rules_file.blocks.append((rule_tuple, render_rule_block(rule_tuple)))
+        messages.append("Rule added" + suffix)
+    _write("user.rules", files[0].render())
+    _write("user6.rules", files[1].render())
+    _apply(full=False)
+    return "\n".join(messages) + "\n"
+
+
+def delete(number: int) -> str:
+    files = _files()
+    index = number - 1
+    for rules_file, name in zip(files, ("user.rules", "user6.rules")):
+        if 0 <= index < len(rules_file.blocks):
+            del rules_file.blocks[index]
+            _write(name, rules_file.render())
+            _apply(full=False)
+            return "Rule deleted\n"
+        index -= len(rules_file.blocks)
+    raise LookupError(f"ERROR: Could not find rule '{number}'")
+
+
+def set_enabled(enabled: bool) -> str:
+    conf = _read("ufw.conf")
+    _write("ufw.conf", conf.replace("ENABLED=no" if enabled else "ENABLED=yes",
+                                    "ENABLED=yes" if enabled else "ENABLED=no"))
+    if enabled:
+        _apply(full=True)
+        return "Firewall is active and enabled on system startup\n"
+    return "Firewall stopped and disabled on system startup\n"
+
+
+def reload() -> str:
+    if not _enabled():
+        return "Firewall not enabled (skipping reload)\n"
+    _apply(full=True)
+    return "Firewall reloaded\n"
+
+
+def run(argv: list) -> tuple:
+    """
+    Runs one ufw command in this process, as the helper daemon runs ufw.
+
+    Returns:
+        tuple: (exit code, stdout, stderr)
+    """
+    words = [word for word in argv if word not in ("--force", "-f")]
+    if not words:
+        return 1, "", "ERROR: not enough args\n"
+    # ufw serializes itself with a lock file; so does the fake.
+    with open(_path(".fake-ufw.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            verb = words[0]
+            if verb == "status":
+                output = status("numbered" in words[1:])
+            elif verb in ("allow", "deny", "reject", "limit"):
+                output = add(verb, words[1:])
+            elif verb == "delete" and len(words) == 2 and words[1].isdigit():
+                output = delete(int(words[1]))
+            elif verb in ("enable", "disable"):
+                output = set_enabled(verb == "enable")
+            elif verb == "reload":
+                output = reload()
+            else:
+                raise LookupError(f"ERROR: Invalid syntax: {' '.join(words)}")
+        except (LookupError, ValueError) as e:
+            return 1, "", f"{e}\n"
+    return 0, output, ""
+
+
+def main(argv: list) -> int:
+    time.sleep(DELAY)
+    code, output, error = run(argv)
+    sys.stdout.write(output)
+    sys.stderr.write(error)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,544 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""IP blocklists installed as ipsets instead of one ufw rule per address.
+
+A list named NAME becomes the ipsets `webfire-NAME-v4` and `webfire-NAME-v6`
+(type hash:net), each referenced by a single DROP rule in before.rules /
+before6.rules. Importing a list parses it, collapses overlapping and adjacent
+prefixes, and then either
+
+- applies the difference to the live set (few changes), or
+- fills a temporary set and swaps it with the live one (`ipset swap` is
+  atomic, so packets never see a half-loaded list).
+
+Only the first import of a list edits before.rules and reloads ufw; later
+imports touch the ipsets alone. If an import fails, the sets it changed are
+put back and the saved state is left as it was, so the next import diffs
+against what is actually live.
+
+ipsets do not survive a reboot, and iptables refuses to load a rule naming a
+missing set. Each list is therefore also saved as an `ipset restore` file
+under `BLOCKLIST_DIR`, and a block in /etc/ufw/before.init (which ufw runs
+before loading its rules) restores those files at boot.
+"""
+import asyncio
+import json
+import os
+import re
+import socket
+import time
+from typing import Dict, List, Optional, Tuple
+
+from ufw_service import UFW_CONF_DIR, read_rules_file, reload_ufw, run_command, write_rules_file
+
+STATE_DIR = os.getenv("WEBFIRE_STATE_DIR", "/var/lib/webfire")
+BLOCKLIST_DIR = os.path.join(STATE_DIR, "blocklists")
+# Local files may only be imported from here (the API runs with sudo rights).
+BLOCKLIST_IMPORT_DIR = os.getenv("WEBFIRE_BLOCKLIST_IMPORT_DIR", os.path.join(STATE_DIR, "imports"))
+BEFORE_RULES_FILES = {
+    "v4": (os.path.join(UFW_CONF_DIR, "before.rules"), "ufw-before-input"),
+    "v6": (os.path.join(UFW_CONF_DIR, "before6.rules"), "ufw6-before-input"),
+}
+BEFORE_INIT_FILE = os.path.join(UFW_CONF_DIR, "before.init")
+IPSET = "/usr/sbin/ipset"
+# Above this share of changed networks the set is rebuilt and swapped.
+SWAP_THRESHOLD = 0.25
+
+# ipset names are limited to 31 characters: "webfire-" + name + "-v4-tmp".
+_NAME = re.compile(r"^[a-z0-9][a-z0-9_-]{0,15}$")
+_FAMILIES = {"v4": (socket.AF_INET, 32, "inet"), "v6": (socket.AF_INET6, 128, "inet6")}
+_MARK = "webfire-blocklist"
+
+
+class BlocklistError(Exception):
+    pass
+
+
+def validate_name(name: str) -> Optional[str]:
+    if not _NAME.match(name):
+        return "Invalid list name (1-16 characters: a-z, 0-9, '-' and '_')"
+    return None
+
+
+def set_name(name: str, family: str) -> str:
+    return f"webfire-{name}-{family}"
+
+
+# --- Parsing and aggregation ---
+def parse_entries(text: str) -> Tuple[Dict[str, List[Tuple[int, int]]], int, int]:
+    """
+    Parses one address or CIDR per line into integer ranges.
+
+    Anything after '#' or ';' and after the first field is ignored, so
+    common feed formats ("1.2.3.0/24 ; SBL123") load as they are. Host bits
+    are cleared. /0 networks are rejected, as they would block everything.
+
+    Args:
+        text (str): The list.
+
+    Returns:
+        tuple: ({"v4": [(first, last), ...], "v6": [...]}, accepted, rejected)
+    """
+    ranges = {"v4": [], "v6": []}
+    accepted = rejected = 0
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].split(";", 1)[0].strip()
+        if not line:
+            continue
+        address, _, prefix = line.split(None, 1)[0].partition("/")
+        family = "v6" if ":" in address else "v4"
+        af, bits, _ = _FAMILIES[family]
+        try:
+            value = int.from_bytes(socket.inet_pton(af, address), "big")
+            length = int(prefix) if prefix else bits
+        except (OSError, ValueError):
+            rejected += 1
+            continue
+        if not 0 < length <= bits:
+            rejected += 1
+            continue
+        host = (1 << (bits - length)) - 1
+        first = value & ~host
+        ranges[family].append((first, first | host))
+        accepted += 1
+    return ranges, accepted, rejected
+
+
+def collapse_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Merges overlapping and adjacent ranges."""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def ranges_to_cidrs(ranges: List[Tuple[int, int]], family: str) -> List[str]:
+    """Splits ranges into the fewest aligned prefixes."""
+    af, bits, _ = _FAMILIES[family]
+    width = bits // 8
+    cidrs = []
+    for first, last in ranges:
+        while first <= last:
+            # Largest block aligned at `first` that does not pass `last`.
+            size = first & -first if first else 1 << bits
+            while size > last - first + 1:
+                size >>= 1
+            length = bits - size.bit_length() + 1
+            cidrs.append(f"{socket.inet_ntop(af, first.to_bytes(width, 'big'))}/{length}")
+            first += size
+    return cidrs
+
+
+def aggregate(text: str) -> dict:
+    """
+    Parses and collapses a list.
+
+    Returns:
+        dict: {"v4": [cidr, ...], "v6": [...], "entries": int, "rejected": int}
+    """
+    ranges, accepted, rejected = parse_entries(text)
+    result = {"entries": accepted, "rejected": rejected}
+    for family, family_ranges in ranges.items():
+        result[family] = ranges_to_cidrs(collapse_ranges(family_ranges), family)
+    return result
+
+
+# --- State ---
+def _state_path(name: str, suffix: str) -> str:
+    return os.path.join(BLOCKLIST_DIR, f"{name}.{suffix}")
+
+
+def _load_networks(name: str, family: str) -> Optional[List[str]]:
+    try:
+        with open(_state_path(name, family), encoding="utf-8") as f:
+            return f.read().split()
+    except FileNotFoundError:
+        return None
+
+
+def _write_state(name: str, suffix: str, text: str):
+    os.makedirs(BLOCKLIST_DIR, exist_ok=True)
+    path = _state_path(name, suffix)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+
+def list_blocklists() -> List[dict]:
+    """Returns the metadata of every installed list, by name."""
+    lists = []
+    try:
+        names = sorted(n[:-len(".json")] for n in os.listdir(BLOCKLIST_DIR) if n.endswith(".json"))
+    except FileNotFoundError:
+        return []
+    for name in names:
+        try:
+            with open(_state_path(name, "json"), encoding="utf-8") as f:
+                lists.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return lists
+
+
+def read_import_file(path: str) -> str:
+    """
+    Reads a list from a local file inside `BLOCKLIST_IMPORT_DIR`.
+
+    Raises:
+        BlocklistError: If the path is outside the import directory or unreadable.
+    """
+    root = os.path.realpath(BLOCKLIST_IMPORT_DIR)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise BlocklistError(f"Lists can only be imported from {BLOCKLIST_IMPORT_DIR}")
+    try:
+        with open(resolved, encoding="utf-8", errors="replace") as f:
+            return f.read()
+    except OSError as e:
+        raise BlocklistError(f"Cannot read {path}: {e.strerror}")
+
+
+# --- Diffs and ipset scripts ---
+def diff_networks(old: Optional[List[str]], new: List[str]) -> dict:
+    old_set = set(old or ())
+    new_set = set(new)
+    return {
+        "added": [cidr for cidr in new if cidr not in old_set],
+        "removed": [cidr for cidr in (old or ()) if cidr not in new_set],
+    }
+
+
+def diff_blocklist(name: str, text: str, sample: int = 20) -> dict:
+    """
+    Compares a list with the installed one without applying it.
+
+    Returns:
+        dict: Counts per family plus up to `sample` added/removed networks.
+    """
+    new = aggregate(text)
+    result = {"name": name, "entries": new["entries"], "rejected": new["rejected"],
+              "installed": os.path.exists(_state_path(name, "json")), "families": {}}
+    for family in _FAMILIES:
+        diff = diff_networks(_load_networks(name, family), new[family])
+        result["families"][family] = {
+            "networks": len(new[family]),
+            "added": len(diff["added"]),
+            "removed": len(diff["removed"]),
+            "sample_added": diff["added"][:sample],
+            "sample_removed": diff["removed"][:sample],
+        }
+    return result
+
+
+def _create_line(set_name_: str, family: str, count: int) -> str:
+    maxelem = 65536
+    while maxelem < count:
+        maxelem *= 2
+    return f"create {set_name_} hash:net family {_FAMILIES[family][2]} maxelem {maxelem}"
+
+
+def swap_script(name: str, family: str, networks: List[str]) -> str:
+    """ipset restore script that loads `networks` into a fresh set and swaps it in."""
+    live = set_name(name, family)
+    tmp = live + "-tmp"
+    lines = [_create_line(live, family, len(networks)) + " -exist",
+             _create_line(tmp, family, len(networks)) + " -exist",
+             f"flush {tmp}"]
+    lines.extend(f"add {tmp} {cidr}" for cidr in networks)
+    lines.extend([f"swap {tmp} {live}", f"destroy {tmp}"])
+    return "\n".join(lines) + "\n"
+
+
+def incremental_script(name: str, family: str, diff: dict) -> str:
+    live = set_name(name, family)
+    lines = [f"del {live} {cidr}" for cidr in diff["removed"]]
+    lines.extend(f"add {live} {cidr}" for cidr in diff["added"])
+    return "\n".join(lines) + "\n"
+
+
+def save_script(name: str, family: str, networks: List[str]) -> str:
+    """Script that recreates the live set at boot (run with -exist)."""
+    live = set_name(name, family)
+    lines = [_create_line(live, family, len(networks)), f"flush {live}"]
+    lines.extend(f"add {live} {cidr}" for cidr in networks)
+    return "\n".join(lines) + "\n"
+
+
+async def _ipset_restore(script: str, exist: bool = False):
+    # WARNING: This executes a system command with `sudo`.
+    args = ['sudo', '-n', IPSET, 'restore'] + (['-exist'] if exist else [])
+    await run_command(args, input=script)
+
+
+# --- ufw files ---
+def _block_markers(name: str):
+    return f"# BEGIN {_MARK} {name}", f"# END {_MARK} {name}"
+
+
+def with_rule_block(text: str, name: str, family: str) -> str:
+    """Inserts the list's DROP rule into before.rules text (idempotent)."""
+    begin, end = _block_markers(name)
+    if begin in text:
+        return text
+    chain = BEFORE_RULES_FILES[family][1]
+    block = [begin, f"-A {chain} -m set --match-set {set_name(name, family)} src -j DROP", end]
+    lines = text.split("\n")
+    # Right after ufw's required chain setup, before any other rule.
+    anchors = [i for i, line in enumerate(lines) if line.strip() == "# End required lines"]
+    if anchors:
+        position = anchors[0] + 1
+    else:
+        commits = [i for i, line in enumerate(lines) if line.strip() == "COMMIT"]
+        if not commits:
+            raise BlocklistError("before.rules has no '# End required lines' or COMMIT line")
+        position = commits[0]
+    return "\n".join(lines[:position] + block + lines[position:])
+
+
+def without_rule_block(text: str, name: str) -> str:
+    begin, end = _block_markers(name)
+    lines = text.split("\n")
+    if begin not in lines:
+        return text
+    start = lines.index(begin)
+    stop = lines.index(end, start)
+    return "\n".join(lines[:start] + lines[stop + 1:])
+
+
+_INIT_BEGIN = f"    # BEGIN {_MARK}s"
+_INIT_END = f"    # END {_MARK}s"
+_DEFAULT_BEFORE_INIT = """#!/bin/sh
+#
+# before.init: if executable, called by ufw-init. See 'man ufw-framework'.
+#
+
+set -e
+
+case "$1" in
+start)
+    ;;
+stop)
+    ;;
+status)
+    ;;
+flush-all)
+    ;;
+*)
+    echo "'$1' not supported"
+    echo "Usage: before.init {start|stop|flush-all|status}"
+    ;;
+esac
+"""
+
+
+def with_init_block(text: str) -> str:
+    """Adds the boot-time ipset restore to before.init (idempotent)."""
+    if _INIT_BEGIN in text:
+        return text
+    lines = (text or _DEFAULT_BEFORE_INIT).split("\n")
+    try:
+        position = [line.strip() for line in lines].index("start)") + 1
+    except ValueError:
+        raise BlocklistError("before.init has no 'start)' case")
+    block = [
+        _INIT_BEGIN,
+        f'    for f in {BLOCKLIST_DIR}/*.ipset; do',
+        f'        [ -e "$f" ] && {IPSET} restore -exist -file "$f"',
+        "    done",
+        _INIT_END,
+    ]
+    return "\n".join(lines[:position] + block + lines[position:])
+
+
+async def _make_executable(path: str):
+    try:
+        os.chmod(path, 0o755)
+    except PermissionError:
+        # WARNING: This executes a system command with `sudo`.
+        await run_command(['sudo', '-n', '/bin/chmod', '0755', path])
+
+
+async def _read_optional(path: str) -> str:
+    if not os.path.exists(path):
+        return ""
+    return await read_rules_file(path)
+
+
+async def _install_rules(name: str) -> bool:
+    """Adds the DROP rules and the boot hook if missing; returns True if ufw was reloaded."""
+    init_text = await _read_optional(BEFORE_INIT_FILE)
+    new_init = with_init_block(init_text)
+    if new_init != init_text:
+        await write_rules_file(BEFORE_INIT_FILE, new_init)
+        await _make_executable(BEFORE_INIT_FILE)
+
+    originals = {}
+    for family, (path, _) in BEFORE_RULES_FILES.items():
+        text = await read_rules_file(path)
+        new_text = with_rule_block(text, name, family)
+        if new_text != text:
+            originals[path] = text
+            await write_rules_file(path, new_text)
+    if not originals:
+        return False
+    try:
+        await reload_ufw()
+    except Exception:
+        for path, text in originals.items():
+            await write_rules_file(path, text)
+        await reload_ufw()
+        raise
+    return True
+
+
+async def _restore_sets(name: str, previous: Dict[str, Optional[List[str]]]) -> Optional[str]:
+    """
+    Puts back the sets of a failed import: the previous networks are swapped
+    in again, and sets the list did not have before are destroyed.
+
+    Returns:
+        str | None: The first error, if any set could not be restored.
+    """
+    error = None
+    for family, networks in previous.items():
+        live = set_name(name, family)
+        try:
+            if networks is None:
+                await _ipset_restore(f"destroy {live}-tmp\ndestroy {live}\n", exist=True)
+            else:
+                await _ipset_restore(swap_script(name, family, networks))
+        except Exception as e:
+            error = error or str(e)
+    return error
+
+
+# --- Operations ---
+async def import_blocklist(name: str, text: str, source: str) -> dict:
+    """
+    Installs or updates a list.
+
+    Run through the mutation queue so it does not interleave with other
+    changes to the ufw files.
+
+    Args:
+        name (str): List name.
+        text (str): List contents, one address or CIDR per line.
+        source (str): Where the list came from, kept in the metadata.
+
+    Returns:
+        dict: {"status", "message", "mode", "entries", "rejected", "families"}
+    """
+    new = await asyncio.to_thread(aggregate, text)
+    families = {}
+    modes = set()
+    touched = {}  # family -> networks before the import, for rolling back
+    try:
+        for family in _FAMILIES:
+            networks = new[family]
+            old = _load_networks(name, family)
+            diff = diff_networks(old, networks)
+            changes = len(diff["added"]) + len(diff["removed"])
+            touched[family] = old
+            mode = "swap"
+            if old is not None and changes <= SWAP_THRESHOLD * max(len(networks), 1):
+                mode = "incremental"
+                try:
+                    if changes:
+                        await _ipset_restore(incremental_script(name, family, diff), exist=True)
+                except Exception:
+                    # E.g. the set vanished or outgrew maxelem: rebuild it instead.
+                    mode = "swap"
+            if mode == "swap":
+                await _ipset_restore(swap_script(name, family, networks))
+            modes.add(mode)
+            families[family] = {"networks": len(networks), "added": len(diff["added"]),
+                                "removed": len(diff["removed"])}
+        reloaded = await _install_rules(name)
+    except Exception as e:
+        message = f"Error installing blocklist {name}: {e}"
+        failed = await _restore_sets(name, touched)
+        if failed:
+            message += f" (restoring the previous sets failed: {failed})"
+        return {"status": "error", "message": message}
+
+    # The state files describe the live sets, so they change only once the import stands.
+    for family in _FAMILIES:
+        _write_state(name, family, "\n".join(new[family]) + "\n")
+        _write_state(name, f"{family}.ipset", save_script(name, family, new[family]))
+    metadata = {
+        "name": name,
+        "source": source,
+        "entries": new["entries"],
+        "rejected": new["rejected"],
+        "networks": {family: info["networks"] for family, info in families.items()},
+        "updated_at": time.time(),
+    }
+    _write_state(name, "json", json.dumps(metadata))
+    networks = sum(info["networks"] for info in families.values())
+    return {
+        "status": "success",
+        "message": f"Blocklist {name}: {new['entries']} entries as {networks} networks"
+                   + (" (ufw reloaded)" if reloaded else ""),
+        "mode": "swap" if "swap" in modes else "incremental",
+        "entries": new["entries"],
+        "rejected": new["rejected"],
+        "families": families,
+    }
+
+
+async def delete_blocklist(name: str) -> dict:
+    """Removes a list's DROP rules, its ipsets and its state."""
+    if not os.path.exists(_state_path(name, "json")):
+        return {"status": "error", "message": f"Blocklist {name} does not exist"}
+    try:
+        changed = False
+        for family, (path, _) in BEFORE_RULES_FILES.items():
+            text = await read_rules_file(path)
+            new_text = without_rule_block(text, name)
+            if new_text != text:
+                await write_rules_file(path, new_text)
+                changed = True
+        if changed:
+            await reload_ufw()
+        await _ipset_restore("".join(f"destroy {set_name(name, family)}\n" for family in _FAMILIES), exist=True)
+    except Exception as e:
+        return {"status": "error", "message": f"Error removing blocklist {name}: {e}"}
+    for suffix in ("json", "v4", "v6", "v4.ipset", "v6.ipset"):
+        try:
+            os.unlink(_state_path(name, suffix))
+        except FileNotFoundError:
+            pass
+    return {"status": "success", "message": f"Blocklist {name} removed"}
+
+
+async def restore_blocklists() -> dict:
+    """
+    Recreates saved sets that are missing, e.g. when before.init is not executable.
+
+    Returns:
+        dict: {"status", "message", "restored": [{"blocklist", "family", "entries"}]}
+        with one item per recreated set.
+    """
+    restored = []
+    for metadata in list_blocklists():
+        for family in _FAMILIES:
+            try:
+                with open(_state_path(metadata["name"], f"{family}.ipset"), encoding="utf-8") as f:
+                    script = f.read()
+            except OSError:
+                continue
+            # `create` without -exist fails on an existing set, leaving it untouched.
+            try:
+                await _ipset_restore(script.split("\n", 1)[0] + "\n")
+            except Exception:
+                continue
+            try:
+                await _ipset_restore(script, exist=True)
+                entries = script.count("\nadd ")
+            except Exception:
+                entries = 0
+            restored.append({"blocklist": metadata["name"], "family": family, "entries": entries})
+    return {"status": "success", "message": f"{len(restored)} blocklist set(s) restored", "restored": restored}
@@ -1,6 +1,8 @@
 """(C) 2025 by OPNLAB Development. All rights reserved."""
+import asyncio
+
 from ufw_service import get_ufw_rules
 
 if __name__ == "__main__":
-    rules = get_ufw_rules()
+    rules = asyncio.run(get_ufw_rules())
     print(rules)
@@ -0,0 +1,153 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Server-Sent Events fan-out for rule, status and traffic changes.
+
+One watcher task per process observes the rule snapshot (see
+`get_rules_snapshot`) and the traffic index, and publishes an event only when
+something changed. Every connected client gets the same events from that
+watcher, so N open dashboards cost one watcher instead of N polling loops.
+The watcher starts with the first subscriber and stops after the last one
+leaves.
+
+Events describe state, not deltas. Each subscriber therefore keeps only the
+latest event of each type: a slow client skips intermediate states instead
+of buffering them.
+"""
+import asyncio
+import json
+import os
+from typing import AsyncIterator, Dict, Optional, Set
+
+from traffic_log import traffic_tailer
+from ufw_service import get_rules_snapshot
+
+# Seconds between watcher checks; mutations through the API wake it immediately.
+EVENTS_INTERVAL = float(os.getenv("WEBFIRE_EVENTS_INTERVAL", "1"))
+# Seconds of silence after which a comment line is sent to keep proxies from
+# closing the connection.
+EVENTS_KEEPALIVE = float(os.getenv("WEBFIRE_EVENTS_KEEPALIVE", "15"))
+
+
+def format_event(event: str, data: dict) -> str:
+    """Encodes one event in the text/event-stream format."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class _Subscriber:
+    __slots__ = ("latest", "ready")
+
+    def __init__(self):
+        self.latest: Dict[str, dict] = {}
+        self.ready = asyncio.Event()
+
+    def put(self, event: str, data: dict):
+        # Replaces an undelivered event of the same type.
+        self.latest[event] = data
+        self.ready.set()
+
+    def take(self) -> Dict[str, dict]:
+        events, self.latest = self.latest, {}
+        self.ready.clear()
+        return events
+
+
+class EventBroker:
+    def __init__(self, interval: float = EVENTS_INTERVAL, tailer=traffic_tailer):
+        self.interval = interval
+        self.tailer = tailer
+        self._subscribers: Set[_Subscriber] = set()
+        self._state: Dict[str, dict] = {}
+        self._watcher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.checks = 0
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def notify(self):
+        """Makes the watcher check for changes now instead of at the next interval."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def publish(self, event: str, data: dict):
+        """Sends `data` to every subscriber unless it equals the last `event` sent."""
+        if self._state.get(event) == data:
+            return
+        self._state[event] = data
+        for subscriber in self._subscribers:
+            subscriber.put(event, data)
+
+    async def check(self):
+        """Reads the current state once and publishes whatever changed."""
+        self.checks += 1
+        snapshot = await get_rules_snapshot()
+        data = snapshot.data
+        if data["status"] == "error":
+            self.publish("status", {"status": "error", "message": data.get("message")})
+        else:
+            self.publish("status", {"status": data["status"]})
+            self.publish("rules", {
+                "version": snapshot.version,
+                "etag": snapshot.etag,
+                "count": len(data.get("rules", [])),
+            })
+        if self.tailer is not None:
+            self.publish("traffic", {"total": self.tailer.index.total})
+
+    async def _watch(self):
+        while self._subscribers:
+            self._wakeup.clear()
+            try:
+                await self.check()
+            except Exception as e:
+                self.publish("status", {"status": "error", "message": str(e)})
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def subscribe(self, keepalive: float = EVENTS_KEEPALIVE) -> AsyncIterator[str]:
+        """
+        Yields encoded events for one client until the consumer stops iterating.
+
+        The current state is sent first, so a client needs no separate fetch to
+        know the rule-set version it is looking at.
+        """
+        subscriber = _Subscriber()
+        for event, data in self._state.items():
+            subscriber.put(event, data)
+        self._subscribers.add(subscriber)
+        loop = asyncio.get_running_loop()
+        if self._watcher is None or self._watcher.done() or self._watcher.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._watcher = loop.create_task(self._watch())
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    await asyncio.wait_for(subscriber.ready.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                for event, data in subscriber.take().items():
+                    yield format_event(event, data)
+        finally:
+            self._subscribers.discard(subscriber)
+            if not self._subscribers and self._watcher is not None:
+                self._watcher.cancel()
+                self._watcher = None
+                # A new watcher must not skip a state a future client has not seen.
+                self._state.clear()
+
+    async def close(self):
+        """Stops the watcher (application shutdown)."""
+        watcher, self._watcher = self._watcher, None
+        if watcher is not None and not watcher.done():
+            watcher.cancel()
+            try:
+                await watcher
+            except asyncio.CancelledError:
+                pass
+
+
+event_broker = EventBroker()
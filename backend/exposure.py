@@ -0,0 +1,331 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Listening sockets, and which rules expose them.
+
+The inventory is read from /proc/net/tcp, tcp6, udp and udp6 (no `ss` or
+`netstat` child). On a busy host these files hold one line per connection,
+100k lines and more, of which only a few are listening sockets: TCP sockets
+in state LISTEN (0A) and unconnected UDP sockets (state 07, no remote
+address). The files are streamed in chunks, each chunk is searched for the
+state code of a listening socket, and only the lines holding it are matched
+and decoded; nothing else is split or converted. Decoded listeners are kept
+by their raw line, so a rescan only decodes sockets that are new since the
+last one, and a scan is reused for `EXPOSURE_MIN_INTERVAL`.
+
+Owning processes are looked up only when asked for, by walking
+/proc/PID/fd for the socket inodes of the listeners; this needs root to see
+other users' processes.
+
+Each listener is then classified against the incoming rules of the current
+listing (application profiles and service names expanded to their ports):
+
+- local:      bound to a loopback address only
+- allowed:    the first rule for any source accepts it
+- denied:     the first rule for any source denies or rejects it
+- restricted: only rules for some sources or interfaces accept it
+- unruled:    no rule mentions its port; the default policy decides
+
+Accepting rules for ports nothing listens on are reported as unused. An
+IPv6 wildcard listener also takes IPv4 connections (the Linux default,
+net.ipv6.bindv6only=0), so it counts for IPv4 rules as well.
+"""
+import asyncio
+import os
+import re
+import socket
+import time
+from typing import BinaryIO, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from flow_replay import compile_rules
+from metrics import add_timing, cache_lookups
+from rule_analysis import RuleMatch
+from ufw_service import RuleSnapshot
+
+PROC_DIR = os.getenv("WEBFIRE_PROC_DIR", "/proc")
+EXPOSURE_MIN_INTERVAL = 2.0
+# Related rule IDs reported per listener.
+MAX_RULES = 10
+
+_FILES = (("tcp", False), ("tcp6", True), ("udp", False), ("udp6", True))
+_CHUNK = 1 << 20
+# The state column is the only field that can read " 0A " or " 07 ": the
+# others are longer hex fields or decimals without leading zeros.
+_STATES = {"tcp": b" 0A ", "udp": b" 07 "}
+# local address, local port, remote address, uid, inode
+_LISTENING = {
+    "tcp": re.compile(rb" *\d+: ([0-9A-F]+):([0-9A-F]{4}) ([0-9A-F]+):[0-9A-F]{4} 0A "
+                      rb"\S+ \S+ \S+ +(\d+) +\d+ (\d+)"),
+    "udp": re.compile(rb" *\d+: ([0-9A-F]+):([0-9A-F]{4}) (0+):0000 07 "
+                      rb"\S+ \S+ \S+ +(\d+) +\d+ (\d+)"),
+}
+_ACCEPT = ("ALLOW", "LIMIT")
+_LOOPBACK = {False: (0x7F000000, 0x7FFFFFFF), True: (1, 1)}
+_KEEP_DECODED = 65536
+
+
+class Listener(NamedTuple):
+    protocol: str  # tcp | udp
+    v6: bool
+    address: str
+    port: int
+    uid: int
+    inode: int
+
+
+def _decode_address(text: bytes, v6: bool) -> str:
+    raw = bytes.fromhex(text.decode())
+    # The kernel prints each 32-bit word in host (little-endian) order.
+    raw = b"".join(raw[i:i + 4][::-1] for i in range(0, len(raw), 4))
+    return socket.inet_ntop(socket.AF_INET6 if v6 else socket.AF_INET, raw)
+
+
+def _chunks(f: BinaryIO) -> Iterable[bytes]:
+    """The file in chunks that end at a line end."""
+    rest = b""
+    while True:
+        data = f.read(_CHUNK)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind(b"\n") + 1
+        rest = data[end:]
+        if end:
+            yield data[:end]
+    if rest:
+        yield rest
+
+
+class SocketScanner:
+    """Reads listening sockets from /proc/net, decoding only lines not seen before."""
+
+    def __init__(self, proc_dir: str = PROC_DIR):
+        self.proc_dir = proc_dir
+        self._decoded: Dict[Tuple[str, bytes], Listener] = {}
+
+    def _scan_file(self, f: BinaryIO, name: str, v6: bool, seen: dict, listeners: List[Listener]):
+        """Adds the listeners of one file to `listeners`, and by their line to `seen`."""
+        protocol = name[:3]
+        decoded = self._decoded
+        pattern, state = _LISTENING[protocol], _STATES[protocol]
+        for chunk in _chunks(f):
+            # Find the state first, then match only the lines that have it.
+            at = chunk.find(state)
+            while at != -1:
+                start = chunk.rfind(b"\n", 0, at) + 1
+                end = chunk.find(b"\n", at)
+                end = len(chunk) if end == -1 else end
+                line = chunk[start:end]
+                at = chunk.find(state, end)
+                key = (name, line)
+                listener = decoded.get(key)
+                if listener is None:
+                    match = pattern.match(line)
+                    if match is None:
+                        continue
+                    address, port, _, uid, inode = match.groups()
+                    listener = Listener(protocol, v6, _decode_address(address, v6), int(port, 16),
+                                        int(uid), int(inode))
+                seen[key] = listener
+                listeners.append(listener)
+
+    def scan(self) -> List[Listener]:
+        """All listening TCP and bound UDP sockets; missing files (no IPv6) are skipped."""
+        listeners = []
+        seen = {}
+        for name, v6 in _FILES:
+            try:
+                f = open(os.path.join(self.proc_dir, "net", name), "rb")
+            except OSError:
+                continue
+            with f:
+                self._scan_file(f, name, v6, seen, listeners)
+        if len(seen) <= _KEEP_DECODED:
+            self._decoded = seen  # sockets closed since the last scan are dropped
+        return listeners
+
+
+def socket_owners(inodes: Iterable[int], proc_dir: str = PROC_DIR) -> Dict[int, Tuple[int, str]]:
+    """
+    Maps socket inodes to (pid, command) by reading /proc/PID/fd.
+
+    Stops as soon as every inode is found. Processes that cannot be read
+    (other users' without root, or gone meanwhile) are skipped.
+    """
+    wanted = {f"socket:[{inode}]": inode for inode in inodes}
+    owners = {}
+    try:
+        pids = [entry for entry in os.listdir(proc_dir) if entry.isdigit()]
+    except OSError:
+        return owners
+    for pid in pids:
+        fd_dir = os.path.join(proc_dir, pid, "fd")
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                inode = wanted.pop(os.readlink(os.path.join(fd_dir, fd)), None)
+            except OSError:
+                continue
+            if inode is not None:
+                try:
+                    with open(os.path.join(proc_dir, pid, "comm"), encoding="utf-8", errors="replace") as f:
+                        command = f.read().strip()
+                except OSError:
+                    command = ""
+                owners[inode] = (int(pid), command)
+        if not wanted:
+            break
+    return owners
+
+
+def _address_range(listener: Listener) -> Optional[Tuple[int, int]]:
+    """The listener's address as an integer range; None for a wildcard address."""
+    value = int.from_bytes(socket.inet_pton(socket.AF_INET6 if listener.v6 else socket.AF_INET, listener.address),
+                           "big")
+    return None if value == 0 else (value, value)
+
+
+def _is_local(listener: Listener) -> bool:
+    low, high = _LOOPBACK[listener.v6]
+    if listener.v6 and listener.address.startswith("::ffff:"):
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET6, listener.address)[12:], "big")
+        low, high = _LOOPBACK[False]
+        return low <= value <= high
+    address = _address_range(listener)
+    return address is not None and low <= address[0] <= high
+
+
+def _ports_contain(ports, port: int) -> bool:
+    return ports is None or any(low <= port <= high for low, high in ports)
+
+
+def _families(listener: Listener) -> Tuple[bool, ...]:
+    # A wildcard IPv6 socket takes IPv4 connections too (bindv6only=0).
+    if listener.v6 and _address_range(listener) is None:
+        return (False, True)
+    return (listener.v6,)
+
+
+def _matches(rule: RuleMatch, listener: Listener, v6: bool) -> bool:
+    if rule.v6 != v6 or rule.protocol not in ("any", listener.protocol):
+        return False
+    if not _ports_contain(rule.dports, listener.port):
+        return False
+    address = _address_range(listener) if rule.v6 == listener.v6 else None
+    return address is None or rule.dst[0] <= address[0] <= rule.dst[1]
+
+
+def _from_anywhere(rule: RuleMatch) -> bool:
+    return rule.src_prefixlen == 0 and rule.iface_in is None and rule.sports is None
+
+
+def classify(listeners: List[Listener], rules: List[dict]) -> dict:
+    """
+    Joins listeners with the incoming rules of a listing.
+
+    Args:
+        listeners (list): From `SocketScanner.scan`.
+        rules (list): Rules as returned by `get_ufw_rules`.
+
+    Returns:
+        dict: {"listeners": [{..., "exposure", "rules"}], "counts": {exposure: int},
+        "unused_rules": [{"id", "to", "from"}], "skipped": [rule IDs]}.
+    """
+    matches, skipped = compile_rules(rules)
+    incoming = [m for m in matches if m.direction == "in" and isinstance(m.dports, (tuple, type(None)))]
+    # Incoming rules by port: few listeners, possibly many rules.
+    by_port: Dict[int, List[int]] = {}
+    wide: List[int] = []
+    for position, match in enumerate(incoming):
+        if match.dports is None or sum(high - low + 1 for low, high in match.dports) > 1024:
+            wide.append(position)
+        else:
+            for low, high in match.dports:
+                for port in range(low, high + 1):
+                    by_port.setdefault(port, []).append(position)
+
+    counts = dict.fromkeys(("local", "allowed", "denied", "restricted", "unruled"), 0)
+    used = set()
+    entries = []
+    for listener in sorted(set(listeners)):
+        related, exposure = [], None
+        if _is_local(listener):
+            exposure = "local"
+        else:
+            positions = sorted(set(by_port.get(listener.port, ())).union(wide))
+            partial = False
+            for v6 in _families(listener):
+                first = None
+                for position in positions:
+                    rule = incoming[position]
+                    if not _matches(rule, listener, v6):
+                        continue
+                    if rule.id not in related:
+                        related.append(rule.id)
+                    if rule.action in _ACCEPT:
+                        used.add(position)
+                    if _from_anywhere(rule):
+                        first = rule
+                        break
+                    partial = partial or rule.action in _ACCEPT
+                if first is not None and exposure != "allowed":
+                    exposure = "allowed" if first.action in _ACCEPT else "denied"
+            if exposure is None:
+                exposure = "restricted" if partial else "unruled"
+        counts[exposure] += 1
+        entries.append(dict(listener._asdict(), exposure=exposure, rules=related[:MAX_RULES]))
+
+    by_id = {rule["id"]: rule for rule in rules}
+    unused_ids = sorted({match.id for position, match in enumerate(incoming)
+                         if match.action in _ACCEPT and match.dports is not None and position not in used}
+                        - {incoming[position].id for position in used})
+    unused = [{"id": rule_id, "to": by_id[rule_id]["to"], "from": by_id[rule_id]["from"]} for rule_id in unused_ids]
+    return {"listeners": entries, "counts": counts, "unused_rules": unused, "skipped": skipped}
+
+
+_scanner = SocketScanner()
+# Last scan: (time.monotonic(), listeners)
+_last_scan: Tuple[float, Optional[List[Listener]]] = (0.0, None)
+# Last join: (snapshot ETag, listeners, result)
+_last_join: Tuple[Optional[str], Optional[List[Listener]], Optional[dict]] = (None, None, None)
+
+
+async def collect_exposure(snapshot: RuleSnapshot, processes: bool = False) -> dict:
+    """
+    The listening sockets of this host and how the rules expose them.
+
+    Args:
+        snapshot (RuleSnapshot): The current rules.
+        processes (bool): Add the owning process of each listener.
+
+    Returns:
+        dict: As `classify`, plus "status" (of ufw) and "scanned_at" (Unix time);
+        with `processes` each listener has "pid" and "process".
+    """
+    global _last_scan, _last_join
+    scanned_at, listeners = _last_scan
+    if listeners is None or time.monotonic() - scanned_at >= EXPOSURE_MIN_INTERVAL:
+        cache_lookups.inc("sockets", "miss")
+        started = time.perf_counter()
+        listeners = await asyncio.to_thread(_scanner.scan)
+        add_timing("socket-scan", time.perf_counter() - started)
+        _last_scan = (time.monotonic(), listeners)
+    else:
+        cache_lookups.inc("sockets", "hit")
+
+    etag, joined, result = _last_join
+    if not (etag is not None and etag == snapshot.etag and joined is listeners):
+        result = await asyncio.to_thread(classify, listeners, snapshot.data.get("rules", []))
+        if snapshot.etag:
+            _last_join = (snapshot.etag, listeners, result)
+    result = dict(result, status=snapshot.data["status"],
+                  scanned_at=time.time() - (time.monotonic() - _last_scan[0]))
+    if processes:
+        owners = await asyncio.to_thread(socket_owners, {entry["inode"] for entry in result["listeners"]})
+        result["listeners"] = [
+            dict(entry, pid=owners.get(entry["inode"], (None, None))[0],
+                 process=owners.get(entry["inode"], (None, None))[1])
+            for entry in result["listeners"]
+        ]
+    return result
@@ -0,0 +1,292 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Fleet control: one webFire instance driving the API of many others.
+
+Any instance becomes an aggregator once agents (other webFire backends) are
+registered with it. Requests to the agents:
+
+- use a pooled httpx client per agent, so connections are kept alive
+  between operations and reused,
+- run concurrently, at most `FLEET_CONCURRENCY` at a time,
+- authenticate with the agent's own `/api/token`; tokens are cached per
+  agent and renewed when the agent answers 401.
+
+Results are yielded per host as they arrive, so the API can stream
+progress. A rollout can first apply the change to `canary` hosts and stop
+there if more than `max_failures` of them fail.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+from pydantic import BaseModel
+
+from ufw_service import Rule, RuleBatch
+
+STATE_DIR = os.getenv("WEBFIRE_STATE_DIR", "/var/lib/webfire")
+FLEET_FILE = os.path.join(STATE_DIR, "fleet.json")
+FLEET_CONCURRENCY = int(os.getenv("WEBFIRE_FLEET_CONCURRENCY", "100"))
+FLEET_TIMEOUT = float(os.getenv("WEBFIRE_FLEET_TIMEOUT", "10"))
+
+_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+
+
+class Agent(BaseModel):
+    url: str
+    username: str
+    password: str
+
+
+class FleetOperation(BaseModel):
+    op: str  # add | batch | enable | disable
+    rule: Optional[Rule] = None
+    batch: Optional[RuleBatch] = None
+    hosts: Optional[List[str]] = None
+    canary: int = 0
+    max_failures: int = 0
+
+
+# Agent endpoint for each operation.
+_OPERATIONS = {
+    "add": ("POST", "/api/rules"),
+    "batch": ("POST", "/api/rules/batch"),
+    "enable": ("POST", "/api/enable"),
+    "disable": ("POST", "/api/disable"),
+}
+
+
+def validate_agent(name: str, agent: Agent) -> Optional[str]:
+    if not _NAME.match(name):
+        return "Invalid agent name"
+    if not agent.url.startswith(("http://", "https://")):
+        return "Agent URL must start with http:// or https://"
+    return None
+
+
+def validate_operation(operation: FleetOperation) -> Optional[str]:
+    """
+    Checks a fleet operation before anything is sent.
+
+    Returns:
+        str | None: An error message, or None if the operation is valid.
+    """
+    if operation.op not in _OPERATIONS:
+        return "Invalid operation"
+    if operation.op == "add" and operation.rule is None:
+        return "`rule` is required for add"
+    if operation.op == "batch" and operation.batch is None:
+        return "`batch` is required for batch"
+    if operation.canary < 0 or operation.max_failures < 0:
+        return "`canary` and `max_failures` must not be negative"
+    return None
+
+
+def operation_request(operation: FleetOperation):
+    """Returns (method, path, json body) of the agent request for an operation."""
+    method, path = _OPERATIONS[operation.op]
+    body = None
+    if operation.op == "add":
+        body = operation.rule.model_dump()
+    elif operation.op == "batch":
+        body = operation.batch.model_dump()
+    return method, path, body
+
+
+class AgentRegistry:
+    """Registered agents, persisted as JSON readable by the service user only."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._agents: Optional[Dict[str, Agent]] = None
+
+    @property
+    def agents(self) -> Dict[str, Agent]:
+        if self._agents is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    raw = json.load(f)
+                self._agents = {name: Agent(**agent) for name, agent in raw.items()}
+            except FileNotFoundError:
+                self._agents = {}
+        return self._agents
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({name: agent.model_dump() for name, agent in sorted(self.agents.items())}, f)
+        os.replace(tmp, self.path)
+
+    def put(self, name: str, agent: Agent):
+        self.agents[name] = agent
+        self._save()
+
+    def remove(self, name: str) -> bool:
+        if self.agents.pop(name, None) is None:
+            return False
+        self._save()
+        return True
+
+    def select(self, names: Optional[List[str]] = None) -> List[str]:
+        """
+        Returns the given agent names, or all of them, in registry order.
+
+        Raises:
+            KeyError: If a name is not registered.
+        """
+        if names is None:
+            return sorted(self.agents)
+        for name in names:
+            if name not in self.agents:
+                raise KeyError(name)
+        return list(dict.fromkeys(names))
+
+
+class FleetClient:
+    """Concurrent requests to the agents of a registry."""
+
+    def __init__(self, registry: AgentRegistry, concurrency: int = FLEET_CONCURRENCY,
+                 timeout: float = FLEET_TIMEOUT, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.registry = registry
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.transport = transport
+        self._tokens: Dict[str, str] = {}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._loop = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._ssl_context = None
+
+    def _client(self, url: str) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Pooled connections belong to the loop that opened them.
+            self._clients = {}
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        client = self._clients.get(url)
+        if client is None:
+            if self._ssl_context is None:
+                # Loading the CA bundle takes tens of milliseconds; do it once.
+                self._ssl_context = httpx.create_ssl_context()
+            # One small pool per agent: a single pool shared by hundreds of
+            # hosts is scanned linearly on every request.
+            client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+                verify=self._ssl_context,
+                transport=self.transport,
+            )
+            self._clients[url] = client
+        return client
+
+    async def _login(self, client: httpx.AsyncClient, name: str, agent: Agent) -> str:
+        response = await client.post(f"{agent.url}/api/token",
+                                      data={"username": agent.username, "password": agent.password})
+        response.raise_for_status()
+        token = response.json()["access_token"]
+        self._tokens[name] = token
+        return token
+
+    async def call(self, name: str, method: str, path: str, body: Optional[dict] = None,
+                   params: Optional[dict] = None) -> dict:
+        """
+        Sends one request to an agent.
+
+        Returns:
+            dict: {"host", "ok", "status_code", "result", "error", "elapsed_ms"},
+            where `ok` requires a 2xx answer whose body does not report an error.
+        """
+        agent = self.registry.agents[name]
+        client = self._client(agent.url)
+        outcome = {"host": name, "ok": False, "status_code": None, "result": None, "error": None}
+        async with self._slots:
+            started = time.perf_counter()
+            try:
+                token = self._tokens.get(name) or await self._login(client, name, agent)
+                for attempt in range(2):
+                    response = await client.request(method, f"{agent.url}{path}", json=body, params=params,
+                                                    headers={"Authorization": f"Bearer {token}"})
+                    if response.status_code != 401 or attempt:
+                        break
+                    token = await self._login(client, name, agent)
+                outcome["status_code"] = response.status_code
+                try:
+                    outcome["result"] = response.json()
+                except ValueError:
+                    outcome["result"] = None
+                if response.is_success:
+                    result = outcome["result"]
+                    reported = result.get("status") if isinstance(result, dict) else None
+                    outcome["ok"] = reported not in ("error", "conflict")
+                    if not outcome["ok"]:
+                        outcome["error"] = result.get("message") or reported
+                else:
+                    detail = outcome["result"].get("detail") if isinstance(outcome["result"], dict) else None
+                    outcome["error"] = f"HTTP {response.status_code}" + (f": {detail}" if detail else "")
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                outcome["error"] = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            outcome["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return outcome
+
+    async def fan_out(self, names: List[str], method: str, path: str, body: Optional[dict] = None,
+                      params: Optional[dict] = None) -> AsyncIterator[dict]:
+        """Sends the same request to every agent in `names`, yielding results as they complete."""
+        tasks = [asyncio.ensure_future(self.call(name, method, path, body, params)) for name in names]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def rollout(self, names: List[str], method: str, path: str, body: Optional[dict] = None,
+                      canary: int = 0, max_failures: int = 0) -> AsyncIterator[dict]:
+        """
+        Applies a change in stages, yielding progress events.
+
+        Events are {"type": "stage", "stage": "canary" | "rest", "hosts": [...]},
+        {"type": "host", ...per-host result...} and finally
+        {"type": "done", "succeeded", "failed", "skipped", "aborted"}.
+
+        Args:
+            names (List[str]): Agents, in rollout order.
+            canary (int): Hosts in the first stage; 0 rolls out to all at once.
+            max_failures (int): Canary failures tolerated before the rollout stops.
+        """
+        stages = [("canary", names[:canary]), ("rest", names[canary:])] if canary else [("rest", names)]
+        succeeded = failed = 0
+        aborted = False
+        done_hosts = 0
+        for stage, hosts in stages:
+            if not hosts:
+                continue
+            yield {"type": "stage", "stage": stage, "hosts": hosts}
+            stage_failures = 0
+            async for outcome in self.fan_out(hosts, method, path, body):
+                done_hosts += 1
+                if outcome["ok"]:
+                    succeeded += 1
+                else:
+                    failed += 1
+                    stage_failures += 1
+                yield dict(outcome, type="host")
+            if stage == "canary" and stage_failures > max_failures:
+                aborted = True
+                break
+        yield {"type": "done", "succeeded": succeeded, "failed": failed,
+               "skipped": len(names) - done_hosts, "aborted": aborted}
+
+    async def close(self):
+        if self._loop is asyncio.get_running_loop():
+            for client in self._clients.values():
+                await client.aclose()
+        self._clients = {}
+
+
+fleet_registry = AgentRegistry(FLEET_FILE)
+fleet_client = FleetClient(fleet_registry)
@@ -0,0 +1,402 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Offline replay of recorded flows against the current or a proposed rule set.
+
+Flows come from a CSV export (a header row naming at least the `src` and
+`dst` columns) or from conntrack's text format (`conntrack -L`,
+/proc/net/nf_conntrack), of which the original direction is used. Each flow
+gets the verdict of the first user rule that matches it, else the default
+policy of its direction, as in ufw's user chains. ufw's before/after rules
+(loopback, established connections, ICMP) are not modelled.
+
+Rules are compiled into `RuleMatch` objects, application profiles and
+service names expanded to their ports, and indexed like the analysis does
+(`FamilyIndex`): a flow is a rule for one address and one port, so the rules
+matching it are the covering candidates under the prefixes that contain its
+source. Recorded traffic repeats the same (source, destination, port)
+combinations many times, so the verdicts are decided once per distinct flow
+and a record costs one dictionary lookup. Source ports are only part of a
+flow when some rule matches on them.
+"""
+import csv
+import io
+import ipaddress
+import re
+from array import array
+from functools import lru_cache
+from operator import itemgetter
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from app_catalog import AppCatalog, get_catalog
+from rule_analysis import FamilyIndex, RuleMatch, covers, parse_listing_rule
+from rule_model import parse_location
+from ufw_service import Rule, number_rule_tuples, rule_to_tuples
+
+VERDICTS = ("allow", "deny", "reject", "limit", "invalid")
+POLICIES = ("allow", "deny", "reject")
+# ufw's defaults: deny incoming, allow outgoing, deny routed.
+DEFAULT_POLICIES = {"in": "deny", "out": "allow", "fwd": "deny"}
+
+FIELDS = ("src", "dst", "protocol", "sport", "dport", "direction", "iface_in", "iface_out")
+_COLUMNS = {
+    "src": "src", "saddr": "src", "source": "src", "src_ip": "src",
+    "dst": "dst", "daddr": "dst", "destination": "dst", "dst_ip": "dst",
+    "proto": "protocol", "protocol": "protocol",
+    "sport": "sport", "src_port": "sport",
+    "dport": "dport", "dst_port": "dport", "port": "dport",
+    "direction": "direction",
+    "in": "iface_in", "iface_in": "iface_in", "out": "iface_out", "iface_out": "iface_out",
+}
+_PROTOCOL_NUMBERS = {"1": "icmp", "6": "tcp", "17": "udp", "58": "ipv6-icmp", "132": "sctp"}
+_DIRECTIONS = {"in": "in", "out": "out", "fwd": "fwd", "incoming": "in", "outgoing": "out", "routed": "fwd"}
+# The original-direction tuple of a conntrack entry; ICMP entries have no ports.
+_CONNTRACK = re.compile(
+    r"^(?:ipv[46]\s+\d+\s+)?([a-z0-9-]+)\s+\d+\s.*?src=(\S+) dst=(\S+)(?: sport=(\d+) dport=(\d+))?",
+    re.MULTILINE,
+)
+
+
+class FlowsError(ValueError):
+    """The flow records cannot be read."""
+
+
+@lru_cache(maxsize=65536)
+def _address(text: str) -> Tuple[bool, int]:
+    address = ipaddress.ip_address(text)
+    return address.version == 6, int(address)
+
+
+def _service_ports(catalog: AppCatalog) -> Dict[str, List[Tuple[int, str]]]:
+    ports = {}
+    for (port, protocol), names in catalog.port_names.items():
+        if protocol != "any":
+            for name in names:
+                ports.setdefault(name, []).append((port, protocol))
+    return ports
+
+
+def compile_rules(rules: List[dict], catalog: Optional[AppCatalog] = None) -> Tuple[List[RuleMatch], List[int]]:
+    """
+    Compiles listed rules for matching flows.
+
+    Application rules become one match per port entry of their profile, and
+    a service name one match per port and protocol it names.
+
+    Args:
+        rules (list): Rules as returned by `get_ufw_rules`, in evaluation order.
+        catalog (AppCatalog): Profiles and services; the installed ones by default.
+
+    Returns:
+        tuple: (matches in evaluation order, IDs of the rules that cannot be interpreted).
+    """
+    catalog = catalog or get_catalog()
+    services = None
+    matches, skipped = [], []
+    for rule in rules:
+        match = parse_listing_rule(rule)
+        expanded = []
+        if match is None or isinstance(match.sports, str):
+            pass
+        elif not isinstance(match.dports, str):
+            expanded.append(match)
+        elif catalog.find(match.dports) is not None:
+            for text in catalog.find(match.dports).ports_text():
+                _, _, ports, protocol, _ = parse_location(text)
+                expanded.append(match._replace(dports=ports, protocol=protocol or "any"))
+        else:
+            if services is None:
+                services = _service_ports(catalog)
+            for port, protocol in services.get(match.dports, ()):
+                if match.protocol in ("any", protocol):
+                    expanded.append(match._replace(dports=((port, port),), protocol=protocol))
+        if expanded:
+            matches.extend(expanded)
+        else:
+            skipped.append(rule["id"])
+    return matches, skipped
+
+
+def ruleset_listing(rules: List[Rule]) -> List[dict]:
+    """
+    Lists a proposed rule set the way `ufw status numbered` would once it
+    is in place: the rules in the given order, IPv4 lines first.
+
+    Args:
+        rules (list): Validated rules.
+
+    Returns:
+        list: Rule dicts as returned by `get_ufw_rules`.
+    """
+    tuples = [rule_tuple for rule in rules for rule_tuple in rule_to_tuples(rule)]
+    tuples.sort(key=lambda rule_tuple: rule_tuple.v6)
+    return number_rule_tuples(tuples)
+
+
+class RuleEngine:
+    """First-match evaluation of one compiled rule set.
+
+    Flows whose sources lie in the same indexed source networks cannot be
+    told apart by any rule's source, so verdicts are kept per such class of
+    sources (and the rest of the flow) rather than per address.
+    """
+
+    def __init__(self, matches: List[RuleMatch], policies: Optional[Dict[str, str]] = None):
+        self.policies = dict(DEFAULT_POLICIES, **(policies or {}))
+        self.families: Dict[Tuple[bool, str], FamilyIndex] = {}
+        self.uses_sports = False
+        for match in matches:
+            key = (match.v6, match.direction)
+            index = self.families.get(key)
+            if index is None:
+                index = self.families[key] = FamilyIndex(128 if match.v6 else 32)
+            index.add(match)
+            self.uses_sports = self.uses_sports or match.sports is not None
+        self._classes: Dict[tuple, tuple] = {}
+        self._decided: Dict[tuple, Tuple[str, Optional[int]]] = {}
+
+    def _source_class(self, index: FamilyIndex, flow: RuleMatch) -> tuple:
+        key = (flow.v6, flow.direction, flow.src[0])
+        found = self._classes.get(key)
+        if found is None:
+            address = flow.src[0]
+            found = []
+            for length in index.lengths:
+                node = (length, address & (((1 << length) - 1) << (index.bits - length)))
+                if node in index.nodes:
+                    found.append(node)
+            found = self._classes[key] = tuple(found)
+        return found
+
+    def decide(self, flow: RuleMatch) -> Tuple[str, Optional[int]]:
+        """
+        The verdict for one flow, given as a RuleMatch for single addresses
+        and ports, and the ID of the deciding rule (None for the policy).
+        """
+        index = self.families.get((flow.v6, flow.direction))
+        if index is None:
+            return self.policies[flow.direction], None
+        key = (self._source_class(index, flow),) + flow[2:8] + flow[10:]
+        decided = self._decided.get(key)
+        if decided is None:
+            decided = self._decided[key] = self._first_match(index, flow)
+        return decided
+
+    def _first_match(self, index: FamilyIndex, flow: RuleMatch) -> Tuple[str, Optional[int]]:
+        rules = index.rules
+        first = None
+        for positions in index.candidates(flow, covering=True):
+            # Positions are ascending: the first covering one is the list's earliest rule.
+            for position in positions:
+                if first is not None and position >= first:
+                    break
+                if covers(rules[position], flow):
+                    first = position
+                    break
+        if first is None:
+            return self.policies[flow.direction], None
+        rule = rules[first]
+        return rule.action.lower(), rule.id
+
+
+def _port(text: Optional[str]) -> Optional[int]:
+    if not text:
+        return None
+    port = int(text)
+    if not 0 <= port <= 65535:
+        raise ValueError(text)
+    return port
+
+
+def flow_match(fields: Dict[str, Optional[str]], direction: str = "in") -> Optional[RuleMatch]:
+    """
+    The RuleMatch of a single flow, or None if its addresses, ports or direction are invalid.
+
+    Args:
+        fields (dict): Values for `FIELDS`; missing or empty values mean unknown.
+        direction (str): The direction of flows without one.
+    """
+    try:
+        src_v6, src = _address(fields["src"] or "")
+        dst_v6, dst = _address(fields["dst"] or "")
+        sport, dport = _port(fields.get("sport")), _port(fields.get("dport"))
+    except ValueError:
+        return None
+    direction = _DIRECTIONS.get((fields.get("direction") or direction).lower())
+    if src_v6 != dst_v6 or direction is None:
+        return None
+    protocol = (fields.get("protocol") or "").lower()
+    protocol = _PROTOCOL_NUMBERS.get(protocol, protocol)
+    return RuleMatch(0, "", direction, src_v6, protocol, (dst, dst), ((dport, dport),) if dport is not None else None,
+                     fields.get("iface_in") or None, (src, src), 128 if src_v6 else 32,
+                     ((sport, sport),) if sport is not None else None, fields.get("iface_out") or None)
+
+
+def read_flows(text: str, fmt: str = "auto", sports: bool = False) -> Tuple[Tuple[str, ...], Iterator[tuple]]:
+    """
+    Reads flow records without interpreting them.
+
+    Args:
+        text (str): A CSV export with a header row, or conntrack output.
+        fmt (str): csv | conntrack | auto.
+        sports (bool): Keep the source ports.
+
+    Returns:
+        tuple: (the `FIELDS` names the records hold, an iterator of records,
+        tuples of strings in that order; None for a malformed CSV row).
+
+    Raises:
+        FlowsError: If the CSV header lacks the address columns or the format is unknown.
+    """
+    if fmt == "auto":
+        head = text[:4096]
+        fmt = "conntrack" if "src=" in head and "dst=" in head else "csv"
+    if fmt == "conntrack":
+        groups = (2, 3, 1, 5, 4) if sports else (2, 3, 1, 5)
+        names = ("src", "dst", "protocol", "dport", "sport")[:len(groups)]
+        return names, (match.group(*groups) for match in _CONNTRACK.finditer(text))
+    if fmt != "csv":
+        raise FlowsError(f"Unknown flow format {fmt!r}")
+
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader, None) or []
+    columns = {}
+    for i, column in enumerate(header):
+        name = _COLUMNS.get(column.strip().lower())
+        if name and name not in columns and (sports or name != "sport"):
+            columns[name] = i
+    if "src" not in columns or "dst" not in columns:
+        raise FlowsError("The CSV header needs `src` and `dst` columns")
+    names = tuple(columns)
+    getter = itemgetter(*columns.values())
+
+    def records():
+        for row in reader:
+            if row:
+                try:
+                    yield getter(row)
+                except IndexError:
+                    yield None
+    return names, records()
+
+
+class Replay(NamedTuple):
+    names: Tuple[str, ...]  # the `FIELDS` in each distinct flow
+    direction: str          # of flows without one
+    distinct: List[tuple]   # distinct flows, None for malformed records
+    decisions: List[tuple]  # per distinct flow: (verdict, rule ID) per engine
+    flows: array            # per record: index into `distinct`
+
+
+def replay(text: str, engines: List[RuleEngine], fmt: str = "auto", direction: str = "in") -> Replay:
+    """
+    Decides every flow record against each engine.
+
+    Args:
+        text (str): The flow records (see `read_flows`).
+        engines (list): Rule sets to evaluate, e.g. the current and a proposed one.
+        fmt (str): csv | conntrack | auto.
+        direction (str): The direction of records without one (in, out, fwd).
+
+    Returns:
+        Replay: The per-record verdicts, by distinct flow.
+    """
+    names, records = read_flows(text, fmt, sports=any(engine.uses_sports for engine in engines))
+    invalid = (("invalid", None),) * len(engines)
+    distinct, decisions = [], []
+    seen = {}
+    flows = array("I")
+    append = flows.append
+    for record in records:
+        i = seen.get(record)
+        if i is None:
+            i = seen[record] = len(distinct)
+            match = flow_match(dict(zip(names, record)), direction) if record is not None else None
+            distinct.append(record)
+            decisions.append(tuple(engine.decide(match) for engine in engines) if match is not None else invalid)
+        append(i)
+    return Replay(names, direction, distinct, decisions, flows)
+
+
+def _summary(replay_: Replay, hits: List[int], engine: int, skipped: List[int]) -> dict:
+    verdicts = dict.fromkeys(VERDICTS, 0)
+    by_rule = {}
+    for decision, count in zip(replay_.decisions, hits):
+        verdict, rule_id = decision[engine]
+        verdicts[verdict] += count
+        if rule_id is not None:
+            by_rule[rule_id] = by_rule.get(rule_id, 0) + count
+    return {"verdicts": verdicts, "rules": [{"id": rule_id, "flows": count} for rule_id, count in sorted(by_rule.items())],
+            "skipped": skipped}
+
+
+def _result(replay_: Replay, position: int, i: int) -> dict:
+    record = replay_.distinct[i]
+    fields = dict.fromkeys(FIELDS)
+    if record is not None:
+        fields.update(zip(replay_.names, record))
+    decision = replay_.decisions[i]
+    result = {
+        "flow": position + 1,
+        "src": fields["src"] or "",
+        "dst": fields["dst"] or "",
+        "protocol": fields["protocol"] or "",
+        "dport": int(fields["dport"]) if (fields["dport"] or "").isdigit() else None,
+        "direction": _DIRECTIONS.get((fields["direction"] or replay_.direction).lower(), fields["direction"]),
+        "verdict": decision[0][0],
+        "rule": decision[0][1],
+    }
+    if len(decision) > 1:
+        result["proposed_verdict"], result["proposed_rule"] = decision[1]
+    return result
+
+
+def simulate(text: str, rules: List[dict], proposed: Optional[List[dict]] = None, fmt: str = "auto",
+             direction: str = "in", policies: Optional[Dict[str, str]] = None, limit: int = 100) -> dict:
+    """
+    Replays flow records against the current rules and, optionally, a proposed rule set.
+
+    Args:
+        text (str): The flow records (see `read_flows`).
+        rules (list): The current listing.
+        proposed (list): The listing of a proposed rule set (`ruleset_listing`).
+        fmt (str): csv | conntrack | auto.
+        direction (str): The direction of records without one (in, out, fwd).
+        policies (dict): Default policy per direction (in, out, fwd).
+        limit (int): Flows to list: the first ones, or with `proposed` the
+            first ones whose verdict would change.
+
+    Returns:
+        dict: {"flows", "current": {"verdicts", "rules": [{"id", "flows"}],
+        "skipped"}, "proposed", "changed", "results": [...]}
+
+    Raises:
+        FlowsError: If the flow records cannot be read.
+    """
+    catalog = get_catalog()
+    sets = [compile_rules(rules, catalog)]
+    if proposed is not None:
+        sets.append(compile_rules(proposed, catalog))
+    replay_ = replay(text, [RuleEngine(matches, policies) for matches, _ in sets], fmt, direction)
+
+    hits = [0] * len(replay_.distinct)
+    for i in replay_.flows:
+        hits[i] += 1
+    summaries = [_summary(replay_, hits, engine, skipped) for engine, (_, skipped) in enumerate(sets)]
+
+    changed = None
+    if proposed is not None:
+        differs = [decision[0][0] != decision[1][0] for decision in replay_.decisions]
+        changed = sum(count for count, differ in zip(hits, differs) if differ)
+    results = []
+    if limit:
+        for position, i in enumerate(replay_.flows):
+            if changed is None or differs[i]:
+                results.append(_result(replay_, position, i))
+                if len(results) >= limit:
+                    break
+    return {
+        "flows": len(replay_.flows),
+        "current": summaries[0],
+        "proposed": summaries[1] if proposed is not None else None,
+        "changed": changed,
+        "results": results,
+    }
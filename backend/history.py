@@ -0,0 +1,373 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Versioned history of the user rule files, with restore.
+
+A version is the content of user.rules + user6.rules. Every mutation that
+goes through the mutation queue records the files before (catching changes
+made outside webFire) and after the change; a version identical to the
+previous one is not recorded again.
+
+Storage, under `HISTORY_DIR`:
+
+- objects.pack: append-only pack of contents keyed by their SHA-256. An
+  identical content is stored once however often it recurs. Each object is
+  a zlib-compressed line delta against its parent, or a full copy every
+  `HISTORY_FULL_EVERY` objects, which bounds the work to rebuild any version.
+- versions.jsonl: one line per version (id, hash, parent hash, time, reason).
+
+Both files are only appended to, under the mutation lock, so other worker
+processes pick up new records by reading the tail. Within a process, the
+in-memory indexes are updated from `asyncio.to_thread` workers and guarded
+by a thread lock each.
+"""
+import asyncio
+import collections
+import difflib
+import hashlib
+import json
+import os
+import subprocess
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from ufw_service import (
+    number_rule_tuples,
+    parse_user_rules,
+    read_user_rules_files,
+    replace_rule_files,
+)
+
+STATE_DIR = os.getenv("WEBFIRE_STATE_DIR", "/var/lib/webfire")
+HISTORY_DIR = os.path.join(STATE_DIR, "history")
+HISTORY_FULL_EVERY = int(os.getenv("WEBFIRE_HISTORY_FULL_EVERY", "100"))
+
+# Between user.rules and user6.rules in a stored content; never part of a rules file.
+_SEPARATOR = "\x00\n"
+
+
+def join_files(texts: List[str]) -> str:
+    return _SEPARATOR.join(texts)
+
+
+def split_files(content: str) -> List[str]:
+    return content.split(_SEPARATOR)
+
+
+def split_lines(text: str) -> List[str]:
+    # Unlike str.splitlines, splits on "\n" only, so joining gives back the text.
+    parts = text.split("\n")
+    lines = [part + "\n" for part in parts[:-1]]
+    if parts[-1]:
+        lines.append(parts[-1])
+    return lines
+
+
+def make_delta(base: List[str], lines: List[str]) -> list:
+    """
+    Encodes `lines` against `base` as [start, end] copies from base and
+    inserted strings.
+    """
+    # Rule edits touch a few blocks; trim the common ends before diffing.
+    head = 0
+    limit = min(len(base), len(lines))
+    while head < limit and base[head] == lines[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and base[-1 - tail] == lines[-1 - tail]:
+        tail += 1
+    ops = [[0, head]] if head else []
+    matcher = difflib.SequenceMatcher(None, base[head:len(base) - tail], lines[head:len(lines) - tail],
+                                      autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([head + i1, head + i2])
+        elif j2 > j1:
+            ops.append("".join(lines[head + j1:head + j2]))
+    if tail:
+        ops.append([len(base) - tail, len(base)])
+    return ops
+
+
+def apply_delta(base: List[str], ops: list) -> str:
+    parts = []
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(base[op[0]:op[1]])
+    return "".join(parts)
+
+
+class ObjectStore:
+    """Append-only pack of contents keyed by SHA-256, delta-compressed against their parent."""
+
+    def __init__(self, path: str, full_every: int = HISTORY_FULL_EVERY, cache_size: int = 8):
+        self.path = path
+        self.full_every = full_every
+        # hash -> (payload offset, payload length, base hash, delta depth)
+        self._index: Dict[str, Tuple[int, int, Optional[str], int]] = {}
+        self._scanned = 0
+        self._cache: "collections.OrderedDict[str, List[str]]" = collections.OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        """Indexes records appended since the last scan (by any process)."""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size <= self._scanned:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._scanned)
+            while True:
+                header = f.readline()
+                if not header.endswith(b"\n"):
+                    break
+                meta = json.loads(header)
+                offset = f.tell()
+                if offset + meta["n"] > size:
+                    break  # torn write; overwritten by the next append
+                base = meta["b"]
+                depth = self._index[base][3] + 1 if base else 0
+                self._index[meta["h"]] = (offset, meta["n"], base, depth)
+                self._scanned = offset + meta["n"]
+                f.seek(self._scanned)
+
+    def __contains__(self, digest: str) -> bool:
+        with self._lock:
+            self._refresh()
+            return digest in self._index
+
+    def size(self) -> int:
+        return self._scanned
+
+    def _remember(self, digest: str, lines: List[str]):
+        self._cache[digest] = lines
+        self._cache.move_to_end(digest)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def _lines(self, digest: str) -> List[str]:
+        if digest in self._cache:
+            self._cache.move_to_end(digest)
+            return self._cache[digest]
+        # Walk back to a full copy (or a cached version), then replay forward.
+        chain = []
+        while digest not in self._cache:
+            chain.append(digest)
+            base = self._index[digest][2]
+            if base is None:
+                break
+            digest = base
+        lines = self._cache.get(digest) if digest not in chain else None
+        with open(self.path, "rb") as f:
+            for link in reversed(chain):
+                offset, length, base, _ = self._index[link]
+                f.seek(offset)
+                data = zlib.decompress(f.read(length))
+                text = data.decode() if base is None else apply_delta(lines, json.loads(data))
+                lines = split_lines(text)
+        self._remember(chain[0], lines)
+        return lines
+
+    def get(self, digest: str) -> str:
+        """
+        Returns a stored content.
+
+        Raises:
+            KeyError: If no content has this hash.
+        """
+        with self._lock:
+            self._refresh()
+            if digest not in self._index:
+                raise KeyError(digest)
+            return "".join(self._lines(digest))
+
+    def put(self, content: str, parent: Optional[str] = None) -> str:
+        """
+        Stores a content (once) and returns its hash.
+
+        Args:
+            content (str): The content.
+            parent (str, optional): Hash of the previous content, to delta against.
+        """
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        lines = split_lines(content)
+        with self._lock:
+            self._refresh()
+            if digest in self._index:
+                return digest
+            payload, base = None, None
+            if parent in self._index and self._index[parent][3] + 1 < self.full_every:
+                delta = json.dumps(make_delta(self._lines(parent), lines), separators=(",", ":"))
+                if len(delta) < len(content) // 2:
+                    payload, base = zlib.compress(delta.encode(), 9), parent
+            if payload is None:
+                payload = zlib.compress(content.encode(), 9)
+            header = json.dumps({"h": digest, "b": base, "n": len(payload)}).encode() + b"\n"
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "ab") as f:
+                if f.tell() > self._scanned:
+                    f.truncate(self._scanned)  # drop a torn record
+                f.write(header + payload)
+            self._refresh()
+            self._remember(digest, lines)
+        return digest
+
+
+class RuleHistory:
+    """Versions of the rule files, newest last."""
+
+    def __init__(self, directory: str, full_every: int = HISTORY_FULL_EVERY):
+        self.directory = directory
+        self.store = ObjectStore(os.path.join(directory, "objects.pack"), full_every)
+        self.log_path = os.path.join(directory, "versions.jsonl")
+        self._versions: List[dict] = []
+        self._log_scanned = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(self._log_scanned)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    self._versions.append(json.loads(line))
+                    self._log_scanned += len(line)
+        except FileNotFoundError:
+            pass
+
+    @property
+    def versions(self) -> List[dict]:
+        """A copy of the versions, oldest first."""
+        with self._lock:
+            self._refresh()
+            return list(self._versions)
+
+    def get(self, version_id: int) -> dict:
+        """
+        Raises:
+            KeyError: If there is no such version.
+        """
+        with self._lock:
+            self._refresh()
+            # IDs are consecutive from 1.
+            if not 1 <= version_id <= len(self._versions):
+                raise KeyError(version_id)
+            return self._versions[version_id - 1]
+
+    def append(self, content: str, reason: str) -> Optional[dict]:
+        """Records a content as the newest version unless it equals the current newest."""
+        with self._lock:
+            self._refresh()
+            parent = self._versions[-1]["hash"] if self._versions else None
+            digest = self.store.put(content, parent)
+            if digest == parent:
+                return None
+            version = {
+                "id": len(self._versions) + 1,
+                "hash": digest,
+                "parent": parent,
+                "time": time.time(),
+                "reason": reason,
+                "rules": content.count("### tuple ###"),
+            }
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.log_path, "ab") as f:
+                f.write(json.dumps(version).encode() + b"\n")
+            self._refresh()
+        return version
+
+    async def record(self, reason: str) -> Optional[dict]:
+        """
+        Records the current rule files.
+
+        Returns:
+            dict | None: The new version, or None if the files did not change
+            (or could not be read).
+        """
+        try:
+            texts = await read_user_rules_files()
+            return await asyncio.to_thread(self.append, join_files(texts), reason)
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    async def on_mutation(self, stage: str, label: str):
+        """Mutation queue hook."""
+        if stage == "before":
+            await self.record("external change" if self.versions else "initial")
+        else:
+            await self.record(label)
+
+    def listing(self, limit: int = 50, before: Optional[int] = None) -> dict:
+        """
+        Returns versions newest first.
+
+        Returns:
+            dict: {"versions": [...], "total": int, "next_cursor": str | None}
+        """
+        versions = self.versions
+        end = len(versions) if before is None else max(0, min(before - 1, len(versions)))
+        start = max(0, end - limit)
+        page = versions[start:end][::-1]
+        return {"versions": page, "total": len(versions), "next_cursor": str(page[-1]["id"]) if start else None}
+
+    def rules(self, version_id: int) -> List[dict]:
+        """The rule listing of a version, numbered as `GET /api/rules` would."""
+        texts = split_files(self.store.get(self.get(version_id)["hash"]))
+        tuples = []
+        for i, text in enumerate(texts):
+            tuples.extend(parse_user_rules(text, v6=bool(i)))
+        return number_rule_tuples(tuples)
+
+    def diff(self, version_id: int, against: Optional[int] = None) -> dict:
+        """
+        Compares the rules of two versions.
+
+        Args:
+            version_id (int): The version to show.
+            against (int, optional): The version to compare with; the previous one by default.
+
+        Returns:
+            dict: {"id", "against", "added": [rules of `version_id`], "removed": [rules of `against`]}
+        """
+        if against is None:
+            against = version_id - 1 if version_id > 1 else None
+        new = self.rules(version_id)
+        old = self.rules(against) if against is not None else []
+
+        def identity(rule):
+            return (rule["to"], rule["action"], rule["direction"], rule["from"])
+
+        old_keys = {identity(rule) for rule in old}
+        new_keys = {identity(rule) for rule in new}
+        return {
+            "id": version_id,
+            "against": against,
+            "added": [rule for rule in new if identity(rule) not in old_keys],
+            "removed": [rule for rule in old if identity(rule) not in new_keys],
+        }
+
+    async def restore(self, version_id: int) -> dict:
+        """
+        Replaces the rule files with a version's and reloads ufw once.
+
+        Run through the mutation queue; the restored state is then recorded
+        as a new version by the queue's hook.
+        """
+        try:
+            version = self.get(version_id)
+        except KeyError:
+            return {"status": "error", "message": f"Version {version_id} does not exist"}
+        texts = await asyncio.to_thread(lambda: split_files(self.store.get(version["hash"])))
+        result = await replace_rule_files(texts)
+        if result["status"] == "success":
+            result["message"] = f"Restored version {version_id}"
+        return result
+
+
+rule_history = RuleHistory(HISTORY_DIR)
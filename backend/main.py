@@ -1,39 +1,114 @@
 """(C) 2025 by OPNLAB Development. All rights reserved."""
-from datetime import timedelta
-from typing import Optional, List
+import asyncio
+from contextlib import asynccontextmanager, suppress
+import json
+import secrets
+import time
+from typing import Any, Dict, Optional, List
 
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, Query, Request, Response, UploadFile, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import JWTError, jwt
-from pydantic import BaseModel, Field, ConfigDict
+import anyio
+import yaml
+from jose import JWTError
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
 
+from app_catalog import annotate_rules, annotated_listing, get_catalog
+from audit import audit_log, audited
 from auth import (
-    ACCESS_TOKEN_EXPIRE_MINUTES,
-    ALGORITHM,
-    SECRET_KEY,
+    LoginBusy,
+    RefreshRequest,
     Token,
     TokenData,
-    create_access_token,
-    get_password_hash,
-    verify_password,
+    decode_token,
+    get_password_hash_async,
+    issue_tokens,
+    verify_password_async,
 )
+from blocklist import (
+    BlocklistError,
+    delete_blocklist,
+    diff_blocklist,
+    import_blocklist,
+    list_blocklists,
+    read_import_file,
+    restore_blocklists,
+    validate_name,
+)
+from events import event_broker
+from exposure import collect_exposure
+from flow_replay import POLICIES, FlowsError, ruleset_listing, simulate
+from fleet import (
+    Agent,
+    FleetOperation,
+    fleet_client,
+    fleet_registry,
+    operation_request,
+    validate_agent,
+    validate_operation,
+)
+from history import rule_history
+from metrics import METRICS_ENABLED, METRICS_TOKEN, Gauge, MetricsMiddleware, render as render_metrics
+from mutation_queue import mutation_queue
+from rule_analysis import analyze_snapshot, check_new_rule
+from rule_expiry import MAX_TTL, ExpiringRule, expiry_schedule, rule_identities
+from rule_index import RuleQuery, get_rule_index
+from rule_model import get_logical_rules
+from rule_stats import collect_rule_stats
+from traffic_log import attribute_to_rules, run_traffic_ingestion, traffic_tailer
 from ufw_service import (
+    get_rules_snapshot,
+    get_snapshot_data,
     get_ufw_status,
-    get_ufw_rules,
-    add_ufw_rule,
-    delete_ufw_rule,
-    enable_ufw,
-    disable_ufw,
     Rule,
+    RuleBatch,
+    RuleSnapshot,
+    RuleSet,
+    canonical_rule,
+    sync_ruleset,
+    validate_rule,
 )
+from users import ROLES, UserError, user_store, validate_user
 
 tags_metadata = [
     {"name": "Health", "description": "Service health and readiness checks."},
     {"name": "Auth", "description": "Authentication and access token issuance."},
     {"name": "UFW", "description": "Firewall status and rule management endpoints."},
+    {"name": "Traffic", "description": "Statistics from the UFW kernel log."},
+    {"name": "Events", "description": "Server-Sent Events push channel."},
+    {"name": "Blocklists", "description": "Bulk IP blocklists installed as ipsets."},
+    {"name": "History", "description": "Recorded versions of the rule set, diff and restore."},
+    {"name": "Audit", "description": "Who changed what: the log of every firewall mutation."},
+    {"name": "Fleet", "description": "Reads and rule changes across registered webFire agents."},
+    {"name": "Users", "description": "Users and their roles (admin or readonly)."},
 ]
 
+
+async def _restore_blocklists():
+    """Recreates missing blocklist sets at startup; recorded in the audit log when any were."""
+    await audited(audit_log, "system:startup", "blocklist-restore", {"task": "restore_blocklists"},
+                  restore_blocklists(), lambda result: {"added": result["restored"], "removed": []},
+                  changed=lambda result: bool(result["restored"]))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background workers that live as long as the application.
+    tasks = [asyncio.create_task(run_traffic_ingestion()), asyncio.create_task(_restore_blocklists()),
+             asyncio.create_task(expiry_schedule.run()), asyncio.create_task(audit_log.run())]
+    yield
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        with suppress(asyncio.CancelledError):
+            await task
+    await audit_log.flush()
+    await event_broker.close()
+    await fleet_client.close()
+
+
 app = FastAPI(
     title="webFire API",
     description="API for managing UFW (Uncomplicated Firewall).",
@@ -42,8 +117,14 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc",
     openapi_url="/openapi.json",
+    lifespan=lifespan,
 )
 
+# Wake the event watcher as soon as a change went through the queue.
+mutation_queue.listeners.append(event_broker.notify)
+# Record the rule files before and after every change.
+mutation_queue.hooks.append(rule_history.on_mutation)
+
 
 # --- Schemas for OpenAPI/Swagger ---
 class HealthResponse(BaseModel):
@@ -63,11 +144,83 @@ class RuleOut(BaseModel):
     action: str
     direction: str = ""
     from_: str = Field(default="", alias="from")
+    services: List[str] = Field(
+        default=[], description="Application profiles and /etc/services names for the destination"
+    )
+    expires_at: Optional[float] = Field(default=None, description="When a temporary rule is deleted (Unix time)")
+    expires_in: Optional[int] = Field(default=None, description="Seconds until then")
 
 
 class RulesResponse(BaseModel):
     status: str
     rules: List[RuleOut] = []
+    total: Optional[int] = Field(default=None, description="Matching rules (filtered or paginated requests)")
+    next_cursor: Optional[str] = Field(default=None, description="Pass as `cursor` to get the next page")
+
+
+class GroupedRuleOut(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+    ids: List[int] = Field(description="IDs of the listed lines: the IPv4 line, the IPv6 line, or both")
+    to: str
+    action: str
+    direction: str = ""
+    from_: str = Field(default="", alias="from")
+    families: List[str] = Field(description="v4 | v6")
+    services: List[str] = Field(
+        default=[], description="Application profiles and /etc/services names for the destination"
+    )
+
+
+class GroupedRulesResponse(BaseModel):
+    status: str
+    rules: List[GroupedRuleOut] = []
+    lines: int = Field(default=0, description="Rules in the numbered listing")
+
+
+class RuleCounters(BaseModel):
+    id: int
+    packets: int = Field(description="Packets the rule accepted, dropped, rejected or rate-limited")
+    bytes: int
+    packets_per_s: Optional[float] = Field(default=None, description="Null without a comparable earlier sample")
+    bytes_per_s: Optional[float] = None
+
+
+class RuleStatsResponse(BaseModel):
+    time: float = Field(description="When the counters were read (Unix time)")
+    interval: Optional[float] = Field(description="Seconds the rates are computed over")
+    rules: List[RuleCounters] = []
+    out_of_sync: List[str] = Field(
+        default=[], description="Chains whose kernel rules do not match the rule files; their rules are left out"
+    )
+
+
+class ListenerOut(BaseModel):
+    protocol: str = Field(description="tcp | udp")
+    v6: bool
+    address: str
+    port: int
+    uid: int
+    inode: int
+    exposure: str = Field(description="local | allowed | denied | restricted | unruled")
+    rules: List[int] = Field(default=[], description="IDs of the incoming rules for the socket, in evaluation order")
+    pid: Optional[int] = Field(default=None, description="Only with `processes=true`")
+    process: Optional[str] = None
+
+
+class UnusedRule(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+    id: int
+    to: str
+    from_: str = Field(alias="from")
+
+
+class ExposureResponse(BaseModel):
+    status: str
+    scanned_at: float = Field(description="When the sockets were read (Unix time)")
+    listeners: List[ListenerOut] = []
+    counts: Dict[str, int] = Field(default={}, description="Listeners per exposure")
+    unused_rules: List[UnusedRule] = Field(default=[], description="Accepting rules for ports nothing listens on")
+    skipped: List[int] = Field(default=[], description="IDs of rules that could not be interpreted")
 
 
 class OperationResult(BaseModel):
@@ -75,6 +228,273 @@ class OperationResult(BaseModel):
     message: Optional[str] = None
 
 
+class BatchItemResult(BaseModel):
+    index: int = Field(description="Position of the item in its `add` or `delete` list")
+    op: str = Field(description="add | delete")
+    status: str = Field(description="success | skipped | error | not_applied | rolled_back")
+    message: Optional[str] = None
+
+
+class BatchResult(OperationResult):
+    results: List[BatchItemResult] = []
+
+
+class RulesetPlan(OperationResult):
+    dry_run: bool
+    add: List[Rule] = Field(default=[], description="Desired rules that are missing, appended in this order")
+    delete: List[RuleOut] = Field(default=[], description="Current rules not in the desired set")
+    unchanged: int = Field(description="Current rules that stay as they are")
+    results: List[BatchItemResult] = Field(default=[], description="Batch results when the plan was applied")
+
+
+class AnalysisFinding(BaseModel):
+    id: Optional[int] = Field(description="Rule ID; null for a rule that is only being checked")
+    kind: str = Field(description="redundant | shadowed | conflict")
+    related: List[int] = Field(description="Earlier rules responsible, in rule order")
+    more: bool = Field(default=False, description="More earlier rules conflict than are listed")
+    message: str
+
+
+class AnalysisCounts(BaseModel):
+    redundant: int
+    shadowed: int
+    conflict: int
+
+
+class RulesAnalysisResponse(BaseModel):
+    rules: int = Field(description="Rules listed")
+    analyzed: int = Field(description="Rules whose match could be interpreted")
+    counts: AnalysisCounts
+    findings: List[AnalysisFinding] = []
+
+
+class RuleFlows(BaseModel):
+    id: int
+    flows: int = Field(description="Flows this rule decided")
+
+
+class ReplaySummary(BaseModel):
+    verdicts: Dict[str, int] = Field(description="Flows per verdict: allow | deny | reject | limit | invalid")
+    rules: List[RuleFlows] = []
+    skipped: List[int] = Field(
+        default=[], description="Rules that could not be interpreted (e.g. unknown application profiles)"
+    )
+
+
+class FlowVerdict(BaseModel):
+    flow: int = Field(description="Position of the record among the flow records, from 1")
+    src: str
+    dst: str
+    protocol: str
+    dport: Optional[int] = None
+    direction: str
+    verdict: str
+    rule: Optional[int] = Field(description="Deciding rule; null when the default policy applies")
+    proposed_verdict: Optional[str] = None
+    proposed_rule: Optional[int] = None
+
+
+class SimulationResponse(BaseModel):
+    flows: int = Field(description="Flow records replayed")
+    current: ReplaySummary
+    proposed: Optional[ReplaySummary] = None
+    changed: Optional[int] = Field(default=None, description="Flows whose verdict the proposed rule set changes")
+    results: List[FlowVerdict] = Field(
+        default=[], description="The first flows, or with a proposed rule set the first changed ones"
+    )
+
+
+class AppOut(BaseModel):
+    name: str
+    title: str = ""
+    description: str = ""
+    ports: List[str] = Field(description='Port entries as in the profile, e.g. "80,443/tcp"')
+
+
+class AppsResponse(BaseModel):
+    apps: List[AppOut]
+
+
+class RuleCheckResponse(BaseModel):
+    findings: List[AnalysisFinding] = []
+
+
+class AddRuleResult(OperationResult):
+    warnings: List[AnalysisFinding] = Field(
+        default=[], description="Findings for the rule as it was about to be added"
+    )
+    expires_at: Optional[float] = Field(default=None, description="When the rule is deleted, for a temporary rule")
+
+
+class WaitTimes(BaseModel):
+    avg: float
+    p50: float
+    p95: float
+    max: float
+
+
+class MutationQueueStats(BaseModel):
+    depth: int = Field(description="Operations waiting to be applied")
+    in_flight: int = Field(description="Operations currently being applied")
+    processed: int = Field(description="Operations applied since start")
+    transactions: int = Field(description="ufw transactions used for them (merged adds/deletes count once)")
+    wait_ms: WaitTimes = Field(description="Queueing delay of recent operations")
+
+
+class SourceCount(BaseModel):
+    address: str
+    count: int
+
+
+class PortCount(BaseModel):
+    action: str = Field(description="UFW log action, e.g. BLOCK or ALLOW")
+    direction: str = Field(description="IN | OUT | FWD")
+    protocol: str
+    port: int
+    count: int
+
+
+class RuleCount(BaseModel):
+    id: int
+    count: int
+
+
+class TrafficTopResponse(BaseModel):
+    window: int = Field(description="Window length in seconds")
+    records: int = Field(description="Log records in the window")
+    total: int = Field(description="Log records ingested since start")
+    actions: Dict[str, int] = {}
+    sources: List[SourceCount] = []
+    ports: List[PortCount] = []
+    rules: List[RuleCount] = Field(
+        default=[], description="Counts attributed to rules by destination port (log lines do not name the rule)"
+    )
+
+
+class BlocklistInfo(BaseModel):
+    name: str
+    source: str = Field(description="Uploaded file name or local path")
+    entries: int = Field(description="Valid lines in the list")
+    rejected: int = Field(description="Lines that did not parse")
+    networks: Dict[str, int] = Field(description="Networks in each ipset after aggregation, by family")
+    updated_at: float
+
+
+class BlocklistFamilyDiff(BaseModel):
+    networks: int
+    added: int
+    removed: int
+    sample_added: List[str] = []
+    sample_removed: List[str] = []
+
+
+class BlocklistDiff(BaseModel):
+    name: str
+    entries: int
+    rejected: int
+    installed: bool
+    families: Dict[str, BlocklistFamilyDiff]
+
+
+class BlocklistFamilyResult(BaseModel):
+    networks: int
+    added: int
+    removed: int
+
+
+class BlocklistResult(OperationResult):
+    mode: Optional[str] = Field(default=None, description="incremental | swap")
+    entries: Optional[int] = None
+    rejected: Optional[int] = None
+    families: Dict[str, BlocklistFamilyResult] = {}
+
+
+class HistoryVersion(BaseModel):
+    id: int
+    hash: str = Field(description="SHA-256 of the rule files")
+    parent: Optional[str] = Field(description="Hash of the previous version")
+    time: float
+    reason: str = Field(description="Operation that produced the version, or `external change`")
+    rules: int = Field(description="Rule tuples in the files")
+
+
+class HistoryResponse(BaseModel):
+    versions: List[HistoryVersion] = Field(description="Newest first")
+    total: int
+    next_cursor: Optional[str] = Field(default=None, description="Pass as `before` to get older versions")
+
+
+class HistoryDiff(BaseModel):
+    id: int
+    against: Optional[int] = Field(description="Version compared with; null for the first version")
+    added: List[RuleOut] = Field(description="Rules only in `id`, numbered as in that version")
+    removed: List[RuleOut] = Field(description="Rules only in `against`, numbered as in that version")
+
+
+class AuditDiff(BaseModel):
+    added: List[Dict[str, Any]] = Field(
+        default=[], description="Rules as listed after the change; for `blocklist-restore`, the recreated sets"
+    )
+    removed: List[Dict[str, Any]] = Field(
+        default=[], description="Rules as listed before the change; only `id` if the client sent no ETag"
+    )
+
+
+class AuditEvent(BaseModel):
+    id: str = Field(description="Position in the log")
+    time: float = Field(description="When the request was received (Unix time)")
+    user: str = Field(
+        description="Who made the request; `system:expiry` or `system:startup` for the server's own changes"
+    )
+    action: str = Field(
+        description="add | delete | batch | ruleset | enable | disable | restore | blocklist | blocklist-delete"
+                    " | expire | blocklist-restore"
+    )
+    request: Dict[str, Any] = Field(
+        description="Method, path, query and body of the request; `task` and `body` for the server's own changes"
+    )
+    outcome: str = Field(description="success, or the error status of the operation")
+    message: Optional[str] = None
+    diff: Optional[AuditDiff] = Field(default=None, description="Null unless the change succeeded")
+    duration_ms: float
+
+
+class AuditResponse(BaseModel):
+    events: List[AuditEvent] = Field(description="Oldest first")
+    next_cursor: Optional[str] = Field(default=None, description="Pass as `cursor` to get the next page")
+
+
+class AgentOut(BaseModel):
+    name: str
+    url: str
+    username: str
+
+
+class FleetHostResult(BaseModel):
+    host: str
+    ok: bool
+    status_code: Optional[int] = None
+    result: Optional[Any] = Field(default=None, description="The agent's response body")
+    error: Optional[str] = None
+    elapsed_ms: float
+
+
+class FleetReadResponse(BaseModel):
+    succeeded: int
+    failed: int
+    hosts: List[FleetHostResult] = Field(description="Per-host results, by host name")
+
+
+class UserIn(BaseModel):
+    password: Optional[str] = Field(default=None, description="Required for a new user; unchanged if omitted")
+    role: str = Field(default="readonly", description=" | ".join(ROLES))
+
+
+class UserOut(BaseModel):
+    username: str
+    role: str
+
+
 # --- Health Check ---
 @app.get(
     "/",
@@ -83,7 +503,7 @@ class OperationResult(BaseModel):
     summary="Service health check",
     description="Returns a simple payload indicating the API is running.",
 )
-def health_check():
+async def health_check():
     return {"service": "webFire API", "status": "ok"}
 
 # CORS Middleware — allow dev (Vite) and Nginx hosts
@@ -97,30 +517,47 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Server-Timing"],
 )
+# Outermost, so the recorded latency includes the other middleware.
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
- 
 
-# --- Minimal Dev Authentication ---
-# In-memory user store for development. Replace with DB-backed users for production.
-fake_users_db = {
-    "admin": {
-        "username": "admin",
-        # default password: "secret" (change in production)
-        "hashed_password": get_password_hash("secret"),
-    }
-}
+def _request_threadpool() -> dict:
+    # Sync endpoints and dependencies run in anyio's worker threads.
+    try:
+        limiter = anyio.to_thread.current_default_thread_limiter()
+    except RuntimeError:  # no event loop
+        return {}
+    return {("busy",): limiter.borrowed_tokens, ("size",): limiter.total_tokens,
+            ("waiting",): limiter.statistics().tasks_waiting}
 
 
-def get_user(db, username: str) -> Optional[dict]:
-    return db.get(username)
+Gauge("webfire_request_threadpool", "Worker threads for sync endpoints and dependencies.",
+      _request_threadpool, ("state",))
 
 
-def authenticate_user(username: str, password: str) -> Optional[dict]:
-    user = get_user(fake_users_db, username)
-    if not user:
-        return None
-    if not verify_password(password, user["hashed_password"]):
+@app.get("/metrics", tags=["Health"], summary="Prometheus metrics", response_class=PlainTextResponse,
+         description="Set `WEBFIRE_METRICS_TOKEN` to require it as a bearer token.")
+async def metrics(authorization: Optional[str] = Header(default=None)):
+    if METRICS_TOKEN and not secrets.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Metrics token required",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+ 
+
+# --- Authentication ---
+# Users and roles live in a SQLite store shared by all workers (see users.py).
+def get_user(username: str) -> Optional[dict]:
+    return user_store.get(username)
+
+
+async def authenticate_user(username: str, password: str) -> Optional[dict]:
+    user = get_user(username)
+    # Unknown users are checked against a dummy hash, so they take as long to reject.
+    if not await verify_password_async(password, user["hashed_password"] if user else None):
         return None
     return user
 
@@ -130,40 +567,169 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
 
 
 def get_current_user(token: str = Depends(oauth2_scheme)):
+    return user_from_token(token)
+
+
+def get_stream_user(
+    authorization: Optional[str] = Header(default=None),
+    token: Optional[str] = Query(default=None, description="Access token, for clients that cannot set headers"),
+):
+    # Browsers' EventSource cannot send an Authorization header.
+    scheme, _, value = (authorization or "").partition(" ")
+    if scheme.lower() == "bearer" and value:
+        token = value
+    return user_from_token(token)
+
+
+def user_from_token(token: Optional[str]):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    if not token:
+        raise credentials_exception
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = get_user(fake_users_db, username=token_data.username)  # type: ignore[arg-type]
+    user = get_user(token_data.username)  # type: ignore[arg-type]
     if user is None:
         raise credentials_exception
     return user
 
 
-@app.post("/api/token", response_model=Token, tags=["Auth"], summary="Issue access token")
+def get_admin_user(user: dict = Depends(get_current_user)):
+    # Read-only users may call every GET endpoint but change nothing.
+    if user["role"] != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin role required")
+    return user
+
+
+@app.post("/api/token", response_model=Token, tags=["Auth"], summary="Issue access and refresh tokens")
 @app.post("/token", response_model=Token, include_in_schema=False)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+    try:
+        user = await authenticate_user(form_data.username, form_data.password)
+    except LoginBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress; retry shortly",
+            headers={"Retry-After": "1"},
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user["username"]}, expires_delta=access_token_expires
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
+    return issue_tokens(user["username"])
+
+
+@app.post("/api/token/refresh", response_model=Token, tags=["Auth"], summary="Exchange a refresh token for new tokens")
+async def refresh_access_token(request: RefreshRequest):
+    try:
+        username = decode_token(request.refresh_token, token_type="refresh").get("sub")
+    except JWTError:
+        username = None
+    if username is None or get_user(username) is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return issue_tokens(username)
+
+
+@app.get(
+    "/api/users/me",
+    response_model=UserOut,
+    tags=["Users"],
+    summary="The authenticated user",
+)
+async def current_user(user: dict = Depends(get_current_user)):
+    return user
+
+
+@app.get(
+    "/api/users",
+    response_model=List[UserOut],
+    dependencies=[Depends(get_admin_user)],
+    tags=["Users"],
+    summary="List users",
+)
+async def list_users():
+    return await asyncio.to_thread(user_store.list)
+
+
+@app.put(
+    "/api/users/{username}",
+    response_model=OperationResult,
+    dependencies=[Depends(get_admin_user)],
+    tags=["Users"],
+    summary="Create or update a user",
+    description="Changes take effect on the user's next request, in every worker.",
+)
+async def put_user(username: str, user: UserIn):
+    error = validate_user(username, user.password, user.role)
+    if error:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=error)
+    try:
+        hashed = await get_password_hash_async(user.password) if user.password is not None else None
+    except LoginBusy:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many password operations in progress; retry shortly",
+                            headers={"Retry-After": "1"})
+    try:
+        created = await asyncio.to_thread(user_store.put, username, user.role, hashed)
+    except UserError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return {"status": "success", "message": f"User {username} {'created' if created else 'updated'}"}
+
+
+@app.delete(
+    "/api/users/{username}",
+    response_model=OperationResult,
+    dependencies=[Depends(get_admin_user)],
+    tags=["Users"],
+    summary="Delete a user",
+    description="The user's tokens stop working at once.",
+)
+async def delete_user(username: str):
+    try:
+        removed = await asyncio.to_thread(user_store.remove, username)
+    except UserError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    if not removed:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown user {username}")
+    return {"status": "success", "message": f"User {username} deleted"}
+
+
+# --- Conditional requests ---
+def etag_matches(request: Request, etag: Optional[str]) -> bool:
+    """Checks the request's If-None-Match header against `etag` (weak comparison)."""
+    header = request.headers.get("if-none-match")
+    if not etag or not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [c.strip() for c in header.split(",")]
+    return any(c.removeprefix("W/") == etag for c in candidates)
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+def set_snapshot_headers(response: Response, etag: Optional[str]):
+    if etag:
+        response.headers["ETag"] = etag
+        # Let browsers keep the body but revalidate on every use.
+        response.headers["Cache-Control"] = "no-cache"
 
 
 # --- Endpoints ---
@@ -173,9 +739,14 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     dependencies=[Depends(get_current_user)],
     tags=["UFW"],
     summary="Get UFW status",
+    responses={304: {"description": "Rule snapshot unchanged since the given ETag"}},
 )
-def get_status():
-    return get_ufw_status()
+async def get_status(request: Request, response: Response):
+    snapshot = await get_rules_snapshot()
+    if etag_matches(request, snapshot.etag):
+        return not_modified(snapshot.etag)
+    set_snapshot_headers(response, snapshot.etag)
+    return await get_ufw_status(snapshot)
 
 
 @app.get(
@@ -184,51 +755,769 @@ def get_status():
     dependencies=[Depends(get_current_user)],
     tags=["UFW"],
     summary="List UFW rules",
-    description="Returns UFW rules with numbered IDs for stable delete operations.",
+    description=(
+        "Returns UFW rules with numbered IDs for stable delete operations. "
+        "Responses carry an ETag; send it back in If-None-Match to get a 304 "
+        "while the rule set is unchanged. All filters are optional and combined; "
+        "with `limit`, `next_cursor` names the next page until the last one. "
+        "Cursors are rule IDs, so compare the ETag between pages to detect a "
+        "rule set that changed in the meantime."
+    ),
+    responses={304: {"description": "Rule snapshot unchanged since the given ETag"}},
+)
+async def get_rules(
+    request: Request,
+    response: Response,
+    action: Optional[str] = Query(None, description="ALLOW | DENY | REJECT | LIMIT"),
+    direction: Optional[str] = Query(None, description="IN | OUT | FWD"),
+    port: Optional[int] = Query(None, ge=1, le=65535, description="Destination port covered by the rule"),
+    cidr_contains: Optional[str] = Query(
+        None, description="Address or network inside an explicit source/destination network of the rule"
+    ),
+    q: Optional[str] = Query(None, description="Case-insensitive substring of any field"),
+    limit: Optional[int] = Query(None, ge=1, le=5000, description="Page size"),
+    cursor: Optional[str] = Query(None, description="`next_cursor` of the previous page"),
+):
+    snapshot = await get_rules_snapshot()
+    if etag_matches(request, snapshot.etag):
+        return not_modified(snapshot.etag)
+    set_snapshot_headers(response, snapshot.etag)
+    query = RuleQuery(action, direction, port, cidr_contains, q)
+    if query.is_empty() and limit is None and cursor is None or snapshot.data["status"] == "error":
+        return expiry_schedule.annotate(await annotated_listing(snapshot))
+    try:
+        after = int(cursor) if cursor else None
+        index = await get_rule_index(snapshot)
+        result = index.query(query, limit, after)
+        return expiry_schedule.annotate(
+            dict(result, rules=annotate_rules(result["rules"]), status=snapshot.data["status"]))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"Invalid filter: {e}")
+
+
+@app.get(
+    "/api/apps",
+    response_model=AppsResponse,
+    dependencies=[Depends(get_current_user)],
+    tags=["UFW"],
+    summary="List ufw application profiles",
+    description="Profiles from /etc/ufw/applications.d; rules can name one in `app` instead of a port.",
 )
-def get_rules():
-    return get_ufw_rules()
+async def list_apps():
+    catalog = get_catalog()
+    return {"apps": [
+        {"name": profile.name, "title": profile.title, "description": profile.description,
+         "ports": profile.ports_text()}
+        for profile in sorted(catalog.profiles.values(), key=lambda profile: profile.name.lower())
+    ]}
+
+
+def _audit_request(request: Request, body: Any = None) -> dict:
+    entry = {"method": request.method, "path": request.url.path}
+    if request.url.query:
+        entry["query"] = request.url.query
+    if body is not None:
+        entry["body"] = body
+    return entry
+
+
+def _rule_lines(rule: Rule, listed: frozenset = frozenset()) -> List[dict]:
+    """How ufw lists a rule, one line per address family, leaving out lines in `listed`."""
+    canonical = canonical_rule(rule)
+    if validate_rule(canonical):  # e.g. service names, which only the ufw CLI resolves
+        return [rule.model_dump(exclude_none=True)]
+    return [dict(zip(("to", "action", "direction", "from"), line)) for line in rule_identities(canonical)
+            if line not in listed]
+
+
+def _listed_lines(snapshot: RuleSnapshot) -> frozenset:
+    """The (to, action, direction, from) of every listed rule."""
+    return frozenset((rule["to"], rule["action"], rule["direction"], rule["from"])
+                     for rule in snapshot.data.get("rules", []))
+
+
+def _added_lines(rule: Rule, result: dict, listed: frozenset) -> List[dict]:
+    """The lines an add created: none when ufw skipped it as existing, and none that were already listed."""
+    messages = (result.get("message") or "").splitlines()
+    if messages and all(message.startswith("Skipping") for message in messages):
+        return []
+    return _rule_lines(rule, listed)
+
+
+def _listed_rule(rule: dict) -> dict:
+    return {key: rule[key] for key in ("id", "to", "action", "direction", "from") if key in rule}
+
+
+async def _check_rule(rule: Rule, snapshot: Optional[RuleSnapshot] = None) -> list:
+    snapshot = snapshot or await get_rules_snapshot()
+    if snapshot.data["status"] == "error":
+        return []
+    return await asyncio.to_thread(check_new_rule, rule, snapshot.data.get("rules", []))
 
 
 @app.post(
     "/api/rules",
-    response_model=OperationResult,
-    dependencies=[Depends(get_current_user)],
+    response_model=AddRuleResult,
     tags=["UFW"],
     summary="Add a UFW rule",
+    description=(
+        "The rule is added even if it would be redundant, shadowed or in conflict "
+        "with an earlier rule; such findings are returned in `warnings`. Use "
+        "`POST /api/rules/check` to see them before adding. With `ttl` or "
+        "`expires_at` the rule is temporary and deleted when it expires; adding "
+        "it again sets a new expiry."
+    ),
 )
-def add_rule(rule: Rule):
-    return add_ufw_rule(rule)
+async def add_rule(rule: ExpiringRule, request: Request, user: dict = Depends(get_admin_user)):
+    body = rule.model_dump(exclude_unset=True)
+    ttl, expires_at = rule.ttl, rule.expires_at
+    rule = Rule(**rule.model_dump(exclude={"ttl", "expires_at"}))
+    if ttl is not None or expires_at is not None:
+        expires_at = await _temporary_rule_expiry(rule, ttl, expires_at)
+    snapshot = await get_rules_snapshot()
+    warnings = await _check_rule(rule, snapshot)
+    listed = _listed_lines(snapshot)
+    result = await audited(audit_log, user["username"], "add", _audit_request(request, body), mutation_queue.add(rule),
+                           lambda result: {"added": _added_lines(rule, result, listed), "removed": []})
+    if expires_at is not None and result["status"] == "success":
+        await expiry_schedule.schedule(rule_identities(canonical_rule(rule)), expires_at)
+    return dict(result, warnings=warnings, expires_at=expires_at)
+
+
+async def _temporary_rule_expiry(rule: Rule, ttl: Optional[int], expires_at: Optional[float]) -> float:
+    def invalid(detail):
+        return HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=detail)
+
+    now = time.time()
+    if ttl is not None and expires_at is not None:
+        raise invalid("Send either `ttl` or `expires_at`")
+    if expires_at is None:
+        expires_at = now + ttl
+    elif not now < expires_at <= now + MAX_TTL:
+        raise invalid("`expires_at` must be in the future, at most a year ahead")
+    error = validate_rule(rule, service_names=True)
+    if error:
+        raise invalid(error)
+    # Expiry finds the rule by how it is listed, which for service names is their port.
+    if validate_rule(canonical_rule(rule)):
+        raise invalid("Temporary rules need numeric ports or an app")
+    identities = rule_identities(canonical_rule(rule))
+    snapshot = await get_rules_snapshot()
+    listed = {(r["to"], r["action"], r["direction"], r["from"]) for r in snapshot.data.get("rules", [])}
+    if expiry_schedule.expires_at(identities) is None and any(identity in listed for identity in identities):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="The rule already exists without an expiry")
+    return expires_at
+
+
+@app.post(
+    "/api/rules/check",
+    response_model=RuleCheckResponse,
+    dependencies=[Depends(get_current_user)],
+    tags=["UFW"],
+    summary="Check a rule against the current rules without adding it",
+)
+async def check_rule(rule: Rule):
+    return {"findings": await _check_rule(rule)}
+
+
+@app.get(
+    "/api/rules/analysis",
+    response_model=RulesAnalysisResponse,
+    dependencies=[Depends(get_current_user)],
+    tags=["UFW"],
+    summary="Find redundant, shadowed and conflicting rules",
+    description=(
+        "ufw applies the first matching rule. A rule is redundant if an earlier "
+        "rule with the same action matches all of its traffic, shadowed if one "
+        "with a different action does, and in conflict if earlier rules with the "
+        "opposite verdict and the same or wider sources take part of its traffic."
+    ),
+)
+async def rules_analysis():
+    snapshot = await get_rules_snapshot()
+    if snapshot.data["status"] == "error":
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=snapshot.data.get("message") or "Rules unavailable")
+    return await analyze_snapshot(snapshot)
+
+
+@app.get(
+    "/api/rules/grouped",
+    response_model=GroupedRulesResponse,
+    dependencies=[Depends(get_current_user)],
+    tags=["UFW"],
+    summary="List rules with IPv4/IPv6 twins as one rule",
+    description=(
+        "ufw lists a rule without addresses twice, once per address family. "
+        "Here such twins are one entry with both IDs; rules with an address "
+        "are listed for their own family."
+    ),
+)
+async def get_grouped_rules():
+    snapshot = await get_rules_snapshot()
+    if snapshot.data["status"] == "error":
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=snapshot.data.get("message") or "Rules unavailable")
+    catalog = get_catalog()
+    rules = []
+    for logical in await get_logical_rules(snapshot):
+        rule = logical.to_dict()
+        rule["services"] = list(catalog.services_for(rule["to"]))
+        rules.append(rule)
+    return {"status": snapshot.data["status"], "rules": rules, "lines": len(snapshot.data.get("rules", []))}
+
+
+@app.get(
+    "/api/rules/stats",
+    response_model=RuleStatsResponse,
+    dependencies=[Depends(get_current_user)],
+    tags=["UFW"],
+    summary="Packet and byte counters per rule",
+    description=(
+        "Reads the kernel counters of all ufw rules in one `iptables-save -c` per "
+        "address family. Rates compare with the previous sample, or with the "
+        "newest kept sample at least `window` seconds old."
+    ),
+)
+async def get_rule_stats(window: float = Query(0, ge=0, description="Minimum seconds to compute rates over")):
+    result = await collect_rule_stats(window)
+    if result["status"] == "error":
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=result["message"])
+    return result
+
+
+@app.get(
+    "/api/exposure",
+    response_model=ExposureResponse,
+    dependencies=[Depends(get_current_user)],
+    tags=["UFW"],
+    summary="Listening sockets and the rules that expose them",
+    description=(
+        "Reads the listening TCP and UDP sockets from /proc/net and classifies each "
+        "against the incoming rules. Also lists accepting rules for ports nothing "
+        "listens on. With `processes=true` the owning process of each socket is "
+        "looked up as well, which walks /proc."
+    ),
+)
+async def get_exposure(processes: bool = Query(False, description="Add the owning process of each socket")):
+    snapshot = await get_rules_snapshot()
+    if snapshot.data["status"] == "error":
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=snapshot.data.get("message") or "Rules unavailable")
+    return await collect_exposure(snapshot, processes)
+
+
+@app.post(
+    "/api/rules/batch",
+    response_model=BatchResult,
+    tags=["UFW"],
+    summary="Add and delete many UFW rules at once",
+    description=(
+        "Validates every item first, writes the combined rule set once and reloads "
+        "ufw once. Either the whole batch is applied or the previous rules are "
+        "restored. Delete IDs refer to the rule list before the batch."
+    ),
+)
+async def add_rules_batch(batch: RuleBatch, request: Request, user: dict = Depends(get_admin_user)):
+    # Delete IDs refer to this listing.
+    snapshot = await get_rules_snapshot()
+    listed = _listed_lines(snapshot)
+    by_id = {rule["id"]: rule for rule in snapshot.data.get("rules", [])}
+
+    def diff(result):
+        done = {(item["op"], item["index"]) for item in result.get("results", []) if item["status"] == "success"}
+        return {
+            "added": [line for i, rule in enumerate(batch.add) if ("add", i) in done
+                      for line in _rule_lines(rule, listed)],
+            "removed": [_listed_rule(by_id[rule_id]) if rule_id in by_id else {"id": rule_id}
+                        for i, rule_id in enumerate(batch.delete) if ("delete", i) in done],
+        }
+
+    body = batch.model_dump(exclude_unset=True)
+    return await audited(audit_log, user["username"], "batch", _audit_request(request, body),
+                         mutation_queue.batch(batch), diff)
+
+
+def _load_ruleset(body, is_yaml: bool) -> RuleSet:
+    try:
+        data = yaml.safe_load(body) if is_yaml else json.loads(body)
+        return RuleSet.model_validate({"rules": data} if isinstance(data, list) else data)
+    except (ValueError, yaml.YAMLError) as e:
+        detail = e.errors(include_url=False, include_context=False) if isinstance(e, ValidationError) else f"Invalid rule set: {e}"
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=detail)
+
+
+@app.put(
+    "/api/ruleset",
+    response_model=RulesetPlan,
+    tags=["UFW"],
+    summary="Make the rules match a desired rule set",
+    description=(
+        "Takes the complete set of user rules as JSON or YAML (`{rules: [...]}` or a "
+        "bare list of rules) and applies only the difference to the current rules, "
+        "in one batch. With `dry_run` the plan is returned without changing anything. "
+        "With `prune=false` current rules missing from the set are kept."
+    ),
+    openapi_extra={"requestBody": {"required": True, "content": {
+        media_type: {"schema": {"type": "object", "properties": {
+            "rules": {"type": "array", "items": {"$ref": "#/components/schemas/Rule"}}}}}
+        for media_type in ("application/json", "application/yaml")
+    }}},
+)
+async def put_ruleset(
+    request: Request,
+    dry_run: bool = Query(False, description="Only return the plan"),
+    prune: bool = Query(True, description="Delete current rules that are not in the set"),
+    user: dict = Depends(get_admin_user),
+):
+    ruleset = _load_ruleset(await request.body(), "yaml" in request.headers.get("content-type", ""))
+    if dry_run:
+        return await sync_ruleset(ruleset, dry_run=True, prune=prune)
+    return await audited(
+        audit_log, user["username"], "ruleset", _audit_request(request, ruleset.model_dump(exclude_unset=True)),
+        mutation_queue.run(lambda: sync_ruleset(ruleset, prune=prune)),
+        lambda result: {"added": [line for rule in result["add"] for line in _rule_lines(rule)],
+                        "removed": [_listed_rule(rule) for rule in result["delete"]]},
+    )
+
+
+@app.post(
+    "/api/simulate",
+    response_model=SimulationResponse,
+    dependencies=[Depends(get_current_user)],
+    tags=["UFW"],
+    summary="Replay recorded flows against the rules",
+    description=(
+        "Decides every flow of a CSV export (header row with `src`, `dst` and "
+        "optionally `proto`, `sport`, `dport`, `direction`, `in`, `out`) or of "
+        "conntrack output the way ufw's user rules would: first matching rule, "
+        "else the default policy. With `ruleset` (JSON or YAML, as for "
+        "`PUT /api/ruleset`, evaluated in the given order) the flows are also "
+        "replayed against that set and the ones whose verdict changes are listed. "
+        "ufw's built-in before/after rules are not modelled."
+    ),
+)
+async def simulate_flows(
+    file: UploadFile = File(..., description="Flow records: CSV or conntrack -L output"),
+    ruleset: Optional[str] = Form(None, description="Proposed rule set; the current rules are always replayed"),
+    fmt: str = Form("auto", alias="format", pattern="^(auto|csv|conntrack)$"),
+    direction: str = Form("in", pattern="^(in|out|fwd)$", description="Direction of records without one"),
+    default_incoming: str = Form("deny", description="allow | deny | reject"),
+    default_outgoing: str = Form("allow", description="allow | deny | reject"),
+    default_routed: str = Form("deny", description="allow | deny | reject"),
+    limit: int = Query(100, ge=0, le=10000, description="Flows to list in `results`"),
+):
+    policies = {"in": default_incoming, "out": default_outgoing, "fwd": default_routed}
+    if any(policy not in POLICIES for policy in policies.values()):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Default policies are allow, deny or reject")
+    proposed = None
+    if ruleset is not None:
+        rules = []
+        for index, rule in enumerate(_load_ruleset(ruleset, not ruleset.lstrip().startswith(("{", "["))).rules):
+            rule = canonical_rule(rule)
+            error = validate_rule(rule, service_names=True)
+            if error:
+                raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Rule {index}: {error}")
+            rules.append(rule)
+        proposed = ruleset_listing(rules)
+    snapshot = await get_rules_snapshot()
+    if snapshot.data["status"] == "error":
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail=snapshot.data.get("message") or "Rules unavailable")
+    text = (await file.read()).decode("utf-8", errors="replace")
+    try:
+        return await asyncio.to_thread(simulate, text, snapshot.data.get("rules", []), proposed, fmt,
+                                       direction, policies, limit)
+    except FlowsError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
 @app.delete(
     "/api/rules/{rule_id}",
     response_model=OperationResult,
-    dependencies=[Depends(get_current_user)],
     tags=["UFW"],
     summary="Delete a UFW rule by ID",
+    description=(
+        "Send the ETag of the rule listing the ID was taken from in If-Match. "
+        "If the rule set changed since, the ID is mapped to the rule's current "
+        "number; if the rule can no longer be identified the request fails with 409."
+    ),
+    responses={409: {"description": "The rule ID is stale"}},
 )
-def delete_rule(rule_id: int):
-    return delete_ufw_rule(rule_id)
+async def delete_rule(
+    rule_id: int,
+    request: Request,
+    if_match: Optional[str] = Header(default=None),
+    user: dict = Depends(get_admin_user),
+):
+    etag = if_match.strip().removeprefix("W/") if if_match else None
+    # The rule as the client saw it listed.
+    seen = [rule for rule in (get_snapshot_data(etag) or {}).get("rules", []) if rule["id"] == rule_id] if etag else []
+    removed = [_listed_rule(rule) for rule in seen] or [{"id": rule_id}]
+    body = {"etag": etag} if etag else None
+    result = await audited(audit_log, user["username"], "delete", _audit_request(request, body),
+                           mutation_queue.delete(rule_id, etag), lambda _: {"added": [], "removed": removed})
+    if result["status"] == "conflict":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=result["message"])
+    return result
 
 
 @app.post(
     "/api/enable",
     response_model=OperationResult,
-    dependencies=[Depends(get_current_user)],
     tags=["UFW"],
     summary="Enable UFW",
 )
-def enable():
-    return enable_ufw()
+async def enable(request: Request, user: dict = Depends(get_admin_user)):
+    return await audited(audit_log, user["username"], "enable", _audit_request(request), mutation_queue.enable())
 
 
 @app.post(
     "/api/disable",
     response_model=OperationResult,
-    dependencies=[Depends(get_current_user)],
     tags=["UFW"],
     summary="Disable UFW",
 )
-def disable():
-    return disable_ufw()
+async def disable(request: Request, user: dict = Depends(get_admin_user)):
+    return await audited(audit_log, user["username"], "disable", _audit_request(request), mutation_queue.disable())
+
+
+@app.get(
+    "/api/mutations",
+    response_model=MutationQueueStats,
+    dependencies=[Depends(get_current_user)],
+    tags=["UFW"],
+    summary="Mutation queue statistics",
+)
+async def mutation_stats():
+    return mutation_queue.stats()
+
+
+@app.get(
+    "/api/traffic/top",
+    response_model=TrafficTopResponse,
+    dependencies=[Depends(get_current_user)],
+    tags=["Traffic"],
+    summary="Top sources, ports and rules from the UFW log",
+)
+async def traffic_top(
+    window: int = Query(3600, ge=1, le=7 * 24 * 3600, description="Window length in seconds"),
+    limit: int = Query(10, ge=1, le=1000),
+):
+    index = traffic_tailer.index
+    top = await asyncio.to_thread(index.top, window, limit)
+    snapshot = await get_rules_snapshot()
+    rules = attribute_to_rules(top["ports"], snapshot.data.get("rules", []))
+    return {
+        "window": window,
+        "records": top["records"],
+        "total": index.total,
+        "actions": top["actions"],
+        "sources": [{"address": ip, "count": n} for ip, n in top["sources"]],
+        "ports": [
+            {"action": a, "direction": d, "protocol": p, "port": port, "count": n}
+            for (a, d, p, port), n in top["ports"][:limit]
+        ],
+        "rules": [{"id": rule_id, "count": n} for rule_id, n in rules[:limit]],
+    }
+
+
+@app.get(
+    "/api/events",
+    dependencies=[Depends(get_stream_user)],
+    tags=["Events"],
+    summary="Stream status, rule-set and traffic changes",
+    description=(
+        "A text/event-stream of `status` ({status}), `rules` ({version, etag, count}) "
+        "and `traffic` ({total}) events. The current state is sent on connect and "
+        "then again whenever it changes. All clients share one server-side watcher. "
+        "Pass the access token as `token` when the client cannot set headers."
+    ),
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+async def events():
+    return StreamingResponse(
+        event_broker.subscribe(),
+        media_type="text/event-stream",
+        # Tell nginx not to buffer the stream.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _blocklist_source(name: str, file: Optional[UploadFile], path: Optional[str]):
+    error = validate_name(name)
+    if error:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=error)
+    if (file is None) == (not path):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Send either a `file` upload or a `path`")
+    if file is not None:
+        return (await file.read()).decode("utf-8", errors="replace"), file.filename or "upload"
+    try:
+        return await asyncio.to_thread(read_import_file, path), path
+    except BlocklistError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@app.get(
+    "/api/blocklists",
+    response_model=List[BlocklistInfo],
+    dependencies=[Depends(get_current_user)],
+    tags=["Blocklists"],
+    summary="List installed blocklists",
+)
+async def blocklists():
+    return await asyncio.to_thread(list_blocklists)
+
+
+@app.post(
+    "/api/blocklists/{name}/diff",
+    response_model=BlocklistDiff,
+    dependencies=[Depends(get_current_user)],
+    tags=["Blocklists"],
+    summary="Compare a list with the installed one",
+    description="Parses and aggregates the list like an import, without applying it.",
+)
+async def blocklist_diff(
+    name: str,
+    file: Optional[UploadFile] = File(None, description="One address or CIDR per line"),
+    path: Optional[str] = Form(None, description="File inside the server's blocklist import directory"),
+):
+    text, _ = await _blocklist_source(name, file, path)
+    return await asyncio.to_thread(diff_blocklist, name, text)
+
+
+@app.put(
+    "/api/blocklists/{name}",
+    response_model=BlocklistResult,
+    tags=["Blocklists"],
+    summary="Install or replace a blocklist",
+    description=(
+        "Overlapping and adjacent networks are merged. The list is loaded into "
+        "the ipsets `webfire-NAME-v4` / `-v6`, which one DROP rule each in "
+        "before.rules refers to. Small updates are applied as a diff to the "
+        "live set; larger ones fill a new set that is swapped in atomically."
+    ),
+)
+async def put_blocklist(
+    name: str,
+    request: Request,
+    file: Optional[UploadFile] = File(None, description="One address or CIDR per line"),
+    path: Optional[str] = Form(None, description="File inside the server's blocklist import directory"),
+    user: dict = Depends(get_admin_user),
+):
+    text, source = await _blocklist_source(name, file, path)
+    return await audited(audit_log, user["username"], "blocklist", _audit_request(request, {"source": source}),
+                         mutation_queue.run(lambda: import_blocklist(name, text, source)))
+
+
+@app.delete(
+    "/api/blocklists/{name}",
+    response_model=OperationResult,
+    tags=["Blocklists"],
+    summary="Remove a blocklist",
+)
+async def remove_blocklist(name: str, request: Request, user: dict = Depends(get_admin_user)):
+    return await audited(audit_log, user["username"], "blocklist-delete", _audit_request(request),
+                         mutation_queue.run(lambda: delete_blocklist(name)))
+
+
+# --- Audit ---
+@app.get(
+    "/api/audit",
+    response_model=AuditResponse,
+    dependencies=[Depends(get_current_user)],
+    tags=["Audit"],
+    summary="Query the audit log",
+    description=(
+        "Mutations in time order, optionally limited to a time range, a user and an "
+        "action. With `format=jsonl` every matching event is streamed as stored, one "
+        "JSON object per line, without paging."
+    ),
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def audit(
+    since: Optional[float] = Query(None, description="Earliest event time (Unix time)"),
+    until: Optional[float] = Query(None, description="Latest event time (Unix time)"),
+    user: Optional[str] = Query(None),
+    action: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="`next_cursor` of the previous page"),
+    fmt: str = Query("json", alias="format", pattern="^(json|jsonl)$"),
+):
+    # Include what this process has not written yet.
+    await audit_log.flush()
+    if fmt == "jsonl":
+        return StreamingResponse(audit_log.export(since, until, user, action), media_type="application/x-ndjson")
+    try:
+        return await asyncio.to_thread(audit_log.query, since, until, user, action, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid cursor")
+
+
+# --- History ---
+@app.get(
+    "/api/history",
+    response_model=HistoryResponse,
+    dependencies=[Depends(get_current_user)],
+    tags=["History"],
+    summary="List recorded rule-set versions",
+)
+async def history(
+    limit: int = Query(50, ge=1, le=1000),
+    before: Optional[int] = Query(None, ge=1, description="Only versions older than this ID"),
+):
+    return await asyncio.to_thread(rule_history.listing, limit, before)
+
+
+@app.get(
+    "/api/history/{version_id}/diff",
+    response_model=HistoryDiff,
+    dependencies=[Depends(get_current_user)],
+    tags=["History"],
+    summary="Rules added and removed in a version",
+)
+async def history_diff(
+    version_id: int,
+    against: Optional[int] = Query(None, description="Version to compare with; the previous one by default"),
+):
+    try:
+        return await asyncio.to_thread(rule_history.diff, version_id, against)
+    except KeyError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Version {e.args[0]} does not exist")
+
+
+@app.post(
+    "/api/history/{version_id}/restore",
+    response_model=OperationResult,
+    tags=["History"],
+    summary="Restore the rules of a version",
+    description=(
+        "Writes the version's user.rules/user6.rules and reloads ufw once. The "
+        "current rules are recorded first, so a restore can itself be undone."
+    ),
+)
+async def history_restore(version_id: int, request: Request, user: dict = Depends(get_admin_user)):
+    try:
+        await asyncio.to_thread(rule_history.get, version_id)
+    except KeyError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Version {version_id} does not exist")
+    return await audited(audit_log, user["username"], "restore", _audit_request(request),
+                         mutation_queue.run(lambda: rule_history.restore(version_id), label=f"restore {version_id}"))
+
+
+# --- Fleet ---
+def _fleet_hosts(hosts: Optional[List[str]]) -> List[str]:
+    try:
+        return fleet_registry.select(hosts)
+    except KeyError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Unknown agent {e.args[0]}")
+
+
+@app.get(
+    "/api/fleet/agents",
+    response_model=List[AgentOut],
+    dependencies=[Depends(get_current_user)],
+    tags=["Fleet"],
+    summary="List registered agents",
+)
+async def fleet_agents():
+    return [{"name": name, "url": agent.url, "username": agent.username}
+            for name, agent in sorted(fleet_registry.agents.items())]
+
+
+@app.put(
+    "/api/fleet/agents/{name}",
+    response_model=OperationResult,
+    dependencies=[Depends(get_admin_user)],
+    tags=["Fleet"],
+    summary="Register or update an agent",
+    description="`url` is the agent's API base URL; the credentials are those of a user on the agent.",
+)
+async def put_fleet_agent(name: str, agent: Agent):
+    error = validate_agent(name, agent)
+    if error:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=error)
+    agent.url = agent.url.rstrip("/")
+    await asyncio.to_thread(fleet_registry.put, name, agent)
+    return {"status": "success", "message": f"Agent {name} registered"}
+
+
+@app.delete(
+    "/api/fleet/agents/{name}",
+    response_model=OperationResult,
+    dependencies=[Depends(get_admin_user)],
+    tags=["Fleet"],
+    summary="Remove an agent",
+)
+async def delete_fleet_agent(name: str):
+    if not await asyncio.to_thread(fleet_registry.remove, name):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown agent {name}")
+    return {"status": "success", "message": f"Agent {name} removed"}
+
+
+async def _fleet_read(hosts: List[str], path: str, params: Optional[dict] = None) -> dict:
+    results = [outcome async for outcome in fleet_client.fan_out(hosts, "GET", path, params=params)]
+    results.sort(key=lambda outcome: outcome["host"])
+    succeeded = sum(outcome["ok"] for outcome in results)
+    return {"succeeded": succeeded, "failed": len(results) - succeeded, "hosts": results}
+
+
+@app.get(
+    "/api/fleet/status",
+    response_model=FleetReadResponse,
+    dependencies=[Depends(get_current_user)],
+    tags=["Fleet"],
+    summary="UFW status of every agent",
+)
+async def fleet_status(hosts: Optional[List[str]] = Query(None, description="Agents to ask; all if omitted")):
+    return await _fleet_read(_fleet_hosts(hosts), "/api/status")
+
+
+@app.get(
+    "/api/fleet/rules",
+    response_model=FleetReadResponse,
+    dependencies=[Depends(get_current_user)],
+    tags=["Fleet"],
+    summary="Rules of every agent",
+    description="Other query parameters (filters, `limit`) are passed on to each agent's `GET /api/rules`.",
+)
+async def fleet_rules(request: Request,
+                      hosts: Optional[List[str]] = Query(None, description="Agents to ask; all if omitted")):
+    params = {key: value for key, value in request.query_params.items() if key not in ("hosts", "token")}
+    return await _fleet_read(_fleet_hosts(hosts), "/api/rules", params)
+
+
+@app.post(
+    "/api/fleet/operations",
+    dependencies=[Depends(get_admin_user)],
+    tags=["Fleet"],
+    summary="Apply a rule change across agents",
+    description=(
+        "`op` is add (with `rule`), batch (with `batch`), enable or disable. "
+        "The response streams newline-delimited JSON events as agents answer: "
+        "`stage`, one `host` event per agent, and a final `done` summary. With "
+        "`canary` > 0 the first that many agents are changed first, and the "
+        "rollout stops if more than `max_failures` of them fail."
+    ),
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def fleet_operation(operation: FleetOperation):
+    error = validate_operation(operation)
+    if error:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=error)
+    hosts = _fleet_hosts(operation.hosts)
+    method, path, body = operation_request(operation)
+
+    async def progress():
+        async for event in fleet_client.rollout(hosts, method, path, body,
+                                                operation.canary, operation.max_failures):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(progress(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,218 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Prometheus metrics and per-request timing.
+
+Metrics are plain in-process counters, histograms and callback gauges,
+rendered in the Prometheus text format by `GET /metrics`. Recording one is
+a dict lookup and an increment, so the hot paths (every request, every ufw
+child) can afford it. Each worker process keeps its own values; scrape the
+workers individually (or run one worker) when exact totals matter.
+
+`MetricsMiddleware` times every request by route template. A request that
+sends the `X-Webfire-Profile` header also gets a `Server-Timing` response
+header with the steps recorded while it ran (`add_timing`): ufw child
+spawn and run time, parsing, mutation queue wait, ...
+"""
+import bisect
+import contextvars
+import os
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv("WEBFIRE_METRICS", "1") != "0"
+# When set, GET /metrics requires "Authorization: Bearer <token>".
+METRICS_TOKEN = os.getenv("WEBFIRE_METRICS_TOKEN")
+PROFILE_HEADER = b"x-webfire-profile"
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        _metrics.append(self)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        if METRICS_ENABLED:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+                for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        if not METRICS_ENABLED:
+            return
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else repr(bound))
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {series[-1]!r}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Read at scrape time from `function`, which returns a number or {label values: number}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], object],
+                 labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def samples(self) -> List[str]:
+        value = self.function()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        return [f"{self.name}{_labels(self.labels, key)} {_number(number)}" for key, number in sorted(items)]
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in _metrics) + "\n"
+
+
+# --- Per-request profile ---
+_profile: "contextvars.ContextVar[Optional[List[Tuple[str, float]]]]" = contextvars.ContextVar(
+    "webfire_profile", default=None)
+
+
+def add_timing(step: str, seconds: float):
+    """Adds a step to the profile of the current request, if it asked for one."""
+    profile = _profile.get()
+    if profile is not None:
+        profile.append((step, seconds))
+
+
+def server_timing(profile: List[Tuple[str, float]], total: float) -> bytes:
+    """Formats a profile as a Server-Timing header value; repeated steps are summed."""
+    steps: Dict[str, List[float]] = {}
+    for step, seconds in profile:
+        entry = steps.setdefault(step, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    parts = [f"{step};dur={entry[0] * 1000:.3f}" + (f';desc="{entry[1]} calls"' if entry[1] > 1 else "")
+             for step, entry in steps.items()]
+    parts.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(parts).encode()
+
+
+# --- Shared metrics ---
+cache_lookups = Counter("webfire_cache_lookups_total", "Cache lookups by cache and result (hit or miss).",
+                        ("cache", "result"))
+
+
+# --- HTTP ---
+http_requests = Counter("webfire_http_requests_total", "HTTP requests by route and status.",
+                        ("method", "route", "status"))
+http_duration = Histogram("webfire_http_request_duration_seconds",
+                          "Time from request start to the end of the response, by route.", ("method", "route"))
+_in_flight = 0
+Gauge("webfire_http_requests_in_flight", "HTTP requests being handled.", lambda: _in_flight)
+
+
+class MetricsMiddleware:
+    """Times requests by route template and answers profiling requests (pure ASGI)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _in_flight
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        profile = reset = None
+        for name, _ in scope["headers"]:
+            if name == PROFILE_HEADER:
+                profile = []
+                reset = _profile.set(profile)
+                break
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if profile is not None:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing(profile, time.perf_counter() - started)))
+                    message = dict(message, headers=headers)
+            await send(message)
+
+        _in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _in_flight -= 1
+            if reset is not None:
+                _profile.reset(reset)
+            route = scope.get("route")
+            # Unmatched paths are lumped together, so scanners cannot create series.
+            path = getattr(route, "path", None) or "unmatched"
+            http_duration.observe(time.perf_counter() - started, scope["method"], path)
+            http_requests.inc(scope["method"], path, str(status_code))
@@ -0,0 +1,326 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Single-writer queue for firewall mutations.
+
+Every change made through the API (add, delete, batch, enable, disable) is
+submitted here and executed strictly in submission order, one at a time. A
+file lock extends the ordering to other worker processes on the same host.
+
+Adds and deletes that queue up within `MUTATION_WINDOW` of each other are
+merged into one `apply_rule_batch` transaction, so a burst of changes costs
+one ufw reload instead of one per change. An operation the batch rejects
+(e.g. a delete of a rule that no longer exists) fails on its own; the others
+are applied without it.
+
+Delete requests may name the listing the client saw (its ETag). The rule ID
+is then mapped from that listing to the current one; if the rule can no
+longer be identified the delete is rejected as a conflict instead of
+removing whichever rule now has that number.
+"""
+import asyncio
+import collections
+import contextvars
+import fcntl
+import os
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from metrics import Gauge, add_timing
+from ufw_service import (
+    Rule,
+    RuleBatch,
+    add_ufw_rule,
+    apply_rule_batch,
+    delete_ufw_rule,
+    disable_ufw,
+    enable_ufw,
+    get_rules_snapshot,
+    get_snapshot_data,
+    validate_rule,
+)
+
+# Seconds to wait for more adds/deletes before applying the first one.
+MUTATION_WINDOW = float(os.getenv("WEBFIRE_MUTATION_WINDOW_MS", "20")) / 1000
+# Serializes mutations across uvicorn worker processes.
+MUTATION_LOCK_FILE = os.getenv(
+    "WEBFIRE_MUTATION_LOCK", os.path.join(tempfile.gettempdir(), "webfire-mutations.lock"))
+# Number of recent operations kept for wait-time statistics.
+STATS_WINDOW = 1000
+
+_MERGEABLE = ("add", "delete")
+
+
+class _Operation:
+    __slots__ = ("kind", "payload", "etag", "label", "future", "enqueued_at", "started_at")
+
+    def __init__(self, kind: str, payload=None, etag: Optional[str] = None, label: Optional[str] = None):
+        self.kind = kind
+        self.payload = payload
+        self.etag = etag
+        self.label = label or kind
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+
+
+def _rule_identity(rule: dict) -> tuple:
+    return (rule["to"], rule["action"], rule["direction"], rule["from"])
+
+
+class MutationQueue:
+    def __init__(self, window: float = MUTATION_WINDOW, lock_file: Optional[str] = MUTATION_LOCK_FILE):
+        self.window = window
+        self.lock_file = lock_file
+        self._pending: "collections.deque[_Operation]" = collections.deque()
+        self._drainer: Optional[asyncio.Task] = None
+        self._in_flight = 0
+        self._processed = 0
+        self._transactions = 0
+        self._waits: "collections.deque[float]" = collections.deque(maxlen=STATS_WINDOW)
+        # Called without arguments after every transaction, e.g. to push events.
+        self.listeners: List[Callable[[], None]] = []
+        # Awaited under the lock as hook("before" | "after", label) around every
+        # transaction, e.g. to record the rule files. Must not raise.
+        self.hooks: List[Callable[[str, str], Awaitable[None]]] = []
+
+    # --- Submission ---
+    async def add(self, rule: Rule) -> dict:
+        return await self._submit(_Operation("add", rule))
+
+    async def delete(self, rule_id: int, etag: Optional[str] = None) -> dict:
+        """
+        Deletes a rule by ID.
+
+        Args:
+            rule_id (int): The rule ID as listed to the client.
+            etag (str, optional): ETag of the listing the ID was taken from.
+
+        Returns:
+            dict: The operation result; status "conflict" if the ID is stale.
+        """
+        return await self._submit(_Operation("delete", rule_id, etag))
+
+    async def batch(self, batch: RuleBatch) -> dict:
+        return await self._submit(_Operation("batch", batch))
+
+    async def enable(self) -> dict:
+        return await self._submit(_Operation("enable"))
+
+    async def disable(self) -> dict:
+        return await self._submit(_Operation("disable"))
+
+    async def run(self, function: Callable[[], Awaitable[dict]], label: str = "call") -> dict:
+        """
+        Runs a coroutine function in queue order, e.g. an edit of other ufw files.
+
+        Args:
+            function (callable): Called without arguments; its result is returned.
+            label (str): Name of the operation passed to `hooks`.
+
+        Returns:
+            dict: The function's result.
+        """
+        return await self._submit(_Operation("call", function, label=label))
+
+    async def _submit(self, operation: _Operation) -> dict:
+        self._pending.append(operation)
+        loop = asyncio.get_running_loop()
+        if self._drainer is None or self._drainer.done() or self._drainer.get_loop() is not loop:
+            # A fresh context: the drainer serves every caller, so what it
+            # does must not show up in the profile of the one that started it.
+            self._drainer = loop.create_task(self._drain(), context=contextvars.Context())
+        # The drainer owns the operation; a caller going away must not abort
+        # a change that may already be half-way through ufw.
+        try:
+            return await asyncio.shield(operation.future)
+        finally:
+            if operation.started_at is not None:
+                add_timing("mutation-queue", operation.started_at - operation.enqueued_at)
+                add_timing("mutation", time.monotonic() - operation.started_at)
+
+    # --- Statistics ---
+    def stats(self) -> dict:
+        """
+        Returns queue depth and per-operation wait times.
+
+        Wait time is the delay between submission and the start of execution,
+        over the last `STATS_WINDOW` operations, in milliseconds.
+        """
+        waits = sorted(self._waits)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 3) if waits else 0.0
+
+        return {
+            "depth": len(self._pending),
+            "in_flight": self._in_flight,
+            "processed": self._processed,
+            "transactions": self._transactions,
+            "wait_ms": {
+                "avg": round(sum(waits) / len(waits) * 1000, 3) if waits else 0.0,
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": round(waits[-1] * 1000, 3) if waits else 0.0,
+            },
+        }
+
+    # --- Execution ---
+    async def _drain(self):
+        while self._pending:
+            if self._pending[0].kind in _MERGEABLE and self.window > 0:
+                await asyncio.sleep(self.window)
+            group = [self._pending.popleft()]
+            if group[0].kind in _MERGEABLE:
+                while self._pending and self._pending[0].kind in _MERGEABLE:
+                    group.append(self._pending.popleft())
+
+            started = time.monotonic()
+            self._waits.extend(started - op.enqueued_at for op in group)
+            for op in group:
+                op.started_at = started
+            self._in_flight = len(group)
+            # Callers are answered once the "after" hooks have run, so what
+            # they read next (e.g. the history) includes their change.
+            results: Dict[_Operation, dict] = {}
+            try:
+                label = "+".join(sorted({op.label for op in group}))
+                async with _ProcessLock(self.lock_file):
+                    for hook in self.hooks:
+                        await hook("before", label)
+                    try:
+                        await self._execute(group, results)
+                    finally:
+                        for hook in self.hooks:
+                            await hook("after", label)
+            except Exception as e:
+                for op in group:
+                    if op not in results:
+                        op.future.set_exception(e)
+            finally:
+                for op, result in results.items():
+                    op.future.set_result(result)
+                self._in_flight = 0
+                self._processed += len(group)
+                self._transactions += 1
+                for listener in self.listeners:
+                    listener()
+
+    async def _execute(self, group: List[_Operation], results: Dict[_Operation, dict]):
+        """Applies a group, storing the result of each operation in `results` as soon as it is known."""
+        kind = group[0].kind
+        if kind == "batch":
+            results[group[0]] = await apply_rule_batch(group[0].payload)
+            return
+        if kind == "enable":
+            results[group[0]] = await enable_ufw()
+            return
+        if kind == "disable":
+            results[group[0]] = await disable_ufw()
+            return
+        if kind == "call":
+            results[group[0]] = await group[0].payload()
+            return
+
+        deletes = [op for op in group if op.kind == "delete"]
+        delete_ids = await self._resolve_deletes(deletes, results)
+        adds = [op for op in group if op.kind == "add"]
+        # Rules only the ufw CLI understands (e.g. service names as ports)
+        # cannot go through the rule-file batch; run them on their own.
+        cli_adds = [op for op in adds if validate_rule(op.payload) is not None]
+        adds = [op for op in adds if op not in cli_adds]
+        deletes = [op for op in deletes if op in delete_ids]
+
+        if len(adds) + len(deletes) == 1:
+            op = (adds or deletes)[0]
+            if op.kind == "add":
+                results[op] = await add_ufw_rule(op.payload)
+            else:
+                results[op] = await delete_ufw_rule(delete_ids[op])
+        elif adds or deletes:
+            ops = adds + deletes
+            while True:
+                batch = RuleBatch(add=[op.payload for op in ops if op.kind == "add"],
+                                  delete=[delete_ids[op] for op in ops if op.kind == "delete"])
+                result = await apply_rule_batch(batch)
+                rejected = [(op, item) for op, item in zip(ops, result["results"]) if item["status"] == "error"]
+                if result["status"] != "error" or not rejected or len(rejected) == len(ops):
+                    break
+                # Validation rejects the whole batch for one bad item, e.g. a
+                # delete of a rule that is already gone. Only that caller
+                # fails; the rest of the group is applied without it.
+                for op, item in rejected:
+                    results[op] = {"status": "error", "message": item["message"]}
+                ops = [op for op in ops if op not in results]
+            for op, item in zip(ops, result["results"]):
+                status = item["status"]
+                message = item["message"]
+                if status in ("not_applied", "rolled_back"):
+                    status, message = "error", result["message"]
+                results[op] = {"status": "error" if status == "error" else "success", "message": message}
+        for op in cli_adds:
+            results[op] = await add_ufw_rule(op.payload)
+
+    async def _resolve_deletes(self, deletes: List[_Operation], results: Dict[_Operation, dict]) -> dict:
+        """Maps delete operations to current rule IDs, failing stale ones with a conflict."""
+        if not deletes:
+            return {}
+        resolved = {}
+        snapshot = None
+        if any(op.etag for op in deletes):
+            snapshot = await get_rules_snapshot()
+        for op in deletes:
+            rule_id = op.payload
+            if op.etag and op.etag != snapshot.etag:
+                rule_id = self._translate_id(op.payload, op.etag, snapshot)
+                if rule_id is None:
+                    results[op] = {
+                        "status": "conflict",
+                        "message": f"Rule {op.payload} changed since it was listed; reload the rules",
+                    }
+                    continue
+            if rule_id in resolved.values():
+                results[op] = {"status": "conflict", "message": f"Rule {op.payload} is already being deleted"}
+                continue
+            resolved[op] = rule_id
+        return resolved
+
+    @staticmethod
+    def _translate_id(rule_id: int, etag: str, snapshot) -> Optional[int]:
+        seen = get_snapshot_data(etag)
+        if seen is None or snapshot.etag is None:
+            return None
+        wanted = [_rule_identity(r) for r in seen["rules"] if r["id"] == rule_id]
+        if not wanted:
+            return None
+        matches = [r["id"] for r in snapshot.data["rules"] if _rule_identity(r) == wanted[0]]
+        return matches[0] if len(matches) == 1 else None
+
+
+class _ProcessLock:
+    """Exclusive flock on `path`; a no-op when `path` is None."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.fd = None
+
+    async def __aenter__(self):
+        if self.path:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                await asyncio.to_thread(fcntl.flock, self.fd, fcntl.LOCK_EX)
+            except BaseException:
+                os.close(self.fd)
+                raise
+        return self
+
+    async def __aexit__(self, *exc):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+
+mutation_queue = MutationQueue()
+Gauge("webfire_mutation_queue_depth", "Mutations waiting in the queue.", lambda: len(mutation_queue._pending))
+Gauge("webfire_mutations_in_flight", "Mutations being applied (a merged batch counts each).",
+      lambda: mutation_queue._in_flight)
@@ -0,0 +1,366 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Shadowing, redundancy and conflict analysis of the UFW rule list.
+
+ufw evaluates rules in order and the first match wins, so a rule whose
+traffic is entirely matched by an earlier rule never takes effect:
+
+- redundant: an earlier rule with the same action covers it,
+- shadowed: an earlier rule with a different action covers it,
+- conflict: an earlier rule that accepts where this one blocks (or the
+  other way round) matches part of its traffic, for the same or a wider set
+  of sources. (An earlier rule for a narrower source set is the usual
+  "exception first" pattern and is not reported.)
+
+Rules are compiled from the listing (`get_ufw_rules`) into `RuleMatch`
+objects and analysed in one ordered pass. Earlier rules of the same family
+and direction are indexed by source prefix and, under each prefix, by
+destination port (exact ports plus 256-port buckets for ranges); only the
+candidates found there are checked exactly. Application profiles are
+compared by name only, since their ports are not part of the listing.
+"""
+import asyncio
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from typing import List, NamedTuple, Optional, Tuple
+
+from rule_model import Ports, parse_location
+from ufw_service import Rule, RuleSnapshot, format_rule_tuple, rule_to_tuples, validate_rule
+
+# Related rule IDs reported per finding; "more" is set when there are others.
+MAX_RELATED = 10
+
+_ANY_V4 = (0, 2 ** 32 - 1)
+_ANY_V6 = (0, 2 ** 128 - 1)
+_ACCEPT = ("ALLOW", "LIMIT")
+_BUCKET_SHIFT = 8
+
+
+class RuleMatch(NamedTuple):
+    """The traffic a listed rule matches. `None` ports/interfaces mean any.
+
+    Addresses are (first, last) integer ranges of the rule's network.
+    """
+    id: int
+    action: str       # ALLOW | DENY | REJECT | LIMIT
+    direction: str    # in | out | fwd
+    v6: bool
+    protocol: str     # any | tcp | udp | ...
+    dst: Tuple[int, int]
+    dports: Ports     # ranges, or an application profile name
+    iface_in: Optional[str]
+    src: Tuple[int, int]
+    src_prefixlen: int
+    sports: Ports
+    iface_out: Optional[str]
+
+
+def parse_listing_rule(rule: dict) -> Optional[RuleMatch]:
+    """
+    Compiles a listed rule into a RuleMatch.
+
+    Args:
+        rule (dict): A rule as returned by `get_ufw_rules`.
+
+    Returns:
+        RuleMatch | None: None if the rule cannot be interpreted.
+    """
+    action = rule["action"].upper()
+    direction = rule.get("direction", "").lower()
+    if action.endswith(" FWD"):
+        action, direction = action[:-len(" FWD")], "fwd"
+    if direction not in ("in", "out", "fwd"):
+        return None
+    dst_v6, dst, dports, dproto, iface_in = parse_location(rule["to"])
+    src_v6, src, sports, sproto, iface_out = parse_location(rule["from"])
+    v6 = dst_v6 or src_v6
+    if any(address is not None and (address.version == 6) != v6 for address in (dst, src)):
+        return None
+    any_address = _ANY_V6 if v6 else _ANY_V4
+    dst_range = (int(dst.network_address), int(dst.broadcast_address)) if dst else any_address
+    src_range = (int(src.network_address), int(src.broadcast_address)) if src else any_address
+    return RuleMatch(rule["id"], action, direction, v6, dproto or sproto or "any",
+                     dst_range, dports, iface_in, src_range, src.prefixlen if src else 0, sports, iface_out)
+
+
+def _ports_cover(outer: Ports, inner: Ports) -> bool:
+    if outer is None:
+        return True
+    if inner is None:
+        return False
+    if isinstance(outer, str) or isinstance(inner, str):
+        return outer == inner
+    return all(any(low <= i_low and i_high <= high for low, high in outer) for i_low, i_high in inner)
+
+
+def _ports_overlap(a: Ports, b: Ports) -> bool:
+    if a is None or b is None:
+        return True
+    if isinstance(a, str) or isinstance(b, str):
+        return a == b
+    return any(a_low <= b_high and b_low <= a_high for a_low, a_high in a for b_low, b_high in b)
+
+
+def covers(outer: RuleMatch, inner: RuleMatch) -> bool:
+    """True if every packet matched by `inner` is also matched by `outer`."""
+    return (
+        (outer.protocol == "any" or outer.protocol == inner.protocol)
+        and (outer.iface_in is None or outer.iface_in == inner.iface_in)
+        and (outer.iface_out is None or outer.iface_out == inner.iface_out)
+        and outer.src[0] <= inner.src[0] and inner.src[1] <= outer.src[1]
+        and outer.dst[0] <= inner.dst[0] and inner.dst[1] <= outer.dst[1]
+        and _ports_cover(outer.dports, inner.dports)
+        and _ports_cover(outer.sports, inner.sports)
+    )
+
+
+def overlaps(a: RuleMatch, b: RuleMatch) -> bool:
+    """True if some packet is matched by both rules."""
+    return (
+        (a.protocol == "any" or b.protocol == "any" or a.protocol == b.protocol)
+        and (a.iface_in is None or b.iface_in is None or a.iface_in == b.iface_in)
+        and (a.iface_out is None or b.iface_out is None or a.iface_out == b.iface_out)
+        and a.src[0] <= b.src[1] and b.src[0] <= a.src[1]
+        and a.dst[0] <= b.dst[1] and b.dst[0] <= a.dst[1]
+        and _ports_overlap(a.dports, b.dports)
+        and _ports_overlap(a.sports, b.sports)
+    )
+
+
+class _PortIndex:
+    """Positions of rules by destination port: exact ports, 256-port buckets for ranges, any, apps."""
+
+    def __init__(self):
+        self.exact = {}           # port -> positions
+        self.exact_keys = []      # sorted ports in `exact`
+        self.buckets = defaultdict(list)
+        self.any_port: List[int] = []
+        self.apps = defaultdict(list)
+
+    def add(self, ports: Ports, position: int):
+        if ports is None:
+            self.any_port.append(position)
+        elif isinstance(ports, str):
+            self.apps[ports].append(position)
+        elif len(ports) == 1 and ports[0][0] == ports[0][1]:
+            port = ports[0][0]
+            if port not in self.exact:
+                self.exact[port] = []
+                insort(self.exact_keys, port)
+            self.exact[port].append(position)
+        else:
+            for bucket in _buckets(ports):
+                self.buckets[bucket].append(position)
+
+    def lookup(self, ports: Ports, lists: list, covering: bool = False):
+        """
+        Appends position lists to `lists`: those that may overlap `ports`, or
+        with `covering` only those whose ports may contain all of `ports`.
+        """
+        lists.append(self.any_port)
+        if covering:
+            if isinstance(ports, str):
+                lists.append(self.apps.get(ports, ()))
+            elif ports is not None:
+                low = ports[0][0]
+                lists.append(self.buckets.get(low >> _BUCKET_SHIFT, ()))
+                if len(ports) == 1 and ports[0][1] == low:
+                    lists.append(self.exact.get(low, ()))
+        elif ports is None:
+            lists.extend(self.exact.values())
+            lists.extend(self.buckets.values())
+            lists.extend(self.apps.values())
+        elif isinstance(ports, str):
+            if ports in self.apps:
+                lists.append(self.apps[ports])
+        else:
+            if self.buckets:
+                lists.extend(self.buckets[b] for b in _buckets(ports) if b in self.buckets)
+            keys = self.exact_keys
+            for low, high in ports:
+                for i in range(bisect_left(keys, low), bisect_right(keys, high)):
+                    lists.append(self.exact[keys[i]])
+
+
+def _buckets(ranges):
+    buckets = set()
+    for low, high in ranges:
+        buckets.update(range(low >> _BUCKET_SHIFT, (high >> _BUCKET_SHIFT) + 1))
+    return buckets
+
+
+class FamilyIndex:
+    """Rules of one (family, direction) seen so far, by source prefix and then port.
+
+    Every relation reported for a rule involves an earlier rule whose sources
+    contain its own, so the candidates are the port matches under each
+    supernet of the rule's source: at most one lookup per prefix length in use.
+    """
+
+    def __init__(self, bits: int):
+        self.bits = bits
+        self.rules: List[RuleMatch] = []
+        self.nodes = {}  # (prefixlen, network) -> _PortIndex
+        self.lengths = []  # sorted prefix lengths in use
+
+    def add(self, match: RuleMatch):
+        position = len(self.rules)
+        self.rules.append(match)
+        key = (match.src_prefixlen, match.src[0])
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = _PortIndex()
+            if key[0] not in self.lengths:
+                insort(self.lengths, key[0])
+        node.add(match.dports, position)
+
+    def candidates(self, match: RuleMatch, covering: bool = False) -> List[List[int]]:
+        """
+        Lists of positions of earlier rules whose sources contain those of
+        `match` and which may overlap it (or with `covering`, contain it).
+        """
+        network = match.src[0]
+        lists = []
+        for length in self.lengths:
+            if length > match.src_prefixlen:
+                break
+            mask = ((1 << length) - 1) << (self.bits - length)
+            node = self.nodes.get((length, network & mask))
+            if node is not None:
+                node.lookup(match.dports, lists, covering)
+        return lists
+
+
+def _finding(match: RuleMatch, kind: str, related: List[RuleMatch], more: bool = False) -> dict:
+    first = related[0]
+    if kind == "redundant":
+        message = f"Rule {match.id} is redundant: rule {first.id} already {first.action.lower()}s this traffic"
+    elif kind == "shadowed":
+        message = f"Rule {match.id} never matches: rule {first.id} ({first.action}) takes all of its traffic first"
+    else:
+        ids = ", ".join(str(r.id) for r in related[:3]) + (", ..." if len(related) > 3 or more else "")
+        message = f"Rule {match.id} ({match.action}) is overridden for part of its traffic by rule(s) {ids}"
+    return {
+        "id": match.id,
+        "kind": kind,
+        "related": [r.id for r in related],
+        "more": more,
+        "message": message,
+    }
+
+
+def _analyze_one(index: FamilyIndex, match: RuleMatch) -> Optional[dict]:
+    rules = index.rules
+    covering = [position for positions in index.candidates(match, covering=True) for position in positions
+                if covers(rules[position], match)]
+    if covering:
+        # The first covering rule decides what happens to the traffic.
+        earlier = rules[min(covering)]
+        return _finding(match, "redundant" if earlier.action == match.action else "shadowed", [earlier])
+
+    # Candidates' sources contain ours (see `FamilyIndex`). A rule can
+    # conflict with thousands of earlier ones (a late "deny from"), so the
+    # scan stops once MAX_RELATED of them are known.
+    accept = match.action in _ACCEPT
+    conflicting = set()
+    for positions in index.candidates(match):
+        for position in positions:
+            earlier = rules[position]
+            if (earlier.action in _ACCEPT) != accept and overlaps(earlier, match):
+                conflicting.add(position)
+                if len(conflicting) > MAX_RELATED:
+                    break
+        else:
+            continue
+        break
+    if conflicting:
+        related = [rules[position] for position in sorted(conflicting)]
+        return _finding(match, "conflict", related[:MAX_RELATED], more=len(related) > MAX_RELATED)
+    return None
+
+
+def _analyze(matches: List[RuleMatch], report_from: int = 0) -> List[dict]:
+    families = {}
+    findings = []
+    for i, match in enumerate(matches):
+        key = (match.v6, match.direction)
+        index = families.get(key)
+        if index is None:
+            index = families[key] = FamilyIndex(128 if match.v6 else 32)
+        if i >= report_from:
+            finding = _analyze_one(index, match)
+            if finding:
+                findings.append(finding)
+        index.add(match)
+    return findings
+
+
+def analyze_rules(rules: List[dict]) -> dict:
+    """
+    Reports redundant, shadowed and conflicting rules.
+
+    Args:
+        rules (list): Rules as returned by `get_ufw_rules`, in evaluation order.
+
+    Returns:
+        dict: {"rules": int, "analyzed": int, "counts": {kind: int}, "findings": [...]}
+        where each finding is {"id", "kind", "related", "more", "message"}.
+    """
+    matches = [m for m in map(parse_listing_rule, rules) if m is not None]
+    findings = _analyze(matches)
+    counts = {"redundant": 0, "shadowed": 0, "conflict": 0}
+    for finding in findings:
+        counts[finding["kind"]] += 1
+    return {"rules": len(rules), "analyzed": len(matches), "counts": counts, "findings": findings}
+
+
+def check_new_rule(rule: Rule, rules: List[dict]) -> List[dict]:
+    """
+    Analyses a rule as if it were appended to `rules`.
+
+    Args:
+        rule (Rule): The rule about to be added.
+        rules (list): The current listing.
+
+    Returns:
+        list: Findings for the new rule (one per address family it would
+        create); empty if it would take effect or cannot be checked offline.
+    """
+    if validate_rule(rule) is not None:
+        return []
+    next_id = max((r["id"] for r in rules), default=0) + 1
+    existing = [m for m in map(parse_listing_rule, rules) if m is not None]
+    new = []
+    for tuple_ in rule_to_tuples(rule):
+        match = parse_listing_rule(dict(format_rule_tuple(tuple_), id=next_id))
+        if match is not None:
+            new.append(match)
+    findings = _analyze(existing + new, report_from=len(existing))
+    for finding in findings:
+        finding["id"] = None
+        finding["message"] = finding["message"].replace(f"Rule {next_id}", "The new rule", 1)
+    return findings
+
+
+# Analysis of the last snapshot, by ETag.
+_last_analysis: Tuple[Optional[str], Optional[dict]] = (None, None)
+
+
+async def analyze_snapshot(snapshot: RuleSnapshot) -> dict:
+    """
+    Analyses a rule snapshot in a worker thread, reusing the result while the
+    snapshot's ETag is unchanged.
+
+    Args:
+        snapshot (RuleSnapshot): The snapshot to analyse.
+
+    Returns:
+        dict: As returned by `analyze_rules`.
+    """
+    global _last_analysis
+    etag, result = _last_analysis
+    if etag is not None and etag == snapshot.etag:
+        return result
+    result = await asyncio.to_thread(analyze_rules, snapshot.data.get("rules", []))
+    if snapshot.etag:
+        _last_analysis = (snapshot.etag, result)
+    return result
@@ -0,0 +1,288 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Temporary rules, removed when their lifetime ends.
+
+- A rule added with `ttl` or `expires_at` is recorded under its listing
+  identity: (To, Action, Direction, From) of each line ufw lists for it, as
+  rule IDs shift when other rules come and go. Adding the same rule again
+  with a new lifetime moves its expiry.
+- The schedule is a SQLite table (`EXPIRY_DB`) shared by all worker
+  processes and, per process, a heap of (expiry time, rule) loaded from it.
+- One task per process sleeps until the earliest expiry, or until an earlier
+  one is scheduled; there is no timer per rule and no polling. Rules due
+  within `EXPIRY_BATCH_WINDOW` after the earliest one are waited for and
+  deleted with it in one batch through the mutation queue, i.e. one ufw
+  reload however many rules expire together. No rule is deleted before its
+  time; the earliest of a batch may go up to `EXPIRY_BATCH_WINDOW` late.
+- Scheduled rules that are no longer listed (deleted by other means) are
+  dropped from the schedule: at startup, so that rules which expired while
+  the service was down go first, and whenever rules expire. The table is
+  reread when another process changed it.
+"""
+import asyncio
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import suppress
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import Field
+
+from audit import audit_log, audited
+from metrics import Gauge
+from mutation_queue import mutation_queue
+from ufw_service import (
+    Rule,
+    RuleBatch,
+    apply_rule_batch,
+    format_rule_tuple,
+    get_rules_snapshot,
+    rule_to_tuples,
+)
+
+STATE_DIR = os.getenv("WEBFIRE_STATE_DIR", "/var/lib/webfire")
+EXPIRY_DB = os.getenv("WEBFIRE_EXPIRY_DB", os.path.join(STATE_DIR, "expiry.db"))
+# Rules due this close together are deleted in the same batch, when the last is due.
+EXPIRY_BATCH_WINDOW = 1.0
+# Delay before deleting again after a failed batch.
+EXPIRY_RETRY_DELAY = 30.0
+MAX_TTL = 366 * 86400
+
+Identity = Tuple[str, str, str, str]
+
+
+class ExpiringRule(Rule):
+    ttl: Optional[int] = Field(default=None, ge=1, le=MAX_TTL, description="Delete the rule after this many seconds")
+    expires_at: Optional[float] = Field(default=None, description="Delete the rule at this time (Unix time)")
+
+
+def rule_identities(rule: Rule) -> List[Identity]:
+    """The (to, action, direction, from) of each line ufw lists for a validated rule."""
+    identities = []
+    for rule_tuple in rule_to_tuples(rule):
+        listed = format_rule_tuple(rule_tuple)
+        identity = (listed["to"], listed["action"], listed["direction"], listed["from"])
+        if identity not in identities:
+            identities.append(identity)
+    return identities
+
+
+def _identity(rule: dict) -> Identity:
+    return (rule["to"], rule["action"], rule["direction"], rule["from"])
+
+
+class ExpirySchedule:
+    """Pending expiries: a SQLite table and an in-memory heap ordered by expiry time."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._data_version = -1
+        self._expiry: Dict[str, float] = {}  # key -> expires_at
+        self._lines: Dict[Identity, str] = {}  # listed line -> key
+        self._heap: List[Tuple[float, str]] = []  # may hold outdated entries; checked against `_expiry`
+        self._wake: Optional[asyncio.Event] = None
+        self._not_before = 0.0
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+    # --- Storage ---
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS expiry ("
+                " key TEXT PRIMARY KEY,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._connection = connection
+        return self._connection
+
+    def load(self, force: bool = False):
+        """Reads the table, unless no other connection changed it since the last read."""
+        with self._db_lock:
+            connection = self._connect()
+            data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version and not force:
+                return
+            self._data_version = data_version
+            rows = connection.execute("SELECT key, expires_at FROM expiry").fetchall()
+        self._expiry = dict(rows)
+        self._lines = {tuple(line): key for key in self._expiry for line in json.loads(key)}
+        self._heap = [(expires_at, key) for key, expires_at in rows]
+        heapq.heapify(self._heap)
+
+    def _write(self, put: List[Tuple[str, float]], remove: List[str]):
+        with self._db_lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany("INSERT OR REPLACE INTO expiry VALUES (?, ?)", put)
+                connection.executemany("DELETE FROM expiry WHERE key = ?", [(key,) for key in remove])
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def _forget(self, keys: List[str]):
+        for key in keys:
+            if self._expiry.pop(key, None) is not None:
+                for line in json.loads(key):
+                    self._lines.pop(tuple(line), None)
+
+    # --- Scheduling ---
+    async def schedule(self, identities: List[Identity], expires_at: float):
+        """Records that the rule listed as `identities` expires at `expires_at` (Unix time)."""
+        key = json.dumps(identities)
+        # A rule overlapping an already scheduled one replaces it.
+        replaced = [self._lines[line] for line in identities if line in self._lines and self._lines[line] != key]
+        await asyncio.to_thread(self._write, [(key, expires_at)], replaced)
+        self._forget(replaced)
+        self._expiry[key] = expires_at
+        for line in identities:
+            self._lines[line] = key
+        heapq.heappush(self._heap, (expires_at, key))
+        if self._wake is not None and self._heap[0][1] == key:
+            self._wake.set()
+
+    def expires_at(self, identities: List[Identity]) -> Optional[float]:
+        """When the rule listed as `identities` expires, or None if it is permanent."""
+        key = self._lines.get(identities[0]) if identities else None
+        return self._expiry.get(key) if key is not None else None
+
+    def annotate(self, listing: dict, now: Optional[float] = None) -> dict:
+        """
+        Adds `expires_at` and `expires_in` (seconds) to the temporary rules of a listing.
+
+        The listing is not modified; rules without expiry are shared with it.
+        The schedule is reread first if another worker process changed it.
+        """
+        with suppress(OSError, sqlite3.Error):
+            self.load()
+        if not self._lines:
+            return listing
+        now = time.time() if now is None else now
+        rules = []
+        for rule in listing.get("rules", []):
+            key = self._lines.get(_identity(rule))
+            if key is not None:
+                expires_at = self._expiry[key]
+                rule = dict(rule, expires_at=expires_at, expires_in=max(0, round(expires_at - now)))
+            rules.append(rule)
+        return dict(listing, rules=rules)
+
+    def _next_due(self) -> Optional[float]:
+        heap = self._heap
+        while heap and self._expiry.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def _batch_end(self, due: float) -> float:
+        """The latest expiry within `EXPIRY_BATCH_WINDOW` after `due`."""
+        until = due + EXPIRY_BATCH_WINDOW
+        return max((expires_at for expires_at, key in self._heap
+                    if due <= expires_at <= until and self._expiry.get(key) == expires_at), default=due)
+
+    def _pop_due(self, until: float) -> List[str]:
+        due = []
+        heap = self._heap
+        while heap and heap[0][0] <= until:
+            expires_at, key = heapq.heappop(heap)
+            if self._expiry.get(key) == expires_at:
+                due.append(key)
+        return due
+
+    # --- Expiry ---
+    async def _delete(self, keys: List[str]) -> dict:
+        """
+        Deletes the listed lines of the given rules in one batch; runs in the mutation queue.
+
+        Returns:
+            dict: {"status", "message", "removed": [the deleted lines as they were listed]}
+        """
+        snapshot = await get_rules_snapshot()
+        if snapshot.data["status"] == "error":
+            return {"status": "error", "message": snapshot.data.get("message") or "Rules unavailable"}
+        listed = {_identity(rule): rule for rule in snapshot.data.get("rules", [])}
+        removed = {}
+        for key in keys:
+            for line in json.loads(key):
+                rule = listed.get(tuple(line))
+                if rule is not None:
+                    removed[rule["id"]] = {name: rule[name] for name in ("id", "to", "action", "direction", "from")}
+        ids = sorted(removed)
+        if ids:
+            result = await apply_rule_batch(RuleBatch(delete=ids))
+            if result["status"] != "success":
+                return result
+        return {"status": "success", "message": f"{len(ids)} expired rule(s) deleted",
+                "removed": [removed[rule_id] for rule_id in ids]}
+
+    async def expire_due(self, now: Optional[float] = None) -> dict:
+        """Deletes every rule due by `now` in one batch."""
+        now = time.time() if now is None else now
+        await asyncio.to_thread(self.load)
+        keys = self._pop_due(now)
+        if not keys:
+            return {"status": "success", "message": "Nothing to expire"}
+        expires = {key: self._expiry[key] for key in keys}
+        request = {"task": "expire", "body": {"rules": [json.loads(key) for key in keys]}}
+        result = None
+        try:
+            result = await audited(audit_log, "system:expiry", "expire", request,
+                                   mutation_queue.run(lambda: self._delete(keys), label="expire"),
+                                   lambda result: {"added": [], "removed": result["removed"]},
+                                   changed=lambda result: bool(result["removed"]))
+        finally:
+            # Failed or raised: the rules stay due and are retried.
+            if result is None or result["status"] != "success":
+                for key, expires_at in expires.items():
+                    heapq.heappush(self._heap, (expires_at, key))
+        if result["status"] != "success":
+            return result
+        await asyncio.to_thread(self._write, [], keys)
+        self._forget(keys)
+        return result
+
+    async def reconcile(self):
+        """Drops scheduled rules that are no longer listed."""
+        snapshot = await get_rules_snapshot()
+        if snapshot.data["status"] == "error":
+            return
+        listed = {_identity(rule) for rule in snapshot.data.get("rules", [])}
+        gone = [key for key in self._expiry if not any(tuple(line) in listed for line in json.loads(key))]
+        if gone:
+            await asyncio.to_thread(self._write, [], gone)
+            self._forget(gone)
+
+    async def run(self):
+        """Background task: deletes rules as they expire."""
+        self._wake = asyncio.Event()
+        await asyncio.to_thread(self.load, True)
+        await self.reconcile()
+        while True:
+            self._wake.clear()
+            now = time.time()
+            due = self._next_due()
+            if due is not None:
+                due = max(self._batch_end(due), self._not_before)
+            if due is None or due > now:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), None if due is None else due - now)
+                continue
+            try:
+                result = await self.expire_due(now)
+            except Exception as e:  # keep the task alive; the rules are retried
+                result = {"status": "error", "message": str(e)}
+            self._not_before = time.time() + EXPIRY_RETRY_DELAY if result["status"] != "success" else 0.0
+
+
+expiry_schedule = ExpirySchedule(EXPIRY_DB)
+Gauge("webfire_rules_expiring", "Temporary rules waiting for their expiry.", lambda: len(expiry_schedule))
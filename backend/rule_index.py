@@ -0,0 +1,181 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Query index over a rule snapshot for filtered, paginated listings.
+
+`RuleIndex` is built once per snapshot (see `get_rule_index`) and answers
+`GET /api/rules` filters without scanning the whole list:
+
+- action / direction: position lists per value,
+- port: exact ports plus a list of port ranges,
+- cidr_contains: explicit source/destination networks keyed by prefix, so a
+  lookup is one dict probe per prefix length in use,
+- q: trigram postings over the lowercased fields, verified by substring
+  match (queries shorter than three characters scan the text column).
+
+Results are intersected smallest-first and returned in rule order. Paging is
+keyset-based: the cursor is the last rule ID of the previous page.
+"""
+import asyncio
+import ipaddress
+from bisect import bisect_right
+from collections import defaultdict
+from typing import List, NamedTuple, Optional, Tuple
+
+from rule_analysis import parse_listing_rule
+from ufw_service import RuleSnapshot
+
+
+class RuleQuery(NamedTuple):
+    action: Optional[str] = None
+    direction: Optional[str] = None
+    port: Optional[int] = None
+    cidr_contains: Optional[str] = None
+    q: Optional[str] = None
+
+    def is_empty(self) -> bool:
+        return not any(value is not None and value != "" for value in self)
+
+
+def _trigrams(text: str):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _intersect(lists: List[List[int]]) -> List[int]:
+    lists = sorted(lists, key=len)
+    result = lists[0]
+    for other in lists[1:]:
+        members = set(other)
+        result = [position for position in result if position in members]
+    return result
+
+
+class RuleIndex:
+    """Secondary indexes over one rule listing."""
+
+    def __init__(self, rules: List[dict]):
+        self.rules = rules
+        self.ids = [rule["id"] for rule in rules]
+        self.by_action = defaultdict(list)
+        self.by_direction = defaultdict(list)
+        self.exact_ports = defaultdict(list)
+        self.port_ranges: List[Tuple[int, int, int]] = []
+        self.networks = defaultdict(list)  # (version, prefixlen, network) -> positions
+        self.prefix_lengths = defaultdict(set)
+        self.text: List[str] = []
+        self.trigrams = defaultdict(list)
+        for position, rule in enumerate(rules):
+            self._add(position, rule)
+
+    def _add(self, position: int, rule: dict):
+        action, _, fwd = rule["action"].partition(" ")
+        self.by_action[action.upper()].append(position)
+        direction = "FWD" if fwd == "FWD" else rule.get("direction", "").upper()
+        self.by_direction[direction].append(position)
+
+        match = parse_listing_rule(rule)
+        if match is not None:
+            if isinstance(match.dports, tuple):
+                for low, high in match.dports:
+                    if low == high:
+                        self.exact_ports[low].append(position)
+                    else:
+                        self.port_ranges.append((low, high, position))
+            version = 6 if match.v6 else 4
+            bits = 128 if match.v6 else 32
+            for first, last in {match.src, match.dst}:
+                prefixlen = bits - (last - first + 1).bit_length() + 1
+                if prefixlen == 0:
+                    continue  # "Anywhere" is not an explicit network
+                key = (version, prefixlen, first)
+                if not self.networks[key] or self.networks[key][-1] != position:
+                    self.networks[key].append(position)
+                self.prefix_lengths[version].add(prefixlen)
+
+        # Fields are searched separately, as the rules table used to do.
+        text = "\0".join(str(value).lower() for value in rule.values())
+        self.text.append(text)
+        for trigram in _trigrams(text):
+            self.trigrams[trigram].append(position)
+
+    # --- Filters; each returns positions in rule order ---
+    def _port(self, port: int) -> List[int]:
+        positions = set(self.exact_ports.get(port, ()))
+        positions.update(p for low, high, p in self.port_ranges if low <= port <= high)
+        return sorted(positions)
+
+    def _cidr(self, value: str) -> List[int]:
+        network = ipaddress.ip_network(value, strict=False)
+        first = int(network.network_address)
+        bits = network.max_prefixlen
+        positions = set()
+        for length in self.prefix_lengths[network.version]:
+            if length <= network.prefixlen:
+                mask = ((1 << length) - 1) << (bits - length)
+                positions.update(self.networks.get((network.version, length, first & mask), ()))
+        return sorted(positions)
+
+    def _text(self, q: str) -> List[int]:
+        q = q.lower()
+        grams = _trigrams(q)
+        if grams:
+            candidates = _intersect([self.trigrams.get(g, []) for g in grams])
+        else:
+            candidates = range(len(self.text))
+        return [position for position in candidates if q in self.text[position]]
+
+    def query(self, query: RuleQuery, limit: Optional[int] = None, after: Optional[int] = None) -> dict:
+        """
+        Filters the listing.
+
+        Args:
+            query (RuleQuery): Filters; all given filters must match.
+            limit (int, optional): Page size; all matches if omitted.
+            after (int, optional): Cursor, the last rule ID of the previous page.
+
+        Returns:
+            dict: {"rules": [...], "total": int, "next_cursor": str | None}
+            where total counts all matches, not just this page.
+
+        Raises:
+            ValueError: If `cidr_contains` is not an address or network.
+        """
+        lists = []
+        if query.action:
+            lists.append(self.by_action.get(query.action.upper(), []))
+        if query.direction:
+            lists.append(self.by_direction.get(query.direction.upper(), []))
+        if query.port is not None:
+            lists.append(self._port(query.port))
+        if query.cidr_contains:
+            lists.append(self._cidr(query.cidr_contains))
+        if query.q:
+            lists.append(self._text(query.q))
+        positions = _intersect(lists) if lists else range(len(self.rules))
+
+        total = len(positions)
+        start = 0
+        if after is not None:
+            # Listings are numbered in order, so positions are sorted by ID too.
+            start = bisect_right(positions, after, key=self.ids.__getitem__)
+        stop = total if limit is None else min(total, start + limit)
+        page = [self.rules[p] for p in positions[start:stop]]
+        next_cursor = str(page[-1]["id"]) if page and stop < total else None
+        return {"rules": page, "total": total, "next_cursor": next_cursor}
+
+
+# Index of the last snapshot, by ETag.
+_last_index: Tuple[Optional[str], Optional[RuleIndex]] = (None, None)
+
+
+async def get_rule_index(snapshot: RuleSnapshot) -> RuleIndex:
+    """
+    Returns the index for a snapshot, building it in a worker thread the first
+    time the snapshot is queried.
+    """
+    global _last_index
+    etag, index = _last_index
+    if etag is not None and etag == snapshot.etag:
+        return index
+    index = await asyncio.to_thread(RuleIndex, snapshot.data.get("rules", []))
+    if snapshot.etag:
+        _last_index = (snapshot.etag, index)
+    return index
@@ -0,0 +1,214 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Typed rule listing: networks, port ranges and IPv4/IPv6 twins.
+
+The JSON listing (`get_ufw_rules`) has one dict per `[ N]` line of
+`ufw status numbered`, so a rule without addresses appears twice: once for
+IPv4 and once, marked "(v6)", for IPv6. Here:
+
+- `ListedRule` is one listed line with its To/From columns parsed:
+  addresses into `ipaddress` networks (None for "Anywhere"), ports into
+  merged (low, high) ranges (None for any port; a str for an application
+  profile), plus protocol and interfaces.
+- `LogicalRule` is a rule as the operator wrote it: the IPv4 line, the IPv6
+  line, or both twins (`group_twins`).
+
+Both use `__slots__` and share their parts: each distinct To/From text is
+parsed once (`parse_location`, cached), so rules with the same destination
+share one network object and one port tuple. The model is built from the
+snapshot's listing (`parse_listing`), whose strings it shares, and kept per
+snapshot (`get_listed_rules`).
+"""
+import asyncio
+import ipaddress
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
+
+from ufw_service import RuleSnapshot
+
+Ports = Union[None, Tuple[Tuple[int, int], ...], str]
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+_PORTS = re.compile(r"^(\d+(?::\d+)?(?:,\d+(?::\d+)?)*)(?:/(\w+))?$")
+
+
+def merge_ranges(ranges) -> Tuple[Tuple[int, int], ...]:
+    """Sorts (low, high) ranges and merges overlapping or adjacent ones."""
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return tuple(merged)
+
+
+@lru_cache(maxsize=65536)
+def _network(text: str) -> Network:
+    return ipaddress.ip_network(text, strict=False)
+
+
+def _port_ranges(text: str) -> Tuple[Tuple[int, int], ...]:
+    if text.isdigit():
+        port = int(text)
+        return ((port, port),)
+    ranges = []
+    for part in text.split(","):
+        low, _, high = part.partition(":")
+        ranges.append((int(low), int(high or low)))
+    return merge_ranges(ranges)
+
+
+@lru_cache(maxsize=65536)
+def parse_location(text: str) -> Tuple[bool, Optional[Network], Ports, Optional[str], Optional[str]]:
+    """Parses a To/From column into (v6, network, ports, protocol, interface)."""
+    v6 = text.endswith(" (v6)")
+    if v6:
+        text = text[:-len(" (v6)")]
+    text, _, interface = text.partition(" on ")
+    address = None
+    ports: Ports = None
+    protocol = None
+    head, _, rest = text.partition(" ")
+    if head.startswith("Anywhere"):
+        _, _, protocol = head.partition("/")
+    elif rest or not _PORTS.match(head):
+        try:
+            address = _network(head)
+        except ValueError:
+            rest = text
+    else:
+        rest = head
+    if rest:
+        m = _PORTS.match(rest)
+        if m:
+            ports = _port_ranges(m.group(1))
+            protocol = m.group(2)
+        else:
+            ports = rest  # application profile
+    if address is not None and address.version == 6:
+        v6 = True
+    return v6, address, ports, protocol or None, interface or None
+
+
+class ListedRule:
+    """One line of the numbered listing, parsed. `None` addresses and ports mean any."""
+
+    __slots__ = ("id", "action", "direction", "to", "from_", "v6", "protocol",
+                 "dst", "dports", "iface_in", "src", "sports", "iface_out")
+
+    def __init__(self, rule_id: int, to: str, action: str, direction: str, from_: str):
+        self.id = rule_id
+        self.to = to
+        self.action = action
+        self.direction = direction
+        self.from_ = from_
+        dst_v6, self.dst, self.dports, dproto, self.iface_in = parse_location(to)
+        src_v6, self.src, self.sports, sproto, self.iface_out = parse_location(from_)
+        self.v6 = dst_v6 or src_v6
+        self.protocol = dproto or sproto or "any"
+
+    @classmethod
+    def from_dict(cls, rule: dict) -> "ListedRule":
+        return cls(rule["id"], rule["to"], rule["action"], rule.get("direction", ""), rule.get("from", ""))
+
+    def to_dict(self) -> dict:
+        """The rule as `get_ufw_rules` lists it."""
+        return {"id": self.id, "to": self.to, "action": self.action, "direction": self.direction,
+                "from": self.from_}
+
+    def twin_key(self) -> Optional[tuple]:
+        """What an IPv4 rule and its IPv6 twin share; None for rules with an address."""
+        if self.dst is not None or self.src is not None:
+            return None
+        return (self.action, self.direction, self.protocol, self.dports, self.sports,
+                self.iface_in, self.iface_out)
+
+    def __repr__(self):
+        return "ListedRule(%d, %r, %r, %r, %r)" % (self.id, self.to, self.action, self.direction, self.from_)
+
+
+class LogicalRule:
+    """A rule as written: its IPv4 line, its IPv6 line, or both."""
+
+    __slots__ = ("v4", "v6")
+
+    def __init__(self, v4: Optional[ListedRule] = None, v6: Optional[ListedRule] = None):
+        self.v4 = v4
+        self.v6 = v6
+
+    @property
+    def lines(self) -> List[ListedRule]:
+        return [line for line in (self.v4, self.v6) if line is not None]
+
+    @property
+    def ids(self) -> List[int]:
+        return [line.id for line in self.lines]
+
+    def to_dict(self) -> dict:
+        """The rule once, with the IDs of its lines and the address families it covers."""
+        first = self.v4 or self.v6
+        to, from_ = first.to, first.from_
+        if self.v4 is None:
+            to, from_ = to.removesuffix(" (v6)"), from_.removesuffix(" (v6)")
+        return {"ids": self.ids, "to": to, "action": first.action, "direction": first.direction,
+                "from": from_, "families": ["v4"] * (self.v4 is not None) + ["v6"] * (self.v6 is not None)}
+
+
+def parse_listing(rules: List[dict]) -> List[ListedRule]:
+    """Parses a JSON listing (as returned by `get_ufw_rules`)."""
+    return [ListedRule.from_dict(rule) for rule in rules]
+
+
+def group_twins(rules: List[ListedRule]) -> List[LogicalRule]:
+    """
+    Joins each IPv4 rule without addresses to the IPv6 rule ufw created with it.
+
+    Returns:
+        list: Logical rules in listing order of their first line.
+    """
+    grouped: List[LogicalRule] = []
+    waiting: Dict[tuple, List[LogicalRule]] = {}
+    for rule in rules:
+        key = rule.twin_key()
+        if not rule.v6:
+            logical = LogicalRule(v4=rule)
+            grouped.append(logical)
+            if key is not None:
+                waiting.setdefault(key, []).append(logical)
+            continue
+        candidates = waiting.get(key) if key is not None else None
+        if candidates:
+            candidates.pop(0).v6 = rule
+        else:
+            grouped.append(LogicalRule(v6=rule))
+    return grouped
+
+
+# Parsed listing of the last snapshot: (ETag, rules, logical rules or None until grouped).
+_last_listing: Tuple[Optional[str], Optional[List[ListedRule]], Optional[List[LogicalRule]]] = (None, None, None)
+
+
+async def get_listed_rules(snapshot: RuleSnapshot) -> List[ListedRule]:
+    """Returns the snapshot's rules parsed, parsing them in a worker thread once per snapshot."""
+    global _last_listing
+    etag, rules, _ = _last_listing
+    if etag is not None and etag == snapshot.etag:
+        return rules
+    rules = await asyncio.to_thread(parse_listing, snapshot.data.get("rules", []))
+    if snapshot.etag:
+        _last_listing = (snapshot.etag, rules, None)
+    return rules
+
+
+async def get_logical_rules(snapshot: RuleSnapshot) -> List[LogicalRule]:
+    """Returns the snapshot's rules with IPv4/IPv6 twins grouped, once per snapshot."""
+    global _last_listing
+    rules = await get_listed_rules(snapshot)
+    etag, cached, logical = _last_listing
+    if logical is not None and cached is rules:
+        return logical
+    logical = group_twins(rules)
+    if cached is rules:
+        _last_listing = (etag, rules, logical)
+    return logical
@@ -0,0 +1,259 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Per-rule packet and byte counters from the kernel.
+
+One sample is one `iptables-save -c -t filter` (plus `ip6tables-save` when
+IPv6 is enabled): a single dump per family, whatever the number of rules.
+ufw loads user.rules/user6.rules with iptables-restore, so the
+`ufw-user-input`, `-output` and `-forward` chains hold the files' lines in
+file order. Position k of a chain in the dump is therefore line k of that
+chain in the files, and the files say which rule each line belongs to
+(`rule_file_chains`). The mapping is rebuilt only when a rule file changes.
+
+A rule's counters are the sum of its verdict lines: the lines that accept,
+drop, reject or hand over to the rate limit chains. A limit rule's `--set`
+line and a logging rule's jump to its logging chain see the same packets
+again and are not counted. When a chain in the kernel does not have the
+lines the files list (ufw not reloaded since the files changed, or
+disabled), its rules are left out and the chain is reported.
+
+Samples are kept in a ring buffer of `STATS_SAMPLES`; rates are the
+difference to an earlier sample (the previous one, or the newest one at
+least `window` seconds old). Requests within `STATS_MIN_INTERVAL` of the last
+sample reuse it.
+"""
+import asyncio
+import os
+import re
+import subprocess
+import time
+from array import array
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import ufw_service
+from metrics import add_timing, cache_lookups
+from ufw_service import helper_call, read_user_rules_files, rule_file_chains, run_command_shared
+
+IPTABLES_SAVE = os.getenv("WEBFIRE_IPTABLES_SAVE", "/usr/sbin/iptables-save")
+IP6TABLES_SAVE = os.getenv("WEBFIRE_IP6TABLES_SAVE", "/usr/sbin/ip6tables-save")
+STATS_SAMPLES = int(os.getenv("WEBFIRE_STATS_SAMPLES", "16"))
+STATS_MIN_INTERVAL = 1.0
+
+USER_CHAINS = tuple(prefix + chain for prefix in ("ufw-user-", "ufw6-user-")
+                    for chain in ("input", "output", "forward"))
+_VERDICTS = {"ACCEPT", "DROP", "REJECT", "ufw-user-limit", "ufw-user-limit-accept",
+             "ufw6-user-limit", "ufw6-user-limit-accept"}
+_TARGET = re.compile(r" -j (\S+)")
+_COUNTERS = re.compile(r"^\[(\d+):(\d+)\]", re.MULTILINE)
+
+
+class CounterLayout(NamedTuple):
+    """Which rule each line of the user chains counts for."""
+    stamp: tuple
+    rules: int  # highest rule ID
+    # chain -> rule ID per line in chain order; 0 for lines that are not counted
+    chains: Dict[str, List[int]]
+
+
+class CounterSample(NamedTuple):
+    at: float  # time.monotonic()
+    time: float  # time.time()
+    layout: CounterLayout
+    packets: array  # by rule ID
+    bytes: array
+    out_of_sync: Tuple[str, ...]
+
+
+def build_layout(texts: List[str], stamp: tuple = ()) -> CounterLayout:
+    """Maps the verdict lines of user.rules/user6.rules to rule IDs."""
+    rules = 0
+    chains = {}
+    for chain, lines in rule_file_chains(texts).items():
+        if chain not in USER_CHAINS:
+            continue
+        owners = []
+        for rule_id, line in lines:
+            target = _TARGET.search(line)
+            if not (target and target.group(1) in _VERDICTS):
+                rule_id = 0
+            owners.append(rule_id)
+            rules = max(rules, rule_id)
+        chains[chain] = owners
+    return CounterLayout(stamp, rules, chains)
+
+
+def count_rules(layout: CounterLayout, dumps: List[str]) -> Tuple[array, array, List[str]]:
+    """
+    Adds up the counters of each rule from `iptables-save -c` dumps.
+
+    iptables-save prints the rules of a chain together, so each user chain
+    is one slice of its dump; only those slices are parsed.
+
+    Args:
+        layout (CounterLayout): The mapping for the loaded rule files.
+        dumps (List[str]): The IPv4 dump, then the IPv6 dump.
+
+    Returns:
+        tuple: (packets, bytes, out-of-sync chains); the arrays are indexed by rule ID.
+    """
+    packets = array("Q", bytes(8 * (layout.rules + 1)))
+    nbytes = array("Q", packets)
+    out_of_sync = []
+    for chain, owners in layout.chains.items():
+        family = 1 if chain.startswith("ufw6-") else 0
+        dump = dumps[family] if family < len(dumps) else ""
+        marker = "] -A %s " % chain
+        first = dump.find(marker)
+        if first < 0:
+            out_of_sync.append(chain)
+            continue
+        start = dump.rfind("\n", 0, first) + 1
+        end = dump.find("\n", dump.rfind(marker))
+        if end < 0:
+            end = len(dump)
+        if dump.count(marker, start, end) != len(owners):
+            out_of_sync.append(chain)
+            continue
+        for rule_id, (line_packets, line_bytes) in zip(owners, _COUNTERS.findall(dump, start, end)):
+            if rule_id:
+                packets[rule_id] += int(line_packets)
+                nbytes[rule_id] += int(line_bytes)
+    return packets, nbytes, out_of_sync
+
+
+def _rules_stamp() -> tuple:
+    stamp = []
+    for path in (ufw_service.USER_RULES_FILE, ufw_service.USER6_RULES_FILE):
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+_layout: Optional[CounterLayout] = None
+_samples: Deque[CounterSample] = deque(maxlen=STATS_SAMPLES)
+_lock: Optional[asyncio.Lock] = None
+
+
+async def _get_layout() -> Tuple[CounterLayout, int]:
+    """The layout for the current rule files, and the number of families they enable."""
+    global _layout
+    stamp = _rules_stamp()
+    if _layout is not None and _layout.stamp == stamp:
+        cache_lookups.inc("counter-layout", "hit")
+    else:
+        cache_lookups.inc("counter-layout", "miss")
+        texts = await read_user_rules_files()
+        _layout = await asyncio.to_thread(build_layout, texts, stamp)
+    return _layout, 1 + any(chain.startswith("ufw6-") for chain in _layout.chains)
+
+
+async def _dump(families: int) -> List[str]:
+    """`iptables-save -c -t filter` per family: one helper request or one sudo child per family."""
+    if ufw_service.HELPER_SOCKET:
+        result = await helper_call("counters")
+        return [result["v4"], result["v6"]][:families]
+    # WARNING: This executes system commands with `sudo`.
+    commands = [["sudo", "-n", command, "-c", "-t", "filter"] for command in (IPTABLES_SAVE, IP6TABLES_SAVE)]
+    results = await asyncio.gather(*(run_command_shared(args) for args in commands[:families]),
+                                   return_exceptions=True)
+    dumps = []
+    for i, result in enumerate(results):
+        if isinstance(result, BaseException):
+            if i == 0 or not isinstance(result, (OSError, subprocess.SubprocessError)):
+                raise result
+            result = ufw_service.CommandResult(1, "", "")  # its chains are reported out of sync
+        dumps.append(result.stdout)
+    return dumps
+
+
+async def _take_sample() -> CounterSample:
+    layout, families = await _get_layout()
+    dumps = await _dump(families)
+    started = time.perf_counter()
+    packets, nbytes, out_of_sync = await asyncio.to_thread(count_rules, layout, dumps)
+    add_timing("counters-parse", time.perf_counter() - started)
+    return CounterSample(time.monotonic(), time.time(), layout, packets, nbytes, tuple(out_of_sync))
+
+
+def _rate(now: int, before: int, seconds: float) -> float:
+    # Counters restart from zero when ufw reloads.
+    return round((now - before if now >= before else now) / seconds, 3)
+
+
+def _counted(sample: CounterSample) -> set:
+    """IDs of the rules whose chains were in sync."""
+    counted = set()
+    for chain, owners in sample.layout.chains.items():
+        if chain not in sample.out_of_sync:
+            counted.update(owners)
+    counted.discard(0)
+    return counted
+
+
+def rule_counters(sample: CounterSample, base: Optional[CounterSample]) -> List[dict]:
+    """Counters per rule ID, with rates against `base` when it has the same layout."""
+    seconds = sample.at - base.at if base is not None else 0
+    comparable = _counted(base) if seconds > 0 and base.layout is sample.layout else set()
+    rules = []
+    for rule_id in sorted(_counted(sample)):
+        packets, nbytes = sample.packets[rule_id], sample.bytes[rule_id]
+        entry = {"id": rule_id, "packets": packets, "bytes": nbytes, "packets_per_s": None, "bytes_per_s": None}
+        if rule_id in comparable:
+            entry["packets_per_s"] = _rate(packets, base.packets[rule_id], seconds)
+            entry["bytes_per_s"] = _rate(nbytes, base.bytes[rule_id], seconds)
+        rules.append(entry)
+    return rules
+
+
+def _base(sample: CounterSample, window: float) -> Optional[CounterSample]:
+    """The newest earlier sample at least `window` seconds older, else the oldest one."""
+    earlier = [s for s in _samples if s.at < sample.at]
+    for candidate in reversed(earlier):
+        if sample.at - candidate.at >= window:
+            return candidate
+    return earlier[0] if earlier else None
+
+
+async def collect_rule_stats(window: float = 0.0) -> dict:
+    """
+    Samples the kernel counters of all ufw rules.
+
+    Args:
+        window (float): Compute rates over at least this many seconds, as
+            far as the kept samples reach; 0 compares with the previous sample.
+
+    Returns:
+        dict: {"status", "time", "interval", "rules": [{"id", "packets",
+        "bytes", "packets_per_s", "bytes_per_s"}], "out_of_sync": [chain]},
+        or {"status": "error", "message"}.
+    """
+    global _lock
+    if _lock is None:
+        _lock = asyncio.Lock()
+    async with _lock:
+        sample = _samples[-1] if _samples else None
+        if sample is None or time.monotonic() - sample.at >= STATS_MIN_INTERVAL:
+            cache_lookups.inc("counters", "miss")
+            try:
+                sample = await _take_sample()
+            except FileNotFoundError as e:
+                return {"status": "error", "message": f"{e.filename} not found"}
+            except subprocess.CalledProcessError as e:
+                return {"status": "error", "message": (e.stderr or "").strip() or "Reading counters failed"}
+            except subprocess.TimeoutExpired:
+                return {"status": "error", "message": "Reading counters timed out"}
+            _samples.append(sample)
+        else:
+            cache_lookups.inc("counters", "hit")
+    base = _base(sample, window)
+    comparable = base is not None and base.layout is sample.layout
+    return {
+        "status": "success",
+        "time": sample.time,
+        "interval": round(sample.at - base.at, 3) if comparable else None,
+        "rules": rule_counters(sample, base),
+        "out_of_sync": list(sample.out_of_sync),
+    }
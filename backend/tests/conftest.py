@@ -0,0 +1,16 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+# Keep persistent state (user store, history, ...) out of /var/lib/webfire.
+# Runs before the test modules import the application.
+import atexit
+import os
+import shutil
+import tempfile
+
+_state_dir = tempfile.mkdtemp(prefix="webfire-tests-")
+os.environ["WEBFIRE_STATE_DIR"] = _state_dir
+atexit.register(shutil.rmtree, _state_dir, True)
+
+# Application profiles and service names from fixtures, not the host.
+_apps = os.path.join(os.path.dirname(__file__), "fixtures", "apps")
+os.environ["UFW_APPLICATIONS_DIR"] = os.path.join(_apps, "applications.d")
+os.environ["WEBFIRE_SERVICES_FILE"] = os.path.join(_apps, "services")
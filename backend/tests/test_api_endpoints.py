@@ -1,9 +1,34 @@
 # (C) 2025 by OPNLAB Development. All rights reserved.
+import asyncio
+import json
+import os
+import tempfile
+from unittest.mock import AsyncMock, patch
+
 from fastapi.testclient import TestClient
+from audit import AuditLog
+import exposure
+from exposure import Listener
 from main import app
+from rule_expiry import ExpirySchedule
+from ufw_service import Rule, invalidate_rules_cache
 
 client = TestClient(app)
 
+SNAPSHOT_DATA = {
+    "status": "active",
+    "rules": [{"id": 1, "to": "22/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"}],
+}
+
+
+def _auth_headers():
+    token_response = client.post(
+        "/token",
+        data={"username": "admin", "password": "secret"}
+    )
+    return {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+
+
 def test_health_root():
     response = client.get("/")
     assert response.status_code == 200
@@ -19,6 +44,27 @@ def test_login_for_access_token():
     assert "access_token" in response.json()
     assert response.json()["token_type"] == "bearer"
 
+def test_login_rejects_unknown_user():
+    response = client.post("/token", data={"username": "nobody", "password": "secret"})
+    assert response.status_code == 401
+
+def test_refresh_token():
+    tokens = client.post("/token", data={"username": "admin", "password": "secret"}).json()
+    assert tokens["refresh_token"] and tokens["expires_in"] > 0
+
+    # A refresh token is not an access token.
+    response = client.get("/api/status", headers={"Authorization": f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == 401
+
+    response = client.post("/api/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert response.status_code == 200
+    renewed = response.json()
+    response = client.get("/api/status", headers={"Authorization": f"Bearer {renewed['access_token']}"})
+    assert response.status_code == 200
+
+    response = client.post("/api/token/refresh", json={"refresh_token": tokens["access_token"]})
+    assert response.status_code == 401
+
 def test_get_status_unauthorized():
     response = client.get("/api/status")
     assert response.status_code == 401
@@ -38,3 +84,386 @@ def test_get_status_authorized():
     )
     assert response.status_code == 200
     assert "status" in response.json()
+
+@patch("ufw_service._fetch_ufw_rules", return_value=SNAPSHOT_DATA)
+def test_get_rules_conditional(mock_fetch):
+    invalidate_rules_cache()
+    headers = _auth_headers()
+
+    response = client.get("/api/rules", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["rules"][0]["to"] == "22/tcp"
+    etag = response.headers["etag"]
+
+    cached = client.get("/api/rules", headers={**headers, "If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+
+    status_response = client.get("/api/status", headers={**headers, "If-None-Match": f"W/{etag}"})
+    assert status_response.status_code == 304
+    assert mock_fetch.call_count == 1
+
+
+@patch("ufw_service._fetch_ufw_rules", return_value=SNAPSHOT_DATA)
+def test_get_rules_stale_etag(mock_fetch):
+    invalidate_rules_cache()
+    response = client.get("/api/rules", headers={**_auth_headers(), "If-None-Match": '"stale"'})
+    assert response.status_code == 200
+    assert response.headers["etag"] != '"stale"'
+
+
+@patch("mutation_queue.apply_rule_batch")
+def test_add_rules_batch(mock_apply):
+    mock_apply.return_value = {
+        "status": "success",
+        "message": "Applied 2 changes",
+        "results": [
+            {"index": 0, "op": "add", "status": "success", "message": "Rule added"},
+            {"index": 0, "op": "delete", "status": "success", "message": "Rule deleted"},
+        ],
+    }
+    response = client.post(
+        "/api/rules/batch",
+        json={"add": [{"action": "allow", "port": "443", "protocol": "tcp"}], "delete": [3]},
+        headers=_auth_headers(),
+    )
+    assert response.status_code == 200
+    assert [r["op"] for r in response.json()["results"]] == ["add", "delete"]
+    batch = mock_apply.call_args.args[0]
+    assert batch.add[0].port == "443"
+    assert batch.delete == [3]
+
+
+@patch("main.mutation_queue.delete")
+def test_delete_rule_conflict(mock_delete):
+    mock_delete.return_value = {"status": "conflict", "message": "Rule 3 changed since it was listed; reload the rules"}
+    response = client.delete("/api/rules/3", headers={**_auth_headers(), "If-Match": 'W/"abc"'})
+    assert response.status_code == 409
+    assert "changed" in response.json()["detail"]
+    mock_delete.assert_awaited_once_with(3, '"abc"')
+
+
+@patch("ufw_service._fetch_ufw_rules", return_value={"status": "active", "rules": [
+    {"id": 1, "to": "443/tcp (v6)", "action": "ALLOW", "direction": "IN", "from": "Anywhere (v6)"},
+]})
+@patch("main.mutation_queue.disable")
+@patch("main.mutation_queue.delete")
+@patch("main.mutation_queue.add")
+def test_audit_trail(mock_add, mock_delete, mock_disable, mock_fetch):
+    invalidate_rules_cache()
+    headers = _auth_headers()
+    mock_add.side_effect = [{"status": "success", "message": "Rule added\nSkipping adding existing rule (v6)"},
+                            {"status": "success", "message": "Skipping adding existing rule"}]
+    mock_delete.return_value = {"status": "conflict", "message": "Rule 3 changed since it was listed"}
+    mock_disable.return_value = {"status": "success", "message": "Firewall stopped"}
+    with tempfile.TemporaryDirectory() as directory, patch("main.audit_log", AuditLog(directory)), \
+            patch("main._check_rule", new_callable=AsyncMock, return_value=[]):
+        client.post("/api/rules", json={"action": "allow", "port": "443", "protocol": "tcp"}, headers=headers)
+        client.post("/api/rules", json={"action": "allow", "port": "443", "protocol": "tcp"}, headers=headers)
+        client.delete("/api/rules/3", headers=headers)
+        client.post("/api/disable", headers=headers)
+
+        body = client.get("/api/audit", headers=headers).json()
+        assert [(e["user"], e["action"], e["outcome"]) for e in body["events"]] == [
+            ("admin", "add", "success"), ("admin", "add", "success"), ("admin", "delete", "conflict"),
+            ("admin", "disable", "success")]
+        add = body["events"][0]
+        assert add["request"] == {"method": "POST", "path": "/api/rules",
+                                  "body": {"action": "allow", "port": "443", "protocol": "tcp"}}
+        # Only the line that was not listed yet; nothing for the add ufw skipped.
+        assert add["diff"]["added"] == [{"to": "443/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"}]
+        assert body["events"][1]["diff"]["added"] == []
+        assert body["events"][2]["diff"] is None
+
+        page = client.get("/api/audit", params={"action": "delete", "limit": 1}, headers=headers).json()
+        assert [e["action"] for e in page["events"]] == ["delete"] and page["next_cursor"] is None
+        since = body["events"][2]["time"]
+        response = client.get("/api/audit", params={"format": "jsonl", "since": since}, headers=headers)
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert [json.loads(line)["action"] for line in response.text.splitlines()] == ["delete", "disable"]
+        assert client.get("/api/audit", params={"cursor": "x"}, headers=headers).status_code == 422
+
+
+def test_events_require_token():
+    assert client.get("/api/events").status_code == 401
+    assert client.get("/api/events", params={"token": "not-a-token"}).status_code == 401
+
+
+@patch("ufw_service._fetch_ufw_rules", return_value={"status": "active", "rules": [
+    {"id": 1, "to": "22/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+    {"id": 2, "to": "22/tcp", "action": "DENY", "direction": "IN", "from": "10.0.0.5"},
+]})
+def test_rules_analysis(mock_fetch):
+    invalidate_rules_cache()
+    headers = _auth_headers()
+    response = client.get("/api/rules/analysis", headers=headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["counts"] == {"redundant": 0, "shadowed": 1, "conflict": 0}
+    assert body["findings"][0]["id"] == 2
+    assert body["findings"][0]["related"] == [1]
+
+    check = client.post("/api/rules/check", json={"action": "allow", "port": "22", "protocol": "tcp"},
+                        headers=headers)
+    assert check.json()["findings"][0]["kind"] == "redundant"
+
+
+@patch("main.mutation_queue.add")
+@patch("ufw_service._fetch_ufw_rules", return_value=SNAPSHOT_DATA)
+def test_add_rule_returns_warnings(mock_fetch, mock_add):
+    invalidate_rules_cache()
+    mock_add.return_value = {"status": "success", "message": "Rule added"}
+    response = client.post("/api/rules", json={"action": "deny", "port": "22", "protocol": "tcp"},
+                           headers=_auth_headers())
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "success"
+    assert [w["kind"] for w in body["warnings"]] == ["shadowed"]
+    mock_add.assert_awaited_once()
+
+
+@patch("main.expiry_schedule.schedule", new_callable=AsyncMock)
+@patch("main.mutation_queue.add")
+@patch("ufw_service._fetch_ufw_rules", return_value=SNAPSHOT_DATA)
+def test_add_temporary_rule(mock_fetch, mock_add, mock_schedule):
+    invalidate_rules_cache()
+    headers = _auth_headers()
+    mock_add.return_value = {"status": "success", "message": "Rule added"}
+    with patch("main.time.time", return_value=1000.0):
+        response = client.post("/api/rules", json={"action": "allow", "port": "8443", "protocol": "tcp",
+                                                    "ttl": 3600}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["expires_at"] == 4600.0
+    assert mock_add.call_args.args[0] == Rule(action="allow", port="8443", protocol="tcp")
+    mock_schedule.assert_awaited_once_with(
+        [("8443/tcp", "ALLOW", "IN", "Anywhere"), ("8443/tcp (v6)", "ALLOW", "IN", "Anywhere (v6)")], 4600.0)
+
+    for body, code in (({"action": "allow", "port": "22", "protocol": "tcp", "ttl": 60}, 409),  # permanent rule
+                       ({"action": "allow", "port": "ssh", "ttl": 60}, 422),
+                       ({"action": "allow", "port": "8443", "ttl": 60, "expires_at": 2000}, 422),
+                       ({"action": "allow", "port": "8443", "expires_at": 1}, 422),
+                       ({"action": "allow", "port": "8443", "ttl": 0}, 422)):
+        assert client.post("/api/rules", json=body, headers=headers).status_code == code, body
+    assert mock_add.await_count == 1
+
+
+@patch("ufw_service._fetch_ufw_rules", return_value={"status": "active", "rules": [
+    {"id": 1, "to": "8443/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+    {"id": 2, "to": "22/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+]})
+def test_rules_show_remaining_lifetime(mock_fetch):
+    invalidate_rules_cache()
+    schedule = ExpirySchedule(os.path.join(tempfile.mkdtemp(), "expiry.db"))
+    asyncio.run(schedule.schedule([("8443/tcp", "ALLOW", "IN", "Anywhere")], 1000.0))
+    with patch("main.expiry_schedule", schedule), patch("rule_expiry.time.time", return_value=400.0):
+        rules = client.get("/api/rules", headers=_auth_headers()).json()["rules"]
+    assert (rules[0]["expires_at"], rules[0]["expires_in"]) == (1000.0, 600)
+    assert rules[1]["expires_in"] is None
+
+
+@patch("ufw_service._fetch_ufw_rules", return_value={"status": "active", "rules": [
+    {"id": i, "to": f"{1000 + i}/tcp", "action": "ALLOW" if i % 2 else "DENY", "direction": "IN",
+     "from": "Anywhere"} for i in range(1, 8)
+]})
+def test_get_rules_filtered_pages(mock_fetch):
+    invalidate_rules_cache()
+    headers = _auth_headers()
+    first = client.get("/api/rules", params={"action": "allow", "limit": 3}, headers=headers).json()
+    assert [r["id"] for r in first["rules"]] == [1, 3, 5]
+    assert first["total"] == 4
+    second = client.get("/api/rules", params={"action": "allow", "limit": 3, "cursor": first["next_cursor"]},
+                        headers=headers).json()
+    assert [r["id"] for r in second["rules"]] == [7]
+    assert second["next_cursor"] is None
+
+    assert client.get("/api/rules", params={"port": 1004}, headers=headers).json()["total"] == 1
+    assert client.get("/api/rules", params={"cidr_contains": "x"}, headers=headers).status_code == 422
+    assert client.get("/api/rules", headers=headers).json()["total"] is None
+
+
+@patch("ufw_service._fetch_ufw_rules", return_value={"status": "active", "rules": [
+    {"id": 1, "to": "22/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+    {"id": 2, "to": "Apache Full", "action": "ALLOW", "direction": "IN", "from": "10.0.0.0/8"},
+    {"id": 3, "to": "12345/udp", "action": "DENY", "direction": "IN", "from": "Anywhere"},
+]})
+def test_apps_and_rule_services(mock_fetch):
+    invalidate_rules_cache()
+    headers = _auth_headers()
+    apps = client.get("/api/apps", headers=headers).json()["apps"]
+    assert [app["name"] for app in apps] == ["Apache", "Apache Full", "Apache Secure", "Bind9", "OpenSSH"]
+    assert apps[1]["ports"] == ["80,443/tcp"]
+
+    rules = client.get("/api/rules", headers=headers).json()["rules"]
+    assert [rule["services"] for rule in rules] == [["OpenSSH", "ssh"], ["Apache Full"], []]
+    filtered = client.get("/api/rules", params={"port": 22}, headers=headers).json()["rules"]
+    assert filtered[0]["services"] == ["OpenSSH", "ssh"]
+
+    response = client.post("/api/rules", json={"action": "allow", "app": "Nope"}, headers=headers)
+    assert response.json() == {"status": "error", "message": "Unknown application profile", "warnings": [],
+                               "expires_at": None}
+
+
+@patch("ufw_service._fetch_ufw_rules", return_value={"status": "active", "rules": [
+    {"id": 1, "to": "22/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+    {"id": 2, "to": "443/tcp", "action": "ALLOW", "direction": "IN", "from": "10.0.0.0/8"},
+    {"id": 3, "to": "22/tcp (v6)", "action": "ALLOW", "direction": "IN", "from": "Anywhere (v6)"},
+]})
+def test_grouped_rules(mock_fetch):
+    invalidate_rules_cache()
+    response = client.get("/api/rules/grouped", headers=_auth_headers()).json()
+    assert response["lines"] == 3
+    assert response["rules"] == [
+        {"ids": [1, 3], "to": "22/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere",
+         "families": ["v4", "v6"], "services": ["OpenSSH", "ssh"]},
+        {"ids": [2], "to": "443/tcp", "action": "ALLOW", "direction": "IN", "from": "10.0.0.0/8",
+         "families": ["v4"], "services": ["Apache Full", "Apache Secure", "https"]},
+    ]
+
+
+@patch("main.collect_rule_stats")
+def test_rule_stats(mock_collect):
+    headers = _auth_headers()
+    mock_collect.return_value = {"status": "success", "time": 1700000000.0, "interval": 2.0, "out_of_sync": [],
+                                 "rules": [{"id": 1, "packets": 10, "bytes": 1000, "packets_per_s": 4.0,
+                                            "bytes_per_s": 400.0}]}
+    response = client.get("/api/rules/stats", params={"window": 60}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["rules"][0]["packets_per_s"] == 4.0
+    mock_collect.assert_awaited_with(60)
+
+    mock_collect.return_value = {"status": "error", "message": "sudo not found"}
+    response = client.get("/api/rules/stats", headers=headers)
+    assert response.status_code == 503
+    assert response.json()["detail"] == "sudo not found"
+    assert client.get("/api/rules/stats", params={"window": -1}, headers=headers).status_code == 422
+
+
+@patch("exposure._scanner")
+@patch("ufw_service._fetch_ufw_rules", return_value={"status": "active", "rules": [
+    {"id": 1, "to": "22/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+    {"id": 2, "to": "443/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+]})
+def test_exposure(mock_fetch, mock_scanner):
+    invalidate_rules_cache()
+    exposure._last_scan = (0.0, None)
+    mock_scanner.scan.return_value = [Listener("tcp", False, "0.0.0.0", 22, 0, 101),
+                                      Listener("tcp", False, "127.0.0.1", 5432, 112, 102)]
+    headers = _auth_headers()
+    with patch("exposure.socket_owners", return_value={101: (812, "sshd")}) as mock_owners:
+        response = client.get("/api/exposure", headers=headers)
+        assert response.status_code == 200
+        mock_owners.assert_not_called()
+        body = response.json()
+        assert body["counts"]["allowed"] == 1 and body["counts"]["local"] == 1
+        assert body["unused_rules"] == [{"id": 2, "to": "443/tcp", "from": "Anywhere"}]
+        assert body["listeners"][0]["pid"] is None
+
+        body = client.get("/api/exposure", params={"processes": True}, headers=headers).json()
+        assert mock_scanner.scan.call_count == 1
+        assert [(entry["port"], entry["process"]) for entry in body["listeners"]] == [(22, "sshd"), (5432, None)]
+
+
+@patch("ufw_service._fetch_ufw_rules", return_value={"status": "active", "rules": [
+    {"id": 1, "to": "22/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+    {"id": 2, "to": "443/tcp", "action": "ALLOW", "direction": "IN", "from": "10.0.0.0/8"},
+]})
+def test_simulate(mock_fetch):
+    invalidate_rules_cache()
+    headers = _auth_headers()
+    flows = b"src,dst,proto,sport,dport\n10.1.1.1,10.0.0.1,tcp,40000,443\n192.0.2.9,10.0.0.1,tcp,40001,443\n"
+    response = client.post("/api/simulate", headers=headers, files={"file": ("flows.csv", flows)})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["flows"] == 2
+    assert body["current"]["verdicts"]["allow"] == 1
+    assert [(r["verdict"], r["rule"]) for r in body["results"]] == [("allow", 2), ("deny", None)]
+
+    ruleset = "rules:\n  - {action: allow, port: '443', protocol: tcp}\n"
+    response = client.post("/api/simulate", headers=headers, files={"file": ("flows.csv", flows)},
+                           data={"ruleset": ruleset, "default_incoming": "reject"})
+    body = response.json()
+    assert body["changed"] == 1
+    assert body["results"] == [{"flow": 2, "src": "192.0.2.9", "dst": "10.0.0.1", "protocol": "tcp", "dport": 443,
+                                "direction": "in", "verdict": "reject", "rule": None,
+                                "proposed_verdict": "allow", "proposed_rule": 1}]
+
+    response = client.post("/api/simulate", headers=headers, files={"file": ("flows.csv", flows)},
+                           data={"ruleset": '[{"action": "allow", "port": "70000"}]'})
+    assert response.status_code == 422
+    response = client.post("/api/simulate", headers=headers, files={"file": ("flows.csv", b"a,b\n1,2\n")})
+    assert response.status_code == 400
+
+
+def test_blocklist_requires_one_source():
+    headers = _auth_headers()
+    response = client.put("/api/blocklists/spam", headers=headers)
+    assert response.status_code == 422
+    response = client.put("/api/blocklists/Bad%20Name", headers=headers,
+                          files={"file": ("list.txt", b"10.0.0.1\n")})
+    assert response.status_code == 422
+    response = client.post("/api/blocklists/spam/diff", headers=headers, data={"path": "../../etc/shadow"})
+    assert response.status_code == 400
+
+
+@patch("main.import_blocklist")
+def test_put_blocklist_upload(mock_import):
+    mock_import.return_value = {"status": "success", "message": "ok", "mode": "swap", "entries": 2,
+                                "rejected": 0, "families": {"v4": {"networks": 1, "added": 1, "removed": 0}}}
+    response = client.put("/api/blocklists/spam", headers=_auth_headers(),
+                          files={"file": ("drop.txt", b"10.0.0.0/25\n10.0.0.128/25\n")})
+    assert response.status_code == 200
+    assert response.json()["mode"] == "swap"
+    mock_import.assert_awaited_once_with("spam", "10.0.0.0/25\n10.0.0.128/25\n", "drop.txt")
+
+
+@patch("main.sync_ruleset")
+def test_put_ruleset_yaml_dry_run(mock_sync):
+    mock_sync.return_value = {"status": "success", "message": "0 to add, 0 to delete, 2 unchanged",
+                              "dry_run": True, "add": [], "delete": [], "unchanged": 2, "results": []}
+    body = "rules:\n  - {action: allow, port: '22', protocol: tcp}\n"
+    response = client.put("/api/ruleset", params={"dry_run": "true"}, content=body,
+                          headers={**_auth_headers(), "Content-Type": "application/yaml"})
+    assert response.status_code == 200
+    assert response.json()["unchanged"] == 2
+    ruleset = mock_sync.call_args.args[0]
+    assert ruleset.rules[0].port == "22"
+    assert mock_sync.call_args.kwargs == {"dry_run": True, "prune": True}
+
+    response = client.put("/api/ruleset", json=[{"action": "allow"}], headers=_auth_headers())
+    assert response.status_code == 422
+
+
+def test_history_listing_and_unknown_version(tmp_path):
+    from history import RuleHistory
+
+    history = RuleHistory(str(tmp_path))
+    history.append("### tuple ### allow tcp 22 0.0.0.0/0 any 0.0.0.0/0 in\n", "initial")
+    with patch("main.rule_history", history):
+        headers = _auth_headers()
+        response = client.get("/api/history", headers=headers)
+        assert [v["id"] for v in response.json()["versions"]] == [1]
+        assert client.get("/api/history/1/diff", headers=headers).json()["added"][0]["to"] == "22/tcp"
+        assert client.get("/api/history/2/diff", headers=headers).status_code == 404
+        assert client.post("/api/history/2/restore", headers=headers).status_code == 404
+
+
+def test_readonly_user_cannot_change_anything():
+    response = client.put("/api/users/auditor", headers=_auth_headers(),
+                          json={"password": "read-only-pass", "role": "readonly"})
+    assert response.status_code == 200
+    token = client.post("/token", data={"username": "auditor", "password": "read-only-pass"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/api/mutations", headers=headers).status_code == 200
+    assert client.get("/api/users/me", headers=headers).json() == {"username": "auditor", "role": "readonly"}
+    assert client.post("/api/enable", headers=headers).status_code == 403
+    assert client.delete("/api/rules/1", headers=headers).status_code == 403
+    assert client.put("/api/users/auditor", headers=headers, json={"role": "admin"}).status_code == 403
+
+    assert client.delete("/api/users/auditor", headers=_auth_headers()).status_code == 200
+    assert client.get("/api/mutations", headers=headers).status_code == 401
+
+
+def test_last_admin_cannot_be_removed():
+    response = client.delete("/api/users/admin", headers=_auth_headers())
+    assert response.status_code == 409
@@ -0,0 +1,113 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import app_catalog
+from app_catalog import PortEntry, get_catalog, load_catalog, parse_profile_ports
+from ufw_service import (
+    Rule,
+    _RulesFile,
+    format_rule_tuple,
+    number_rule_tuples,
+    parse_rule_tuple,
+    render_rule_block,
+    rule_command,
+    rule_to_tuples,
+    validate_rule,
+)
+
+
+class TestAppCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = load_catalog()
+
+    def test_profiles(self):
+        self.assertEqual(sorted(self.catalog.profiles),
+                         ["Apache", "Apache Full", "Apache Secure", "Bind9", "OpenSSH"])
+        self.assertEqual(self.catalog.profiles["Bind9"].ports,
+                         (PortEntry("53", "any"), PortEntry("953", "tcp")))
+        self.assertEqual(self.catalog.find("apache full").name, "Apache Full")
+        self.assertIsNone(self.catalog.find("Broken"))
+
+    def test_parse_profile_ports(self):
+        self.assertEqual(parse_profile_ports("60000:61000/udp"), (PortEntry("60000:61000", "udp"),))
+        for invalid in ("", "80,443", "70000/tcp", "22/icmp"):
+            with self.subTest(ports=invalid):
+                self.assertIsNone(parse_profile_ports(invalid))
+
+    def test_services_for_listed_destinations(self):
+        services_for = self.catalog.services_for
+        self.assertEqual(services_for("22/tcp"), ("OpenSSH", "ssh"))
+        self.assertEqual(services_for("22/tcp (v6)"), ("OpenSSH", "ssh"))
+        self.assertEqual(services_for("53"), ("Bind9", "domain"))
+        self.assertEqual(services_for("80,443/tcp"), ("Apache", "Apache Full", "http", "Apache Secure", "https"))
+        self.assertEqual(services_for("10.0.0.0/8 443/udp"), ("https",))
+        self.assertEqual(services_for("Apache Full"), ("Apache Full",))
+        self.assertEqual(services_for("10.0.0.1 Apache Full (v6)"), ("Apache Full",))
+        for nothing in ("Anywhere", "Anywhere/tcp", "10.0.0.0/8", "1:65535/tcp", "12345/tcp", "Unknown"):
+            with self.subTest(to=nothing):
+                self.assertEqual(services_for(nothing), ())
+
+    def test_reloads_when_a_file_changes(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        apps = os.path.join(tmp, "applications.d")
+        os.mkdir(apps)
+        services = os.path.join(tmp, "services")
+        with open(services, "w") as f:
+            f.write("ssh 22/tcp\n")
+        with patch.multiple(app_catalog, UFW_APPLICATIONS_DIR=apps, SERVICES_FILE=services,
+                            CATALOG_CHECK_INTERVAL=0, _catalog=None):
+            first = get_catalog()
+            self.assertIs(get_catalog(), first)
+            self.assertEqual(first.services_for("22/tcp"), ("ssh",))
+            with open(os.path.join(apps, "custom"), "w") as f:
+                f.write("[Custom]\ntitle=Custom\ndescription=x\nports=22/tcp\n")
+            second = get_catalog()
+            self.assertIsNot(second, first)
+            self.assertEqual(second.services_for("22/tcp"), ("Custom", "ssh"))
+
+
+class TestAppRules(unittest.TestCase):
+
+    def test_validate(self):
+        self.assertIsNone(validate_rule(Rule(action="allow", app="OpenSSH")))
+        self.assertEqual(validate_rule(Rule(action="allow", app="Nope")), "Unknown application profile")
+        self.assertEqual(validate_rule(Rule(action="allow", app="OpenSSH", port="22")),
+                         "An application rule takes no port or protocol")
+        with self.assertRaises(ValueError):
+            Rule(action="allow")
+
+    def test_command_uses_the_profile_name(self):
+        self.assertEqual(rule_command(Rule(action="allow", app="apache full", from_ip="10.0.0.0/8")),
+                         ["sudo", "/usr/sbin/ufw", "allow", "in", "from", "10.0.0.0/8", "to", "any",
+                          "app", "Apache Full"])
+
+    def test_tuples_and_rule_file_lines(self):
+        tuples = rule_to_tuples(Rule(action="allow", app="Bind9"))
+        self.assertEqual([(t.protocol, t.dport, t.dapp, t.v6) for t in tuples],
+                         [("any", "53", "Bind9", False), ("tcp", "953", "Bind9", False),
+                          ("any", "53", "Bind9", True), ("tcp", "953", "Bind9", True)])
+        lines = render_rule_block(rule_to_tuples(Rule(action="allow", app="Apache Full"))[0])
+        self.assertEqual(lines, [
+            "### tuple ### allow tcp 80,443 0.0.0.0/0 any 0.0.0.0/0 Apache%20Full - in",
+            "-A ufw-user-input -p tcp -m multiport --dports 80,443 -j ACCEPT -m comment --comment 'dapp_Apache%20Full'",
+        ])
+        self.assertEqual(parse_rule_tuple(lines[0]), rule_to_tuples(Rule(action="allow", app="Apache Full"))[0])
+
+    def test_listed_once_per_profile(self):
+        rules = rule_to_tuples(Rule(action="allow", app="Bind9"))
+        listing = number_rule_tuples(rules)
+        self.assertEqual([(r["to"], r["from"]) for r in listing],
+                         [("Bind9", "Anywhere"), ("Bind9 (v6)", "Anywhere (v6)")])
+        self.assertEqual(format_rule_tuple(rules[0])["to"], "Bind9")
+        text = "### RULES ###\n\n" + "\n".join(render_rule_block(rules[0])) + "\n\n### END RULES ###\n"
+        self.assertEqual(_RulesFile(text, v6=False).blocks[0][0], rules[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from audit import AuditLog, audited
+
+
+def event(t, user="admin", action="add"):
+    return {"time": t, "user": user, "action": action, "request": {"method": "POST", "path": "/api/rules"},
+            "diff": None, "outcome": "success", "message": None, "duration_ms": 1.0}
+
+
+class TestAuditLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.log = AuditLog(self.tmp.name, segment_bytes=4096, block_events=8)
+
+    def times(self, result):
+        return [e["time"] for e in result["events"]]
+
+    def test_group_commit_rotation_and_index(self):
+        users = ("alice", "bob", "carol")
+        for start in range(0, 300, 30):
+            self.log.commit([event(float(t), users[t % 3]) for t in range(start, start + 30)])
+        segments = sorted(name for name in os.listdir(self.tmp.name) if name.endswith(".log"))
+        self.assertGreater(len(segments), 1)
+
+        # A new reader builds the same index from the files.
+        reader = AuditLog(self.tmp.name)
+        self.assertEqual(self.times(reader.query(since=100, until=104.5)), [100.0, 101.0, 102.0, 103.0, 104.0])
+        self.assertEqual(self.times(reader.query(user="bob", since=200, limit=3)), [202.0, 205.0, 208.0])
+        self.assertEqual(reader.query(user="dave")["events"], [])
+        self.assertEqual(len(reader.query(limit=1000)["events"]), 300)
+        self.assertEqual(self.times(reader.query(action="delete")), [])
+
+    def test_paging_follows_time_order_across_writers(self):
+        other = AuditLog(self.tmp.name, block_events=8)
+        # Two workers whose flushes interleave: blocks overlap in time.
+        self.log.commit([event(t) for t in (1.0, 3.0, 5.0, 7.0)])
+        other.commit([event(t) for t in (2.0, 4.0, 6.0)])
+        self.log.commit([event(t) for t in (8.0, 9.0)])
+        seen, cursor = [], None
+        while True:
+            page = self.log.query(limit=2, cursor=cursor)
+            seen += self.times(page)
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0])
+        with self.assertRaises(ValueError):
+            self.log.query(cursor="garbage")
+
+    def test_export_streams_stored_lines(self):
+        self.log.commit([event(1.0, "alice"), event(2.0, "bob"), event(3.0, "alice")])
+        lines = list(self.log.export(user="alice"))
+        self.assertEqual([json.loads(line)["time"] for line in lines], [1.0, 3.0])
+        self.assertTrue(all(line.endswith(b"\n") for line in lines))
+
+    def test_unindexed_events_are_recovered(self):
+        self.log.commit([event(1.0)])
+        # A crash after the log write, before the index write, and a torn line.
+        with open(os.path.join(self.tmp.name, "000001.log"), "ab") as f:
+            f.write(json.dumps(event(2.0)).encode() + b"\n" + b'{"time": 3')
+        self.log.commit([event(4.0)])
+        self.assertEqual(self.times(AuditLog(self.tmp.name).query()), [1.0, 2.0, 4.0])
+
+    def test_audited_buffers_until_flushed(self):
+        async def scenario():
+            async def ok():
+                return {"status": "success", "message": "Rule added"}
+
+            async def conflict():
+                return {"status": "conflict", "message": "stale"}
+
+            async def boom():
+                raise RuntimeError("ufw crashed")
+
+            await audited(self.log, "alice", "add", {"method": "POST"}, ok(), lambda _: {"added": [1], "removed": []})
+            await audited(self.log, "alice", "delete", {"method": "DELETE"}, conflict(), lambda _: {"added": [2]})
+            with self.assertRaises(RuntimeError):
+                await audited(self.log, "bob", "enable", {"method": "POST"}, boom())
+            self.assertEqual(self.log.buffered(), 3)
+            self.assertEqual(self.log.query()["events"], [])
+            await self.log.flush()
+            self.assertEqual(self.log.buffered(), 0)
+
+        asyncio.run(scenario())
+        events = self.log.query()["events"]
+        self.assertEqual([(e["user"], e["outcome"], e["diff"]) for e in events], [
+            ("alice", "success", {"added": [1], "removed": []}),
+            ("alice", "conflict", None),
+            ("bob", "error", None),
+        ])
+        self.assertEqual(events[2]["message"], "ufw crashed")
+
+
+if __name__ == "__main__":
+    unittest.main()
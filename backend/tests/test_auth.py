@@ -0,0 +1,92 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest.mock import patch
+
+from jose import JWTError
+
+import auth
+from auth import (
+    TokenCache,
+    create_access_token,
+    decode_token,
+    get_password_hash,
+    issue_tokens,
+    verify_password_async,
+)
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        auth.token_cache.clear()
+
+    def test_verified_claims_are_cached(self):
+        token = issue_tokens("admin")["access_token"]
+        claims = decode_token(token)
+        self.assertEqual(claims["sub"], "admin")
+        with patch("auth.jwt.decode", side_effect=AssertionError("not cached")):
+            self.assertEqual(decode_token(token), claims)
+
+    def test_expired_claims_are_dropped(self):
+        cache = TokenCache()
+        cache.put("token", {"sub": "admin", "exp": time.time() - 1})
+        self.assertIsNone(cache.get("token"))
+
+    def test_size_is_bounded(self):
+        cache = TokenCache(size=2)
+        for name in ("a", "b", "c"):
+            cache.put(name, {"exp": time.time() + 60})
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+
+    def test_concurrent_use(self):
+        cache = TokenCache(size=4)
+
+        def churn(worker):
+            for i in range(2000):
+                name = "token%d" % (i % 8)
+                cache.put(name, {"exp": time.time() + (60 if (i + worker) % 2 else -1)})
+                cache.get(name)
+
+        with ThreadPoolExecutor(8) as pool:
+            for future in [pool.submit(churn, worker) for worker in range(8)]:
+                future.result()
+        self.assertLessEqual(len(cache._claims), 4)
+
+    def test_expired_token_is_rejected(self):
+        token = create_access_token({"sub": "admin"}, expires_delta=timedelta(seconds=-1))
+        with self.assertRaises(JWTError):
+            decode_token(token)
+
+    def test_token_types_are_not_interchangeable(self):
+        tokens = issue_tokens("admin")
+        with self.assertRaises(JWTError):
+            decode_token(tokens["refresh_token"])
+        with self.assertRaises(JWTError):
+            decode_token(tokens["access_token"], token_type="refresh")
+        self.assertEqual(decode_token(tokens["refresh_token"], token_type="refresh")["sub"], "admin")
+
+
+class TestPasswordPool(unittest.IsolatedAsyncioTestCase):
+
+    async def test_verify(self):
+        hashed = get_password_hash("secret")
+        self.assertTrue(await verify_password_async("secret", hashed))
+        self.assertFalse(await verify_password_async("wrong", hashed))
+        self.assertFalse(await verify_password_async("secret", None))
+
+    async def test_busy_beyond_pending_limit(self):
+        hashed = get_password_hash("secret")
+        with patch("auth.AUTH_MAX_PENDING", 2):
+            results = await asyncio.gather(
+                *(verify_password_async("secret", hashed) for _ in range(4)), return_exceptions=True)
+        self.assertEqual(sum(isinstance(r, auth.LoginBusy) for r in results), 2)
+        self.assertEqual(auth._pending, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import ipaddress
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import blocklist
+from blocklist import (
+    aggregate,
+    diff_blocklist,
+    import_blocklist,
+    list_blocklists,
+    read_import_file,
+    restore_blocklists,
+    with_init_block,
+    with_rule_block,
+    without_rule_block,
+)
+
+BEFORE_RULES = """*filter
+:ufw-before-input - [0:0]
+# End required lines
+
+-A ufw-before-input -i lo -j ACCEPT
+COMMIT
+"""
+
+
+class TestAggregate(unittest.TestCase):
+
+    def test_merges_overlapping_and_adjacent(self):
+        result = aggregate(
+            "# feed\n10.0.0.0/25\n10.0.0.128/25 ; SBL1\n10.0.0.7\n192.168.1.77/24\n"
+            "2001:db8::/33\n2001:db8:8000::/33\nnot-an-ip\n0.0.0.0/0\n"
+        )
+        self.assertEqual(result["v4"], ["10.0.0.0/24", "192.168.1.0/24"])
+        self.assertEqual(result["v6"], ["2001:db8::/32"])
+        self.assertEqual((result["entries"], result["rejected"]), (6, 2))
+
+    def test_matches_ipaddress_collapse(self):
+        rng = random.Random(7)
+        networks = [ipaddress.ip_network((rng.getrandbits(32), rng.randint(8, 32)), strict=False)
+                    for _ in range(2000)]
+        result = aggregate("\n".join(map(str, networks)))
+        self.assertEqual(result["v4"], [str(n) for n in ipaddress.collapse_addresses(networks)])
+
+
+class TestRulesFiles(unittest.TestCase):
+
+    def test_rule_block_round_trip(self):
+        text = with_rule_block(BEFORE_RULES, "spam", "v4")
+        lines = text.splitlines()
+        position = lines.index("# End required lines")
+        self.assertEqual(lines[position + 2],
+                         "-A ufw-before-input -m set --match-set webfire-spam-v4 src -j DROP")
+        self.assertEqual(with_rule_block(text, "spam", "v4"), text)
+        self.assertEqual(without_rule_block(text, "spam"), BEFORE_RULES)
+
+    def test_init_block_runs_on_start(self):
+        text = with_init_block("")
+        lines = text.splitlines()
+        self.assertEqual(lines[lines.index("start)") + 1].strip(), "# BEGIN webfire-blocklists")
+        self.assertEqual(with_init_block(text), text)
+
+
+class TestImport(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        for name in ("before.rules", "before6.rules"):
+            with open(os.path.join(self.tmp, name), "w") as f:
+                f.write(BEFORE_RULES.replace("ufw-", "ufw6-") if "6" in name else BEFORE_RULES)
+        patcher = patch.multiple(
+            blocklist,
+            BLOCKLIST_DIR=os.path.join(self.tmp, "state"),
+            BLOCKLIST_IMPORT_DIR=os.path.join(self.tmp, "imports"),
+            BEFORE_INIT_FILE=os.path.join(self.tmp, "before.init"),
+            BEFORE_RULES_FILES={
+                "v4": (os.path.join(self.tmp, "before.rules"), "ufw-before-input"),
+                "v6": (os.path.join(self.tmp, "before6.rules"), "ufw6-before-input"),
+            },
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.run_command = AsyncMock()
+        self.reload = AsyncMock()
+        for target, mock in (("blocklist.run_command", self.run_command), ("blocklist.reload_ufw", self.reload)):
+            p = patch(target, mock)
+            p.start()
+            self.addCleanup(p.stop)
+
+    def _scripts(self):
+        return [call.kwargs["input"] for call in self.run_command.await_args_list]
+
+    async def test_first_import_swaps_then_updates_incrementally(self):
+        entries = "\n".join(f"10.{i // 256}.{i % 256}.0/24" for i in range(0, 2000, 2))
+        result = await import_blocklist("spam", entries, "feed.txt")
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(result["mode"], "swap")
+        self.assertEqual(result["families"]["v4"]["networks"], 1000)
+        self.reload.assert_awaited_once()
+        v4_script = self._scripts()[0]
+        self.assertIn("swap webfire-spam-v4-tmp webfire-spam-v4", v4_script)
+        self.assertTrue(os.access(blocklist.BEFORE_INIT_FILE, os.X_OK))
+
+        self.run_command.reset_mock()
+        result = await import_blocklist("spam", entries + "\n172.16.0.0/12\n", "feed.txt")
+        self.assertEqual(result["mode"], "incremental")
+        self.assertEqual(self._scripts(), ["add webfire-spam-v4 172.16.0.0/12\n"])
+        self.reload.assert_awaited_once()  # before.rules already refers to the set
+
+        diff = diff_blocklist("spam", "10.0.0.0/24\n")
+        self.assertEqual(diff["families"]["v4"]["added"], 0)
+        self.assertEqual(diff["families"]["v4"]["removed"], 1000)
+        self.assertEqual([b["name"] for b in list_blocklists()], ["spam"])
+
+    async def test_failed_incremental_update_falls_back_to_swap(self):
+        await import_blocklist("spam", "\n".join(f"10.0.{i}.0/24" for i in range(0, 200, 2)), "a")
+        self.run_command.reset_mock()
+        self.run_command.side_effect = [Exception("set full"), None, None]
+        result = await import_blocklist("spam", "\n".join(f"10.0.{i}.0/24" for i in range(0, 202, 2)), "a")
+        self.assertEqual(result["mode"], "swap")
+        self.assertIn("swap ", self._scripts()[1])
+
+    async def test_failed_first_import_removes_the_sets(self):
+        self.reload.side_effect = Exception("reload failed")
+        result = await import_blocklist("spam", "10.0.0.0/24\n2001:db8::/32\n", "a")
+        self.assertEqual(result["status"], "error")
+        self.assertIn("destroy webfire-spam-v4\n", self._scripts()[-2])
+        self.assertIn("destroy webfire-spam-v6\n", self._scripts()[-1])
+        self.assertIsNone(blocklist._load_networks("spam", "v4"))
+        self.assertEqual(list_blocklists(), [])
+
+    async def test_failed_update_restores_previous_sets_and_state(self):
+        v4 = "\n".join(f"10.0.{i}.0/24" for i in range(0, 200, 2))
+        await import_blocklist("spam", v4 + "\n2001:db8::/32\n", "a")
+        self.run_command.reset_mock()
+        # v4 is updated in place; the swap of the replaced v6 list fails.
+        self.run_command.side_effect = [None, Exception("set full"), None, None]
+        result = await import_blocklist("spam", v4 + "\n172.16.0.0/12\n2001:db9::/32\n", "b")
+        self.assertEqual(result["status"], "error")
+        rollback = self._scripts()[2:]
+        self.assertIn("swap webfire-spam-v4-tmp webfire-spam-v4", rollback[0])
+        self.assertNotIn("172.16.0.0/12", rollback[0])
+        self.assertIn("add webfire-spam-v6-tmp 2001:db8::/32", rollback[1])
+        self.assertNotIn("172.16.0.0/12", blocklist._load_networks("spam", "v4"))
+        self.assertEqual(list_blocklists()[0]["source"], "a")
+
+    async def test_restore_reports_recreated_sets(self):
+        await import_blocklist("spam", "10.0.0.0/24\n10.0.2.0/24\n2001:db8::/32\n", "a")
+        self.run_command.reset_mock()
+        # The v4 set is missing; creating the v6 one fails because it exists.
+        self.run_command.side_effect = [None, None, Exception("set exists")]
+        result = await restore_blocklists()
+        self.assertEqual(result["restored"], [{"blocklist": "spam", "family": "v4", "entries": 2}])
+
+    def test_import_path_must_stay_in_import_dir(self):
+        os.makedirs(blocklist.BLOCKLIST_IMPORT_DIR)
+        with open(os.path.join(blocklist.BLOCKLIST_IMPORT_DIR, "list.txt"), "w") as f:
+            f.write("10.0.0.1\n")
+        self.assertEqual(read_import_file("list.txt"), "10.0.0.1\n")
+        with self.assertRaises(blocklist.BlocklistError):
+            read_import_file("../before.rules")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import asyncio
+import json
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from events import EventBroker
+from ufw_service import invalidate_rules_cache
+
+ACTIVE = {"status": "active", "rules": [
+    {"id": 1, "to": "22/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+]}
+INACTIVE = {"status": "inactive", "rules": []}
+
+
+def parse(chunk):
+    lines = dict(line.split(": ", 1) for line in chunk.strip().splitlines())
+    return lines["event"], json.loads(lines["data"])
+
+
+async def next_event(stream):
+    while True:
+        chunk = await asyncio.wait_for(stream.__anext__(), 1)
+        if chunk.startswith("event:"):
+            return parse(chunk)
+
+
+class TestEventBroker(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        invalidate_rules_cache()
+        self.broker = EventBroker(interval=60, tailer=None)
+
+    async def asyncTearDown(self):
+        await self.broker.close()
+
+    async def test_current_state_then_changes(self):
+        fetch = AsyncMock(return_value=ACTIVE)
+        with patch("ufw_service._fetch_ufw_rules", fetch):
+            stream = self.broker.subscribe()
+            received = dict([await next_event(stream), await next_event(stream)])
+            self.assertEqual(received["status"], {"status": "active"})
+            self.assertEqual(received["rules"]["count"], 1)
+
+            fetch.return_value = INACTIVE
+            invalidate_rules_cache()
+            self.broker.notify()
+            received = dict([await next_event(stream), await next_event(stream)])
+            self.assertEqual(received["status"], {"status": "inactive"})
+            self.assertEqual(received["rules"]["count"], 0)
+            await stream.aclose()
+        self.assertEqual(self.broker.subscribers, 0)
+
+    async def test_many_subscribers_share_one_watcher(self):
+        fetch = AsyncMock(return_value=ACTIVE)
+        with patch("ufw_service._fetch_ufw_rules", fetch):
+            streams = [self.broker.subscribe() for _ in range(20)]
+            for stream in streams:
+                await next_event(stream)
+            self.assertEqual(self.broker.subscribers, 20)
+            self.assertEqual(self.broker.checks, 1)
+            self.assertEqual(fetch.await_count, 1)
+            for stream in streams:
+                await stream.aclose()
+        self.assertEqual(self.broker.subscribers, 0)
+
+    async def test_unchanged_state_is_not_resent(self):
+        with patch("ufw_service._fetch_ufw_rules", AsyncMock(return_value=ACTIVE)):
+            stream = self.broker.subscribe()
+            await next_event(stream)
+            await next_event(stream)
+            self.broker.notify()
+            await asyncio.sleep(0.05)
+            self.assertEqual(self.broker.checks, 2)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(next_event(stream), 0.1)
+            await stream.aclose()
+
+    async def test_slow_subscriber_gets_latest_state_only(self):
+        stream = self.broker.subscribe()
+        await stream.__anext__()  # retry hint; registers the subscriber
+        for n in range(100):
+            self.broker.publish("traffic", {"total": n})
+        self.assertEqual(await next_event(stream), ("traffic", {"total": 99}))
+        await stream.aclose()
+
+
+if __name__ == "__main__":
+    unittest.main()
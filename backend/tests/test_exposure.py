@@ -0,0 +1,124 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import os
+import socket
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from exposure import SocketScanner, classify, socket_owners
+
+HEADER = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+
+
+def encode(address, port):
+    """An address as /proc/net prints it: 32-bit words in little-endian order."""
+    family = socket.AF_INET6 if ":" in address else socket.AF_INET
+    raw = socket.inet_pton(family, address)
+    words = b"".join(raw[i:i + 4][::-1] for i in range(0, len(raw), 4))
+    return "%s:%04X" % (words.hex().upper(), port)
+
+
+def proc_line(number, local, remote, state, uid, inode):
+    return "%4d: %s %s %s 00000000:00000000 00:00000000 00000000 %5d        0 %d 1 0000000000000000 100 0 0 10 0\n" % (
+        number, encode(*local), encode(*remote), state, uid, inode)
+
+
+SOCKETS = {
+    "tcp": [
+        (("0.0.0.0", 22), ("0.0.0.0", 0), "0A", 0, 101),
+        (("127.0.0.1", 5432), ("0.0.0.0", 0), "0A", 112, 102),
+        (("10.0.0.1", 8080), ("0.0.0.0", 0), "0A", 1000, 103),
+        (("10.0.0.1", 22), ("10.0.0.9", 50000), "01", 0, 104),  # established
+        (("0.0.0.0", 9100), ("0.0.0.0", 0), "0A", 0, 105),
+    ],
+    "tcp6": [
+        (("::", 80), ("::", 0), "0A", 33, 201),
+        (("::1", 6379), ("::", 0), "0A", 0, 202),
+    ],
+    "udp": [
+        (("0.0.0.0", 53), ("0.0.0.0", 0), "07", 0, 301),
+        (("10.0.0.1", 5353), ("224.0.0.251", 5353), "01", 0, 302),  # connected
+    ],
+}
+
+RULES = [
+    {"id": 1, "to": "22/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+    {"id": 2, "to": "80/tcp", "action": "DENY", "direction": "IN", "from": "198.51.100.0/24"},
+    {"id": 3, "to": "80/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+    {"id": 4, "to": "8080/tcp", "action": "ALLOW", "direction": "IN", "from": "10.0.0.0/8"},
+    {"id": 5, "to": "53", "action": "DENY", "direction": "IN", "from": "Anywhere"},
+    {"id": 6, "to": "3306/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+    {"id": 7, "to": "80/tcp (v6)", "action": "ALLOW", "direction": "IN", "from": "Anywhere (v6)"},
+    {"id": 8, "to": "5432/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+    {"id": 9, "to": "Anywhere", "action": "ALLOW", "direction": "OUT", "from": "Anywhere"},
+]
+
+
+class TestExposure(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        os.makedirs(os.path.join(self.tmp.name, "net"))
+        self.write(SOCKETS)
+
+    def write(self, sockets):
+        for name in ("tcp", "tcp6", "udp", "udp6"):
+            with open(os.path.join(self.tmp.name, "net", name), "w") as f:
+                f.write(HEADER + "".join(proc_line(i, *entry) for i, entry in enumerate(sockets.get(name, []))))
+
+    def test_scan_keeps_listening_sockets(self):
+        listeners = SocketScanner(self.tmp.name).scan()
+        self.assertEqual(sorted((l.protocol, l.v6, l.address, l.port, l.uid, l.inode) for l in listeners), [
+            ("tcp", False, "0.0.0.0", 22, 0, 101),
+            ("tcp", False, "0.0.0.0", 9100, 0, 105),
+            ("tcp", False, "10.0.0.1", 8080, 1000, 103),
+            ("tcp", False, "127.0.0.1", 5432, 112, 102),
+            ("tcp", True, "::", 80, 33, 201),
+            ("tcp", True, "::1", 6379, 0, 202),
+            ("udp", False, "0.0.0.0", 53, 0, 301),
+        ])
+
+    def test_rescan_decodes_only_new_lines(self):
+        scanner = SocketScanner(self.tmp.name)
+        first = {l.inode: l for l in scanner.scan()}
+        sockets = dict(SOCKETS, tcp=SOCKETS["tcp"][:1] + [(("0.0.0.0", 443), ("0.0.0.0", 0), "0A", 0, 106)])
+        self.write(sockets)
+        second = {l.inode: l for l in scanner.scan()}
+        self.assertIs(second[101], first[101])
+        self.assertEqual(second[106].port, 443)
+        self.assertNotIn(103, second)
+        self.assertNotIn(103, {l.inode for l in scanner._decoded.values()})
+
+    def test_lines_split_across_chunks(self):
+        with patch("exposure._CHUNK", 64):
+            self.assertEqual(len(SocketScanner(self.tmp.name).scan()), 7)
+
+    def test_classify(self):
+        result = classify(SocketScanner(self.tmp.name).scan(), RULES)
+        by_port = {entry["port"]: entry for entry in result["listeners"]}
+        self.assertEqual(by_port[22]["exposure"], "allowed")
+        self.assertEqual(by_port[5432]["exposure"], "local")
+        self.assertEqual(by_port[6379]["exposure"], "local")
+        self.assertEqual(by_port[8080]["exposure"], "restricted")
+        self.assertEqual(by_port[53]["exposure"], "denied")
+        self.assertEqual(by_port[9100]["exposure"], "unruled")
+        # The IPv6 wildcard socket takes IPv4 connections: rules of both families apply.
+        self.assertEqual(by_port[80]["exposure"], "allowed")
+        self.assertEqual(by_port[80]["rules"], [2, 3, 7])
+        self.assertEqual(result["counts"], {"local": 2, "allowed": 2, "denied": 1, "restricted": 1, "unruled": 1})
+        # Nothing listens on 3306; 5432 listens on loopback only.
+        self.assertEqual([rule["id"] for rule in result["unused_rules"]], [6, 8])
+
+    def test_socket_owners(self):
+        for pid, inodes in (("1", [101, 999]), ("42", [201]), ("77", [])):
+            os.makedirs(os.path.join(self.tmp.name, pid, "fd"))
+            with open(os.path.join(self.tmp.name, pid, "comm"), "w") as f:
+                f.write("proc%s\n" % pid)
+            os.symlink("/dev/null", os.path.join(self.tmp.name, pid, "fd", "0"))
+            for fd, inode in enumerate(inodes, 3):
+                os.symlink("socket:[%d]" % inode, os.path.join(self.tmp.name, pid, "fd", str(fd)))
+        self.assertEqual(socket_owners([101, 201, 301], self.tmp.name), {101: (1, "proc1"), 201: (42, "proc42")})
+
+
+if __name__ == "__main__":
+    unittest.main()
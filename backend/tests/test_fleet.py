@@ -0,0 +1,136 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import httpx
+from fastapi.testclient import TestClient
+
+from fleet import Agent, AgentRegistry, FleetClient
+
+
+class StandInAgents:
+    """Answers webFire API requests for any number of fake agent hosts."""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.logins = 0
+        self.changed = []
+        self.revoked = set()
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        if request.url.path == "/api/token":
+            self.logins += 1
+            self.revoked.discard(host)
+            return httpx.Response(200, json={"access_token": f"token-{host}", "token_type": "bearer"})
+        if request.headers.get("authorization") != f"Bearer token-{host}" or host in self.revoked:
+            return httpx.Response(401, json={"detail": "Could not validate credentials"})
+        if request.url.path == "/api/status":
+            return httpx.Response(200, json={"status": "active"})
+        if request.url.path == "/api/rules" and request.method == "POST":
+            if host in self.failing:
+                return httpx.Response(200, json={"status": "error", "message": "ufw failed"})
+            self.changed.append((host, json.loads(request.content)["port"]))
+            return httpx.Response(200, json={"status": "success", "message": "Rule added"})
+        return httpx.Response(404, json={"detail": "Not Found"})
+
+
+class TestFleetClient(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.registry = AgentRegistry(os.path.join(self.tmp, "fleet.json"))
+        for n in range(10):
+            self.registry.put(f"host{n}", Agent(url=f"http://host{n}:8000", username="admin", password="x"))
+        self.agents = StandInAgents(failing={"host1"})
+        self.client = FleetClient(self.registry, concurrency=4, transport=httpx.MockTransport(self.agents.handler))
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def test_fan_out_reuses_tokens(self):
+        names = self.registry.select()
+        results = [r async for r in self.client.fan_out(names, "GET", "/api/status")]
+        self.assertEqual(sorted(r["host"] for r in results), names)
+        self.assertTrue(all(r["ok"] for r in results))
+        results = [r async for r in self.client.fan_out(names, "GET", "/api/status")]
+        self.assertEqual(self.agents.logins, 10)
+
+        self.agents.revoked.add("host3")
+        result = await self.client.call("host3", "GET", "/api/status")
+        self.assertTrue(result["ok"])
+        self.assertEqual(self.agents.logins, 11)
+
+    async def test_canary_failure_stops_rollout(self):
+        names = self.registry.select()
+        events = [e async for e in self.client.rollout(names, "POST", "/api/rules", {"port": "443"}, canary=2)]
+        self.assertEqual(events[0], {"type": "stage", "stage": "canary", "hosts": ["host0", "host1"]})
+        failed = [e for e in events if e["type"] == "host" and not e["ok"]]
+        self.assertEqual([e["host"] for e in failed], ["host1"])
+        self.assertEqual(failed[0]["error"], "ufw failed")
+        self.assertEqual(events[-1], {"type": "done", "succeeded": 1, "failed": 1, "skipped": 8, "aborted": True})
+        self.assertEqual(self.agents.changed, [("host0", "443")])
+
+    async def test_rollout_continues_within_failure_budget(self):
+        names = self.registry.select()
+        events = [e async for e in self.client.rollout(names, "POST", "/api/rules", {"port": "443"},
+                                                       canary=2, max_failures=1)]
+        self.assertEqual([e["stage"] for e in events if e["type"] == "stage"], ["canary", "rest"])
+        self.assertEqual(events[-1], {"type": "done", "succeeded": 9, "failed": 1, "skipped": 0, "aborted": False})
+
+    async def test_unreachable_agent(self):
+        def refuse(request):
+            raise httpx.ConnectError("Connection refused", request=request)
+        client = FleetClient(self.registry, transport=httpx.MockTransport(refuse))
+        result = await client.call("host0", "GET", "/api/status")
+        self.assertFalse(result["ok"])
+        self.assertIn("ConnectError", result["error"])
+        await client.close()
+
+
+def test_fleet_api_streams_progress():
+    import main
+
+    tmp = tempfile.mkdtemp()
+    try:
+        registry = AgentRegistry(os.path.join(tmp, "fleet.json"))
+        agents = StandInAgents()
+        client = FleetClient(registry, transport=httpx.MockTransport(agents.handler))
+        with patch.multiple(main, fleet_registry=registry, fleet_client=client):
+            api = TestClient(main.app)
+            token = api.post("/token", data={"username": "admin", "password": "secret"}).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            for n in range(3):
+                response = api.put(f"/api/fleet/agents/web{n}", headers=headers,
+                                   json={"url": f"http://web{n}/", "username": "admin", "password": "x"})
+                assert response.status_code == 200
+            assert [a["url"] for a in api.get("/api/fleet/agents", headers=headers).json()] == \
+                ["http://web0", "http://web1", "http://web2"]
+            assert "password" not in api.get("/api/fleet/agents", headers=headers).json()[0]
+
+            status = api.get("/api/fleet/status", headers=headers, params={"hosts": ["web2", "web0"]}).json()
+            assert [h["host"] for h in status["hosts"]] == ["web0", "web2"]
+            assert status["succeeded"] == 2
+
+            response = api.post("/api/fleet/operations", headers=headers,
+                                json={"op": "add", "rule": {"action": "allow", "port": "8443"}, "canary": 1})
+            assert response.headers["content-type"].startswith("application/x-ndjson")
+            events = [json.loads(line) for line in response.text.splitlines()]
+            assert [e["type"] for e in events] == ["stage", "host", "stage", "host", "host", "done"]
+            assert events[-1]["succeeded"] == 3
+
+            assert api.post("/api/fleet/operations", headers=headers,
+                            json={"op": "add", "hosts": ["nope"], "rule": {"action": "allow", "port": "1"}}
+                            ).status_code == 422
+            assert api.post("/api/fleet/operations", headers=headers, json={"op": "batch"}).status_code == 422
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    unittest.main()
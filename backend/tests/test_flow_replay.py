@@ -0,0 +1,96 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import os
+import unittest
+
+from flow_replay import FlowsError, RuleEngine, compile_rules, flow_match, replay, ruleset_listing, simulate
+from ufw_service import Rule, parse_ufw_status_numbered
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "ufw", "mixed")
+
+FLOWS = """src,dst,proto,sport,dport,direction,in
+10.0.0.5,10.0.0.1,tcp,40000,22,in,
+10.0.0.5,10.0.0.1,tcp,40001,80,in,
+192.168.1.20,10.0.0.1,udp,40002,80,in,
+198.51.100.1,10.0.0.1,tcp,40003,3050,in,
+198.51.100.1,10.0.0.1,udp,40004,137,in,
+198.51.100.1,10.0.0.1,tcp,40005,9100,in,eth0
+198.51.100.1,10.0.0.1,tcp,40006,9100,in,eth1
+10.0.0.1,198.51.100.1,tcp,40007,25,out,
+2001:db8::1,2001:db8::2,tcp,40008,443,in,
+10.0.0.1,2001:db8::2,tcp,40009,443,in,
+"""
+
+
+def current_rules():
+    with open(os.path.join(FIXTURES, "status_numbered.txt"), encoding="utf-8") as f:
+        return parse_ufw_status_numbered(f.read())["rules"]
+
+
+class TestReplay(unittest.TestCase):
+
+    def test_first_matching_rule_or_policy(self):
+        result = simulate(FLOWS, current_rules(), limit=20)
+        decided = [(r["verdict"], r["rule"]) for r in result["results"]]
+        self.assertEqual(decided, [
+            ("allow", 1),      # 22/tcp before the deny for 10.0.0.5
+            ("deny", 4),
+            ("allow", 2),      # 80 from 192.168.1.0/24, any protocol
+            ("allow", 6),      # inside 3000:3100/tcp
+            ("deny", None),    # no Samba profile installed: rule 11 is skipped
+            ("deny", None),    # 9100 is only allowed on eth1
+            ("allow", 12),
+            ("deny", 8),
+            ("allow", 17),
+            ("invalid", None),  # mixed address families
+        ])
+        self.assertEqual(result["current"]["verdicts"],
+                         {"allow": 5, "deny": 4, "reject": 0, "limit": 0, "invalid": 1})
+        self.assertEqual(result["current"]["skipped"], [11, 19])
+        self.assertIsNone(result["changed"])
+
+    def test_profiles_and_services_expand_to_ports(self):
+        matches, skipped = compile_rules([
+            {"id": 1, "to": "Bind9", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+            {"id": 2, "to": "https", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+            {"id": 3, "to": "Nope", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+        ])
+        self.assertEqual([(m.id, m.protocol, m.dports) for m in matches], [
+            (1, "any", ((53, 53),)), (1, "tcp", ((953, 953),)), (2, "tcp", ((443, 443),)), (2, "udp", ((443, 443),))])
+        self.assertEqual(skipped, [3])
+
+    def test_proposed_rule_set(self):
+        proposed = ruleset_listing([Rule(action="allow", port="ssh"),
+                                    Rule(action="deny", port="80", from_ip="10.0.0.0/8")])
+        self.assertEqual([rule["to"] for rule in proposed], ["ssh", "80", "ssh (v6)"])
+        result = simulate(FLOWS, current_rules(), proposed, limit=2)
+        self.assertEqual(result["changed"], 5)
+        self.assertEqual([(r["flow"], r["verdict"], r["proposed_verdict"], r["proposed_rule"])
+                          for r in result["results"]], [(3, "allow", "deny", None), (4, "allow", "deny", None)])
+        self.assertEqual(result["proposed"]["rules"], [{"id": 1, "flows": 1}, {"id": 2, "flows": 1}])
+
+    def test_distinct_flows_are_decided_once(self):
+        engine = RuleEngine(compile_rules(current_rules())[0])
+        text = "src,dst,proto,sport,dport\n" + "10.9.9.9,10.0.0.1,tcp,%d,22\n" * 1000
+        result = replay(text % tuple(range(1000)), [engine])
+        self.assertEqual((len(result.flows), len(result.distinct)), (1000, 1))  # no rule needs source ports
+
+    def test_conntrack(self):
+        text = ("ipv4     2 tcp      6 431999 ESTABLISHED src=10.0.0.2 dst=10.0.0.1 sport=51234 dport=2222 "
+                "src=10.0.0.1 dst=10.0.0.2 sport=2222 dport=51234 [ASSURED] mark=0 use=1\n"
+                "icmp     1 29 src=10.0.0.2 dst=10.0.0.1 type=8 code=0 id=7 "
+                "src=10.0.0.1 dst=10.0.0.2 type=0 code=0 id=7 mark=0 use=1\n")
+        result = simulate(text, current_rules(), policies={"in": "reject"})
+        self.assertEqual([(r["protocol"], r["dport"], r["verdict"], r["rule"]) for r in result["results"]],
+                         [("tcp", 2222, "limit", 7), ("icmp", None, "reject", None)])
+
+    def test_invalid_input(self):
+        self.assertIsNone(flow_match({"src": "10.0.0.1", "dst": "10.0.0.2", "dport": "70000"}))
+        self.assertIsNone(flow_match({"src": "10.0.0.1", "dst": "10.0.0.2", "direction": "sideways"}))
+        with self.assertRaises(FlowsError):
+            simulate("source_host,port\n", current_rules())
+        result = simulate("src,dst,dport\n10.0.0.1\n", current_rules())
+        self.assertEqual(result["current"]["verdicts"]["invalid"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
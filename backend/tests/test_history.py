@@ -0,0 +1,152 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import ufw_service
+from history import ObjectStore, RuleHistory, apply_delta, make_delta, split_lines
+from mutation_queue import MutationQueue
+from ufw_service import Rule, RuleBatch
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "ufw", "mixed")
+
+
+class TestDelta(unittest.TestCase):
+
+    def test_round_trip(self):
+        rng = random.Random(3)
+        base = ["line %d\n" % rng.randrange(50) for _ in range(300)]
+        for _ in range(50):
+            lines = list(base)
+            for _ in range(rng.randint(1, 5)):
+                position = rng.randrange(len(lines))
+                if rng.random() < 0.5:
+                    del lines[position]
+                else:
+                    lines.insert(position, "new %d\n" % rng.randrange(1000))
+            self.assertEqual(apply_delta(base, make_delta(base, lines)), "".join(lines))
+
+    def test_split_lines_only_on_newline(self):
+        text = "a\x1cb\nc\x00\n\nd"
+        self.assertEqual("".join(split_lines(text)), text)
+        self.assertEqual(len(split_lines(text)), 4)
+
+
+class TestObjectStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, "objects.pack")
+
+    def test_dedup_delta_and_reopen(self):
+        store = ObjectStore(self.path, full_every=4)
+        contents = ["".join("rule %d\n" % n for n in range(200) if n != skip) for skip in range(10)]
+        parent = None
+        digests = []
+        for content in contents:
+            parent = store.put(content, parent)
+            digests.append(parent)
+        size = store.size()
+        self.assertEqual(store.put(contents[3], parent), digests[3])
+        self.assertEqual(store.size(), size)
+        # Deltas are much smaller than the full copies every fourth object.
+        self.assertLess(size, 4 * len(contents[0]))
+
+        reopened = ObjectStore(self.path, full_every=4)
+        for digest, content in zip(digests, contents):
+            self.assertEqual(reopened.get(digest), content)
+        self.assertEqual(max(reopened._index[d][3] for d in digests), 3)
+
+    def test_torn_record_is_dropped(self):
+        store = ObjectStore(self.path)
+        first = store.put("a\n")
+        with open(self.path, "ab") as f:
+            f.write(b'{"h": "x", "b": null, "n": 100}\nshort')
+        reopened = ObjectStore(self.path)
+        second = reopened.put("b\n", first)
+        self.assertEqual(ObjectStore(self.path).get(second), "b\n")
+        self.assertNotIn("x", ObjectStore(self.path))
+
+    def test_concurrent_appends_and_reads(self):
+        history = RuleHistory(self.tmp, full_every=4)
+        contents = ["".join("rule %d\n" % n for n in range(100) if n != skip) for skip in range(40)]
+
+        def read():
+            for version in history.versions:
+                history.store.get(history.get(version["id"])["hash"])
+
+        with ThreadPoolExecutor(8) as pool:
+            for future in [pool.submit(history.append, content, "test") for content in contents] + \
+                          [pool.submit(read) for _ in range(40)]:
+                future.result()
+        self.assertEqual([version["id"] for version in history.versions], list(range(1, 41)))
+        reopened = RuleHistory(self.tmp)
+        self.assertEqual(sorted(reopened.store.get(version["hash"]) for version in reopened.versions),
+                         sorted(contents))
+
+
+class TestRuleHistory(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        for name in ("ufw.conf", "user.rules", "user6.rules"):
+            shutil.copy(os.path.join(FIXTURE, name), self.tmp)
+        patcher = patch.multiple(
+            ufw_service,
+            UFW_CONF_FILE=os.path.join(self.tmp, "ufw.conf"),
+            USER_RULES_FILE=os.path.join(self.tmp, "user.rules"),
+            USER6_RULES_FILE=os.path.join(self.tmp, "user6.rules"),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        reload_patcher = patch("ufw_service.reload_ufw")
+        self.mock_reload = reload_patcher.start()
+        self.addCleanup(reload_patcher.stop)
+        self.history = RuleHistory(os.path.join(self.tmp, "history"))
+        self.queue = MutationQueue(window=0, lock_file=None)
+        self.queue.hooks.append(self.history.on_mutation)
+
+    def _files(self):
+        with open(os.path.join(self.tmp, "user.rules")) as f, open(os.path.join(self.tmp, "user6.rules")) as g:
+            return f.read(), g.read()
+
+    async def test_record_diff_and_restore(self):
+        original = self._files()
+        await self.queue.batch(RuleBatch(add=[Rule(action="deny", port="3306", protocol="tcp")]))
+        await self.queue.batch(RuleBatch(add=[Rule(action="allow", port="22", protocol="tcp")]))  # no change
+        self.assertEqual([(v["id"], v["reason"]) for v in self.history.versions], [(1, "initial"), (2, "batch")])
+
+        diff = self.history.diff(2)
+        self.assertEqual([(r["to"], r["action"]) for r in diff["added"]],
+                         [("3306/tcp", "DENY"), ("3306/tcp (v6)", "DENY")])
+        self.assertEqual(diff["removed"], [])
+
+        with open(os.path.join(self.tmp, "user.rules"), "a") as f:
+            f.write("\n")  # edited outside webFire
+        self.mock_reload.reset_mock()
+        result = await self.queue.run(lambda: self.history.restore(1), label="restore 1")
+        self.assertEqual(result, {"status": "success", "message": "Restored version 1"})
+        self.assertEqual(self._files(), original)
+        self.mock_reload.assert_called_once()
+        self.assertEqual([v["reason"] for v in self.history.versions],
+                         ["initial", "batch", "external change", "restore 1"])
+        # Restoring a known content stores no new object.
+        self.assertEqual(self.history.versions[-1]["hash"], self.history.versions[0]["hash"])
+
+        page = self.history.listing(limit=3)
+        self.assertEqual([v["id"] for v in page["versions"]], [4, 3, 2])
+        self.assertEqual(self.history.listing(limit=3, before=int(page["next_cursor"]))["versions"][0]["id"], 1)
+
+    async def test_restore_unknown_version(self):
+        result = await self.history.restore(7)
+        self.assertEqual(result["status"], "error")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import asyncio
+import sys
+import unittest
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+import metrics
+from main import app
+from metrics import Counter, Histogram, server_timing
+from ufw_service import command_name, command_duration, run_command
+
+client = TestClient(app)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram_is_cumulative(self):
+        histogram = Histogram("test_seconds", "Test.", ("verb",), buckets=(0.1, 1.0))
+        try:
+            for value in (0.05, 0.5, 0.5, 5):
+                histogram.observe(value, 'say "hi"')
+            lines = histogram.render().split("\n")
+        finally:
+            metrics._metrics.remove(histogram)
+        self.assertIn('test_seconds_bucket{verb="say \\"hi\\"",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{verb="say \\"hi\\"",le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{verb="say \\"hi\\"",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{verb="say \\"hi\\""} 4', lines)
+
+    def test_counter(self):
+        counter = Counter("test_total", "Test.", ("result",))
+        try:
+            counter.inc("hit")
+            counter.inc("hit")
+            counter.inc("miss")
+            self.assertEqual(counter.samples(), ['test_total{result="hit"} 2', 'test_total{result="miss"} 1'])
+        finally:
+            metrics._metrics.remove(counter)
+
+    def test_server_timing_sums_repeated_steps(self):
+        header = server_timing([("spawn", 0.001), ("spawn", 0.002), ("parse", 0.0005)], 0.01)
+        self.assertEqual(header, b'spawn;dur=3.000;desc="2 calls", parse;dur=0.500, total;dur=10.000')
+
+    def test_command_name(self):
+        self.assertEqual(command_name(["sudo", "/usr/sbin/ufw", "status", "numbered"]), "ufw status")
+        self.assertEqual(command_name(["sudo", "-n", "/bin/cat", "/etc/ufw/user.rules"]), "cat")
+        self.assertEqual(command_name(["sudo", "-n", "/usr/sbin/ipset", "restore", "-exist"]), "ipset restore")
+
+    def test_command_timing(self):
+        args = [sys.executable, "-c", "pass"]
+        before = command_duration.count(command_name(args))
+        asyncio.run(run_command(args))
+        self.assertEqual(command_duration.count(command_name(args)), before + 1)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+
+    def _headers(self, **extra):
+        token = client.post("/token", data={"username": "admin", "password": "secret"}).json()["access_token"]
+        return {"Authorization": f"Bearer {token}", **extra}
+
+    def test_routes_are_templates(self):
+        client.get("/api/history/12345/diff", headers=self._headers())
+        client.get("/no/such/path")
+        text = client.get("/metrics").text
+        self.assertIn('webfire_http_requests_total{method="GET",route="/api/history/{version_id}/diff",status="404"}',
+                      text)
+        self.assertIn('route="unmatched"', text)
+        self.assertNotIn("12345", text)
+        self.assertIn('webfire_cache_lookups_total{cache="token",result="hit"}', text)
+
+    def test_profile_header(self):
+        headers = self._headers()
+        self.assertNotIn("server-timing", client.get("/api/mutations", headers=headers).headers)
+        response = client.get("/api/mutations", headers={**headers, "X-Webfire-Profile": "1"})
+        self.assertTrue(response.headers["server-timing"].startswith("total;dur="))
+
+    def test_token(self):
+        with patch("main.METRICS_TOKEN", "scrape"):
+            self.assertEqual(client.get("/metrics").status_code, 401)
+            self.assertEqual(client.get("/metrics", headers={"Authorization": "Bearer scrape"}).status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import ufw_service
+from mutation_queue import MutationQueue
+from ufw_service import Rule, RuleBatch, invalidate_rules_cache
+
+LISTING_BEFORE = {
+    "status": "active",
+    "rules": [
+        {"id": 1, "to": "22/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+        {"id": 2, "to": "80/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+        {"id": 3, "to": "443/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+    ],
+}
+# Rule 1 was deleted by someone else: 80/tcp is now rule 1, 443/tcp rule 2.
+LISTING_AFTER = {"status": "active", "rules": [
+    dict(rule, id=rule["id"] - 1) for rule in LISTING_BEFORE["rules"][1:]
+]}
+
+
+def success(message):
+    return {"status": "success", "message": message}
+
+
+class TestMutationQueue(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        invalidate_rules_cache()
+        self.queue = MutationQueue(window=0.01, lock_file=None)
+
+    async def _etag_for(self, listing):
+        with patch("ufw_service._fetch_ufw_rules", return_value=listing):
+            invalidate_rules_cache()
+            return (await ufw_service.get_rules_snapshot()).etag
+
+    @patch("mutation_queue.delete_ufw_rule", return_value=success("Rule deleted"))
+    @patch("mutation_queue.add_ufw_rule", return_value=success("Rule added"))
+    async def test_single_operations_use_the_cli(self, mock_add, mock_delete):
+        self.assertEqual(await self.queue.add(Rule(action="allow", port="22")), success("Rule added"))
+        self.assertEqual(await self.queue.delete(4), success("Rule deleted"))
+        mock_delete.assert_awaited_once_with(4)
+        self.assertEqual(self.queue.stats()["transactions"], 2)
+
+    @patch("mutation_queue.apply_rule_batch")
+    async def test_adjacent_operations_are_merged(self, mock_batch):
+        mock_batch.return_value = {"status": "success", "message": "Applied 3 changes", "results": [
+            {"index": 0, "op": "add", "status": "success", "message": "Rule added"},
+            {"index": 1, "op": "add", "status": "skipped", "message": "Skipping adding existing rule"},
+            {"index": 0, "op": "delete", "status": "success", "message": "Rule deleted"},
+        ]}
+        results = await asyncio.gather(
+            self.queue.add(Rule(action="allow", port="8080", protocol="tcp")),
+            self.queue.delete(7),
+            self.queue.add(Rule(action="allow", port="22", protocol="tcp")),
+        )
+        batch = mock_batch.await_args.args[0]
+        self.assertEqual([r.port for r in batch.add], ["8080", "22"])
+        self.assertEqual(batch.delete, [7])
+        self.assertEqual(results, [success("Rule added"), success("Rule deleted"),
+                                   success("Skipping adding existing rule")])
+        stats = self.queue.stats()
+        self.assertEqual((stats["processed"], stats["transactions"], stats["depth"]), (3, 1, 0))
+
+    @patch("mutation_queue.apply_rule_batch")
+    async def test_rejected_operation_fails_alone(self, mock_batch):
+        mock_batch.side_effect = [
+            {"status": "error", "message": "Batch validation failed", "results": [
+                {"index": 0, "op": "add", "status": "not_applied", "message": "Batch rejected"},
+                {"index": 0, "op": "delete", "status": "error", "message": "Rule 9 does not exist"},
+                {"index": 1, "op": "delete", "status": "not_applied", "message": "Batch rejected"},
+            ]},
+            {"status": "success", "message": "Applied 2 changes", "results": [
+                {"index": 0, "op": "add", "status": "success", "message": "Rule added"},
+                {"index": 0, "op": "delete", "status": "success", "message": "Rule deleted"},
+            ]},
+        ]
+        results = await asyncio.gather(
+            self.queue.delete(9),
+            self.queue.add(Rule(action="allow", port="8080", protocol="tcp")),
+            self.queue.delete(2),
+        )
+        self.assertEqual(results, [{"status": "error", "message": "Rule 9 does not exist"},
+                                   success("Rule added"), success("Rule deleted")])
+        retried = mock_batch.await_args.args[0]
+        self.assertEqual(([r.port for r in retried.add], retried.delete), (["8080"], [2]))
+
+    @patch("mutation_queue.enable_ufw", return_value=success("enabled"))
+    @patch("mutation_queue.apply_rule_batch")
+    @patch("mutation_queue.add_ufw_rule", return_value=success("Rule added"))
+    async def test_order_is_preserved_across_barriers(self, mock_add, mock_batch, mock_enable):
+        calls = []
+        mock_add.side_effect = lambda rule: calls.append(("add", rule.port)) or success("Rule added")
+        mock_enable.side_effect = lambda: calls.append(("enable",)) or success("enabled")
+        await asyncio.gather(
+            self.queue.add(Rule(action="allow", port="1", protocol="tcp")),
+            self.queue.enable(),
+            self.queue.add(Rule(action="allow", port="2", protocol="tcp")),
+        )
+        self.assertEqual(calls, [("add", "1"), ("enable",), ("add", "2")])
+        mock_batch.assert_not_awaited()
+
+    @patch("mutation_queue.delete_ufw_rule", return_value=success("Rule deleted"))
+    async def test_delete_is_mapped_to_current_id(self, mock_delete):
+        seen = await self._etag_for(LISTING_BEFORE)
+        await self._etag_for(LISTING_AFTER)
+        result = await self.queue.delete(3, etag=seen)
+        self.assertEqual(result, success("Rule deleted"))
+        mock_delete.assert_awaited_once_with(2)
+
+    @patch("mutation_queue.delete_ufw_rule")
+    async def test_stale_delete_is_a_conflict(self, mock_delete):
+        seen = await self._etag_for(LISTING_BEFORE)
+        await self._etag_for(LISTING_AFTER)
+        result = await self.queue.delete(1, etag=seen)
+        self.assertEqual(result["status"], "conflict")
+        unknown = await self.queue.delete(1, etag='"unknown"')
+        self.assertEqual(unknown["status"], "conflict")
+        mock_delete.assert_not_awaited()
+
+    @patch("mutation_queue.apply_rule_batch")
+    async def test_duplicate_deletes_conflict(self, mock_batch):
+        await self._etag_for(LISTING_AFTER)
+        with patch("mutation_queue.delete_ufw_rule", return_value=success("Rule deleted")):
+            first, second = await asyncio.gather(self.queue.delete(1), self.queue.delete(1))
+        self.assertEqual(first, success("Rule deleted"))
+        self.assertEqual(second["status"], "conflict")
+        mock_batch.assert_not_awaited()
+
+    @patch("mutation_queue.apply_rule_batch")
+    async def test_batches_are_not_merged(self, mock_batch):
+        mock_batch.return_value = {"status": "success", "message": "No changes", "results": []}
+        await asyncio.gather(self.queue.batch(RuleBatch()), self.queue.batch(RuleBatch()))
+        self.assertEqual(mock_batch.await_count, 2)
+
+    async def test_callers_are_answered_after_the_hooks(self):
+        events = []
+
+        async def hook(stage, label):
+            await asyncio.sleep(0.01)
+            events.append((stage, label))
+
+        async def call():
+            events.append("call")
+            return success("Done")
+
+        self.queue.hooks.append(hook)
+        self.assertEqual(await self.queue.run(call, label="edit"), success("Done"))
+        self.assertEqual(events, [("before", "edit"), "call", ("after", "edit")])
+
+        async def failing():
+            raise RuntimeError("boom")
+
+        with self.assertRaisesRegex(RuntimeError, "boom"):
+            await self.queue.run(failing, label="edit")
+        self.assertEqual(events[-1], ("after", "edit"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import os
+import unittest
+
+from rule_analysis import analyze_rules, check_new_rule, parse_listing_rule
+from ufw_service import Rule, parse_ufw_status_numbered
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "ufw")
+
+
+def listing(*rows):
+    return [{"id": i + 1, "to": to, "action": action, "direction": direction, "from": src}
+            for i, (to, action, direction, src) in enumerate(rows)]
+
+
+def kinds(rules):
+    return {f["id"]: (f["kind"], f["related"]) for f in analyze_rules(rules)["findings"]}
+
+
+class TestRuleAnalysis(unittest.TestCase):
+
+    def test_parse_listing_columns(self):
+        match = parse_listing_rule({"id": 14, "to": "10.0.0.2 8443/tcp on eth0", "action": "ALLOW FWD",
+                                    "direction": "", "from": "Anywhere on eth1"})
+        self.assertEqual((match.direction, match.protocol, match.dports), ("fwd", "tcp", ((8443, 8443),)))
+        self.assertEqual((match.iface_in, match.iface_out), ("eth0", "eth1"))
+        self.assertEqual(match.dst, (0x0A000002, 0x0A000002))
+
+        match = parse_listing_rule({"id": 1, "to": "80,443,8000:8010/tcp (v6)", "action": "ALLOW",
+                                    "direction": "IN", "from": "2001:db8::/32"})
+        self.assertTrue(match.v6)
+        self.assertEqual(match.dports, ((80, 80), (443, 443), (8000, 8010)))
+        self.assertEqual(match.src_prefixlen, 32)
+
+        self.assertEqual(parse_listing_rule({"id": 3, "to": "Apache Full", "action": "ALLOW",
+                                             "direction": "IN", "from": "Anywhere"}).dports, "Apache Full")
+
+    def test_redundant_and_shadowed(self):
+        rules = listing(
+            ("22", "ALLOW", "IN", "Anywhere"),
+            ("22/tcp", "ALLOW", "IN", "10.0.0.0/8"),     # inside rule 1, same action
+            ("1000:2000/tcp", "DENY", "IN", "Anywhere"),
+            ("1500/tcp", "ALLOW", "IN", "192.168.1.7"),  # inside rule 3, other action
+            ("1500/udp", "ALLOW", "IN", "Anywhere"),     # other protocol
+            ("22/tcp", "ALLOW", "OUT", "Anywhere"),      # other direction
+        )
+        self.assertEqual(kinds(rules), {2: ("redundant", [1]), 4: ("shadowed", [3])})
+
+    def test_conflicts_need_same_or_wider_sources(self):
+        rules = listing(
+            ("22/tcp", "ALLOW", "IN", "Anywhere"),
+            ("Anywhere", "DENY", "IN", "203.0.113.7"),   # does not block 22/tcp for that host
+            ("Anywhere", "DENY", "IN", "198.51.100.0/24"),
+            ("80/tcp", "ALLOW", "IN", "Anywhere"),       # exception-first pattern: not reported
+        )
+        self.assertEqual(kinds(rules), {2: ("conflict", [1]), 3: ("conflict", [1])})
+
+    def test_families_are_analyzed_separately(self):
+        rules = listing(
+            ("22/tcp", "DENY", "IN", "Anywhere"),
+            ("22/tcp (v6)", "ALLOW", "IN", "Anywhere (v6)"),
+        )
+        self.assertEqual(kinds(rules), {})
+
+    def test_conflicts_are_capped(self):
+        rows = [("%d/tcp" % (1000 + i), "ALLOW", "IN", "Anywhere") for i in range(25)]
+        rows.append(("Anywhere", "DENY", "IN", "203.0.113.7"))
+        finding = analyze_rules(listing(*rows))["findings"][0]
+        self.assertEqual(finding["related"], list(range(1, 11)))
+        self.assertTrue(finding["more"])
+
+    def test_fixture_listing(self):
+        with open(os.path.join(FIXTURES, "mixed", "status_numbered.txt"), encoding="utf-8") as f:
+            rules = parse_ufw_status_numbered(f.read())["rules"]
+        result = analyze_rules(rules)
+        self.assertEqual(result["analyzed"], len(rules))
+        self.assertEqual(kinds(rules), {4: ("conflict", [1, 3]), 13: ("conflict", [1, 3, 5, 6, 7, 10, 11, 12])})
+
+    def test_check_new_rule(self):
+        rules = listing(
+            ("80,443/tcp", "ALLOW", "IN", "Anywhere"),
+            ("80,443/tcp (v6)", "ALLOW", "IN", "Anywhere (v6)"),
+        )
+        findings = check_new_rule(Rule(action="deny", port="443", protocol="tcp"), rules)
+        self.assertEqual([(f["id"], f["kind"], f["related"]) for f in findings],
+                         [(None, "shadowed", [1]), (None, "shadowed", [2])])
+        self.assertTrue(findings[0]["message"].startswith("The new rule never matches"))
+        self.assertEqual(check_new_rule(Rule(action="allow", port="8080", protocol="tcp"), rules), [])
+        # Service names cannot be resolved offline.
+        self.assertEqual(check_new_rule(Rule(action="allow", port="ssh"), rules), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import ufw_service
+from ufw_service import (
+    Rule,
+    RuleBatch,
+    RuleSet,
+    apply_rule_batch,
+    read_ufw_rules_native,
+    render_rule_block,
+    rule_to_tuples,
+    sync_ruleset,
+    validate_rule,
+)
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "ufw", "mixed")
+
+
+class TestRuleBatch(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        for name in ("ufw.conf", "user.rules", "user6.rules"):
+            shutil.copy(os.path.join(FIXTURE, name), self.tmp)
+        patcher = patch.multiple(
+            ufw_service,
+            UFW_CONF_FILE=os.path.join(self.tmp, "ufw.conf"),
+            USER_RULES_FILE=os.path.join(self.tmp, "user.rules"),
+            USER6_RULES_FILE=os.path.join(self.tmp, "user6.rules"),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.tmp)
+        reload_patcher = patch("ufw_service.reload_ufw")
+        self.mock_reload = reload_patcher.start()
+        self.addCleanup(reload_patcher.stop)
+
+    def _file(self, name):
+        with open(os.path.join(self.tmp, name)) as f:
+            return f.read()
+
+    async def test_add_and_delete_with_one_reload(self):
+        batch = RuleBatch(
+            add=[Rule(action="allow", port="5432", protocol="tcp", from_ip="10.1.0.0/16"),
+                 Rule(action="deny", port="6000:6010", protocol="udp")],
+            delete=[2, 11],
+        )
+        result = await apply_rule_batch(batch)
+        self.assertEqual(result["status"], "success")
+        self.assertEqual([r["status"] for r in result["results"]], ["success"] * 4)
+        self.mock_reload.assert_called_once()
+
+        listed = [(r["to"], r["action"], r["from"]) for r in (await read_ufw_rules_native())["rules"]]
+        self.assertNotIn(("80", "ALLOW", "192.168.1.0/24"), listed)
+        self.assertNotIn(("Samba", "ALLOW", "Anywhere"), listed)
+        self.assertIn(("Samba (v6)", "ALLOW", "Anywhere (v6)"), listed)
+        self.assertIn(("5432/tcp", "ALLOW", "10.1.0.0/16"), listed)
+        self.assertIn(("6000:6010/udp", "DENY", "Anywhere"), listed)
+        self.assertIn(("6000:6010/udp (v6)", "DENY", "Anywhere (v6)"), listed)
+        self.assertIn("-A ufw-user-input -p tcp --dport 5432 -s 10.1.0.0/16 -j ACCEPT", self._file("user.rules"))
+        self.assertIn("### LOGGING ###", self._file("user.rules"))
+
+    async def test_invalid_item_rejects_whole_batch(self):
+        before = self._file("user.rules")
+        batch = RuleBatch(add=[Rule(action="allow", port="22", protocol="tcp"),
+                               Rule(action="allow", port="99999")],
+                          delete=[500])
+        result = await apply_rule_batch(batch)
+        self.assertEqual(result["status"], "error")
+        self.assertEqual([r["status"] for r in result["results"]], ["not_applied", "error", "error"])
+        self.assertEqual(self._file("user.rules"), before)
+        self.mock_reload.assert_not_called()
+
+    async def test_reload_failure_restores_files(self):
+        before = (self._file("user.rules"), self._file("user6.rules"))
+        self.mock_reload.side_effect = [subprocess.CalledProcessError(1, "ufw", stderr="ERROR: bad rule"), None]
+        result = await apply_rule_batch(RuleBatch(add=[Rule(action="allow", port="8081", protocol="tcp")]))
+        self.assertEqual(result["status"], "error")
+        self.assertIn("bad rule", result["message"])
+        self.assertEqual(result["results"][0]["status"], "rolled_back")
+        self.assertEqual((self._file("user.rules"), self._file("user6.rules")), before)
+        self.assertEqual(self.mock_reload.call_count, 2)
+
+    async def test_existing_rule_is_skipped(self):
+        result = await apply_rule_batch(RuleBatch(add=[Rule(action="allow", port="22", protocol="tcp")]))
+        self.assertEqual(result["results"][0]["status"], "skipped")
+        self.mock_reload.assert_not_called()
+
+    async def test_inactive_firewall_is_not_reloaded(self):
+        with open(os.path.join(self.tmp, "ufw.conf"), "w") as f:
+            f.write("ENABLED=no\n")
+        result = await apply_rule_batch(RuleBatch(add=[Rule(action="allow", port="8081", protocol="tcp")]))
+        self.assertEqual(result["status"], "success")
+        self.assertIn("8081", self._file("user.rules"))
+        self.mock_reload.assert_not_called()
+
+    async def test_ruleset_applies_only_the_difference(self):
+        desired = RuleSet(rules=[Rule(action="allow", port="22", protocol="tcp"),
+                                 Rule(action="deny", port="3306", protocol="tcp", from_ip="10.0.0.0/8")])
+        result = await sync_ruleset(desired)
+        self.assertEqual(result["status"], "success")
+        self.assertEqual([r.port for r in result["add"]], ["3306"])
+        listed = [(r["to"], r["action"], r["from"]) for r in (await read_ufw_rules_native())["rules"]]
+        self.assertEqual(listed, [("22/tcp", "ALLOW", "Anywhere"), ("3306/tcp", "DENY", "10.0.0.0/8"),
+                                  ("22/tcp (v6)", "ALLOW", "Anywhere (v6)")])
+        self.mock_reload.assert_called_once()
+
+        # Same set, spelled differently: nothing to do, no reload.
+        before = (self._file("user.rules"), self._file("user6.rules"))
+        result = await sync_ruleset(RuleSet(rules=[
+            Rule(action="ALLOW", port="22", protocol="TCP", direction="IN", from_ip="Any"),
+            Rule(action="deny", port="3306", protocol="tcp", from_ip="10.0.0.0/8"),
+        ]))
+        self.assertEqual((result["add"], result["delete"], result["unchanged"]), ([], [], 3))
+        self.assertEqual((self._file("user.rules"), self._file("user6.rules")), before)
+        self.mock_reload.assert_called_once()
+
+    async def test_ruleset_dry_run_and_prune(self):
+        before = self._file("user.rules")
+        current = len((await read_ufw_rules_native())["rules"])
+        desired = RuleSet(rules=[Rule(action="allow", port="8080", protocol="tcp")])
+        plan = await sync_ruleset(desired, dry_run=True)
+        self.assertEqual(len(plan["add"]), 1)
+        self.assertEqual(len(plan["delete"]), current)
+        self.assertEqual(plan["delete"][0]["id"], 1)
+        plan = await sync_ruleset(desired, dry_run=True, prune=False)
+        self.assertEqual((len(plan["delete"]), plan["unchanged"]), (0, current))
+        self.assertEqual(self._file("user.rules"), before)
+        self.mock_reload.assert_not_called()
+
+    async def test_ruleset_invalid_rule(self):
+        result = await sync_ruleset(RuleSet(rules=[Rule(action="allow", port="22"), Rule(action="open", port="1")]))
+        self.assertEqual(result["status"], "error")
+        self.assertEqual(result["message"], "Rule 1: Invalid action")
+
+
+class TestRuleConversion(unittest.TestCase):
+
+    def test_validate_rule(self):
+        self.assertIsNone(validate_rule(Rule(action="limit", port="22", protocol="tcp")))
+        self.assertEqual(validate_rule(Rule(action="accept", port="22")), "Invalid action")
+        self.assertEqual(validate_rule(Rule(action="allow", port="80,443")),
+                         "Port ranges and lists require a protocol")
+        self.assertEqual(validate_rule(Rule.model_construct(action="allow", port="22", protocol=None,
+                                                            direction="in", from_ip="10.0.0.300", app=None)),
+                         "Invalid source address")
+
+    def test_source_address_selects_family(self):
+        tuples = rule_to_tuples(Rule(action="allow", port="22", protocol="tcp", from_ip="2001:db8::/32"))
+        self.assertEqual([t.v6 for t in tuples], [True])
+        self.assertEqual(len(rule_to_tuples(Rule(action="allow", port="22"))), 2)
+
+    def test_render_limit_rule(self):
+        rule = rule_to_tuples(Rule(action="limit", port="2222", protocol="tcp"))[0]
+        lines = render_rule_block(rule)
+        self.assertEqual(lines[0], "### tuple ### limit tcp 2222 0.0.0.0/0 any 0.0.0.0/0 in")
+        self.assertEqual(lines[-1], "-A ufw-user-input -p tcp --dport 2222 -j ufw-user-limit-accept")
+
+
+if __name__ == '__main__':
+    unittest.main()
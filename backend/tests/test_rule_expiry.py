@@ -0,0 +1,128 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from audit import AuditLog
+from mutation_queue import MutationQueue
+from rule_expiry import ExpirySchedule, rule_identities
+from ufw_service import Rule, RuleSnapshot
+
+
+def snapshot(rules):
+    return RuleSnapshot(1, "etag", {"status": "active", "rules": rules}, (), 0.0)
+
+
+def listed(*identities):
+    return [{"id": i + 1, "to": to, "action": action, "direction": direction, "from": from_}
+            for i, (to, action, direction, from_) in enumerate(identities)]
+
+
+class TestExpirySchedule(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "expiry.db")
+        self.schedule = ExpirySchedule(self.path)
+        queue = patch("rule_expiry.mutation_queue", MutationQueue(window=0, lock_file=None))
+        queue.start()
+        self.addCleanup(queue.stop)
+        self.audit = AuditLog(os.path.join(self.directory.name, "audit"))
+        audit = patch("rule_expiry.audit_log", self.audit)
+        audit.start()
+        self.addCleanup(audit.stop)
+
+    def test_identities_as_listed(self):
+        self.assertEqual(rule_identities(Rule(action="allow", port="22", protocol="tcp")),
+                         [("22/tcp", "ALLOW", "IN", "Anywhere"), ("22/tcp (v6)", "ALLOW", "IN", "Anywhere (v6)")])
+        self.assertEqual(rule_identities(Rule(action="allow", app="Bind9", from_ip="10.0.0.0/8")),
+                         [("Bind9", "ALLOW", "IN", "10.0.0.0/8")])
+
+    async def test_persists_and_annotates(self):
+        ssh = rule_identities(Rule(action="allow", port="22", protocol="tcp"))
+        await self.schedule.schedule(ssh, 1000.0)
+        await self.schedule.schedule([("80", "ALLOW", "IN", "Anywhere")], 2000.0)
+        await self.schedule.schedule(ssh, 1500.0)  # added again: new expiry
+
+        restarted = ExpirySchedule(self.path)
+        restarted.load()
+        self.assertEqual(len(restarted), 2)
+        self.assertEqual(restarted.expires_at(ssh), 1500.0)
+        listing = {"status": "active", "rules": listed(*ssh, ("443", "ALLOW", "IN", "Anywhere"))}
+        annotated = restarted.annotate(listing, now=1400.0)
+        self.assertEqual([(r.get("expires_at"), r.get("expires_in")) for r in annotated["rules"]],
+                         [(1500.0, 100), (1500.0, 100), (None, None)])
+        self.assertIs(annotated["rules"][2], listing["rules"][2])
+        self.assertNotIn("expires_at", listing["rules"][0])
+
+    async def test_due_rules_expire_in_one_batch(self):
+        identities = [[(f"{1000 + i}/tcp", "ALLOW", "IN", "Anywhere")] for i in range(2000)]
+        for i, lines in enumerate(identities):
+            await self.schedule.schedule(lines, 10000.0 - i)  # scheduled latest first
+        current = listed(*(lines[0] for lines in identities[:1500]))  # others deleted by hand
+        with patch("rule_expiry.get_rules_snapshot", new_callable=AsyncMock, return_value=snapshot(current)), \
+                patch("rule_expiry.apply_rule_batch", new_callable=AsyncMock,
+                      return_value={"status": "success", "message": "ok", "results": []}) as mock_apply:
+            result = await self.schedule.expire_due(now=9000.0)
+        # Due by 9000: 1000 rules, of which 500 are still listed.
+        mock_apply.assert_awaited_once()
+        self.assertEqual(mock_apply.call_args.args[0].delete, list(range(1001, 1501)))
+        self.assertEqual(result["message"], "500 expired rule(s) deleted")
+        self.assertEqual(len(self.schedule), 1000)
+        self.assertEqual(self.schedule._next_due(), 9001.0)
+        await self.audit.flush()
+        event, = self.audit.query()["events"]
+        self.assertEqual((event["user"], event["action"], event["outcome"]), ("system:expiry", "expire", "success"))
+        self.assertEqual(len(event["request"]["body"]["rules"]), 1000)
+        self.assertEqual(event["diff"]["removed"][0],
+                         {"id": 1001, "to": "2000/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"})
+        self.assertEqual(len(event["diff"]["removed"]), 500)
+
+    async def test_batch_waits_for_rules_due_within_the_window(self):
+        for port, expires_at in ((22, 100.0), (80, 100.4), (443, 100.9), (8080, 102.0)):
+            await self.schedule.schedule([(str(port), "ALLOW", "IN", "Anywhere")], expires_at)
+        self.assertEqual(self.schedule._batch_end(self.schedule._next_due()), 100.9)
+        self.assertEqual(len(self.schedule._pop_due(100.5)), 2)  # nothing before its time
+
+    async def test_annotate_sees_rules_scheduled_by_other_workers(self):
+        other = ExpirySchedule(self.path)
+        self.schedule.load()
+        await other.schedule([("22", "ALLOW", "IN", "Anywhere")], 1000.0)
+        annotated = self.schedule.annotate({"rules": listed(("22", "ALLOW", "IN", "Anywhere"))}, now=400.0)
+        self.assertEqual(annotated["rules"][0]["expires_in"], 600)
+
+    async def test_failed_batch_is_retried(self):
+        await self.schedule.schedule([("22", "ALLOW", "IN", "Anywhere")], 100.0)
+        with patch("rule_expiry.get_rules_snapshot", new_callable=AsyncMock,
+                   return_value=snapshot(listed(("22", "ALLOW", "IN", "Anywhere")))), \
+                patch("rule_expiry.apply_rule_batch", new_callable=AsyncMock,
+                      return_value={"status": "error", "message": "reload failed", "results": []}):
+            result = await self.schedule.expire_due(now=200.0)
+        self.assertEqual(result["status"], "error")
+        self.assertEqual(self.schedule._next_due(), 100.0)
+        restarted = ExpirySchedule(self.path)
+        restarted.load()
+        self.assertEqual(len(restarted), 1)
+
+    async def test_rules_stay_due_when_the_queue_raises(self):
+        await self.schedule.schedule([("22", "ALLOW", "IN", "Anywhere")], 100.0)
+        with patch("rule_expiry.mutation_queue.run", new_callable=AsyncMock, side_effect=RuntimeError("lock")):
+            with self.assertRaises(RuntimeError):
+                await self.schedule.expire_due(now=200.0)
+        self.assertEqual(self.schedule._next_due(), 100.0)
+        self.assertEqual(len(self.schedule), 1)
+
+    async def test_reconcile_drops_rules_deleted_meanwhile(self):
+        await self.schedule.schedule([("22", "ALLOW", "IN", "Anywhere")], 100.0)
+        await self.schedule.schedule([("80", "ALLOW", "IN", "Anywhere")], 100.0)
+        with patch("rule_expiry.get_rules_snapshot", new_callable=AsyncMock,
+                   return_value=snapshot(listed(("80", "ALLOW", "IN", "Anywhere")))):
+            await self.schedule.reconcile()
+        self.assertIsNone(self.schedule.expires_at([("22", "ALLOW", "IN", "Anywhere")]))
+        self.assertEqual(self.schedule.expires_at([("80", "ALLOW", "IN", "Anywhere")]), 100.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
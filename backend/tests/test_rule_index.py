@@ -0,0 +1,66 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import os
+import unittest
+
+from rule_index import RuleIndex, RuleQuery
+from ufw_service import parse_ufw_status_numbered
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "ufw")
+
+
+def ids(result):
+    return [rule["id"] for rule in result["rules"]]
+
+
+class TestRuleIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        with open(os.path.join(FIXTURES, "mixed", "status_numbered.txt"), encoding="utf-8") as f:
+            cls.rules = parse_ufw_status_numbered(f.read())["rules"]
+        cls.index = RuleIndex(cls.rules)
+
+    def query(self, **filters):
+        return ids(self.index.query(RuleQuery(**filters)))
+
+    def test_action_and_direction(self):
+        self.assertEqual(self.query(action="deny"), [4, 8, 13, 18])
+        self.assertEqual(self.query(action="DENY", direction="out"), [8, 18])
+        self.assertEqual(self.query(direction="FWD"), [14])
+        self.assertEqual(self.query(action="ALLOW", direction="FWD"), [14])
+
+    def test_port(self):
+        self.assertEqual(self.query(port=443), [10, 17])
+        self.assertEqual(self.query(port=3050), [6])
+        self.assertEqual(self.query(port=80), [2, 10])
+
+    def test_cidr_contains(self):
+        self.assertEqual(self.query(cidr_contains="192.168.1.77"), [2])
+        self.assertEqual(self.query(cidr_contains="10.0.0.5"), [4])
+        self.assertEqual(self.query(cidr_contains="2001:db8:1::/48"), [17])
+        self.assertEqual(self.query(cidr_contains="172.16.0.1"), [])
+        with self.assertRaises(ValueError):
+            self.query(cidr_contains="not-an-address")
+
+    def test_text_search_matches_a_field_scan(self):
+        for q in ("ssh", "SAMBA", "eth", "/tcp", "v6", "22", "1", "an", "nope"):
+            expected = [r["id"] for r in self.rules
+                        if any(q.lower() in str(value).lower() for value in r.values())]
+            self.assertEqual(self.query(q=q), expected, q)
+
+    def test_keyset_pagination(self):
+        pages, cursor = [], None
+        while True:
+            result = self.index.query(RuleQuery(direction="in"), limit=5,
+                                      after=int(cursor) if cursor else None)
+            pages.append(ids(result))
+            self.assertEqual(result["total"], 16)
+            cursor = result["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual([len(page) for page in pages], [5, 5, 5, 1])
+        self.assertEqual(sum(pages, []), self.query(direction="in"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import ipaddress
+import os
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from pydantic import ValidationError
+
+from rule_model import ListedRule, group_twins, parse_listing
+from ufw_service import Rule, add_ufw_rule, parse_ufw_status_numbered, validate_rule
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "ufw")
+
+
+def read_fixture():
+    with open(os.path.join(FIXTURES, "mixed", "status_numbered.txt"), encoding="utf-8") as f:
+        return f.read()
+
+
+def parse(output):
+    return parse_listing(parse_ufw_status_numbered(output)["rules"])
+
+
+class TestRuleModel(unittest.TestCase):
+
+    def test_round_trips_the_dict_listing(self):
+        listing = parse_ufw_status_numbered(read_fixture())
+        self.assertEqual([rule.to_dict() for rule in parse_listing(listing["rules"])], listing["rules"])
+
+    def test_typed_columns(self):
+        rule = ListedRule(14, "10.0.0.2 8443/tcp on eth0", "ALLOW FWD", "", "Anywhere on eth1")
+        self.assertEqual(rule.dst, ipaddress.ip_network("10.0.0.2/32"))
+        self.assertEqual((rule.dports, rule.protocol, rule.iface_in, rule.iface_out),
+                         (((8443, 8443),), "tcp", "eth0", "eth1"))
+        self.assertIsNone(rule.src)
+
+        rule = ListedRule(1, "80,443,8000:8010,8005/tcp", "ALLOW", "IN", "2001:db8::/32")
+        self.assertTrue(rule.v6)
+        self.assertEqual(rule.src, ipaddress.ip_network("2001:db8::/32"))
+        self.assertEqual(rule.dports, ((80, 80), (443, 443), (8000, 8010)))
+        self.assertEqual(ListedRule(3, "Apache Full (v6)", "ALLOW", "IN", "Anywhere (v6)").dports, "Apache Full")
+
+        with self.assertRaises(AttributeError):
+            rule.extra = 1
+
+    def test_rules_share_parsed_parts(self):
+        rules = parse(
+            "Status: active\n[ 1] 10.0.0.0/8 22/tcp  ALLOW IN  Anywhere\n"
+            "[ 2] 10.0.0.0/8 22/tcp  DENY OUT  Anywhere\n")
+        self.assertIs(rules[0].dst, rules[1].dst)
+        self.assertIs(rules[0].dports, rules[1].dports)
+        self.assertEqual(rules[0].from_, rules[1].from_)
+
+    def test_groups_twins(self):
+        rules = parse(read_fixture())
+        grouped = {tuple(logical.ids): logical for logical in group_twins(rules)}
+        self.assertEqual(sorted(grouped), sorted([
+            (1, 15), (2,), (3, 16), (4,), (5,), (6,), (7,), (8, 18), (9,), (10,), (11, 19), (12,), (13,),
+            (14,), (17,)]))
+        self.assertEqual(grouped[(1, 15)].to_dict(), {"ids": [1, 15], "to": "22/tcp", "action": "ALLOW",
+                                                      "direction": "IN", "from": "Anywhere",
+                                                      "families": ["v4", "v6"]})
+        self.assertEqual(grouped[(17,)].to_dict()["families"], ["v6"])
+
+        # An IPv6 line only joins an IPv4 line with the same match.
+        rules = parse(
+            "Status: active\n[ 1] 22/tcp  ALLOW IN  Anywhere\n[ 2] 22/udp (v6)  ALLOW IN  Anywhere (v6)\n")
+        self.assertEqual([logical.ids for logical in group_twins(rules)], [[1], [2]])
+
+
+class TestValidationBeforeSpawn(unittest.IsolatedAsyncioTestCase):
+
+    def test_port_ranges_and_lists(self):
+        self.assertIsNone(validate_rule(Rule(action="allow", port="1000:2000,3000", protocol="tcp")))
+        self.assertEqual(validate_rule(Rule(action="allow", port="2000:1000", protocol="tcp")), "Invalid port")
+        self.assertIn("Too many ports", validate_rule(Rule(action="allow", port=",".join(map(str, range(1, 17))),
+                                                           protocol="tcp")))
+        self.assertEqual(validate_rule(Rule(action="allow", port="ssh")), "Invalid port")
+        self.assertIsNone(validate_rule(Rule(action="allow", port="ssh"), service_names=True))
+
+    def test_source_address_is_validated_by_the_model(self):
+        for source in ("10.0.0.300", "any; reboot", "example.org"):
+            with self.subTest(source=source), self.assertRaisesRegex(ValidationError, "Invalid source address"):
+                Rule(action="allow", port="22", from_ip=source)
+        self.assertEqual(Rule(action="allow", port="22", from_ip="2001:db8::/32").from_ip, "2001:db8::/32")
+        self.assertEqual(Rule(action="allow", port="22", from_ip="Any").from_ip, "Any")
+
+    async def test_invalid_rules_never_reach_ufw(self):
+        with patch("ufw_service.asyncio.create_subprocess_exec", new_callable=AsyncMock) as mock_exec:
+            for rule, message in ((Rule(action="allow", port="70000"), "Invalid port"),
+                                  (Rule(action="allow", port="nosuchservice"), "Invalid port")):
+                with self.subTest(message=message):
+                    self.assertEqual(await add_ufw_rule(rule), {"status": "error", "message": message})
+        mock_exec.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Parity between the `ufw status numbered` parser and the native rule reader.
+
+Each directory under tests/fixtures/ufw holds ufw.conf, user.rules and
+user6.rules from one host together with the `ufw status numbered` output
+captured on that host at the same time.
+"""
+import asyncio
+import os
+import unittest
+from unittest.mock import patch
+
+import ufw_service
+from ufw_service import (
+    format_rule_tuple,
+    parse_rule_tuple,
+    parse_ufw_status_numbered,
+    read_ufw_rules_native,
+)
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "ufw")
+
+
+def _read(name, filename):
+    with open(os.path.join(FIXTURES, name, filename), encoding="utf-8") as f:
+        return f.read()
+
+
+def _read_native(name):
+    directory = os.path.join(FIXTURES, name)
+    with patch.multiple(
+        ufw_service,
+        UFW_CONF_FILE=os.path.join(directory, "ufw.conf"),
+        USER_RULES_FILE=os.path.join(directory, "user.rules"),
+        USER6_RULES_FILE=os.path.join(directory, "user6.rules"),
+    ):
+        return asyncio.run(read_ufw_rules_native())
+
+
+class TestRuleParity(unittest.TestCase):
+
+    def test_fixtures_match_status_parser(self):
+        for name in sorted(os.listdir(FIXTURES)):
+            with self.subTest(fixture=name):
+                expected = parse_ufw_status_numbered(_read(name, "status_numbered.txt"))
+                self.assertEqual(_read_native(name), expected)
+
+    def test_numbering_skips_duplicate_app_tuples(self):
+        rules = _read_native("mixed")["rules"]
+        self.assertEqual([r["id"] for r in rules], list(range(1, 20)))
+        self.assertEqual([r["to"] for r in rules].count("Samba"), 1)
+        self.assertEqual(rules[14]["to"], "22/tcp (v6)")
+
+    def test_missing_rules_file(self):
+        with patch.object(ufw_service, "UFW_CONF_FILE", os.path.join(FIXTURES, "mixed", "ufw.conf")), \
+                patch.object(ufw_service, "USER_RULES_FILE", os.path.join(FIXTURES, "missing.rules")):
+            result = asyncio.run(read_ufw_rules_native())
+        self.assertEqual(result["status"], "error")
+
+
+class TestRuleTuple(unittest.TestCase):
+
+    def test_parse_comment_and_log(self):
+        rule = parse_rule_tuple("### tuple ### allow_log tcp 22 0.0.0.0/0 any 0.0.0.0/0 in comment=737368")
+        self.assertEqual((rule.action, rule.logtype, rule.comment), ("allow", "log", "ssh"))
+
+    def test_parse_app_with_space(self):
+        rule = parse_rule_tuple("### tuple ### allow tcp 80,443 0.0.0.0/0 any 0.0.0.0/0 Nginx%20Full - in")
+        self.assertEqual(rule.dapp, "Nginx Full")
+        self.assertEqual(format_rule_tuple(rule)["to"], "Nginx Full")
+
+    def test_long_v6_address(self):
+        # Wider than the 26-character To column of `ufw status`, which the
+        # status parser cannot split reliably.
+        rule = parse_rule_tuple(
+            "### tuple ### allow tcp 22 2001:db8:aaaa:bbbb:cccc:dddd:eeee:1 any ::/0 in", v6=True)
+        self.assertEqual(format_rule_tuple(rule), {
+            "to": "2001:db8:aaaa:bbbb:cccc:dddd:eeee:1 22/tcp",
+            "action": "ALLOW",
+            "direction": "IN",
+            "from": "Anywhere (v6)",
+        })
+
+    def test_malformed_tuple(self):
+        self.assertIsNone(parse_rule_tuple("### tuple ### allow tcp 22"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import os
+import unittest
+from collections import deque
+from unittest.mock import AsyncMock, patch
+
+import rule_stats
+import ufw_service
+from rule_stats import build_layout, collect_rule_stats, count_rules
+from ufw_service import CommandResult
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "ufw", "mixed")
+FILES = {"UFW_CONF_FILE": os.path.join(FIXTURES, "ufw.conf"),
+         "USER_RULES_FILE": os.path.join(FIXTURES, "user.rules"),
+         "USER6_RULES_FILE": os.path.join(FIXTURES, "user6.rules")}
+
+
+def read(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def kernel_dump(text, packets=1, skip_chain=None):
+    """What `iptables-save -c` shows once ufw loaded `text`: every line with the same counters."""
+    lines = ["*filter"]
+    for line in text.splitlines():
+        if line.startswith("-A ") and line.split()[1] != skip_chain:
+            lines.append("[%d:%d] %s" % (packets, packets * 100, line))
+    return "\n".join(lines + ["COMMIT", ""])
+
+
+class TestCounting(unittest.TestCase):
+
+    def setUp(self):
+        self.texts = [read("user.rules"), read("user6.rules")]
+        self.layout = build_layout(self.texts)
+
+    def test_counts_verdict_lines_per_rule(self):
+        packets, nbytes, out_of_sync = count_rules(self.layout, [kernel_dump(text) for text in self.texts])
+        self.assertEqual(out_of_sync, [])
+        self.assertEqual(packets[1], 1)
+        self.assertEqual(packets[2], 2)   # tcp and udp lines
+        self.assertEqual(packets[7], 2)   # limit: not the --set line
+        self.assertEqual(packets[9], 1)   # logged reject: not the jump to the logging chain
+        self.assertEqual(packets[11], 2)  # application with two port entries
+        self.assertEqual((packets[17], nbytes[17]), (1, 100))
+        self.assertEqual(len(packets), 20)
+
+    def test_chain_out_of_sync(self):
+        dumps = [kernel_dump(self.texts[0], skip_chain="ufw-user-output"), kernel_dump(self.texts[1])]
+        packets, _, out_of_sync = count_rules(self.layout, dumps)
+        self.assertEqual(out_of_sync, ["ufw-user-output"])
+        self.assertEqual((packets[8], packets[18]), (0, 1))
+
+
+class TestCollect(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        for patcher in (patch.multiple(ufw_service, **FILES, HELPER_SOCKET=None),
+                        patch.multiple(rule_stats, _layout=None, _samples=deque(maxlen=4), _lock=None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.texts = [read("user.rules"), read("user6.rules")]
+        self.clock = patch("rule_stats.time").start()
+        self.addCleanup(patch.stopall)
+        self.clock.perf_counter.return_value = 0.0
+        self.clock.time.return_value = 1700000000.0
+
+    def dumps(self, packets):
+        async def run(args, timeout=None):
+            text = self.texts[1] if "ip6tables" in args[2] else self.texts[0]
+            return CommandResult(0, kernel_dump(text, packets), "")
+        return patch("rule_stats.run_command_shared", side_effect=run)
+
+    async def test_rates_from_the_previous_sample(self):
+        self.clock.monotonic.return_value = 100.0
+        with self.dumps(1) as mock_run:
+            first = await collect_rule_stats()
+        self.assertEqual(mock_run.await_count, 2)
+        self.assertIsNone(first["interval"])
+        self.assertEqual(first["rules"][0], {"id": 1, "packets": 1, "bytes": 100,
+                                             "packets_per_s": None, "bytes_per_s": None})
+
+        self.clock.monotonic.return_value = 100.5  # within STATS_MIN_INTERVAL: reused
+        with self.dumps(5) as mock_run:
+            self.assertEqual((await collect_rule_stats())["rules"], first["rules"])
+        mock_run.assert_not_called()
+
+        self.clock.monotonic.return_value = 102.0
+        with self.dumps(5):
+            second = await collect_rule_stats()
+        self.assertEqual(second["interval"], 2.0)
+        by_id = {rule["id"]: rule for rule in second["rules"]}
+        self.assertEqual(by_id[7], {"id": 7, "packets": 10, "bytes": 1000, "packets_per_s": 4.0,
+                                    "bytes_per_s": 400.0})
+
+        self.clock.monotonic.return_value = 104.0
+        with self.dumps(2):  # ufw reloaded: counters restarted
+            third = await collect_rule_stats()
+        self.assertEqual(third["rules"][0]["packets_per_s"], 1.0)
+
+        self.clock.monotonic.return_value = 106.0
+        with self.dumps(9):
+            fourth = await collect_rule_stats(window=3)
+        self.assertEqual(fourth["interval"], 4.0)  # against the sample at 102
+        self.assertEqual(fourth["rules"][0]["packets_per_s"], 1.0)
+
+    async def test_errors(self):
+        self.clock.monotonic.return_value = 100.0
+        with patch("rule_stats.run_command_shared", new_callable=AsyncMock,
+                   side_effect=FileNotFoundError(2, "No such file", "sudo")):
+            result = await collect_rule_stats()
+        self.assertEqual(result, {"status": "error", "message": "sudo not found"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from traffic_log import LogTailer, TrafficIndex, attribute_to_rules
+
+BLOCK = ("Oct 18 13:16:33 host kernel: [ 5312.120312] [UFW BLOCK] IN=eth0 OUT= "
+         "MAC=52:54:00:12:34:56:52:54:00:65:43:21:08:00 SRC={src} DST=10.0.0.2 LEN=60 TOS=0x00 "
+         "PREC=0x00 TTL=50 ID=54321 DF PROTO={proto} SPT=51234 DPT={port} WINDOW=64240 RES=0x00 SYN URGP=0\n")
+ALLOW_OUT = ("Oct 18 13:16:34 host kernel: [ 5313.000001] [UFW ALLOW] IN= OUT=eth0 SRC=10.0.0.2 "
+             "DST=198.51.100.9 LEN=60 TOS=0x00 PREC=0x00 TTL=64 ID=1 DF PROTO=UDP SPT=40000 DPT=53 LEN=40\n")
+ICMP = ("Oct 18 13:16:35 host kernel: [ 5314.000001] [UFW BLOCK] IN=eth0 OUT= MAC=00 SRC=192.0.2.1 "
+        "DST=10.0.0.2 LEN=84 TOS=0x00 PREC=0x00 TTL=57 ID=0 DF PROTO=ICMP TYPE=8 CODE=0 ID=1 SEQ=1\n")
+NOISE = "Oct 18 13:16:35 host kernel: [ 5314.100000] eth0: link up\n"
+
+
+def block(src="203.0.113.5", port=22, proto="TCP"):
+    return BLOCK.format(src=src, port=port, proto=proto)
+
+
+class TestTrafficIndex(unittest.TestCase):
+
+    def test_parse_and_top(self):
+        index = TrafficIndex(capacity=100)
+        data = (block() * 3 + block(src="198.51.100.7", port=3389) + ALLOW_OUT + ICMP + NOISE).encode()
+        self.assertEqual(index.add_lines(data, now=1000), 6)
+        top = index.top(window=60, now=1000)
+        self.assertEqual(top["records"], 6)
+        self.assertEqual(top["actions"], {"BLOCK": 5, "ALLOW": 1})
+        self.assertEqual(top["sources"][0], ("203.0.113.5", 3))
+        self.assertIn((("BLOCK", "IN", "TCP", 22), 3), top["ports"])
+        self.assertIn((("ALLOW", "OUT", "UDP", 53), 1), top["ports"])
+
+    def test_rolling_window_and_ring(self):
+        index = TrafficIndex(capacity=4)
+        index.add_lines((block(port=1) * 3).encode(), now=100)
+        index.add_lines((block(port=2) * 3).encode(), now=200)
+        self.assertEqual(index.total, 6)
+        self.assertEqual(index.top(window=1000, now=200)["records"], 4)
+        top = index.top(window=50, now=200)
+        self.assertEqual(top["records"], 3)
+        self.assertEqual(top["ports"], [(("BLOCK", "IN", "TCP", 2), 3)])
+
+    def test_interned_addresses_are_compacted(self):
+        index = TrafficIndex(capacity=2)
+        for i in range(20):
+            index.add_lines(block(src="192.0.2.%d" % i).encode(), now=i)
+        self.assertLessEqual(len(index._ips), 9)
+        self.assertEqual(sorted(ip for ip, _ in index.top(window=100, now=19)["sources"]),
+                         ["192.0.2.18", "192.0.2.19"])
+
+    def test_attribute_to_rules(self):
+        rules = [
+            {"id": 1, "to": "22/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+            {"id": 2, "to": "3000:3400/tcp", "action": "DENY", "direction": "IN", "from": "Anywhere"},
+            {"id": 3, "to": "OpenSSH", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+            {"id": 4, "to": "53 (v6)", "action": "ALLOW", "direction": "OUT", "from": "Anywhere (v6)"},
+        ]
+        ports = [(("BLOCK", "IN", "TCP", 3389), 5), (("ALLOW", "IN", "TCP", 22), 2),
+                 (("ALLOW", "OUT", "UDP", 53), 1), (("BLOCK", "IN", "TCP", 22), 7)]
+        self.assertEqual(attribute_to_rules(ports, rules), [(2, 5), (1, 2), (4, 1)])
+
+    def test_limit_blocks_are_attributed_to_limit_rules(self):
+        rules = [
+            {"id": 1, "to": "22/tcp", "action": "DENY", "direction": "IN", "from": "10.0.0.0/8"},
+            {"id": 2, "to": "22/tcp", "action": "LIMIT", "direction": "IN", "from": "Anywhere"},
+        ]
+        ports = [(("LIMIT BLOCK", "IN", "TCP", 22), 4), (("BLOCK", "IN", "TCP", 22), 1),
+                 (("ALLOW", "IN", "TCP", 22), 3)]
+        self.assertEqual(attribute_to_rules(ports, rules), [(2, 7), (1, 1)])
+
+
+class TestLogTailer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.log = os.path.join(self.tmp.name, "ufw.log")
+        self.state = os.path.join(self.tmp.name, "state", "traffic.offset")
+
+    def _append(self, text, path=None):
+        with open(path or self.log, "a") as f:
+            f.write(text)
+
+    def test_incremental_reads_and_partial_lines(self):
+        tailer = LogTailer(self.log, self.state, TrafficIndex(100))
+        self.assertEqual(tailer.poll(), 0)
+        self._append(block() + block()[:40])
+        self.assertEqual(tailer.poll(), 1)
+        self._append(block()[40:])
+        self.assertEqual(tailer.poll(), 1)
+        self.assertEqual(tailer.poll(), 0)
+
+    @patch("traffic_log.READ_CHUNK", 300)
+    def test_backlog_read_in_chunks_within_budget(self):
+        tailer = LogTailer(self.log, self.state, TrafficIndex(100))
+        self._append(block() * 10)
+        self.assertEqual(tailer.poll(), 10)
+        self.assertTrue(tailer.caught_up)
+        self._append(block() * 10)
+        self.assertEqual(tailer.poll(budget=0), 1)
+        self.assertFalse(tailer.caught_up)
+        self.assertEqual(tailer.poll(), 9)
+        self.assertTrue(tailer.caught_up)
+
+    def test_resume_from_stored_offset(self):
+        self._append(block() * 2)
+        LogTailer(self.log, self.state, TrafficIndex(100)).poll()
+        self._append(block())
+        resumed = LogTailer(self.log, self.state, TrafficIndex(100))
+        self.assertEqual(resumed.poll(), 1)
+
+    def test_rotation_finishes_old_file(self):
+        tailer = LogTailer(self.log, self.state, TrafficIndex(100))
+        self._append(block())
+        tailer.poll()
+        self._append(block(port=80))
+        os.rename(self.log, self.log + ".1")
+        self._append(block(port=443))
+        self.assertEqual(tailer.poll(), 2)
+        ports = [key[3] for key, _ in tailer.index.top(window=60)["ports"]]
+        self.assertEqual(sorted(ports), [22, 80, 443])
+
+    def test_truncation_restarts_at_zero(self):
+        tailer = LogTailer(self.log, self.state, TrafficIndex(100))
+        self._append(block() * 3)
+        tailer.poll()
+        with open(self.log, "w") as f:
+            f.write(block())
+        self.assertEqual(tailer.poll(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import asyncio
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from collections import deque
+from unittest.mock import patch
+
+import rule_stats
+import ufw_service
+from ufw_helper import UfwHelper, serve
+from ufw_service import CommandResult, Rule, add_ufw_rule, delete_ufw_rule, helper_call, read_ufw_rules_native
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "ufw", "mixed")
+
+
+class RecordingRunner:
+    def __init__(self, result=CommandResult(0, "Rule added\n", "")):
+        self.result = result
+        self.calls = []
+
+    def __call__(self, argv, input=None):
+        self.calls.append((list(argv), input))
+        return self.result
+
+
+class TestUfwHelper(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        for name in ("ufw.conf", "user.rules", "user6.rules"):
+            shutil.copy(os.path.join(FIXTURE, name), self.tmp)
+        self.socket = os.path.join(self.tmp, "helper.sock")
+        patcher = patch.multiple(
+            ufw_service,
+            UFW_CONF_FILE=os.path.join(self.tmp, "ufw.conf"),
+            USER_RULES_FILE=os.path.join(self.tmp, "user.rules"),
+            USER6_RULES_FILE=os.path.join(self.tmp, "user6.rules"),
+            HELPER_SOCKET=self.socket,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.runner = RecordingRunner()
+        self.helper = UfwHelper(self.runner)
+        started = asyncio.Event()
+        self.server = asyncio.create_task(serve(self.socket, self.helper, started=started.set))
+        await asyncio.wait_for(started.wait(), 5)
+
+    async def asyncTearDown(self):
+        self.server.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await self.server
+
+    async def test_socket_is_private(self):
+        self.assertEqual(os.stat(self.socket).st_mode & 0o777, 0o600)
+
+    async def test_list_matches_file_backend_and_stays_warm(self):
+        expected = await read_ufw_rules_native()
+        self.assertEqual(await ufw_service._fetch_ufw_rules(), expected)
+        with patch("ufw_service.read_ufw_rules_native") as mock_read:
+            self.assertEqual(await helper_call("list"), expected)
+            self.assertEqual(await helper_call("status"), {"status": "active"})
+        mock_read.assert_not_called()
+
+    async def test_list_follows_file_changes(self):
+        before = await helper_call("list")
+        path = os.path.join(self.tmp, "ufw.conf")
+        with open(path) as f:
+            conf = f.read()
+        with open(path, "w") as f:
+            f.write(conf.replace("ENABLED=yes", "ENABLED=no"))
+        self.assertEqual(await helper_call("list"), {"status": "inactive", "rules": []})
+        self.assertNotEqual(before["status"], "inactive")
+
+    async def test_add_runs_ufw_with_the_rule(self):
+        result = await add_ufw_rule(Rule(action="allow", port="22", protocol="tcp", from_ip="10.0.0.0/8"))
+        self.assertEqual(result, {"status": "success", "message": "Rule added"})
+        self.assertEqual(self.runner.calls,
+                         [(["allow", "in", "from", "10.0.0.0/8", "to", "any", "port", "22", "proto", "tcp"], "y\n")])
+
+    async def test_add_validates_in_the_helper(self):
+        with self.assertRaises(subprocess.CalledProcessError) as raised:
+            await helper_call("add", rule={"action": "allow", "port": "99999"})
+        self.assertEqual(raised.exception.stderr, "Invalid port")
+        with self.assertRaises(subprocess.CalledProcessError) as raised:
+            await helper_call("add", rule={"action": "allow", "port": "22", "from_ip": "any; reboot"})
+        self.assertEqual(raised.exception.stderr, "Invalid source address")
+        self.assertEqual(self.runner.calls, [])
+
+    async def test_delete_and_ufw_errors(self):
+        self.runner.result = CommandResult(1, "", "ERROR: Could not find rule '40'\n")
+        result = await delete_ufw_rule(40)
+        self.assertEqual(result, {"status": "error", "message": "ERROR: Could not find rule '40'"})
+        self.assertEqual(self.runner.calls, [(["delete", "40"], "y\n")])
+        with self.assertRaises(subprocess.CalledProcessError):
+            await helper_call("delete", id="1; reboot")
+
+    async def test_rejects_unknown_operations_and_paths(self):
+        for op, args in (("run", {"argv": ["ufw", "reset"]}),
+                         ("read", {"path": "/etc/shadow"}),
+                         ("write", {"path": os.path.join(self.tmp, "ufw.conf"), "text": ""})):
+            with self.subTest(op=op), self.assertRaises(subprocess.CalledProcessError):
+                await helper_call(op, **args)
+        self.assertEqual(self.runner.calls, [])
+
+    async def test_read_and_write_rule_files(self):
+        path = ufw_service.USER_RULES_FILE
+        text = (await helper_call("read", path=path))["text"]
+        await helper_call("write", path=path, text=text + "\n")
+        self.assertEqual((await helper_call("read", path=path))["text"], text + "\n")
+        os.unlink(ufw_service.USER6_RULES_FILE)
+        with self.assertRaises(FileNotFoundError):
+            await helper_call("read", path=ufw_service.USER6_RULES_FILE)
+
+    async def test_write_accepts_only_ufw_rules_files(self):
+        path = ufw_service.USER_RULES_FILE
+        text = (await helper_call("read", path=path))["text"]
+        block = "### tuple ### deny tcp 25 0.0.0.0/0 any 0.0.0.0/0 out\n-A ufw-user-output -p tcp --dport 25 -j DROP\n"
+        for name, bad in (("foreign line", text.replace("### END RULES ###", "-A INPUT -j ACCEPT\n### END RULES ###")),
+                          ("tampered block", text.replace(block, block.replace("-j DROP", "-j ACCEPT"))),
+                          ("other family", text.replace("-A ufw-user-output", "-A ufw6-user-output")),
+                          ("other table", text.replace("COMMIT", "COMMIT\n*nat\n-A PREROUTING -j ACCEPT\nCOMMIT")),
+                          ("not a rules file", "reboot\n")):
+            with self.subTest(name), self.assertRaises(subprocess.CalledProcessError):
+                await helper_call("write", path=path, text=bad)
+        self.assertEqual((await helper_call("read", path=path))["text"], text)
+        with self.assertRaises(subprocess.CalledProcessError):
+            await helper_call("write", path=ufw_service.USER6_RULES_FILE, text=text)
+
+    async def test_counters(self):
+        async def run(args, timeout=None):
+            if "ip6tables" in args[0]:
+                raise FileNotFoundError(2, "No such file", args[0])
+            return CommandResult(0, "[4:400] -A ufw-user-input -p tcp -m tcp --dport 22 -j ACCEPT\n", "")
+
+        with patch("ufw_service.run_command_shared", side_effect=run), \
+                patch.multiple(rule_stats, _layout=None, _samples=deque(maxlen=4), _lock=None):
+            self.assertEqual(await helper_call("counters"),
+                             {"v4": "[4:400] -A ufw-user-input -p tcp -m tcp --dport 22 -j ACCEPT\n", "v6": ""})
+            result = await rule_stats.collect_rule_stats()
+        self.assertIn("ufw-user-input", result["out_of_sync"])  # one kernel line, the files list more
+        self.assertIn("ufw6-user-input", result["out_of_sync"])
+
+    async def test_unreachable_helper(self):
+        with patch("ufw_service.HELPER_SOCKET", os.path.join(self.tmp, "missing.sock")):
+            result = await add_ufw_rule(Rule(action="allow", port="22"))
+        self.assertEqual(result["status"], "error")
+        self.assertIn("not reachable", result["message"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,81 +1,218 @@
 # (C) 2025 by OPNLAB Development. All rights reserved.
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 
+import ufw_service
 from ufw_service import (
+    get_rules_snapshot,
     get_ufw_status,
     get_ufw_rules,
     add_ufw_rule,
     delete_ufw_rule,
     enable_ufw,
     disable_ufw,
+    invalidate_rules_cache,
+    run_command,
+    run_command_shared,
     Rule,
 )
 
-class TestUfwService(unittest.TestCase):
+NUMBERED_OUTPUT = (
+    "Status: active\n\n"
+    "     To                         Action      From\n"
+    "     --                         ------      ----\n"
+    "[ 1] 22/tcp                     ALLOW IN    Anywhere\n"
+    "[ 2] 80/tcp                     ALLOW IN    Anywhere\n"
+)
+
+
+def fake_process(stdout="", stderr="", returncode=0):
+    process = MagicMock()
+    process.pid = 0
+    process.returncode = returncode
+    process.communicate = AsyncMock(return_value=(stdout.encode(), stderr.encode()))
+    process.wait = AsyncMock(return_value=returncode)
+    return process
+
+
+def patch_exec(**kwargs):
+    """Patches process creation in ufw_service; kwargs go to `fake_process`."""
+    return patch('ufw_service.asyncio.create_subprocess_exec',
+                 new_callable=AsyncMock, return_value=fake_process(**kwargs))
+
+
+class TestUfwService(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        invalidate_rules_cache()
 
-    @patch('ufw_service.subprocess.run')
-    def test_get_ufw_status_active(self, mock_run):
-        mock_result = MagicMock()
-        mock_result.stdout = "Status: active"
-        mock_run.return_value = mock_result
-        status = get_ufw_status()
+    async def test_get_ufw_status_active(self):
+        with patch_exec(stdout="Status: active"):
+            status = await get_ufw_status()
         self.assertEqual(status, {"status": "active"})
 
-    @patch('ufw_service.subprocess.run')
-    def test_get_ufw_status_inactive(self, mock_run):
-        mock_result = MagicMock()
-        mock_result.stdout = "Status: inactive"
-        mock_run.return_value = mock_result
-        status = get_ufw_status()
+    async def test_get_ufw_status_inactive(self):
+        with patch_exec(stdout="Status: inactive"):
+            status = await get_ufw_status()
         self.assertEqual(status, {"status": "inactive"})
 
-    @patch('ufw_service.subprocess.run')
-    def test_get_ufw_rules(self, mock_run):
-        mock_result = MagicMock()
-        mock_result.stdout = "Status: active\nTo                         Action      From\n--                         ------      ----\n22/tcp                     ALLOW       Anywhere\n80/tcp                     ALLOW       Anywhere\n"
-        mock_run.return_value = mock_result
-        rules = get_ufw_rules()
+    async def test_get_ufw_rules(self):
+        with patch_exec(stdout=NUMBERED_OUTPUT):
+            rules = await get_ufw_rules()
         self.assertEqual(rules['status'], 'active')
-        self.assertEqual(len(rules['rules']), 2)
-        self.assertEqual(rules['rules'][0]['To'], '22/tcp')
-        self.assertEqual(rules['rules'][0]['Action'], 'ALLOW')
-        self.assertEqual(rules['rules'][0]['From'], 'Anywhere')
-
-
-    @patch('ufw_service.subprocess.run')
-    def test_add_ufw_rule(self, mock_run):
-        mock_result = MagicMock()
-        mock_result.stdout = "Rule added"
-        mock_run.return_value = mock_result
-        rule = Rule(action="allow", port="80", protocol="tcp")
-        result = add_ufw_rule(rule)
+        self.assertEqual(rules['rules'], [
+            {"id": 1, "to": "22/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+            {"id": 2, "to": "80/tcp", "action": "ALLOW", "direction": "IN", "from": "Anywhere"},
+        ])
+
+    async def test_add_ufw_rule(self):
+        with patch_exec(stdout="Rule added") as mock_exec:
+            rule = Rule(action="allow", port="80", protocol="tcp")
+            result = await add_ufw_rule(rule)
         self.assertEqual(result, {"status": "success", "message": "Rule added"})
+        self.assertEqual(mock_exec.call_args.args,
+                         ('sudo', '/usr/sbin/ufw', 'allow', 'in', 'to', 'any', 'port', '80', 'proto', 'tcp'))
 
-    @patch('ufw_service.subprocess.run')
-    def test_delete_ufw_rule(self, mock_run):
-        mock_result = MagicMock()
-        mock_result.stdout = "Rule deleted"
-        mock_run.return_value = mock_result
-        result = delete_ufw_rule(1)
+    async def test_delete_ufw_rule(self):
+        with patch_exec(stdout="Rule deleted"):
+            result = await delete_ufw_rule(1)
         self.assertEqual(result, {"status": "success", "message": "Rule deleted"})
 
-    @patch('ufw_service.subprocess.run')
-    def test_enable_ufw(self, mock_run):
-        mock_result = MagicMock()
-        mock_result.stdout = "Firewall is active and enabled on system startup"
-        mock_run.return_value = mock_result
-        result = enable_ufw()
+    async def test_enable_ufw(self):
+        with patch_exec(stdout="Firewall is active and enabled on system startup"):
+            result = await enable_ufw()
         self.assertEqual(result, {"status": "success", "message": "Firewall is active and enabled on system startup"})
 
-    @patch('ufw_service.subprocess.run')
-    def test_disable_ufw(self, mock_run):
-        mock_result = MagicMock()
-        mock_result.stdout = "Firewall stopped and disabled on system startup"
-        mock_run.return_value = mock_result
-        result = disable_ufw()
+    async def test_disable_ufw(self):
+        with patch_exec(stdout="Firewall stopped and disabled on system startup"):
+            result = await disable_ufw()
         self.assertEqual(result, {"status": "success", "message": "Firewall stopped and disabled on system startup"})
 
+    async def test_command_failure(self):
+        with patch_exec(stderr="ERROR: Could not find a profile matching 'foo'\n", returncode=1):
+            result = await delete_ufw_rule(9)
+        self.assertEqual(result, {"status": "error", "message": "ERROR: Could not find a profile matching 'foo'"})
+
+
+class TestRuleSnapshotCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        invalidate_rules_cache()
+
+    async def test_reads_share_one_snapshot(self):
+        with patch_exec(stdout=NUMBERED_OUTPUT) as mock_exec:
+            first = await get_ufw_rules()
+            self.assertEqual(await get_ufw_status(), {"status": "active"})
+            self.assertIs(await get_ufw_rules(), first)
+        self.assertEqual(mock_exec.call_count, 1)
+        self.assertEqual([r["id"] for r in first["rules"]], [1, 2])
+
+    async def test_mutation_invalidates_snapshot(self):
+        with patch_exec(stdout=NUMBERED_OUTPUT) as mock_exec:
+            await get_ufw_rules()
+            await delete_ufw_rule(2)
+            await get_ufw_rules()
+        self.assertEqual(mock_exec.call_count, 3)
+
+    async def test_watched_file_change_invalidates_snapshot(self):
+        with patch_exec(stdout=NUMBERED_OUTPUT) as mock_exec, tempfile.TemporaryDirectory() as tmp:
+            rules_file = os.path.join(tmp, "user.rules")
+            with open(rules_file, "w") as f:
+                f.write("### RULES ###\n")
+            with patch.object(ufw_service, "_WATCHED_FILES", [rules_file]):
+                await get_ufw_rules()
+                await get_ufw_rules()
+                self.assertEqual(mock_exec.call_count, 1)
+                with open(rules_file, "a") as f:
+                    f.write("### tuple ### allow tcp 443 0.0.0.0/0 any 0.0.0.0/0 in\n")
+                await get_ufw_rules()
+                self.assertEqual(mock_exec.call_count, 2)
+
+    async def test_version_and_etag_follow_content(self):
+        with patch_exec(stdout=NUMBERED_OUTPUT):
+            first = await get_rules_snapshot()
+            invalidate_rules_cache()
+            same = await get_rules_snapshot()
+        self.assertEqual(same.version, first.version)
+        self.assertEqual(same.etag, first.etag)
+
+        with patch_exec(stdout=NUMBERED_OUTPUT.replace("80/tcp", "81/tcp")):
+            invalidate_rules_cache()
+            changed = await get_rules_snapshot()
+        self.assertEqual(changed.version, first.version + 1)
+        self.assertNotEqual(changed.etag, first.etag)
+
+    async def test_errors_are_not_cached(self):
+        with patch('ufw_service.asyncio.create_subprocess_exec', side_effect=FileNotFoundError) as mock_exec:
+            snapshot = await get_rules_snapshot()
+            self.assertIsNone(snapshot.etag)
+            self.assertEqual(snapshot.data["message"], "ufw command not found")
+            await get_rules_snapshot()
+        self.assertEqual(mock_exec.call_count, 2)
+
+    async def test_concurrent_refreshes_share_one_child(self):
+        process = fake_process(stdout=NUMBERED_OUTPUT)
+
+        async def slow_communicate(_input):
+            await asyncio.sleep(0.05)
+            return NUMBERED_OUTPUT.encode(), b""
+        process.communicate = slow_communicate
+        with patch('ufw_service.asyncio.create_subprocess_exec', new_callable=AsyncMock,
+                   return_value=process) as mock_exec:
+            results = await asyncio.gather(*(get_ufw_rules() for _ in range(10)))
+        self.assertEqual(mock_exec.call_count, 1)
+        self.assertTrue(all(r == results[0] for r in results))
+
+
+class TestRunCommand(unittest.IsolatedAsyncioTestCase):
+    """Runs real (harmless) child processes."""
+
+    async def test_output_and_input(self):
+        result = await run_command([sys.executable, "-c", "import sys; print(sys.stdin.read().upper())"],
+                                   input="y\n")
+        self.assertEqual(result.stdout, "Y\n\n")
+
+    async def test_non_zero_exit(self):
+        with self.assertRaises(subprocess.CalledProcessError) as ctx:
+            await run_command([sys.executable, "-c", "import sys; sys.stderr.write('boom'); sys.exit(3)"])
+        self.assertEqual((ctx.exception.returncode, ctx.exception.stderr), (3, "boom"))
+
+    async def test_timeout_kills_child(self):
+        start = time.monotonic()
+        with self.assertRaises(subprocess.TimeoutExpired):
+            await run_command([sys.executable, "-c", "import time; time.sleep(30)"], timeout=0.2)
+        self.assertLess(time.monotonic() - start, 5)
+
+    async def test_cancellation_kills_child(self):
+        with patch('ufw_service._kill', wraps=ufw_service._kill) as mock_kill:
+            task = asyncio.create_task(run_command([sys.executable, "-c", "import time; time.sleep(30)"]))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        mock_kill.assert_called_once()
+
+    async def test_shared_call_survives_one_cancelled_waiter(self):
+        command = [sys.executable, "-c", "import time; time.sleep(0.3); print('done')"]
+        first = asyncio.create_task(run_command_shared(command))
+        second = asyncio.create_task(run_command_shared(command))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        self.assertEqual((await second).stdout, "done\n")
+
+    async def test_concurrency_is_bounded(self):
+        command = [sys.executable, "-c", "import time; time.sleep(0.2)"]
+        with patch.object(ufw_service, "UFW_MAX_CONCURRENCY", 2), patch.object(ufw_service, "_command_slots", {}):
+            start = time.monotonic()
+            await asyncio.gather(*(run_command(command) for _ in range(4)))
+        self.assertGreaterEqual(time.monotonic() - start, 0.4)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,164 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from users import UserError, UserStore, validate_user
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..")
+
+
+class TestUserStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "users.db")
+        self.store = UserStore(self.path, admin_hash="admin-hash")
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp)
+
+    def test_new_store_has_admin(self):
+        self.assertEqual(self.store.get("admin"),
+                         {"username": "admin", "hashed_password": "admin-hash", "role": "admin"})
+        self.assertIsNone(self.store.get("nobody"))
+
+    def test_put_and_remove(self):
+        self.assertTrue(self.store.put("alice", "readonly", "h1"))
+        self.assertFalse(self.store.put("alice", "admin"))
+        self.assertEqual(self.store.get("alice"), {"username": "alice", "hashed_password": "h1", "role": "admin"})
+        self.assertEqual([u["username"] for u in self.store.list()], ["admin", "alice"])
+        self.assertTrue(self.store.remove("alice"))
+        self.assertFalse(self.store.remove("alice"))
+        self.assertIsNone(self.store.get("alice"))
+
+    def test_new_user_needs_password(self):
+        with self.assertRaises(UserError):
+            self.store.put("bob", "readonly")
+
+    def test_last_admin_is_kept(self):
+        with self.assertRaises(UserError):
+            self.store.remove("admin")
+        with self.assertRaises(UserError):
+            self.store.put("admin", "readonly")
+        self.store.put("carol", "admin", "h")
+        self.store.put("admin", "readonly")
+        self.assertEqual(self.store.get("admin")["role"], "readonly")
+
+    def test_changes_by_other_process_are_seen(self):
+        self.assertIsNone(self.store.get("dave"))  # cached as unknown
+        other = UserStore(self.path)
+        try:
+            other.put("dave", "readonly", "h")
+            self.assertEqual(self.store.get("dave")["role"], "readonly")
+            other.put("dave", "admin")
+            self.assertEqual(self.store.get("dave")["role"], "admin")
+            other.remove("dave")
+            self.assertIsNone(self.store.get("dave"))
+        finally:
+            other.close()
+
+    def test_seed_only_once(self):
+        self.store.put("erin", "admin", "h")
+        self.store.remove("admin")
+        again = UserStore(self.path, admin_hash="other")
+        try:
+            self.assertIsNone(again.get("admin"))
+        finally:
+            again.close()
+
+    def test_validate(self):
+        self.assertIsNone(validate_user("frank", "long enough", "readonly"))
+        self.assertIsNotNone(validate_user("frank", "short", "readonly"))
+        self.assertIsNotNone(validate_user("frank", None, "root"))
+        self.assertIsNotNone(validate_user("../x", None, "admin"))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class TestWorkersShareStore(unittest.TestCase):
+    """Four uvicorn workers on one store: every worker sees every change."""
+
+    WORKERS = 4
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        port = _free_port()
+        cls.base = f"http://127.0.0.1:{port}"
+        env = dict(os.environ, WEBFIRE_STATE_DIR=cls.tmp, WEBFIRE_MUTATION_LOCK=os.path.join(cls.tmp, "lock"))
+        cls.server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(cls.WORKERS), "--log-level", "warning"],
+            cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                if httpx.get(cls.base + "/").status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline or cls.server.poll() is not None:
+                cls.tearDownClass()
+                raise RuntimeError("uvicorn did not start")
+            time.sleep(0.2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait(10)
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def _token(self, username, password):
+        response = httpx.post(self.base + "/api/token", data={"username": username, "password": password})
+        self.assertEqual(response.status_code, 200, response.text)
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    def _each_connection(self, method, path, headers, times=24, **kwargs):
+        # A new connection per request, so the requests spread over the workers.
+        with ThreadPoolExecutor(8) as pool:
+            return list(pool.map(lambda _: httpx.request(method, self.base + path, headers=headers, **kwargs),
+                                 range(times)))
+
+    def test_roles_across_workers(self):
+        admin = self._token("admin", "secret")
+
+        # Users created concurrently (through any worker) all land.
+        names = [f"user{n}" for n in range(12)]
+        with ThreadPoolExecutor(8) as pool:
+            responses = list(pool.map(
+                lambda name: httpx.put(f"{self.base}/api/users/{name}", headers=admin,
+                                       json={"password": "password1", "role": "readonly"}), names))
+        self.assertEqual([r.status_code for r in responses], [200] * len(names))
+        listed = httpx.get(self.base + "/api/users", headers=admin).json()
+        self.assertEqual(sorted(u["username"] for u in listed), sorted(names + ["admin"]))
+
+        viewer = self._token("user0", "password1")
+        self.assertEqual({r.status_code for r in self._each_connection("GET", "/api/users/me", viewer)}, {200})
+        self.assertEqual({r.status_code for r in self._each_connection("GET", "/api/users", viewer)}, {403})
+
+        # A promotion is seen by every worker on the next request.
+        response = httpx.put(self.base + "/api/users/user0", headers=admin, json={"role": "admin"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({r.status_code for r in self._each_connection("GET", "/api/users", viewer)}, {200})
+
+        # So is a deletion: the user's token stops working everywhere.
+        self.assertEqual(httpx.delete(self.base + "/api/users/user0", headers=admin).status_code, 200)
+        self.assertEqual({r.status_code for r in self._each_connection("GET", "/api/users/me", viewer)}, {401})
+
+
+if __name__ == "__main__":
+    unittest.main()
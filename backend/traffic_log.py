@@ -0,0 +1,344 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Incremental ingestion of UFW kernel log lines.
+
+`LogTailer` reads new bytes from the UFW log (default /var/log/ufw.log),
+resuming from an offset stored on disk and following logrotate renames and
+truncation. `TrafficIndex` parses `[UFW BLOCK]`/`[UFW ALLOW]`/... lines into
+fixed-width records held in preallocated arrays (a ring of the most recent
+`TRAFFIC_CAPACITY` packets) and answers top-N queries over a rolling time
+window from those arrays.
+
+Records are timestamped when ingested, not with the syslog time, so a
+backlog read after a restart is counted as recent traffic.
+"""
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from typing import List, Optional
+
+UFW_LOG_FILE = os.getenv("UFW_LOG_FILE", "/var/log/ufw.log")
+STATE_DIR = os.getenv("WEBFIRE_STATE_DIR", "/var/lib/webfire")
+TRAFFIC_STATE_FILE = os.path.join(STATE_DIR, "traffic.offset")
+# Number of most recent log records kept in memory.
+TRAFFIC_CAPACITY = int(os.getenv("WEBFIRE_TRAFFIC_CAPACITY", "500000"))
+TRAFFIC_POLL_INTERVAL = float(os.getenv("WEBFIRE_TRAFFIC_POLL_INTERVAL", "1"))
+# Bytes read and parsed at a time.
+READ_CHUNK = 4 * 1024 * 1024
+# Seconds a poll may spend on a backlog before saving its offset; the next
+# poll then starts right away instead of after `TRAFFIC_POLL_INTERVAL`.
+POLL_BUDGET = 1.0
+
+ACTIONS = ("BLOCK", "ALLOW", "LIMIT BLOCK", "AUDIT", "AUDIT INVALID")
+PROTOCOLS = ("", "TCP", "UDP", "ICMP", "ICMPv6", "other")
+_ACTION_CODES = {name.encode(): code for code, name in enumerate(ACTIONS)}
+_PROTO_CODES = {name.encode(): code for code, name in enumerate(PROTOCOLS) if name}
+_PROTO_OTHER = PROTOCOLS.index("other")
+# Direction: 0 = incoming (IN= set), 1 = outgoing, 2 = forwarded (both set).
+DIRECTIONS = ("IN", "OUT", "FWD")
+
+_LINE = re.compile(
+    rb"\[UFW ([A-Z ]+)\] IN=(\S*) OUT=(\S*) .*?SRC=(\S+) DST=\S+ .*?PROTO=(\S+)(?: SPT=\d+ DPT=(\d+))?"
+)
+
+
+class TrafficIndex:
+    """Ring buffer of parsed UFW log records with top-N queries."""
+
+    def __init__(self, capacity: int = TRAFFIC_CAPACITY):
+        self.capacity = capacity
+        # One column per field, preallocated so ingestion never allocates per record.
+        self.ts = array("I", bytes(4 * capacity))
+        self.action = array("B", bytes(capacity))
+        self.proto = array("B", bytes(capacity))
+        self.direction = array("B", bytes(capacity))
+        self.dport = array("H", bytes(2 * capacity))
+        self.src = array("I", bytes(4 * capacity))
+        self.head = 0  # next slot to write
+        self.size = 0
+        self.total = 0
+        # Source addresses are interned; records store the id.
+        self._ip_ids = {}
+        self._ips: List[str] = []
+        # Ingestion runs in a worker thread while queries run on the event loop.
+        self._lock = threading.Lock()
+
+    def _intern(self, ip: bytes) -> int:
+        ip_id = self._ip_ids.get(ip)
+        if ip_id is None:
+            ip_id = self._ip_ids[ip] = len(self._ips)
+            self._ips.append(ip.decode())
+        return ip_id
+
+    def _compact_ips(self):
+        # Drop addresses no longer referenced by any record in the ring.
+        live = sorted(set(self.src[i] for i in self._slots()))
+        remap = {old: new for new, old in enumerate(live)}
+        for i in self._slots():
+            self.src[i] = remap[self.src[i]]
+        self._ips = [self._ips[old] for old in live]
+        self._ip_ids = {ip.encode(): i for i, ip in enumerate(self._ips)}
+
+    def _slots(self):
+        start = (self.head - self.size) % self.capacity
+        return (((start + i) % self.capacity) for i in range(self.size))
+
+    def add_lines(self, data: bytes, now: Optional[float] = None) -> int:
+        """
+        Parses complete log lines and appends one record per UFW line.
+
+        Args:
+            data (bytes): Log data; lines without a UFW prefix are ignored.
+            now (float, optional): Timestamp for the records; defaults to the current time.
+
+        Returns:
+            int: The number of records added.
+        """
+        with self._lock:
+            return self._add_lines(data, int(now if now is not None else time.time()))
+
+    def _add_lines(self, data: bytes, ts: int) -> int:
+        if len(self._ips) >= 4 * self.capacity:
+            self._compact_ips()
+        head, capacity = self.head, self.capacity
+        ts_col, action_col, proto_col = self.ts, self.action, self.proto
+        direction_col, dport_col, src_col = self.direction, self.dport, self.src
+        actions, protos, intern = _ACTION_CODES, _PROTO_CODES, self._intern
+        count = 0
+        for action, iface_in, iface_out, src, proto, dport in _LINE.findall(data):
+            code = actions.get(action)
+            if code is None:
+                continue
+            ts_col[head] = ts
+            action_col[head] = code
+            proto_col[head] = protos.get(proto, _PROTO_OTHER)
+            direction_col[head] = 2 if iface_in and iface_out else (0 if iface_in else 1)
+            dport_col[head] = int(dport) if dport else 0
+            src_col[head] = intern(src)
+            head += 1
+            if head == capacity:
+                head = 0
+            count += 1
+        self.head = head
+        self.size = min(self.capacity, self.size + count)
+        self.total += count
+        return count
+
+    def _segments(self, since: int) -> List[tuple]:
+        """Physical (start, stop) ranges of the records with ts >= since, oldest first."""
+        start = (self.head - self.size) % self.capacity if self.size else 0
+        # Records are appended in time order: binary search the logical index.
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.ts[(start + middle) % self.capacity] < since:
+                low = middle + 1
+            else:
+                high = middle
+        first = (start + low) % self.capacity
+        count = self.size - low
+        if count == 0:
+            return []
+        if first + count <= self.capacity:
+            return [(first, first + count)]
+        return [(first, self.capacity), (0, first + count - self.capacity)]
+
+    def top(self, window: int = 3600, limit: int = 10, now: Optional[float] = None) -> dict:
+        """
+        Counts records of the last `window` seconds by action, source and port.
+
+        Args:
+            window (int): Window length in seconds.
+            limit (int): Number of entries per top list.
+            now (float, optional): End of the window; defaults to the current time.
+
+        Returns:
+            dict: {"records", "actions", "sources", "ports"} where ports are
+            keyed by (action, direction, protocol, port).
+        """
+        since = int((now if now is not None else time.time()) - window)
+        actions, sources, ports = Counter(), Counter(), Counter()
+        records = 0
+        with self._lock:
+            for a, b in self._segments(since):
+                records += b - a
+                action = self.action[a:b]
+                actions.update(action)
+                sources.update(self.src[a:b])
+                ports.update(zip(action, self.direction[a:b], self.proto[a:b], self.dport[a:b]))
+            top_sources = [(self._ips[ip_id], n) for ip_id, n in sources.most_common(limit)]
+        return {
+            "records": records,
+            "actions": {ACTIONS[code]: n for code, n in actions.most_common()},
+            "sources": top_sources,
+            "ports": [
+                ((ACTIONS[a], DIRECTIONS[d], PROTOCOLS[p], port), n)
+                for (a, d, p, port), n in ports.most_common() if port
+            ],
+        }
+
+
+class LogTailer:
+    """Reads a log file incrementally, persisting the read position."""
+
+    def __init__(self, path: str = UFW_LOG_FILE, state_file: Optional[str] = TRAFFIC_STATE_FILE,
+                 index: Optional[TrafficIndex] = None):
+        self.path = path
+        self.state_file = state_file
+        self.index = index if index is not None else TrafficIndex()
+        self.inode, self.offset = self._load_state()
+        # False while a poll stopped on its time budget with data left to read.
+        self.caught_up = True
+
+    def _load_state(self):
+        if not self.state_file:
+            return None, 0
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+            return state.get("inode"), int(state.get("offset", 0))
+        except (OSError, ValueError):
+            return None, 0
+
+    def _save_state(self):
+        if not self.state_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            tmp_path = self.state_file + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"inode": self.inode, "offset": self.offset}, f)
+            os.replace(tmp_path, self.state_file)
+        except OSError:
+            pass  # Resuming is best effort; counting continues in memory.
+
+    def _read_from(self, path: str, offset: int, limit: int):
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(limit)
+        # Only consume complete lines; the rest is read on the next poll.
+        end = data.rfind(b"\n") + 1
+        return data[:end], offset + end
+
+    def poll(self, now: Optional[float] = None, budget: float = POLL_BUDGET) -> int:
+        """
+        Ingests everything appended since the last poll, `READ_CHUNK` bytes at
+        a time, until the end of the file or until `budget` seconds have passed.
+
+        Returns:
+            int: The number of records added.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return 0
+        added = 0
+        if self.inode is not None and st.st_ino != self.inode:
+            # Rotated: finish the old file if logrotate kept it next to the new one.
+            rotated = self.path + ".1"
+            try:
+                if os.stat(rotated).st_ino == self.inode:
+                    while True:
+                        data, self.offset = self._read_from(rotated, self.offset, READ_CHUNK)
+                        if not data:
+                            break
+                        added += self.index.add_lines(data, now)
+            except OSError:
+                pass
+            self.inode, self.offset = st.st_ino, 0
+        elif self.inode is None:
+            self.inode = st.st_ino
+        if st.st_size < self.offset:
+            self.offset = 0  # truncated in place (copytruncate)
+        deadline = time.monotonic() + budget
+        self.caught_up = True
+        while st.st_size > self.offset:
+            data, self.offset = self._read_from(self.path, self.offset, READ_CHUNK)
+            if not data:
+                break  # at the end, or only a partial line left
+            added += self.index.add_lines(data, now)
+            if time.monotonic() >= deadline:
+                self.caught_up = False
+                break
+        self._save_state()
+        return added
+
+
+def _port_matches(spec: str, port: int) -> bool:
+    for part in spec.split(","):
+        low, _, high = part.partition(":")
+        if low.isdigit() and int(low) <= port <= int(high or low):
+            return True
+    return False
+
+
+def _rule_port_spec(rule: dict):
+    """Extracts (ports, protocol) from a listed rule's To column, e.g. "10.0.0.1 80,443/tcp"."""
+    to = rule["to"].replace(" (v6)", "").split(" on ")[0]
+    last = to.split()[-1]
+    ports, _, proto = last.partition("/")
+    if not ports[:1].isdigit():
+        return None
+    return ports, proto.upper()
+
+
+# Rule actions a logged action can come from; other log actions come from
+# rules that are neither ALLOW nor LIMIT.
+_RULE_ACTIONS = {"ALLOW": ("ALLOW", "LIMIT"), "LIMIT BLOCK": ("LIMIT",)}
+
+
+def attribute_to_rules(ports: list, rules: List[dict]) -> List[tuple]:
+    """
+    Attributes per-port counts to listed rules.
+
+    UFW log lines do not name the rule that matched, so each (action,
+    direction, protocol, port) count is credited to the first rule with a
+    compatible action and direction that covers the port: ALLOW lines to
+    ALLOW or LIMIT rules, LIMIT BLOCK lines to LIMIT rules, others to the
+    remaining rules.
+
+    Args:
+        ports (list): The "ports" entries of `TrafficIndex.top`.
+        rules (list): Rules as returned by `get_ufw_rules`.
+
+    Returns:
+        list: (rule id, count) pairs, highest count first.
+    """
+    compiled = []
+    for rule in rules:
+        spec = _rule_port_spec(rule)
+        if spec:
+            compiled.append((rule["id"], rule["action"], rule["direction"], spec[0], spec[1]))
+    counts = Counter()
+    for (action, direction, proto, port), n in ports:
+        accepted = _RULE_ACTIONS.get(action)
+        for rule_id, rule_action, rule_direction, spec, rule_proto in compiled:
+            compatible = rule_action in accepted if accepted else rule_action not in ("ALLOW", "LIMIT")
+            if not compatible:
+                continue
+            if rule_direction and rule_direction != direction:
+                continue
+            if rule_proto and rule_proto != proto:
+                continue
+            if _port_matches(spec, port):
+                counts[rule_id] += n
+                break
+    return counts.most_common()
+
+
+traffic_tailer = LogTailer()
+
+
+async def run_traffic_ingestion(tailer: LogTailer = traffic_tailer, interval: float = TRAFFIC_POLL_INTERVAL):
+    """
+    Polls the UFW log forever; file reads and parsing run in a worker thread.
+    A backlog is read in back-to-back polls, sleeping only once caught up.
+    """
+    while True:
+        await asyncio.to_thread(tailer.poll)
+        if tailer.caught_up:
+            await asyncio.sleep(interval)
@@ -0,0 +1,341 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Privileged helper: a long-lived root process that runs ufw for the API.
+
+Without it every ufw call is `sudo /usr/sbin/ufw ...`: a sudo session, a new
+Python interpreter, ufw's imports and a fresh read of its configuration, for
+each request. With the helper running and `WEBFIRE_HELPER_SOCKET` set, the
+API (which then needs neither root nor sudo for ufw) sends requests over a
+Unix socket instead:
+
+- ufw commands run through ufw's own frontend, imported once into this
+  process (`ModuleRunner`); the frontend and the rules it parsed are kept
+  between commands and rebuilt only when the rule files change behind our
+  back. Where the ufw package cannot be imported the executable is run
+  instead (`ExecRunner`), which still saves the sudo session.
+- Listings are parsed from user.rules/user6.rules and kept until one of the
+  watched files changes, so a read costs a stat and a reply.
+- Commands are serialized; listings are answered while one runs.
+
+Protocol: one JSON object per line each way, one request per connection.
+
+    request: {"op": "add", "args": {"rule": {...}}}
+    reply:   {"ok": true, "result": {...}}
+             {"ok": false, "error": "message"[, "errno": n]}
+
+Operations (nothing else is accepted, in particular no command lines):
+
+- `status` -> {"status": "active" | "inactive"}
+- `list` -> {"status", "rules"}, as returned by `ufw_service.get_ufw_rules`
+- `add` {"rule": Rule fields} -> {"output"}; the rule is validated here
+- `delete` {"id": int} -> {"output"}
+- `enable`, `disable`, `reload` -> {"output"}
+- `read` {"path"} -> {"text"}, for ufw.conf, user.rules and user6.rules
+- `write` {"path", "text"} -> {}, for user.rules and user6.rules; the
+  text must be a rules file as ufw writes it (`check_rules_file`)
+- `counters` -> {"v4", "v6"}: `iptables-save -c -t filter` and
+  `ip6tables-save -c -t filter` (empty when IPv6 is unavailable)
+
+Usage (as root):
+    python ufw_helper.py --socket /run/webfire/helper.sock --group webfire
+"""
+import argparse
+import asyncio
+import grp
+import json
+import logging
+import os
+import subprocess
+from typing import Callable, List, Optional, Sequence
+
+from pydantic import ValidationError
+
+import rule_stats
+import ufw_service
+from ufw_service import HELPER_MAX_MESSAGE, CommandResult, Rule, validate_rule
+
+logger = logging.getLogger("webfire.helper")
+
+UFW_EXECUTABLE = "/usr/sbin/ufw"
+
+Runner = Callable[[Sequence[str], Optional[str]], CommandResult]
+
+
+def _stamp() -> tuple:
+    stamp = []
+    for path in (ufw_service.USER_RULES_FILE, ufw_service.USER6_RULES_FILE, ufw_service.UFW_CONF_FILE):
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+class ExecRunner:
+    """Runs the ufw executable; no sudo, the helper already is root."""
+
+    def __init__(self, executable: str = UFW_EXECUTABLE):
+        self.executable = executable
+
+    def __call__(self, argv: Sequence[str], input: Optional[str] = None) -> CommandResult:
+        result = subprocess.run([self.executable, *argv], input=input, capture_output=True, text=True,
+                                timeout=ufw_service.UFW_COMMAND_TIMEOUT)
+        return CommandResult(result.returncode, result.stdout, result.stderr)
+
+
+class ModuleRunner:
+    """
+    Runs commands through ufw's Python frontend in this process.
+
+    Does what /usr/sbin/ufw does once it has parsed its arguments, with
+    `--force` (the API confirms every prompt). The frontend is reused while
+    the rule files are unchanged, so its backend does not re-read them.
+
+    Raises:
+        ImportError: If the ufw package is not installed.
+    """
+
+    def __init__(self):
+        import gettext
+
+        gettext.install("ufw")  # ufw's modules expect _() as a builtin
+        import ufw.common
+        import ufw.frontend
+        import ufw.util
+
+        self._ufw = ufw
+        self._frontend = None
+        self._stamp: Optional[tuple] = None
+
+    def __call__(self, argv: Sequence[str], input: Optional[str] = None) -> CommandResult:
+        ufw = self._ufw
+        create_lock = getattr(ufw.util, "create_lock", None)  # ufw >= 0.36
+        lock = create_lock() if create_lock else None
+        try:
+            command = ufw.frontend.parse_command(["ufw", *argv])
+            if self._frontend is None or self._stamp != _stamp():
+                self._frontend = ufw.frontend.UFWFrontend(command.dryrun)
+            output = self._frontend.do_action(command.action, command.data.get("rule", ""),
+                                              command.data.get("iptype", ""), True)
+        except ufw.common.UFWError as e:
+            self._frontend = None
+            return CommandResult(1, "", f"ERROR: {e.value}\n")
+        except ValueError as e:
+            return CommandResult(1, "", f"ERROR: Invalid syntax: {e}\n")
+        except SystemExit:
+            # ufw.util.error() exits after printing to our stderr.
+            self._frontend = None
+            return CommandResult(1, "", "ERROR: ufw rejected the command (see the helper's log)\n")
+        finally:
+            if lock is not None:
+                ufw.util.release_lock(lock)
+        self._stamp = _stamp()
+        return CommandResult(0, (output or "").rstrip("\n") + "\n", "")
+
+
+def default_runner() -> Runner:
+    """ufw's frontend in-process if the ufw package is importable, else the executable."""
+    try:
+        return ModuleRunner()
+    except ImportError:
+        logger.warning("ufw package not importable; running %s for each command", UFW_EXECUTABLE)
+        return ExecRunner()
+
+
+class HelperRequestError(Exception):
+    def __init__(self, message: str, errno: Optional[int] = None):
+        super().__init__(message)
+        self.errno = errno
+
+
+class UfwHelper:
+    """Answers the helper protocol; see the module docstring."""
+
+    def __init__(self, runner: Runner):
+        self.runner = runner
+        self._lock: Optional[asyncio.Lock] = None
+        self._listing: Optional[tuple] = None  # (stamp, data, encoded reply)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            line = await reader.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line)
+                if request["op"] == "list":
+                    writer.write(await self.listing_reply())
+                    await writer.drain()
+                    return
+                result = await self.dispatch(request["op"], request.get("args") or {})
+                reply = {"ok": True, "result": result}
+            except HelperRequestError as e:
+                reply = {"ok": False, "error": str(e)}
+                if e.errno is not None:
+                    reply["errno"] = e.errno
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {"ok": False, "error": f"Bad request: {e}"}
+            writer.write(json.dumps(reply).encode() + b"\n")
+            await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass  # client went away or sent an oversized line
+        finally:
+            writer.close()
+
+    async def dispatch(self, op: str, args: dict) -> dict:
+        if op == "list":
+            return await self.listing()
+        if op == "status":
+            return {"status": (await self.listing())["status"]}
+        if op == "read":
+            return {"text": self._read(self._path(args["path"], _READABLE))}
+        if op == "write":
+            path = self._path(args["path"], _WRITABLE)
+            text = str(args["text"])
+            error = ufw_service.check_rules_file(text, v6=path == ufw_service.USER6_RULES_FILE)
+            if error:
+                raise HelperRequestError(error)
+            async with self._mutations():
+                await ufw_service.write_rules_file(path, text)
+            return {}
+        if op == "add":
+            try:
+                rule = Rule(**args["rule"])
+            except ValidationError as e:
+                raise HelperRequestError("; ".join(error["msg"].removeprefix("Value error, ") for error in e.errors()))
+            error = validate_rule(rule)
+            if error:
+                raise HelperRequestError(error)
+            return await self._run(ufw_service.rule_command(rule)[2:])
+        if op == "delete":
+            rule_id = args["id"]
+            if not isinstance(rule_id, int) or isinstance(rule_id, bool) or rule_id < 1:
+                raise HelperRequestError("Invalid rule id")
+            return await self._run(["delete", str(rule_id)])
+        if op in ("enable", "disable", "reload"):
+            return await self._run([op])
+        if op == "counters":
+            return await self.counters()
+        raise HelperRequestError(f"Unknown operation: {op}")
+
+    async def listing(self) -> dict:
+        stamp = _stamp()
+        cached = self._listing
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        data = await ufw_service.read_ufw_rules_native()
+        if data["status"] != "error":
+            self._listing = (stamp, data, None)
+        return data
+
+    async def listing_reply(self) -> bytes:
+        """The encoded reply to `list`, kept with the listing: a large one takes milliseconds to encode."""
+        data = await self.listing()
+        cached = self._listing
+        if cached is None or cached[1] is not data:
+            return json.dumps({"ok": True, "result": data}).encode() + b"\n"
+        if cached[2] is None:
+            self._listing = cached = (cached[0], data, json.dumps({"ok": True, "result": data}).encode() + b"\n")
+        return cached[2]
+
+    async def counters(self) -> dict:
+        results = await asyncio.gather(
+            *(ufw_service.run_command_shared([command, "-c", "-t", "filter"])
+              for command in (rule_stats.IPTABLES_SAVE, rule_stats.IP6TABLES_SAVE)),
+            return_exceptions=True)
+        dumps = {}
+        for family, result in zip(("v4", "v6"), results):
+            if isinstance(result, (OSError, subprocess.SubprocessError)):
+                if family == "v4":
+                    raise HelperRequestError(f"iptables-save failed: {getattr(result, 'stderr', None) or result}")
+                result = CommandResult(1, "", "")
+            elif isinstance(result, BaseException):
+                raise result
+            dumps[family] = result.stdout
+        return dumps
+
+    def _mutations(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _run(self, argv: List[str]) -> dict:
+        async with self._mutations():
+            try:
+                result = await asyncio.to_thread(self.runner, argv, "y\n")
+            except subprocess.TimeoutExpired:
+                raise HelperRequestError("ufw command timed out")
+            finally:
+                self._listing = None
+        if result.returncode != 0:
+            raise HelperRequestError(result.stderr.strip() or f"ufw exited with {result.returncode}")
+        return {"output": result.stdout}
+
+    @staticmethod
+    def _path(path: str, allowed: Sequence[str]) -> str:
+        if path not in [getattr(ufw_service, name) for name in allowed]:
+            raise HelperRequestError(f"Path not allowed: {path}")
+        return path
+
+    @staticmethod
+    def _read(path: str) -> str:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        except OSError as e:
+            raise HelperRequestError(f"{path}: {e.strerror}", e.errno)
+
+
+_READABLE = ("UFW_CONF_FILE", "USER_RULES_FILE", "USER6_RULES_FILE")
+_WRITABLE = ("USER_RULES_FILE", "USER6_RULES_FILE")
+
+
+async def serve(path: str, helper: UfwHelper, group: Optional[str] = None,
+                started: Optional[Callable[[], None]] = None):
+    """
+    Listens on a Unix socket until cancelled.
+
+    The socket is created with mode 0660 (0600 without `group`), so only
+    root and members of `group` can connect.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if os.path.exists(path):
+        os.unlink(path)  # left over from a previous run
+    umask = os.umask(0o177)
+    try:
+        server = await asyncio.start_unix_server(helper.handle, path=path, limit=HELPER_MAX_MESSAGE)
+    finally:
+        os.umask(umask)
+    if group:
+        os.chown(path, -1, grp.getgrnam(group).gr_gid)
+        os.chmod(path, 0o660)
+    if started:
+        started()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def main(runner: Optional[Runner] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=ufw_service.HELPER_SOCKET or "/run/webfire/helper.sock")
+    parser.add_argument("--group", help="Group allowed to connect (the API's)")
+    parser.add_argument("--ufw", choices=["auto", "module", "exec"], default="auto",
+                        help="Run ufw in-process (module), as a child (exec), or module when available")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(message)s")
+
+    if runner is None:
+        runner = {"auto": default_runner, "module": ModuleRunner, "exec": ExecRunner}[args.ufw]()
+    logger.info("Listening on %s", args.socket)
+    try:
+        asyncio.run(serve(args.socket, UfwHelper(runner), args.group))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,133 +1,838 @@
 # (C) 2025 by OPNLAB Development. All rights reserved.
+import asyncio
+import hashlib
+import ipaddress
+import json
+import os
+import signal
 import subprocess
 import re
-from pydantic import BaseModel
-from typing import Optional
+import tempfile
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from pydantic import BaseModel, field_validator, model_validator
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
 
-def get_ufw_status():
+from app_catalog import get_catalog
+from metrics import Gauge, Histogram, add_timing, cache_lookups
+
+# Files whose modification invalidates the cached rule snapshot. `ufw` rewrites
+# user.rules/user6.rules on every rule change and ufw.conf on enable/disable,
+# so a changed stat signature means someone (us, the CLI, config management)
+# touched the firewall.
+UFW_CONF_DIR = os.getenv("UFW_CONF_DIR", "/etc/ufw")
+USER_RULES_FILE = os.path.join(UFW_CONF_DIR, "user.rules")
+USER6_RULES_FILE = os.path.join(UFW_CONF_DIR, "user6.rules")
+UFW_CONF_FILE = os.path.join(UFW_CONF_DIR, "ufw.conf")
+_WATCHED_FILES = [USER_RULES_FILE, USER6_RULES_FILE, UFW_CONF_FILE]
+
+# Where rule listings come from: "status" parses `ufw status numbered`, "file"
+# reads the `### tuple ###` lines of user.rules/user6.rules directly.
+UFW_RULES_BACKEND = os.getenv("UFW_RULES_BACKEND", "status")
+
+# Per-command timeout (seconds) and the number of ufw/sudo children that may run
+# at once. Commands beyond the limit wait for a free slot.
+UFW_COMMAND_TIMEOUT = float(os.getenv("UFW_COMMAND_TIMEOUT", "30"))
+UFW_MAX_CONCURRENCY = int(os.getenv("UFW_MAX_CONCURRENCY", "4"))
+
+# Upper bound on snapshot age. Covers hosts where the watched files cannot be
+# stat'ed (e.g. /etc/ufw not visible to the API process).
+CACHE_MAX_AGE = float(os.getenv("UFW_CACHE_MAX_AGE", "60"))
+
+# Socket of the privileged helper (ufw_helper.py). When set, ufw commands and
+# root-only rule file access go to the helper instead of through sudo.
+HELPER_SOCKET = os.getenv("WEBFIRE_HELPER_SOCKET")
+# Longest protocol line either side accepts (a listing of ~100k rules).
+HELPER_MAX_MESSAGE = 64 * 1024 * 1024
+
+
+# --- Subprocess execution ---
+class CommandResult(NamedTuple):
+    returncode: int
+    stdout: str
+    stderr: str
+
+
+# Semaphores and in-flight calls are per event loop (the test client runs one
+# loop per client).
+_command_slots: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_inflight: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+_commands_waiting = 0
+_commands_running = 0
+
+command_slot_wait = Histogram("webfire_command_slot_wait_seconds",
+                              "Time a child process waited for one of the UFW_MAX_CONCURRENCY slots.", ("command",))
+command_spawn = Histogram("webfire_command_spawn_seconds",
+                          "Time to start a child process (fork and exec of sudo or the command).", ("command",))
+command_duration = Histogram("webfire_command_duration_seconds",
+                             "Time from start to exit of a child process (sudo, ufw startup and work).", ("command",))
+rules_parse = Histogram("webfire_rules_parse_seconds",
+                        "Time to parse a rule listing, by backend (status or file).", ("backend",))
+Gauge("webfire_command_slots_in_use", "Child processes running, out of UFW_MAX_CONCURRENCY.",
+      lambda: _commands_running)
+Gauge("webfire_command_slots_waiting", "Child processes waiting for a free slot.", lambda: _commands_waiting)
+
+
+def command_name(args: Sequence[str]) -> str:
+    """Metric label for a command: the executable, plus the verb for ufw and ipset."""
+    words = [arg for arg in args if not arg.startswith("-")]
+    if words and words[0] == "sudo":
+        words = words[1:]
+    if not words:
+        return "unknown"
+    name = os.path.basename(words[0])
+    if name in ("ufw", "ipset") and len(words) > 1:
+        name += " " + words[1]
+    return name
+
+
+def _slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _command_slots.get(loop)
+    if semaphore is None:
+        semaphore = _command_slots[loop] = asyncio.Semaphore(UFW_MAX_CONCURRENCY)
+    return semaphore
+
+
+def _kill(process):
+    # The child runs in its own session, so this also reaches ufw (or the
+    # iptables processes it spawned) behind sudo.
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+
+async def run_command(args: Sequence[str], input: Optional[str] = None,
+                      timeout: Optional[float] = None) -> CommandResult:
+    """
+    Runs a command in a child process without blocking the event loop.
+
+    At most `UFW_MAX_CONCURRENCY` children run at once. If the call times out
+    or the awaiting task is cancelled, the child (and its process group) is
+    killed before the exception propagates.
+
+    Args:
+        args (Sequence[str]): Command and arguments.
+        input (str, optional): Text written to the child's stdin.
+        timeout (float, optional): Seconds to wait; defaults to `UFW_COMMAND_TIMEOUT`.
+
+    Returns:
+        CommandResult: Exit code and decoded output.
+
+    Raises:
+        FileNotFoundError: The executable does not exist.
+        subprocess.CalledProcessError: The command exited with a non-zero code.
+        subprocess.TimeoutExpired: The command did not finish in time.
+    """
+    global _commands_waiting, _commands_running
+    timeout = UFW_COMMAND_TIMEOUT if timeout is None else timeout
+    command = command_name(args)
+    queued = time.perf_counter()
+    _commands_waiting += 1
+    try:
+        await _slots().acquire()
+    finally:
+        _commands_waiting -= 1
+    _commands_running += 1
+    try:
+        started = time.perf_counter()
+        command_slot_wait.observe(started - queued, command)
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+        )
+        spawned = time.perf_counter()
+        command_spawn.observe(spawned - started, command)
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(input.encode() if input is not None else None), timeout)
+        except asyncio.TimeoutError:
+            _kill(process)
+            await process.wait()
+            raise subprocess.TimeoutExpired(list(args), timeout)
+        except asyncio.CancelledError:
+            _kill(process)
+            raise
+        finally:
+            finished = time.perf_counter()
+            command_duration.observe(finished - spawned, command)
+            add_timing("slot-wait", started - queued)
+            add_timing("spawn", spawned - started)
+            add_timing(command.replace(" ", "-"), finished - spawned)
+    finally:
+        _commands_running -= 1
+        _slots().release()
+    result = CommandResult(process.returncode, stdout.decode(errors="replace"),
+                           stderr.decode(errors="replace"))
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, list(args), result.stdout, result.stderr)
+    return result
+
+
+class _SharedCall:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+async def run_command_shared(args: Sequence[str], timeout: Optional[float] = None) -> CommandResult:
+    """
+    Like `run_command`, but concurrent calls with identical arguments share one child.
+
+    Only for read-only commands. The child is killed once every caller
+    waiting on it has been cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    calls = _inflight.setdefault(loop, {})
+    key = tuple(args)
+    call = calls.get(key)
+    if call is None:
+        call = _SharedCall(loop.create_task(run_command(args, timeout=timeout)))
+        calls[key] = call
+        call.task.add_done_callback(lambda _: calls.pop(key, None))
+    call.waiters += 1
+    try:
+        return await asyncio.shield(call.task)
+    except asyncio.CancelledError:
+        if call.waiters == 1:
+            call.task.cancel()
+        raise
+    finally:
+        call.waiters -= 1
+
+
+# --- Privileged helper client ---
+helper_duration = Histogram("webfire_helper_call_seconds",
+                            "Time from connecting to the privileged helper to its reply, by operation.", ("op",))
+
+
+async def helper_call(op: str, **args) -> dict:
+    """
+    Sends one request to the privileged helper and returns its result.
+
+    Failures are raised as the exceptions `run_command` raises, so callers
+    handle the helper and sudo the same way.
+
+    Args:
+        op (str): Operation; see ufw_helper.py for the protocol.
+        **args: Its arguments.
+
+    Raises:
+        OSError: The helper reported a file error (e.g. FileNotFoundError for a missing file).
+        subprocess.CalledProcessError: The helper is unreachable, refused the
+            request, or ufw failed; `stderr` holds the message.
+        subprocess.TimeoutExpired: No reply within `UFW_COMMAND_TIMEOUT`.
+    """
+    command = ["webfire-helper", op]
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_unix_connection(HELPER_SOCKET, limit=HELPER_MAX_MESSAGE), UFW_COMMAND_TIMEOUT)
+    except OSError as e:
+        raise subprocess.CalledProcessError(
+            1, command, "", f"Privileged helper not reachable at {HELPER_SOCKET}: {e.strerror or e}")
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(command, UFW_COMMAND_TIMEOUT)
+    try:
+        writer.write(json.dumps({"op": op, "args": args}).encode() + b"\n")
+        line = await asyncio.wait_for(reader.readline(), UFW_COMMAND_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(command, UFW_COMMAND_TIMEOUT)
+    except (ConnectionError, ValueError) as e:
+        raise subprocess.CalledProcessError(1, command, "", f"Privileged helper connection failed: {e}")
+    finally:
+        writer.close()
+        elapsed = time.perf_counter() - started
+        helper_duration.observe(elapsed, op)
+        add_timing("helper-" + op, elapsed)
+    if not line:
+        raise subprocess.CalledProcessError(1, command, "", "Privileged helper closed the connection")
+    reply = json.loads(line)
+    if not reply["ok"]:
+        if "errno" in reply:
+            raise OSError(reply["errno"], reply["error"], args.get("path"))
+        raise subprocess.CalledProcessError(1, command, "", reply["error"])
+    return reply["result"]
+
+
+async def run_ufw(op: str, args: List[str], input: Optional[str] = None, **params) -> CommandResult:
+    """
+    Runs a ufw command: through the privileged helper when `HELPER_SOCKET` is
+    set, else as `sudo /usr/sbin/ufw <args>`.
+
+    Args:
+        op (str): Helper operation for the command.
+        args (List[str]): ufw arguments, for sudo.
+        input (str, optional): Text written to ufw's stdin, for sudo.
+        **params: Helper operation arguments.
+
+    Raises:
+        As `run_command`.
+    """
+    if HELPER_SOCKET:
+        result = await helper_call(op, **params)
+        return CommandResult(0, result.get("output", ""), "")
+    # WARNING: This executes a system command with `sudo`.
+    return await run_command(['sudo', '/usr/sbin/ufw', *args], input=input)
+
+
+# --- Rule snapshot cache ---
+@dataclass(frozen=True)
+class RuleSnapshot:
+    """An immutable view of the parsed `ufw status numbered` output.
+
+    `data` is shared between callers and must not be mutated.
+    """
+    version: int
+    etag: Optional[str]
+    data: dict
+    stamp: tuple
+    captured_at: float
+
+
+_snapshot: Optional[RuleSnapshot] = None
+_snapshot_version = 0
+_last_etag: Optional[str] = None
+# Bumped by every invalidation so a refresh that raced a mutation is not stored.
+_generation = 0
+# Recent snapshot contents by ETag, so IDs a client saw in an older listing
+# can still be mapped to rules (see `get_snapshot_data`).
+SNAPSHOT_HISTORY_SIZE = 32
+_snapshot_history: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def _watched_stamp():
+    stamp = []
+    for path in _WATCHED_FILES:
+        try:
+            st = os.stat(path)
+            stamp.append((st.st_ino, st.st_size, st.st_mtime_ns))
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def _compute_etag(data: dict) -> str:
+    payload = json.dumps(data, sort_keys=True, separators=(",", ":")).encode()
+    return '"%s"' % hashlib.blake2b(payload, digest_size=8).hexdigest()
+
+
+def invalidate_rules_cache():
+    """Drops the cached snapshot so the next read goes to ufw again."""
+    global _snapshot, _generation
+    _generation += 1
+    _snapshot = None
+
+
+def _snapshot_is_fresh(snapshot: Optional[RuleSnapshot], stamp: tuple) -> bool:
+    return (
+        snapshot is not None
+        and snapshot.stamp == stamp
+        and time.monotonic() - snapshot.captured_at < CACHE_MAX_AGE
+    )
+
+
+async def get_rules_snapshot() -> RuleSnapshot:
+    """
+    Returns the current rule snapshot, refreshing it from ufw only when needed.
+
+    The snapshot is reused until one of our own mutations invalidates it, one of
+    the watched ufw files changes, or it is older than `CACHE_MAX_AGE`. The
+    `version` counter increases each time the parsed content actually changes;
+    `etag` is a content hash, so it is stable across worker processes.
+    Error results are never cached and carry no ETag. Concurrent refreshes
+    share a single `ufw status numbered` child (see `run_command_shared`).
+
+    Returns:
+        RuleSnapshot: The current snapshot.
+    """
+    global _snapshot, _snapshot_version, _last_etag
+    stamp = _watched_stamp()
+    snapshot = _snapshot
+    if _snapshot_is_fresh(snapshot, stamp):
+        cache_lookups.inc("rules", "hit")
+        return snapshot
+    cache_lookups.inc("rules", "miss")
+
+    generation = _generation
+    data = await _fetch_ufw_rules()
+    now = time.monotonic()
+    if data["status"] == "error":
+        return RuleSnapshot(_snapshot_version, None, data, stamp, now)
+
+    etag = _compute_etag(data)
+    if etag != _last_etag:
+        _snapshot_version += 1
+        _last_etag = etag
+    snapshot = RuleSnapshot(_snapshot_version, etag, data, stamp, now)
+    _snapshot_history[etag] = data
+    _snapshot_history.move_to_end(etag)
+    while len(_snapshot_history) > SNAPSHOT_HISTORY_SIZE:
+        _snapshot_history.popitem(last=False)
+    # The stamp was taken before running ufw, so a change that lands while
+    # the command runs is picked up by the next read.
+    if generation == _generation:
+        _snapshot = snapshot
+    return snapshot
+
+
+def get_snapshot_data(etag: str) -> Optional[dict]:
+    """Returns the listing served under `etag`, if it is still remembered."""
+    return _snapshot_history.get(etag)
+
+
+async def get_ufw_status(snapshot: Optional[RuleSnapshot] = None):
     """
     Gets the status of UFW.
 
+    The status is taken from the cached rule snapshot, so it does not spawn a
+    process when the snapshot is fresh.
+
+    Args:
+        snapshot (RuleSnapshot, optional): Snapshot to read; defaults to the current one.
+
     Returns:
         dict: A dictionary containing the UFW status.
     """
-    # WARNING: This function executes a system command with `sudo`.
-    # Ensure proper security measures are in place for production environments.
-    # `capture_output=True` captures stdout and stderr.
-    # `text=True` decodes stdout/stderr as text.
-    # `check=True` raises CalledProcessError if the command returns a non-zero exit code.
-    try:
-        result = subprocess.run(['sudo', '/usr/sbin/ufw', 'status'], capture_output=True, text=True, check=True)
-        output = result.stdout.strip()
-        if "Status: active" in output:
-            return {"status": "active"}
-        elif "Status: inactive" in output:
-            return {"status": "inactive"}
-        else:
-            return {"status": "unknown", "output": output}
-    except FileNotFoundError:
-        return {"status": "error", "message": "ufw command not found"}
-    except subprocess.CalledProcessError as e:
-        return {"status": "error", "message": e.stderr}
+    data = (snapshot or await get_rules_snapshot()).data
+    if data["status"] == "error":
+        return {"status": "error", "message": data.get("message")}
+    return {"status": data["status"]}
 
-def get_ufw_rules():
+
+async def get_ufw_rules():
     """
     Gets the rules from UFW in a structured format compatible with the frontend.
 
+    Served from the rule snapshot cache; see `get_rules_snapshot`.
+
     Returns:
         dict: {"status": str, "rules": [{"id": int, "to": str, "action": str, "direction": str, "from": str}]}
     """
-    # WARNING: This function executes a system command with `sudo`.
+    return (await get_rules_snapshot()).data
+
+
+async def _fetch_ufw_rules():
+    if HELPER_SOCKET:
+        # The helper keeps the parsed listing until the rule files change.
+        try:
+            return await helper_call("list")
+        except subprocess.CalledProcessError as e:
+            return {"status": "error", "message": e.stderr}
+        except subprocess.TimeoutExpired:
+            return {"status": "error", "message": "Privileged helper timed out"}
+    if UFW_RULES_BACKEND == "file":
+        return await read_ufw_rules_native()
+    # WARNING: Without the privileged helper this executes a system command with `sudo`.
     # Ensure proper security measures are in place for production environments.
     try:
         # Use numbered output so we can return stable IDs for delete operations
-        result = subprocess.run(
-            ['sudo', '/usr/sbin/ufw', 'status', 'numbered'],
-            capture_output=True,
-            text=True,
-            check=True,
-        )
-        output = result.stdout
+        result = await run_command_shared(['sudo', '/usr/sbin/ufw', 'status', 'numbered'])
+        started = time.perf_counter()
+        data = parse_ufw_status_numbered(result.stdout)
+        elapsed = time.perf_counter() - started
+        rules_parse.observe(elapsed, "status")
+        add_timing("parse", elapsed)
+        return data
+    except FileNotFoundError:
+        return {"status": "error", "message": "ufw command not found"}
+    except subprocess.CalledProcessError as e:
+        return {"status": "error", "message": e.stderr}
+    except subprocess.TimeoutExpired:
+        return {"status": "error", "message": "ufw command timed out"}
+
 
-        parsed_data = {"status": "unknown", "rules": []}
-        lines = output.strip().split('\n')
+def parse_ufw_status_numbered(output: str):
+    """
+    Parses the output of `ufw status numbered`.
+
+    Args:
+        output (str): Raw command output.
 
-        # Parse UFW status (active/inactive) from the first line of the output.
-        if not lines:
-            return parsed_data
-        status_match = re.match(r"Status: (active|inactive)", lines[0])
-        if status_match:
-            parsed_data["status"] = status_match.group(1)
+    Returns:
+        dict: {"status": str, "rules": [...]} as returned by `get_ufw_rules`.
+    """
+    parsed_data = {"status": "unknown", "rules": []}
+    lines = output.strip().split('\n')
+
+    # Parse UFW status (active/inactive) from the first line of the output.
+    if not lines:
+        return parsed_data
+    status_match = re.match(r"Status: (active|inactive)", lines[0])
+    if status_match:
+        parsed_data["status"] = status_match.group(1)
+    else:
+        return parsed_data
+
+    if parsed_data["status"] == "inactive":
+        return parsed_data
+
+    # Iterate over lines that look like "[ 1] ..."
+    for line in lines:
+        m = re.match(r"^\[\s*(\d+)\]\s+(.*)$", line)
+        if not m:
+            continue
+        rule_id = int(m.group(1))
+        rest = m.group(2).rstrip()
+        parts = re.split(r"\s{2,}", rest)
+        if len(parts) < 2:
+            continue
+
+        to_field = parts[0].strip()
+        action_field = parts[1].strip()
+        from_field = parts[2].strip() if len(parts) > 2 else ""
+
+        # Extract direction if present in action field (e.g., "ALLOW IN")
+        direction = ""
+        action_tokens = action_field.split()
+        if len(action_tokens) >= 2 and action_tokens[-1] in ("IN", "OUT"):
+            direction = action_tokens[-1]
+            action = " ".join(action_tokens[:-1]).upper()
         else:
-            return parsed_data
+            action = action_field.upper()
 
-        if parsed_data["status"] == "inactive":
-            return parsed_data
+        parsed_data["rules"].append({
+            "id": rule_id,
+            "to": to_field,
+            "action": action,
+            "direction": direction,
+            "from": from_field,
+        })
 
-        # Iterate over lines that look like "[ 1] ..."
-        for line in lines:
-            m = re.match(r"^\[\s*(\d+)\]\s+(.*)$", line)
-            if not m:
-                continue
-            rule_id = int(m.group(1))
-            rest = m.group(2).rstrip()
-            parts = re.split(r"\s{2,}", rest)
-            if len(parts) < 2:
+    return parsed_data
+
+# --- Native rule reader ---
+class RuleTuple(NamedTuple):
+    """One `### tuple ###` entry of user.rules/user6.rules."""
+    action: str
+    protocol: str
+    dport: str
+    dst: str
+    sport: str
+    src: str
+    direction: str = "in"
+    dapp: str = ""
+    sapp: str = ""
+    interface_in: str = ""
+    interface_out: str = ""
+    logtype: str = ""
+    comment: str = ""
+    v6: bool = False
+
+
+_TUPLE_PREFIX = "### tuple ###"
+_TUPLE_LINE = re.compile(r"^### tuple ###(.*)$", re.MULTILINE)
+_ANY_ADDRESSES = ("0.0.0.0/0", "::/0")
+
+
+def parse_rule_tuple(line: str, v6: bool = False) -> Optional[RuleTuple]:
+    """
+    Parses a single `### tuple ###` line as written by ufw.
+
+    The layout is `action proto dport dst sport src [dapp sapp] direction`,
+    optionally followed by `comment=<hex>`. Application names escape spaces
+    as `%20`, and the direction may carry interfaces (`in_eth0`,
+    `in_eth0!out_eth1` for route rules).
+
+    Args:
+        line (str): The tuple line, with or without the `### tuple ###` prefix.
+        v6 (bool): Whether the line comes from user6.rules.
+
+    Returns:
+        RuleTuple | None: The parsed tuple, or None if the line is malformed.
+    """
+    if line.startswith(_TUPLE_PREFIX):
+        line = line[len(_TUPLE_PREFIX):]
+    fields = line.split()
+    comment = ""
+    if fields and fields[-1].startswith("comment="):
+        try:
+            comment = bytes.fromhex(fields.pop()[len("comment="):]).decode("utf-8", "replace")
+        except ValueError:
+            comment = ""
+    if len(fields) not in (7, 9):
+        return None
+
+    action = fields[0]
+    logtype = ""
+    if "_" in action:
+        action, logtype = action.split("_", 1)
+
+    dapp = sapp = ""
+    if len(fields) == 9:
+        dapp = "" if fields[6] == "-" else fields[6].replace("%20", " ")
+        sapp = "" if fields[7] == "-" else fields[7].replace("%20", " ")
+
+    direction = fields[-1]
+    interface_in = interface_out = ""
+    if "_" in direction:
+        for part in direction.split("!"):
+            name, _, interface = part.partition("_")
+            if name == "in":
+                interface_in = interface
+            elif name == "out":
+                interface_out = interface
+            direction = name
+    if action.startswith("route:"):
+        direction = "fwd"
+
+    return RuleTuple(action, fields[1], fields[2], fields[3], fields[4], fields[5], direction,
+                     dapp, sapp, interface_in, interface_out, logtype, comment, v6)
+
+
+def parse_user_rules(text: str, v6: bool = False) -> List[RuleTuple]:
+    """
+    Extracts the rule tuples from the contents of user.rules or user6.rules.
+
+    Args:
+        text (str): File contents.
+        v6 (bool): Whether the contents come from user6.rules.
+
+    Returns:
+        list: The parsed tuples, in file order.
+    """
+    rules = []
+    for line in _TUPLE_LINE.findall(text):
+        rule = parse_rule_tuple(line, v6)
+        if rule is not None:
+            rules.append(rule)
+    return rules
+
+
+def _format_location(rule: RuleTuple, addr: str, port: str, app: str, interface: str) -> str:
+    # Mirrors the To/From columns of `ufw status`.
+    location = "" if addr in _ANY_ADDRESSES else addr
+    if app:
+        location = f"{location} {app}" if location else app
+    elif port != "any":
+        location = f"{location} {port}" if location else port
+        if rule.protocol != "any":
+            location += f"/{rule.protocol}"
+    if not location:
+        location = "Anywhere"
+        # Anywhere-to-anywhere rules still show a protocol restriction.
+        if not app and rule.protocol != "any" and rule.dport == rule.sport == "any":
+            location += f"/{rule.protocol}"
+    if interface:
+        location += f" on {interface}"
+    if addr == "::/0":
+        location += " (v6)"
+    return location
+
+
+def format_rule_tuple(rule: RuleTuple) -> dict:
+    """
+    Renders a tuple the way `parse_ufw_status_numbered` reports it.
+
+    Args:
+        rule (RuleTuple): The rule to render.
+
+    Returns:
+        dict: {"to": str, "action": str, "direction": str, "from": str}
+    """
+    if rule.direction == "fwd":
+        # `ufw status` shows route rules as e.g. "ALLOW FWD", which the
+        # status parser keeps in the action column.
+        action = "%s FWD" % rule.action[len("route:"):].upper()
+        direction = ""
+    else:
+        action = rule.action.upper()
+        direction = rule.direction.upper()
+    return {
+        "to": _format_location(rule, rule.dst, rule.dport, rule.dapp, rule.interface_in),
+        "action": action,
+        "direction": direction,
+        "from": _format_location(rule, rule.src, rule.sport, rule.sapp, rule.interface_out),
+    }
+
+
+def _listing_key(rule: RuleTuple) -> tuple:
+    # Application rules are listed once per profile, whatever their ports.
+    if rule.dapp or rule.sapp:
+        return (rule.action, rule.dst, rule.src, rule.dapp, rule.sapp, rule.direction,
+                rule.interface_in, rule.interface_out, rule.v6)
+    return rule._replace(comment="")
+
+
+def number_rule_tuples(rules: List[RuleTuple]) -> list:
+    """
+    Numbers tuples the way `ufw status numbered` does.
+
+    IPv4 rules come first, then IPv6 rules. An application profile with
+    several port/protocol entries is stored as several tuples but listed (and
+    numbered) once.
+
+    Args:
+        rules (list): Tuples from user.rules followed by tuples from user6.rules.
+
+    Returns:
+        list: Rule dicts as returned by `get_ufw_rules`.
+    """
+    numbered = []
+    seen_apps = set()
+    for rule in rules:
+        if rule.dapp or rule.sapp:
+            key = _listing_key(rule)
+            if key in seen_apps:
                 continue
+            seen_apps.add(key)
+        entry = {"id": len(numbered) + 1}
+        entry.update(format_rule_tuple(rule))
+        numbered.append(entry)
+    return numbered
+
+
+def rule_file_chains(texts: List[str]) -> Dict[str, List[Tuple[int, str]]]:
+    """
+    Lists the iptables rules of user.rules/user6.rules per chain, in the order ufw loads them.
 
-            to_field = parts[0].strip()
-            action_field = parts[1].strip()
-            from_field = parts[2].strip() if len(parts) > 2 else ""
+    Args:
+        texts (List[str]): user.rules, then user6.rules unless IPv6 is disabled.
 
-            # Extract direction if present in action field (e.g., "ALLOW IN")
-            direction = ""
-            action_tokens = action_field.split()
-            if len(action_tokens) >= 2 and action_tokens[-1] in ("IN", "OUT"):
-                direction = action_tokens[-1]
-                action = " ".join(action_tokens[:-1]).upper()
+    Returns:
+        dict: chain -> [(rule ID, line)]. The ID is the number the owning
+        rule has in the listing (numbered like `number_rule_tuples`), or 0
+        for lines outside the rule blocks.
+    """
+    chains: Dict[str, List[Tuple[int, str]]] = {}
+    numbered = 0
+    apps = {}
+    for i, text in enumerate(texts):
+        rule_id = 0
+        for line in text.split("\n"):
+            if line.startswith("-A "):
+                chains.setdefault(line.split(" ", 2)[1], []).append((rule_id, line))
+            elif line.startswith(_TUPLE_PREFIX):
+                rule = parse_rule_tuple(line, v6=bool(i))
+                if rule is None:
+                    rule_id = 0
+                elif rule.dapp or rule.sapp:
+                    key = _listing_key(rule)
+                    if key not in apps:
+                        numbered += 1
+                        apps[key] = numbered
+                    rule_id = apps[key]
+                else:
+                    numbered += 1
+                    rule_id = numbered
             else:
-                action = action_field.upper()
+                rule_id = 0
+    return chains
 
-            parsed_data["rules"].append({
-                "id": rule_id,
-                "to": to_field,
-                "action": action,
-                "direction": direction,
-                "from": from_field,
-            })
 
-        return parsed_data
+async def read_rules_file(path: str) -> str:
+    """
+    Reads a ufw configuration file.
 
-    except FileNotFoundError:
-        return {"status": "error", "message": "ufw command not found"}
+    The files are root-only on most systems; when the API process cannot read
+    them directly it falls back to `sudo -n cat`, which is still far cheaper
+    than starting the ufw frontend.
+
+    Args:
+        path (str): File to read.
+
+    Returns:
+        str: File contents.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    except PermissionError:
+        if HELPER_SOCKET:
+            return (await helper_call("read", path=path))["text"]
+        # WARNING: This executes a system command with `sudo`.
+        result = await run_command_shared(['sudo', '-n', '/bin/cat', path])
+        return result.stdout
+
+
+def _conf_enabled(text: str) -> bool:
+    for line in text.splitlines():
+        key, _, value = line.strip().partition("=")
+        if key == "ENABLED":
+            return value.strip().strip("\"'").lower() == "yes"
+    return False
+
+
+async def read_ufw_rules_native():
+    """
+    Gets the rules by reading ufw's rule files instead of running ufw.
+
+    Produces the same structure, and the same numbered IDs, as the
+    `ufw status numbered` backend.
+
+    Returns:
+        dict: {"status": str, "rules": [...]} as returned by `get_ufw_rules`.
+    """
+    try:
+        if not _conf_enabled(await read_rules_file(UFW_CONF_FILE)):
+            return {"status": "inactive", "rules": []}
+        text = await read_rules_file(USER_RULES_FILE)
+        try:
+            text6 = await read_rules_file(USER6_RULES_FILE)
+        except FileNotFoundError:
+            text6 = ""  # IPv6 disabled
+    except FileNotFoundError as e:
+        return {"status": "error", "message": f"{e.filename} not found"}
     except subprocess.CalledProcessError as e:
         return {"status": "error", "message": e.stderr}
+    except subprocess.TimeoutExpired:
+        return {"status": "error", "message": "Reading ufw rules timed out"}
+    started = time.perf_counter()
+    rules = number_rule_tuples(parse_user_rules(text) + parse_user_rules(text6, v6=True))
+    elapsed = time.perf_counter() - started
+    rules_parse.observe(elapsed, "file")
+    add_timing("parse", elapsed)
+    return {"status": "active", "rules": rules}
+
 
 class Rule(BaseModel):
     action: str # allow, deny, reject, limit
-    port: str
+    port: str = ''
     protocol: Optional[str] = None
     direction: Optional[str] = 'in'
     from_ip: Optional[str] = 'any'
+    app: Optional[str] = None # application profile, instead of port and protocol
+
+    @model_validator(mode="before")
+    @classmethod
+    def _port_or_app(cls, data):
+        if isinstance(data, dict) and "port" not in data and not data.get("app"):
+            raise ValueError("Either port or app is required")
+        return data
+
+    @field_validator("from_ip")
+    @classmethod
+    def _source_address(cls, value):
+        # "any", an address or a network; ufw itself gets the text as sent.
+        if value is not None and value.strip().lower() != "any":
+            try:
+                ipaddress.ip_network(value.strip(), strict=False)
+            except ValueError:
+                raise ValueError("Invalid source address")
+        return value
 
-def add_ufw_rule(rule: Rule):
+def rule_command(rule: Rule) -> List[str]:
     """
-    Adds a new rule to UFW.
+    Builds the `ufw` command line that adds a rule.
 
     Args:
-        rule (Rule): The rule to add.
+        rule (Rule): The rule; its action must be allow, deny, reject or limit.
 
     Returns:
-        dict: A dictionary containing the result of the operation.
+        list: The command, starting with sudo.
     """
-    # WARNING: This function executes a system command with `sudo`.
-    # Ensure proper security measures are in place for production environments.
-    # `input='y\n'` is used to automatically confirm any prompts from ufw.
-    command = ['sudo', '/usr/sbin/ufw']
-    if rule.action not in ['allow', 'deny', 'reject', 'limit']:
-        return {"status": "error", "message": "Invalid action"}
-    
-    command.append(rule.action)
+    command = ['sudo', '/usr/sbin/ufw', rule.action]
 
     if rule.direction in ['in', 'out']:
         command.append(rule.direction)
@@ -138,6 +843,11 @@ def add_ufw_rule(rule: Rule):
     command.append('to')
     command.append('any')
 
+    if rule.app:
+        profile = get_catalog().find(rule.app)
+        command.extend(['app', profile.name if profile else rule.app])
+        return command
+
     if rule.port:
         command.append('port')
         command.append(rule.port)
@@ -145,17 +855,41 @@ def add_ufw_rule(rule: Rule):
     if rule.protocol:
         command.append('proto')
         command.append(rule.protocol)
+    return command
+
+
+async def add_ufw_rule(rule: Rule):
+    """
+    Adds a new rule to UFW.
+
+    Args:
+        rule (Rule): The rule to add.
+
+    Returns:
+        dict: A dictionary containing the result of the operation.
+    """
+    # WARNING: Without the privileged helper this executes a system command with `sudo`.
+    # Ensure proper security measures are in place for production environments.
+    # `input='y\n'` is used to automatically confirm any prompts from ufw.
+    error = validate_rule(rule, service_names=True)
+    if error:
+        return {"status": "error", "message": error}
+    command = rule_command(rule)
 
     try:
-        result = subprocess.run(command, capture_output=True, text=True, check=True, input='y\n')
+        result = await run_ufw("add", command[2:], input='y\n', rule=rule.model_dump())
 
         return {"status": "success", "message": result.stdout.strip()}
     except FileNotFoundError:
         return {"status": "error", "message": "ufw command not found"}
     except subprocess.CalledProcessError as e:
         return {"status": "error", "message": e.stderr.strip()}
+    except subprocess.TimeoutExpired:
+        return {"status": "error", "message": "ufw command timed out"}
+    finally:
+        invalidate_rules_cache()
 
-def delete_ufw_rule(rule_id: int):
+async def delete_ufw_rule(rule_id: int):
     """
     Deletes a UFW rule by its ID.
 
@@ -165,49 +899,599 @@ def delete_ufw_rule(rule_id: int):
     Returns:
         dict: A dictionary containing the result of the operation.
     """
-    # WARNING: This function executes a system command with `sudo`.
+    # WARNING: Without the privileged helper this executes a system command with `sudo`.
     # Ensure proper security measures are in place for production environments.
     # `input='y\n'` is used to automatically confirm the deletion.
     try:
-        result = subprocess.run(['sudo', '/usr/sbin/ufw', 'delete', str(rule_id)], capture_output=True, text=True, check=True, input='y\n')
+        result = await run_ufw("delete", ['delete', str(rule_id)], input='y\n', id=rule_id)
         return {"status": "success", "message": result.stdout.strip()}
     except FileNotFoundError:
         return {"status": "error", "message": "ufw command not found"}
     except subprocess.CalledProcessError as e:
         return {"status": "error", "message": e.stderr.strip()}
+    except subprocess.TimeoutExpired:
+        return {"status": "error", "message": "ufw command timed out"}
+    finally:
+        invalidate_rules_cache()
 
-def enable_ufw():
+async def enable_ufw():
     """
     Enables UFW.
 
     Returns:
         dict: A dictionary containing the result of the operation.
     """
-    # WARNING: This function executes a system command with `sudo`.
+    # WARNING: Without the privileged helper this executes a system command with `sudo`.
     # Ensure proper security measures are in place for production environments.
     # `input='y\n'` is used to automatically confirm the enabling of UFW.
     try:
-        result = subprocess.run(['sudo', '/usr/sbin/ufw', 'enable'], capture_output=True, text=True, check=True, input='y\n')
+        result = await run_ufw("enable", ['enable'], input='y\n')
 
         return {"status": "success", "message": result.stdout.strip()}
     except FileNotFoundError:
         return {"status": "error", "message": "ufw command not found"}
     except subprocess.CalledProcessError as e:
         return {"status": "error", "message": e.stderr.strip()}
+    except subprocess.TimeoutExpired:
+        return {"status": "error", "message": "ufw command timed out"}
+    finally:
+        invalidate_rules_cache()
 
-def disable_ufw():
+async def disable_ufw():
     """
     Disables UFW.
 
     Returns:
         dict: A dictionary containing the result of the operation.
     """
-    # WARNING: This function executes a system command with `sudo`.
+    # WARNING: Without the privileged helper this executes a system command with `sudo`.
     # Ensure proper security measures are in place for production environments.
     try:
-        result = subprocess.run(['sudo', '/usr/sbin/ufw', 'disable'], capture_output=True, text=True, check=True)
+        result = await run_ufw("disable", ['disable'])
         return {"status": "success", "message": result.stdout.strip()}
     except FileNotFoundError:
         return {"status": "error", "message": "ufw command not found"}
     except subprocess.CalledProcessError as e:
         return {"status": "error", "message": e.stderr.strip()}
+    except subprocess.TimeoutExpired:
+        return {"status": "error", "message": "ufw command timed out"}
+    finally:
+        invalidate_rules_cache()
+
+
+# --- Batch rule changes ---
+class RuleBatch(BaseModel):
+    add: List[Rule] = []
+    delete: List[int] = []
+
+
+class RuleSet(BaseModel):
+    rules: List[Rule] = []
+
+
+_RULE_ACTIONS = ("allow", "deny", "reject", "limit")
+_RULE_PROTOCOLS = ("tcp", "udp", "any")
+_PORT_RE = re.compile(r"^\d{1,5}(:\d{1,5})?(,\d{1,5}(:\d{1,5})?)*$")
+# Ports one iptables multiport match takes.
+_MAX_MULTIPORT = 15
+_IPTABLES_TARGETS = {"allow": "ACCEPT", "deny": "DROP", "reject": "REJECT"}
+
+
+def validate_rule(rule: Rule, service_names: bool = False) -> Optional[str]:
+    """
+    Checks a rule against what ufw accepts, without running ufw.
+
+    Args:
+        rule (Rule): The rule to check.
+        service_names (bool): Also accept an /etc/services name as the port,
+            as the ufw CLI does (the rule files only take numbers).
+
+    Returns:
+        str | None: An error message, or None if the rule is valid.
+    """
+    if rule.action not in _RULE_ACTIONS:
+        return "Invalid action"
+    if rule.direction not in ("in", "out"):
+        return "Invalid direction"
+    protocol = rule.protocol or "any"
+    if protocol not in _RULE_PROTOCOLS:
+        return "Invalid protocol"
+    if rule.app:
+        if rule.port or rule.protocol:
+            return "An application rule takes no port or protocol"
+        if get_catalog().find(rule.app) is None:
+            return "Unknown application profile"
+    if rule.port and not (service_names and rule.port in get_catalog().service_names):
+        if not _PORT_RE.match(rule.port):
+            return "Invalid port"
+        entries = 0
+        for part in rule.port.split(","):
+            low, _, high = part.partition(":")
+            if not 1 <= int(low) <= int(high or low) <= 65535:
+                return "Invalid port"
+            entries += 2 if high else 1
+        if entries > _MAX_MULTIPORT:
+            return "Too many ports (iptables takes up to %d, ranges counting twice)" % _MAX_MULTIPORT
+        if ("," in rule.port or ":" in rule.port) and protocol == "any":
+            return "Port ranges and lists require a protocol"
+    if rule.from_ip and rule.from_ip.lower() != "any":
+        try:
+            ipaddress.ip_network(rule.from_ip, strict=False)
+        except ValueError:
+            return "Invalid source address"
+    return None
+
+
+def rule_to_tuples(rule: Rule, ipv6: bool = True) -> List[RuleTuple]:
+    """
+    Converts a validated rule into the tuples ufw would store for it.
+
+    A rule without a source address applies to both address families and
+    yields an IPv4 and (if `ipv6`) an IPv6 tuple. An application rule yields
+    one tuple per `ports` entry of its profile, per family.
+
+    Args:
+        rule (Rule): The rule to convert.
+        ipv6 (bool): Whether IPv6 rules are managed on this host.
+
+    Returns:
+        list: The tuples, IPv4 first.
+    """
+    entries = [(rule.port or "any", rule.protocol or "any")]
+    dapp = ""
+    if rule.app:
+        profile = get_catalog().find(rule.app)
+        entries = [(entry.ports, entry.protocol) for entry in profile.ports]
+        dapp = profile.name
+    source = None
+    if rule.from_ip and rule.from_ip.lower() != "any":
+        source = ipaddress.ip_network(rule.from_ip, strict=False)
+    tuples = []
+    for v6, any_address in ((False, "0.0.0.0/0"), (True, "::/0")):
+        if source is not None and (source.version == 6) != v6:
+            continue
+        if v6 and not ipv6:
+            continue
+        src = str(source) if source is not None else any_address
+        for dport, protocol in entries:
+            tuples.append(RuleTuple(rule.action, protocol, dport, any_address, "any", src,
+                                    rule.direction, dapp=dapp, v6=v6))
+    return tuples
+
+
+def render_rule_block(rule: RuleTuple) -> List[str]:
+    """
+    Renders a tuple as the lines ufw writes to user.rules/user6.rules.
+
+    Only the rule shapes the `Rule` model can express are supported.
+
+    Args:
+        rule (RuleTuple): The rule to render.
+
+    Returns:
+        list: The `### tuple ###` line followed by its iptables lines.
+    """
+    prefix = "ufw6-user-" if rule.v6 else "ufw-user-"
+    chain = prefix + ("output" if rule.direction == "out" else "input")
+    fields = [rule.action, rule.protocol, rule.dport, rule.dst, rule.sport, rule.src]
+    comment = ""
+    if rule.dapp or rule.sapp:
+        dapp, sapp = (app.replace(" ", "%20") or "-" for app in (rule.dapp, rule.sapp))
+        fields += [dapp, sapp]
+        comment = " -m comment --comment '%s'" % " ".join(
+            "%s_%s" % (kind, app) for kind, app in (("dapp", dapp), ("sapp", sapp)) if app != "-")
+    tuple_line = " ".join([_TUPLE_PREFIX] + fields + [rule.direction])
+    lines = [tuple_line]
+    protocols = [rule.protocol]
+    if rule.protocol == "any":
+        protocols = ["tcp", "udp"] if rule.dport != "any" else [None]
+    for protocol in protocols:
+        match = ["-A", chain]
+        if protocol:
+            match += ["-p", protocol]
+        if rule.dst not in _ANY_ADDRESSES:
+            match += ["-d", rule.dst]
+        if rule.dport != "any":
+            if "," in rule.dport or ":" in rule.dport:
+                match += ["-m", "multiport", "--dports", rule.dport]
+            else:
+                match += ["--dport", rule.dport]
+        if rule.src not in _ANY_ADDRESSES:
+            match += ["-s", rule.src]
+        match = " ".join(match)
+        if rule.action == "limit":
+            lines.append(match + " -m conntrack --ctstate NEW -m recent --set" + comment)
+            lines.append(match + " -m conntrack --ctstate NEW -m recent --update --seconds 30"
+                                 " --hitcount 6 -j " + prefix + "limit" + comment)
+            lines.append(match + " -j " + prefix + "limit-accept" + comment)
+        elif rule.action == "reject" and protocol == "tcp":
+            lines.append(match + " -j REJECT --reject-with tcp-reset" + comment)
+        else:
+            lines.append(match + " -j " + _IPTABLES_TARGETS[rule.action] + comment)
+    return lines
+
+
+class _RulesFile:
+    """user.rules/user6.rules split into the rule blocks and what surrounds them."""
+
+    def __init__(self, text: str, v6: bool):
+        begin = text.index("### RULES ###\n") + len("### RULES ###\n")
+        end = text.index("### END RULES ###", begin)
+        self.head = text[:begin]
+        self.tail = text[end:]
+        self.blocks = []
+        for chunk in text[begin:end].split("\n\n"):
+            lines = [line for line in chunk.split("\n") if line]
+            if lines and lines[0].startswith(_TUPLE_PREFIX):
+                rule = parse_rule_tuple(lines[0], v6)
+                if rule is not None:
+                    self.blocks.append((rule, lines))
+
+    def render(self) -> str:
+        body = "".join("\n" + "\n".join(lines) + "\n" for _, lines in self.blocks)
+        return self.head + body + "\n" + self.tail
+
+
+# Lines ufw writes around the rule blocks: the table, chain declarations,
+# section markers and rules in its own chains.
+_FRAME_LINE = re.compile(r"^(\*filter|COMMIT|:ufw6?-[\w-]+ - \[0:0\]|### [A-Z ]+ ###|-[AI] ufw6?-[\w-]+ .*)$")
+_CHAIN_LINE = re.compile(r"^-[AI] (ufw6?)-[\w-]+ ")
+
+
+def check_rules_file(text: str, v6: bool) -> Optional[str]:
+    """
+    Checks that a text is a user.rules/user6.rules file as ufw writes it.
+
+    Every rule block must be a `### tuple ###` line followed by its iptables
+    lines; blocks of the shapes `render_rule_block` supports must render
+    back to the same lines, other blocks (interfaces, logging, comments)
+    may only add to the user chains. Outside the blocks only ufw's own
+    frame is accepted, and every rule must be in a chain of the file's
+    family.
+
+    Returns:
+        str | None: Why the text was rejected, or None if it is acceptable.
+    """
+    family = "ufw6" if v6 else "ufw"
+    lines = text.split("\n")
+    if [line for line in lines if line][:1] != ["*filter"] or lines.count("*filter") != 1 \
+            or lines.count("COMMIT") != 1 or lines.count("### RULES ###") != 1 \
+            or lines.count("### END RULES ###") != 1:
+        return "Not a ufw rules file"
+    for number, line in enumerate(lines, 1):
+        chain = _CHAIN_LINE.match(line)
+        if line and (not _FRAME_LINE.match(line) and not line.startswith(_TUPLE_PREFIX)
+                     or chain and chain.group(1) != family):
+            return f"Line {number}: not written by ufw"
+    begin = text.index("### RULES ###\n") + len("### RULES ###\n")
+    end = text.index("### END RULES ###", begin)
+    if _TUPLE_PREFIX in text[:begin] or _TUPLE_PREFIX in text[end:]:
+        return "Rules outside the RULES section"
+    for chunk in text[begin:end].split("\n\n"):
+        block = [line for line in chunk.split("\n") if line]
+        if not block:
+            continue
+        rule = parse_rule_tuple(block[0], v6) if block[0].startswith(_TUPLE_PREFIX) else None
+        if rule is None or any(line.startswith(_TUPLE_PREFIX) or not line.startswith(f"-A {family}-user-")
+                               for line in block[1:]):
+            return f"Invalid rule block: {block[0]}"
+        renderable = (rule.action in _IPTABLES_TARGETS or rule.action == "limit") and rule.sport == "any" \
+            and not (rule.logtype or rule.comment or rule.interface_in or rule.interface_out)
+        if renderable and block != render_rule_block(rule):
+            return f"Rule block does not match its tuple: {block[0]}"
+    return None
+
+
+async def write_rules_file(path: str, text: str):
+    """
+    Replaces a ufw configuration file atomically.
+
+    Writes next to the target and renames, so ufw never sees a partial file;
+    falls back to `sudo -n tee` when the API process cannot write there. A
+    missing file is created with mode 0644.
+    """
+    try:
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o644
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".webfire-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except PermissionError:
+        if HELPER_SOCKET:
+            await helper_call("write", path=path, text=text)
+            return
+        # WARNING: This executes a system command with `sudo`.
+        await run_command(['sudo', '-n', '/usr/bin/tee', path], input=text)
+
+
+async def reload_ufw():
+    """Reloads ufw so edited rule files take effect."""
+    await run_ufw("reload", ['reload'])
+
+
+async def _read_rule_files():
+    """
+    Reads ufw.conf and the user rule files for an in-place edit.
+
+    Returns:
+        tuple: (enabled, paths, original texts, parsed `_RulesFile`s), IPv4 first.
+
+    Raises:
+        FileNotFoundError, ValueError, subprocess.SubprocessError
+    """
+    enabled = _conf_enabled(await read_rules_file(UFW_CONF_FILE))
+    paths = [USER_RULES_FILE]
+    originals = [await read_rules_file(USER_RULES_FILE)]
+    try:
+        originals.append(await read_rules_file(USER6_RULES_FILE))
+        paths.append(USER6_RULES_FILE)
+    except FileNotFoundError:
+        pass  # IPv6 disabled
+    files = [_RulesFile(text, v6=bool(i)) for i, text in enumerate(originals)]
+    return enabled, paths, originals, files
+
+
+def _read_error(e: Exception) -> str:
+    if isinstance(e, FileNotFoundError):
+        return f"{e.filename} not found"
+    if isinstance(e, ValueError):
+        return "Unrecognized rules file layout"
+    if isinstance(e, subprocess.CalledProcessError):
+        return e.stderr.strip()
+    return "Reading ufw rules timed out"
+
+
+def _listed_keys(files: List[_RulesFile]) -> dict:
+    """Maps each listing key to (rule ID, first tuple), numbered as ufw lists them."""
+    listed = {}
+    for f in files:
+        for rule, _ in f.blocks:
+            key = _listing_key(rule)
+            if key not in listed:
+                listed[key] = (len(listed) + 1, rule)
+    return listed
+
+
+async def apply_rule_batch(batch: RuleBatch):
+    """
+    Applies many rule additions and deletions with a single ufw reload.
+
+    Every item is validated and every delete ID resolved against the current
+    rule files before anything is written. The new user.rules/user6.rules are
+    then written in one pass and ufw is reloaded once. If writing or
+    reloading fails, the previous files are restored (and reloaded), so
+    either the whole batch lands or none of it does.
+
+    Deletes refer to the rule IDs as listed before the batch. Adding a rule
+    that already exists is reported as "skipped", as ufw does.
+
+    Args:
+        batch (RuleBatch): Rules to add and rule IDs to delete.
+
+    Returns:
+        dict: {"status": str, "message": str, "results": [per-item results]}
+    """
+    results = []
+    for index, rule in enumerate(batch.add):
+        error = validate_rule(rule)
+        results.append({"index": index, "op": "add", "status": "error" if error else "pending",
+                        "message": error})
+    for index, rule_id in enumerate(batch.delete):
+        results.append({"index": index, "op": "delete", "status": "pending", "message": None})
+
+    try:
+        enabled, paths, originals, files = await _read_rule_files()
+    except (FileNotFoundError, ValueError, subprocess.SubprocessError) as e:
+        return {"status": "error", "message": _read_error(e), "results": results}
+    unchanged = [f.render() for f in files]
+
+    # Resolve delete IDs against the numbering as it is now.
+    id_to_key = {rule_id: key for key, (rule_id, _) in _listed_keys(files).items()}
+    delete_keys = set()
+    for result, rule_id in zip(results[len(batch.add):], batch.delete):
+        key = id_to_key.get(rule_id)
+        if key is None:
+            result.update(status="error", message=f"Rule {rule_id} does not exist")
+        elif key in delete_keys:
+            result.update(status="error", message=f"Rule {rule_id} is deleted twice")
+        else:
+            delete_keys.add(key)
+
+    if any(r["status"] == "error" for r in results):
+        for r in results:
+            if r["status"] == "pending":
+                r.update(status="not_applied", message="Batch rejected")
+        return {"status": "error", "message": "Batch validation failed", "results": results}
+
+    for f in files:
+        f.blocks = [(rule, lines) for rule, lines in f.blocks if _listing_key(rule) not in delete_keys]
+    for result in results[len(batch.add):]:
+        result.update(status="success", message="Rule deleted")
+
+    for result, rule in zip(results, batch.add):
+        added = skipped = 0
+        for new in rule_to_tuples(rule, ipv6=len(files) > 1):
+            target = files[1 if new.v6 else 0]
+            if any(_listing_key(existing) == _listing_key(new) for existing, _ in target.blocks):
+                skipped += 1
+                continue
+            target.blocks.append((new, render_rule_block(new)))
+            added += 1
+        if added:
+            result.update(status="success", message="Rule added")
+        else:
+            result.update(status="skipped", message="Skipping adding existing rule")
+
+    rendered = [f.render() for f in files]
+    if rendered == unchanged:
+        return {"status": "success", "message": "No changes", "results": results}
+
+    failure = await _replace_files(paths, rendered, originals, enabled)
+    if failure is not None:
+        rolled_back, message = failure
+        if not rolled_back:
+            return {"status": "error", "message": f"Rollback failed: {message}", "results": results}
+        for r in results:
+            if r["status"] in ("success", "skipped"):
+                r.update(status="rolled_back")
+        return {"status": "error", "message": f"Batch rolled back: {message}", "results": results}
+    return {"status": "success", "message": f"Applied {len(results)} changes", "results": results}
+
+
+async def _replace_files(paths: List[str], texts: List[str], originals: List[str],
+                         enabled: bool) -> Optional[Tuple[bool, str]]:
+    """
+    Writes the changed rule files and reloads ufw once, restoring the
+    originals if anything fails.
+
+    Returns:
+        tuple | None: None on success, else (whether the originals were
+        restored, error message).
+    """
+    written = []
+    try:
+        try:
+            for path, text, before in zip(paths, texts, originals):
+                if text != before:
+                    await write_rules_file(path, text)
+                    written.append(path)
+            if enabled and written:
+                await reload_ufw()
+        except (OSError, subprocess.SubprocessError) as e:
+            message = str(e)
+            if isinstance(e, subprocess.CalledProcessError) and e.stderr:
+                message = e.stderr.strip()
+            for path, original in zip(paths, originals):
+                if path in written:
+                    await write_rules_file(path, original)
+            if enabled and written:
+                await reload_ufw()
+            return True, message
+    except (OSError, subprocess.SubprocessError) as e:
+        return False, str(e)
+    finally:
+        invalidate_rules_cache()
+    return None
+
+
+async def read_user_rules_files() -> List[str]:
+    """
+    Returns the contents of user.rules and, unless IPv6 is disabled, user6.rules.
+
+    Raises:
+        FileNotFoundError, subprocess.SubprocessError
+    """
+    texts = [await read_rules_file(USER_RULES_FILE)]
+    try:
+        texts.append(await read_rules_file(USER6_RULES_FILE))
+    except FileNotFoundError:
+        pass
+    return texts
+
+
+async def replace_rule_files(texts: List[str]) -> dict:
+    """
+    Replaces user.rules (and user6.rules) with the given contents in one reload.
+
+    Args:
+        texts (List[str]): New user.rules contents, then user6.rules contents
+            (ignored when IPv6 is disabled).
+
+    Returns:
+        dict: {"status": str, "message": str}
+    """
+    try:
+        enabled, paths, originals, files = await _read_rule_files()
+        for i, text in enumerate(texts[:len(paths)]):
+            _RulesFile(text, v6=bool(i))  # refuse to install a file ufw cannot read
+    except (FileNotFoundError, ValueError, subprocess.SubprocessError) as e:
+        return {"status": "error", "message": _read_error(e)}
+    texts = list(texts[:len(paths)]) + originals[len(texts):]
+    if texts == originals:
+        return {"status": "success", "message": "No changes"}
+    failure = await _replace_files(paths, texts, originals, enabled)
+    if failure is not None:
+        rolled_back, message = failure
+        prefix = "Rolled back" if rolled_back else "Rollback failed"
+        return {"status": "error", "message": f"{prefix}: {message}"}
+    return {"status": "success", "message": "Rule files replaced"}
+
+
+def canonical_rule(rule: Rule) -> Rule:
+    """Normalizes spelling that ufw does not distinguish (case, "any", whitespace)."""
+    protocol = (rule.protocol or "any").strip().lower()
+    return Rule(
+        action=rule.action.strip().lower(),
+        port=rule.port.strip(),
+        protocol=None if protocol == "any" else protocol,
+        direction=(rule.direction or "in").strip().lower(),
+        from_ip=(rule.from_ip or "any").strip().lower(),
+        app=rule.app.strip() if rule.app else None,
+    )
+
+
+async def sync_ruleset(ruleset: RuleSet, dry_run: bool = False, prune: bool = True) -> dict:
+    """
+    Makes the user rules match a desired rule set with the fewest changes.
+
+    Both sides are reduced to the listing keys `apply_rule_batch` uses, so a
+    rule is only touched if its key is missing or unwanted. Rules to add are
+    appended in the order given; rules that stay keep their position. The
+    delta is applied as one batch (one write, one reload); an unchanged set
+    costs two file reads and no ufw call at all.
+
+    Args:
+        ruleset (RuleSet): The complete desired set of user rules.
+        dry_run (bool): Only return the plan.
+        prune (bool): Delete current rules missing from the set.
+
+    Returns:
+        dict: {"status", "message", "dry_run", "add": [Rule], "delete": [listed rules],
+        "unchanged": int, "results": [...]} with batch results when applied.
+    """
+    plan = {"status": "success", "dry_run": dry_run, "add": [], "delete": [], "unchanged": 0, "results": []}
+    desired = []
+    for index, rule in enumerate(ruleset.rules):
+        rule = canonical_rule(rule)
+        error = validate_rule(rule)
+        if error:
+            return dict(plan, status="error", message=f"Rule {index}: {error}")
+        desired.append(rule)
+
+    try:
+        _, _, _, files = await _read_rule_files()
+    except (FileNotFoundError, ValueError, subprocess.SubprocessError) as e:
+        return dict(plan, status="error", message=_read_error(e))
+    listed = _listed_keys(files)
+
+    wanted = set()
+    for rule in desired:
+        keys = [_listing_key(t) for t in rule_to_tuples(rule, ipv6=len(files) > 1)]
+        if any(key not in listed for key in keys) and not all(key in wanted for key in keys):
+            plan["add"].append(rule)
+        wanted.update(keys)
+    for key, (rule_id, first) in listed.items():
+        if key in wanted:
+            plan["unchanged"] += 1
+        elif prune:
+            plan["delete"].append(dict(format_rule_tuple(first), id=rule_id))
+        else:
+            plan["unchanged"] += 1
+
+    changes = len(plan["add"]) + len(plan["delete"])
+    plan["message"] = f"{len(plan['add'])} to add, {len(plan['delete'])} to delete, {plan['unchanged']} unchanged"
+    if dry_run or not changes:
+        return plan
+
+    batch = RuleBatch(add=plan["add"], delete=[rule["id"] for rule in plan["delete"]])
+    result = await apply_rule_batch(batch)
+    return dict(plan, status=result["status"], message=f"{result['message']}: {plan['message']}",
+                results=result["results"])
@@ -0,0 +1,199 @@
+# (C) 2025 by OPNLAB Development. All rights reserved.
+"""Users and roles, stored in SQLite.
+
+- One database file (`USERS_DB`) is shared by all worker processes. It runs
+  in WAL mode, so lookups never wait for a writer; writers wait up to
+  `USERS_BUSY_TIMEOUT` for each other.
+- Each thread keeps its own connection; sqlite3 caches the prepared
+  statements per connection. Looked-up users are cached per connection as
+  well, and the cache is dropped whenever `PRAGMA data_version` shows that
+  another connection (another thread or worker) committed, so a change is
+  seen by the next request everywhere.
+- A new database gets one "admin" user whose password hash is stored, not
+  computed (`WEBFIRE_ADMIN_PASSWORD_HASH`, or the hash of "secret"), so
+  starting a worker costs no PBKDF2.
+
+Roles: "admin" may change anything, "readonly" may only read.
+"""
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from metrics import cache_lookups
+
+STATE_DIR = os.getenv("WEBFIRE_STATE_DIR", "/var/lib/webfire")
+USERS_DB = os.getenv("WEBFIRE_USERS_DB", os.path.join(STATE_DIR, "users.db"))
+USERS_BUSY_TIMEOUT = 5.0
+# Hash of the default password "secret" (change in production).
+DEFAULT_ADMIN_HASH = os.getenv(
+    "WEBFIRE_ADMIN_PASSWORD_HASH",
+    "$pbkdf2-sha256$29000$Xat1zlmLkZKy9r73XouxNg$DL48jhyqytl.9cmOMqk.Mb6mhYDhLAEQK2oidg.Ty.c",
+)
+
+ROLES = ("admin", "readonly")
+MIN_PASSWORD_LENGTH = 8
+
+_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._@-]{0,63}$")
+_SCHEMA_VERSION = 1
+
+
+class UserError(Exception):
+    """A change that would leave the store without an admin."""
+
+
+def validate_user(username: str, password: Optional[str], role: str) -> Optional[str]:
+    """
+    Checks a user before it is stored.
+
+    Returns:
+        str | None: An error message, or None if the user is valid.
+    """
+    if not _NAME.match(username):
+        return "Invalid username"
+    if role not in ROLES:
+        return f"Role must be one of: {', '.join(ROLES)}"
+    if password is not None and len(password) < MIN_PASSWORD_LENGTH:
+        return f"Password must be at least {MIN_PASSWORD_LENGTH} characters"
+    return None
+
+
+class _Connection(threading.local):
+    connection: Optional[sqlite3.Connection] = None
+    data_version: int = -1
+    users: Dict[str, Optional[dict]]
+
+
+class UserStore:
+    """Users in a SQLite database shared by worker processes."""
+
+    def __init__(self, path: str, admin_hash: str = DEFAULT_ADMIN_HASH):
+        self.path = path
+        self.admin_hash = admin_hash
+        self._local = _Connection()
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        os.close(fd)
+        connection = sqlite3.connect(self.path, timeout=USERS_BUSY_TIMEOUT, isolation_level=None,
+                                     check_same_thread=False, cached_statements=32)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        with _transaction(connection):
+            if connection.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS users ("
+                    " username TEXT PRIMARY KEY,"
+                    " hashed_password TEXT NOT NULL,"
+                    " role TEXT NOT NULL)"
+                )
+                connection.execute("INSERT OR IGNORE INTO users VALUES ('admin', ?, 'admin')", (self.admin_hash,))
+                connection.execute(f"PRAGMA user_version={_SCHEMA_VERSION}")
+        return connection
+
+    def _connection(self) -> sqlite3.Connection:
+        local = self._local
+        if local.connection is None:
+            local.connection = self._connect()
+            local.users = {}
+        data_version = local.connection.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != local.data_version:
+            local.users = {}
+            local.data_version = data_version
+        return local.connection
+
+    def get(self, username: str) -> Optional[dict]:
+        """Returns {"username", "hashed_password", "role"}, or None for an unknown user."""
+        connection = self._connection()
+        users = self._local.users
+        if username in users:
+            cache_lookups.inc("user", "hit")
+        else:
+            cache_lookups.inc("user", "miss")
+            row = connection.execute(
+                "SELECT username, hashed_password, role FROM users WHERE username = ?", (username,)).fetchone()
+            users[username] = dict(row) if row else None
+        return users[username]
+
+    def list(self) -> List[dict]:
+        rows = self._connection().execute("SELECT username, role FROM users ORDER BY username")
+        return [dict(row) for row in rows]
+
+    def put(self, username: str, role: str, hashed_password: Optional[str] = None) -> bool:
+        """
+        Creates or updates a user.
+
+        Args:
+            username (str): The user.
+            role (str): One of `ROLES`.
+            hashed_password (str, optional): New password hash; required for a new user.
+
+        Returns:
+            bool: True if the user was created, False if updated.
+
+        Raises:
+            UserError: If a new user has no password, or the last admin would be demoted.
+        """
+        connection = self._connection()
+        with _transaction(connection):
+            exists = connection.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone()
+            if not exists:
+                if hashed_password is None:
+                    raise UserError("A password is required for a new user")
+                connection.execute("INSERT INTO users VALUES (?, ?, ?)", (username, hashed_password, role))
+            else:
+                if role != "admin":
+                    self._check_other_admin(connection, username)
+                connection.execute(
+                    "UPDATE users SET role = ?, hashed_password = coalesce(?, hashed_password) WHERE username = ?",
+                    (role, hashed_password, username))
+        self._local.users = {}
+        return not exists
+
+    def remove(self, username: str) -> bool:
+        """
+        Deletes a user.
+
+        Raises:
+            UserError: If the user is the last admin.
+        """
+        connection = self._connection()
+        with _transaction(connection):
+            self._check_other_admin(connection, username)
+            removed = connection.execute("DELETE FROM users WHERE username = ?", (username,)).rowcount
+        self._local.users = {}
+        return bool(removed)
+
+    @staticmethod
+    def _check_other_admin(connection: sqlite3.Connection, username: str):
+        others = connection.execute(
+            "SELECT count(*) FROM users WHERE role = 'admin' AND username != ?", (username,)).fetchone()[0]
+        is_admin = connection.execute(
+            "SELECT 1 FROM users WHERE role = 'admin' AND username = ?", (username,)).fetchone()
+        if is_admin and not others:
+            raise UserError("At least one admin must remain")
+
+    def close(self):
+        if self._local.connection is not None:
+            self._local.connection.close()
+            self._local.connection = None
+            self._local.data_version = -1
+
+
+@contextmanager
+def _transaction(connection: sqlite3.Connection):
+    # Take the write lock up front, so two workers cannot both read and then collide.
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+
+user_store = UserStore(USERS_DB)
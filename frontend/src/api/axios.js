@@ -23,15 +23,20 @@ instance.interceptors.request.use(
   }
 );
 
-// Response interceptor to handle token expiration or invalid tokens
+// Response interceptor: on 401, renew the access token once and retry;
+// log out if the session cannot be renewed.
 instance.interceptors.response.use(
   (response) => {
     return response;
   },
-  (error) => {
+  async (error) => {
     const authStore = useAuthStore();
+    const config = error.config || {};
     if (error.response && error.response.status === 401) {
-      // Token expired or invalid, log out the user
+      if (!config.skipAuthRefresh && !config.retriedAfterRefresh && await authStore.refresh()) {
+        config.retriedAfterRefresh = true;
+        return instance(config);
+      }
       authStore.logout();
       // Optionally redirect to login page
       // router.push('/login');
@@ -0,0 +1,49 @@
+// (C) 2025 by OPNLAB Development. All rights reserved.
+import { useAuthStore } from '../stores/auth';
+
+// One EventSource per tab, shared by every view that subscribes.
+const baseURL = import.meta?.env?.VITE_API_BASE_URL || '/api';
+const handlers = new Set();
+let source = null;
+
+const dispatch = (type) => (message) => {
+  let data;
+  try {
+    data = JSON.parse(message.data);
+  } catch (error) {
+    console.error('Malformed event:', error);
+    return;
+  }
+  handlers.forEach((handler) => handler[type] && handler[type](data));
+};
+
+const open = () => {
+  const authStore = useAuthStore();
+  if (!authStore?.token) return;
+  // EventSource cannot send headers, so the token goes in the query string.
+  source = new EventSource(`${baseURL}/events?token=${encodeURIComponent(authStore.token)}`);
+  ['status', 'rules', 'traffic'].forEach((type) => source.addEventListener(type, dispatch(type)));
+  // A rejected token closes the stream instead of retrying; renew it and reconnect.
+  source.onerror = async () => {
+    if (source?.readyState !== EventSource.CLOSED) return;
+    source = null;
+    if (handlers.size && await authStore.refresh() && !source && handlers.size) open();
+  };
+};
+
+/**
+ * Subscribes to server events.
+ * @param {{status?: Function, rules?: Function, traffic?: Function}} handler Callbacks per event type.
+ * @returns {Function} Unsubscribe function; the connection closes with the last subscriber.
+ */
+export const subscribe = (handler) => {
+  handlers.add(handler);
+  if (!source) open();
+  return () => {
+    handlers.delete(handler);
+    if (handlers.size === 0 && source) {
+      source.close();
+      source = null;
+    }
+  };
+};
@@ -2,33 +2,69 @@
 import { defineStore } from 'pinia';
 import axios from '../api/axios';
 
+// Shared by concurrent callers so an expired token is refreshed only once.
+let refreshing = null;
+
 export const useAuthStore = defineStore('auth', {
   state: () => ({
     token: localStorage.getItem('token') || null,
+    refreshToken: localStorage.getItem('refreshToken') || null,
   }),
   getters: {
     isAuthenticated: (state) => !!state.token,
   },
   actions: {
+    setTokens(data) {
+      this.token = data.access_token;
+      this.refreshToken = data.refresh_token || null;
+      localStorage.setItem('token', this.token);
+      if (this.refreshToken) {
+        localStorage.setItem('refreshToken', this.refreshToken);
+      } else {
+        localStorage.removeItem('refreshToken');
+      }
+    },
     async login(username, password) {
       try {
         const response = await axios.post('/token', new URLSearchParams({
           username: username,
           password: password,
         }));
-        this.token = response.data.access_token;
-        localStorage.setItem('token', this.token);
+        this.setTokens(response.data);
         return true;
       } catch (error) {
         console.error('Login failed:', error);
-        this.token = null;
-        localStorage.removeItem('token');
+        this.logout();
         return false;
       }
     },
+    /**
+     * Exchanges the refresh token for a new token pair.
+     * @returns {Promise<boolean>} Whether the session could be renewed.
+     */
+    refresh() {
+      if (!this.refreshToken) return Promise.resolve(false);
+      if (!refreshing) {
+        refreshing = axios.post('/token/refresh', { refresh_token: this.refreshToken }, { skipAuthRefresh: true })
+          .then((response) => {
+            this.setTokens(response.data);
+            return true;
+          })
+          .catch(() => {
+            this.logout();
+            return false;
+          })
+          .finally(() => {
+            refreshing = null;
+          });
+      }
+      return refreshing;
+    },
     logout() {
       this.token = null;
+      this.refreshToken = null;
       localStorage.removeItem('token');
+      localStorage.removeItem('refreshToken');
     },
   },
 });